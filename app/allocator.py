@@ -0,0 +1,120 @@
+"""
+Assegnazione dei titoli predefiniti ("Registrazione n.X") e degli id delle macro.
+
+L'indice viene costruito una volta dalla libreria caricata e poi aggiornato
+a ogni salvataggio e rinomina, senza riesaminare tutti i titoli a ogni
+registrazione. Il numero libero più piccolo si ottiene da un heap dei
+numeri liberati e da una frontiera oltre la quale si avanza solo sui numeri
+in uso (costo ammortizzato costante).
+
+Gli id sono nella forma "<prefisso>-<millisecondi>" e strettamente crescenti
+anche se più macro vengono create nello stesso millisecondo.
+"""
+
+from __future__ import annotations
+
+import heapq
+import re
+import threading
+import time
+from collections import Counter
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+from .models import Macro
+
+TITLE_PREFIX = "Registrazione n."
+
+_TITLE_NUMBER = re.compile(r"^Registrazione n\.\s*(\d+)(?!\S)")
+_ID_MS = re.compile(r"^[a-z]+-(\d+)")
+
+
+def title_number(title: str) -> Optional[int]:
+    """Numero X di un titolo "Registrazione n.X ...", None per gli altri titoli"""
+    m = _TITLE_NUMBER.match(title)
+    return int(m.group(1)) if m else None
+
+
+class RecordingAllocator:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # id macro -> numero del titolo (None se il titolo non è predefinito)
+        self._numbers: Dict[str, Optional[int]] = {}
+        self._counts: Counter = Counter()
+        # Numeri liberati sotto la frontiera (possono essere stati riusati: controllo alla lettura)
+        self._free: List[int] = []
+        # Tutti i numeri liberi minori della frontiera sono in _free
+        self._frontier = 1
+        self._last_ms = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._numbers)
+
+    def _use(self, n: Optional[int]) -> None:
+        if n is not None:
+            self._counts[n] += 1
+
+    def _release(self, n: Optional[int]) -> None:
+        if n is None:
+            return
+        self._counts[n] -= 1
+        if self._counts[n] <= 0:
+            del self._counts[n]
+            if n < self._frontier:
+                heapq.heappush(self._free, n)
+
+    def _set(self, macro_id: str, title: str) -> None:
+        n = title_number(title)
+        if macro_id in self._numbers:
+            old = self._numbers[macro_id]
+            if old == n:
+                return
+            self._release(old)
+        else:
+            m = _ID_MS.match(macro_id)
+            if m:
+                self._last_ms = max(self._last_ms, int(m.group(1)))
+        self._numbers[macro_id] = n
+        self._use(n)
+
+    def sync(self, macros: Iterable[Macro]) -> None:
+        """Allinea l'indice alla libreria (macro aggiunte, eliminate o rinominate)"""
+        with self._lock:
+            seen = set()
+            for m in macros:
+                seen.add(m.id)
+                self._set(m.id, m.title)
+            for mid in [mid for mid in self._numbers if mid not in seen]:
+                self._release(self._numbers.pop(mid))
+
+    def rename(self, macro_id: str, title: str) -> None:
+        with self._lock:
+            self._set(macro_id, title)
+
+    def next_number(self) -> int:
+        """Numero X libero più piccolo; diventa usato quando la macro viene salvata"""
+        with self._lock:
+            free = self._free
+            while free and free[0] in self._counts:
+                heapq.heappop(free)
+            if free:
+                return free[0]
+            while self._frontier in self._counts:
+                self._frontier += 1
+            return self._frontier
+
+    def next_title(self) -> str:
+        return f"{TITLE_PREFIX}{self.next_number()}"
+
+    def new_id(self, prefix: str = "rec", taken: Collection[str] = ()) -> str:
+        """Id nuovo, diverso da quelli della libreria, da `taken` e da quelli già assegnati"""
+        with self._lock:
+            ms = max(int(time.time() * 1000), self._last_ms + 1)
+            while f"{prefix}-{ms}" in self._numbers or f"{prefix}-{ms}" in taken:
+                ms += 1
+            self._last_ms = ms
+            return f"{prefix}-{ms}"
+
+    def allocate(self) -> Tuple[str, str]:
+        """(id, titolo) per una nuova registrazione"""
+        return self.new_id("rec"), self.next_title()
@@ -0,0 +1,264 @@
+"""
+Analisi statica del bilanciamento press/release di tasti e pulsanti.
+
+Viene eseguita dove gli eventi vengono prodotti (importazione, modifica
+degli eventi, verifica in background della libreria), fuori dal thread
+della GUI: gli eventi sbilanciati vengono corretti e la macro viene marcata
+come verificata, così il Player può evitare il doppio rilascio di sicurezza
+dei modificatori. Le correzioni delle registrazioni grandi vengono scritte
+a flusso (iter_balanced) senza costruire la sequenza in memoria.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from .models import ControlEvent, Event, KeyEvent, Macro, MouseEvent
+from .plan import is_modifier_key, normalize_button_name, normalize_modifier_name
+
+
+@dataclass
+class BalanceReport:
+    """Esito dell'analisi: eventi inseriti/rimossi e descrizione dei problemi trovati"""
+    inserted: int = 0
+    removed: int = 0
+    issues: List[str] = field(default_factory=list)
+
+    @property
+    def balanced(self) -> bool:
+        """True se gli eventi originali erano già bilanciati"""
+        return not self.issues
+
+
+def _key_id(key: str) -> str:
+    """Identità del tasto: i modificatori destro e sinistro restano distinti"""
+    key = key.strip()
+    if is_modifier_key(key):
+        return normalize_modifier_name(key)
+    return key.lower()
+
+
+def _modifier_family(ident: str) -> str:
+    """Modificatore senza lato ("left shift" -> "shift")"""
+    for side in ("left ", "right "):
+        if ident.startswith(side):
+            return ident[len(side):]
+    return ident
+
+
+@dataclass
+class _Frame:
+    """Blocco aperto (loop o block) durante l'analisi"""
+    action: str
+    keys_at_start: Set[str]
+    buttons_at_start: Set[str]
+    # Rilasci di tasti premuti prima del ciclo, spostati dopo la sua fine
+    deferred: List[Event] = field(default_factory=list)
+
+
+class _Balancer:
+    def __init__(self) -> None:
+        self.out: List[Event] = []
+        self.report = BalanceReport()
+        # id normalizzato -> nome originale, in ordine di pressione
+        self.keys: Dict[str, str] = {}
+        self.buttons: Dict[str, Optional[str]] = {}
+        self.frames: List[_Frame] = []
+        self.pos: Tuple[int, int] = (0, 0)
+
+    def _release_key(self, name: str) -> KeyEvent:
+        return KeyEvent(type="key", time_delta_ms=0, action="release", key=name)
+
+    def _release_button(self, button: Optional[str]) -> MouseEvent:
+        return MouseEvent(type="mouse", time_delta_ms=0, action="release", x=self.pos[0], y=self.pos[1], button=button)
+
+    def _insert(self, ev: Event, issue: str) -> None:
+        self.out.append(ev)
+        self.report.inserted += 1
+        self.report.issues.append(issue)
+
+    def _remove(self, issue: str) -> None:
+        self.report.removed += 1
+        self.report.issues.append(issue)
+
+    def _outer_loop_holds(self, kind: str, ident: str) -> Optional[_Frame]:
+        """Ciclo più interno aperto mentre il tasto/pulsante era già premuto"""
+        for frame in reversed(self.frames):
+            if frame.action == "loop":
+                held = frame.keys_at_start if kind == "key" else frame.buttons_at_start
+                return frame if ident in held else None
+        return None
+
+    def feed(self, ev: Event) -> None:
+        if isinstance(ev, KeyEvent):
+            self._feed_key(ev)
+        elif isinstance(ev, MouseEvent):
+            self.pos = (ev.x, ev.y)
+            self._feed_button(ev)
+        elif isinstance(ev, ControlEvent) and ev.action != "wait":
+            self._feed_control(ev)
+        else:
+            self.out.append(ev)
+
+    def _feed_key(self, ev: KeyEvent) -> None:
+        ident = _key_id(ev.key)
+        if ev.action == "press":
+            # Le pressioni ripetute senza rilascio (autorepeat) non cambiano lo stato
+            self.keys.setdefault(ident, ev.key)
+            self.out.append(ev)
+            return
+        ident = self._held_key(ident)
+        if ident is None:
+            self._remove(f"rilascio senza pressione: {ev.key}")
+            return
+        frame = self._outer_loop_holds("key", ident)
+        if frame is not None:
+            # Ogni iterazione deve partire con lo stesso stato: il rilascio va dopo il ciclo
+            frame.deferred.append(ev)
+            self.report.issues.append(f"rilascio di {ev.key} spostato dopo la fine del ciclo")
+            return
+        del self.keys[ident]
+        self.out.append(ev)
+
+    def _held_key(self, ident: str) -> Optional[str]:
+        """
+        Tasto premuto a cui corrisponde un rilascio. Un modificatore senza
+        lato ("shift") e uno con lato ("left shift") si corrispondono quando
+        l'altro nome non è premuto (registrazioni che li usano in modo misto).
+        """
+        if ident in self.keys:
+            return ident
+        if not is_modifier_key(ident):
+            return None
+        family = _modifier_family(ident)
+        if family == ident:
+            # Rilascio senza lato: l'ultimo modificatore della famiglia premuto
+            for held in reversed(list(self.keys)):
+                if held != family and _modifier_family(held) == family:
+                    return held
+            return None
+        return family if family in self.keys else None
+
+    def _feed_button(self, ev: MouseEvent) -> None:
+        if ev.action not in ("press", "release"):
+            self.out.append(ev)
+            return
+        ident = normalize_button_name(ev.button)
+        if ev.action == "press":
+            self.buttons.setdefault(ident, ev.button)
+            self.out.append(ev)
+            return
+        if ident not in self.buttons:
+            self._remove(f"rilascio pulsante senza pressione: {ident}")
+            return
+        frame = self._outer_loop_holds("button", ident)
+        if frame is not None:
+            frame.deferred.append(ev)
+            self.report.issues.append(f"rilascio pulsante {ident} spostato dopo la fine del ciclo")
+            return
+        del self.buttons[ident]
+        self.out.append(ev)
+
+    def _feed_control(self, ev: ControlEvent) -> None:
+        if ev.action in ("loop", "block"):
+            self.frames.append(_Frame(ev.action, set(self.keys), set(self.buttons)))
+            self.out.append(ev)
+            return
+        if not self.frames:
+            self._remove("fine blocco senza inizio")
+            return
+        self._close_frame(ev)
+
+    def _close_frame(self, end: ControlEvent) -> None:
+        frame = self.frames[-1]
+        if frame.action == "loop":
+            # I tasti premuti nel corpo vengono rilasciati prima della fine di ogni iterazione
+            for ident in [k for k in reversed(list(self.keys)) if k not in frame.keys_at_start]:
+                self._insert(self._release_key(self.keys.pop(ident)), f"rilascio di {ident} inserito a fine ciclo")
+            for ident in [b for b in reversed(list(self.buttons)) if b not in frame.buttons_at_start]:
+                self._insert(self._release_button(self.buttons.pop(ident)), f"rilascio pulsante {ident} inserito a fine ciclo")
+        self.frames.pop()
+        self.out.append(end)
+        # I rilasci rinviati restituiscono lo stato previsto dopo il ciclo
+        for ev in frame.deferred:
+            self.feed(ev)
+
+    def finish(self) -> List[Event]:
+        while self.frames:
+            self.report.inserted += 1
+            self.report.issues.append("blocco non chiuso")
+            self._close_frame(ControlEvent(type="control", time_delta_ms=0, action="end"))
+        for name in reversed(list(self.keys.values())):
+            self._insert(self._release_key(name), f"rilascio di {name} inserito a fine macro")
+        self.keys.clear()
+        for button in reversed(list(self.buttons.values())):
+            self._insert(self._release_button(button), f"rilascio pulsante {normalize_button_name(button)} inserito a fine macro")
+        self.buttons.clear()
+        return self.out
+
+
+def balance_events(events: List[Event]) -> Tuple[List[Event], BalanceReport]:
+    """
+    Verifica il bilanciamento press/release di ogni tasto e pulsante.
+
+    Correzioni applicate:
+        - rilascio senza pressione: rimosso
+        - tasto premuto alla fine della macro: rilascio aggiunto dopo l'ultimo evento
+        - tasto premuto nel corpo di un ciclo: rilascio inserito prima della fine
+        - rilascio nel corpo di un ciclo di un tasto premuto prima: spostato dopo la fine
+        - blocco non chiuso: fine aggiunta in coda
+
+    Returns:
+        (eventi corretti, report). Se la sequenza era già bilanciata gli eventi
+        sono uguali a quelli ricevuti.
+    """
+    balancer = _Balancer()
+    for ev in events:
+        balancer.feed(ev)
+    return balancer.finish(), balancer.report
+
+
+def iter_balanced(events: Iterable[Event], report: Optional[BalanceReport] = None) -> Iterator[Event]:
+    """
+    Come balance_events, ma produce gli eventi corretti uno alla volta: per
+    le registrazioni grandi, da scrivere a flusso in un file di eventi.
+    `report` viene completato al termine dell'iterazione.
+    """
+    balancer = _Balancer()
+    if report is not None:
+        balancer.report = report
+    out = balancer.out
+    for ev in events:
+        balancer.feed(ev)
+        if out:
+            yield from out
+            out.clear()
+    yield from balancer.finish()
+
+
+def check_balance(events: Iterable[Event]) -> BalanceReport:
+    """Report di balance_events senza tenere in memoria la sequenza corretta"""
+    report = BalanceReport()
+    for _ in iter_balanced(events, report):
+        pass
+    return report
+
+
+def log_repair(title: str, report: BalanceReport) -> None:
+    logger.info(
+        "Macro {} corretta: {} eventi inseriti, {} rimossi ({})",
+        title, report.inserted, report.removed, "; ".join(report.issues[:5]),
+    )
+
+
+def verify_macro(macro: Macro) -> BalanceReport:
+    """Corregge gli eventi della macro se necessario e la marca come verificata"""
+    events, report = balance_events(macro.events)
+    if not report.balanced:
+        macro.events = events
+        log_repair(macro.title, report)
+    macro.verified = True
+    return report
@@ -0,0 +1,306 @@
+"""
+Importazione in blocco di macro da una cartella o da un archivio .zip.
+
+I file JSON esportati vengono letti e validati in parallelo in un
+ProcessPoolExecutor: ogni processo decodifica il file a flusso
+(app/transfer.py), corregge il bilanciamento degli eventi (app/balance.py)
+e calcola gli hash dei segmenti usati per riconoscere i duplicati. Gli
+eventi tornano al processo principale nel formato binario di app/codec.py.
+
+L'unione con la libreria (id in conflitto, duplicati) avviene nel processo
+principale e la libreria viene salvata una sola volta. Gli errori dei
+singoli file vengono raccolti senza interrompere l'importazione.
+
+Uso da riga di comando:
+
+    python -m app.bulkimport <cartella o archivio.zip> [--workers N] [--dry-run]
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+from .balance import verify_macro
+from .chunks import encode_chunks
+from .codec import decode_events, encode_events
+from .models import CallEvent, Macro
+from .transfer import read_macro
+
+ProgressCallback = Callable[[int, int], None]
+
+IMPORT_SUFFIX = ".json"
+
+# Sotto questa soglia i file vengono letti nel processo corrente
+MIN_PARALLEL_FILES = 4
+
+# (percorso file o archivio, nome del membro dell'archivio o None)
+Source = Tuple[str, Optional[str]]
+
+
+@dataclass
+class ParsedMacro:
+    """Macro letta e validata da un processo di importazione"""
+    source: str
+    macro: Macro
+    digests: Tuple[str, ...]
+
+
+@dataclass
+class BulkImportResult:
+    imported: List[Macro] = field(default_factory=list)
+    # (file, titolo della macro già presente)
+    duplicates: List[Tuple[str, str]] = field(default_factory=list)
+    # (file, messaggio di errore)
+    errors: List[Tuple[str, str]] = field(default_factory=list)
+    # id originale -> id assegnato per conflitto con la libreria
+    renamed: Dict[str, str] = field(default_factory=dict)
+
+    def summary(self) -> str:
+        parts = [f"{len(self.imported)} importate"]
+        if self.duplicates:
+            parts.append(f"{len(self.duplicates)} già presenti")
+        if self.renamed:
+            parts.append(f"{len(self.renamed)} con nuovo id")
+        if self.errors:
+            parts.append(f"{len(self.errors)} errori")
+        return ", ".join(parts)
+
+
+def source_label(source: Source) -> str:
+    path, member = source
+    return f"{path}!{member}" if member else path
+
+
+def collect_sources(path: Path) -> List[Source]:
+    """File JSON da importare da una cartella (anche nelle sottocartelle) o da un archivio .zip"""
+    path = Path(path)
+    if path.is_dir():
+        return [(str(p), None) for p in sorted(path.rglob(f"*{IMPORT_SUFFIX}")) if p.is_file()]
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            names = [
+                info.filename for info in zf.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(IMPORT_SUFFIX)
+                and not info.filename.startswith("__MACOSX/")
+            ]
+        return [(str(path), name) for name in sorted(names)]
+    if path.is_file():
+        return [(str(path), None)]
+    raise FileNotFoundError(f"Percorso non trovato: {path}")
+
+
+# Archivi aperti dal processo di importazione corrente (percorso -> ZipFile)
+_archives: Dict[str, zipfile.ZipFile] = {}
+
+
+def _open_source(source: Source):
+    path, member = source
+    if member is None:
+        return open(path, "r", encoding="utf-8")
+    zf = _archives.get(path)
+    if zf is None:
+        zf = _archives[path] = zipfile.ZipFile(path)
+    return io.TextIOWrapper(zf.open(member), encoding="utf-8")
+
+
+def _parse_source(source: Source) -> Tuple[Source, Optional[Dict[str, Any]], str]:
+    """
+    Legge e valida un file (eseguita nei processi di importazione).
+
+    Returns:
+        (sorgente, dati della macro o None, messaggio di errore)
+    """
+    try:
+        with _open_source(source) as f:
+            macro = read_macro(f)
+        verify_macro(macro)
+        data = encode_events(macro.events)
+        digests = tuple(digest for digest, _ in encode_chunks(macro.events))
+        macro.events = []
+        return source, {"macro": macro, "events": data, "digests": digests}, ""
+    except Exception as exc:
+        return source, None, f"{type(exc).__name__}: {exc}"
+
+
+def parse_sources(
+    sources: Sequence[Source],
+    workers: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> Tuple[List[ParsedMacro], List[Tuple[str, str]]]:
+    """
+    Legge e valida i file in parallelo, nell'ordine di `sources`.
+
+    Returns:
+        (macro lette, errori come (file, messaggio))
+    """
+    parsed: List[ParsedMacro] = []
+    errors: List[Tuple[str, str]] = []
+    total = len(sources)
+
+    def collect(results) -> None:
+        for done, (source, data, error) in enumerate(results, 1):
+            label = source_label(source)
+            if data is None:
+                logger.warning("Importazione di {} non riuscita: {}", label, error)
+                errors.append((label, error))
+            else:
+                macro = data["macro"]
+                macro.events = decode_events(data["events"])
+                parsed.append(ParsedMacro(label, macro, data["digests"]))
+            if progress is not None:
+                progress(done, total)
+
+    if workers is None:
+        workers = min(os.cpu_count() or 1, 8)
+    if workers <= 1 or total < MIN_PARALLEL_FILES:
+        try:
+            collect(map(_parse_source, sources))
+        finally:
+            _close_archives()
+        return parsed, errors
+
+    workers = min(workers, total)
+    chunksize = max(1, min(16, total // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        collect(pool.map(_parse_source, sources, chunksize=chunksize))
+    return parsed, errors
+
+
+def _close_archives() -> None:
+    for zf in _archives.values():
+        zf.close()
+    _archives.clear()
+
+
+def _free_id(taken: Set[str]) -> str:
+    base = f"imp-{int(time.time() * 1000)}"
+    new_id, n = base, 1
+    while new_id in taken:
+        n += 1
+        new_id = f"{base}-{n}"
+    return new_id
+
+
+def merge_parsed(
+    macros: List[Macro],
+    parsed: Sequence[ParsedMacro],
+    find_duplicate: Callable[[List[Macro], Macro, Tuple[str, ...]], Optional[Macro]],
+    new_id: Callable[[Set[str]], str] = _free_id,
+) -> BulkImportResult:
+    """
+    Prepara le macro lette per l'aggiunta alla libreria, senza modificarla.
+
+    I duplicati (stessi eventi di una macro della libreria o di una macro già
+    importata in questo blocco) vengono scartati. Le macro con un id già
+    usato ricevono un id nuovo e le chiamate tra macro dello stesso blocco
+    vengono aggiornate di conseguenza. Id ed eventi cambiano solo nelle copie
+    restituite in `imported`: le macro di `parsed` restano come sono state
+    lette (es. con --dry-run).
+    """
+    result = BulkImportResult()
+    taken = {m.id for m in macros}
+    seen: Dict[Tuple[str, ...], Macro] = {}
+    # id originale -> id assegnato, per le macro del blocco
+    batch_ids: Dict[str, str] = {}
+
+    for item in parsed:
+        macro = item.macro
+        dup = seen.get(item.digests) or find_duplicate(macros, macro, item.digests)
+        if dup is not None:
+            result.duplicates.append((item.source, dup.title))
+            batch_ids.setdefault(macro.id, dup.id)
+            continue
+        original = macro.id
+        if original in taken:
+            macro = replace(macro, id=new_id(taken))
+            result.renamed[original] = macro.id
+        else:
+            macro = replace(macro)
+        taken.add(macro.id)
+        batch_ids.setdefault(original, macro.id)
+        seen[item.digests] = macro
+        result.imported.append(macro)
+
+    for macro in result.imported:
+        if any(isinstance(ev, CallEvent) and batch_ids.get(ev.macro_id, ev.macro_id) != ev.macro_id for ev in macro.events):
+            macro.events = [
+                replace(ev, macro_id=batch_ids[ev.macro_id])
+                if isinstance(ev, CallEvent) and ev.macro_id in batch_ids else ev
+                for ev in macro.events
+            ]
+    return result
+
+
+def import_into_library(
+    macros: List[Macro],
+    parsed: Sequence[ParsedMacro],
+    errors: Sequence[Tuple[str, str]] = (),
+) -> BulkImportResult:
+    """
+    Aggiunge le macro lette alla libreria e la salva con un'unica scrittura.
+    Se le chiamate tra macro formano un ciclo la libreria resta invariata
+    (solleva MacroCycleError).
+    """
+    from .storage import find_duplicate, get_allocator, save_macros
+
+    result = merge_parsed(macros, parsed, find_duplicate, lambda taken: get_allocator().new_id("imp", taken))
+    result.errors.extend(errors)
+    if result.imported:
+        count = len(macros)
+        macros.extend(result.imported)
+        try:
+            save_macros(macros)
+        except Exception:
+            del macros[count:]
+            raise
+    return result
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.bulkimport", description="Importa macro da una cartella o da un archivio .zip")
+    parser.add_argument("path", type=Path, help="cartella o archivio .zip con i file JSON esportati")
+    parser.add_argument("--workers", type=int, default=None, help="processi di lettura (default: numero di CPU, max 8)")
+    parser.add_argument("--dry-run", action="store_true", help="legge e valida i file senza modificare la libreria")
+    args = parser.parse_args(argv)
+
+    from .storage import configure_storage, find_duplicate, flush_storage, load_macros, load_settings
+
+    try:
+        sources = collect_sources(args.path)
+    except OSError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    print(f"{len(sources)} file da importare")
+
+    start = time.perf_counter()
+    parsed, errors = parse_sources(sources, args.workers)
+    configure_storage(load_settings())
+    macros = load_macros()
+    if args.dry_run:
+        result = merge_parsed(macros, parsed, find_duplicate)
+        result.errors.extend(errors)
+    else:
+        result = import_into_library(macros, parsed, errors)
+        flush_storage()
+
+    for source, title in result.duplicates:
+        print(f"  già presente: {source} ({title})")
+    for source, error in result.errors:
+        print(f"  errore: {source}: {error}", file=sys.stderr)
+    print(f"{result.summary()} in {time.perf_counter() - start:.1f} s")
+    return 1 if result.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Compilazione del piano di riproduzione in un programma compatto.
+
+Il programma è un array di coppie (opcode, argomento) più una tabella delle
+operazioni del piano. I cicli vengono eseguiti dall'interprete con un
+contatore per livello: un ciclo interno di 10.000 iterazioni occupa la
+stessa memoria di una singola iterazione.
+"""
+
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List
+
+from loguru import logger
+
+from .models import ControlEvent
+
+OP_EMIT = 0      # argomento: indice nella tabella delle operazioni
+OP_LOOP = 1      # argomento: numero di iterazioni
+OP_ENDLOOP = 2   # argomento: posizione della prima istruzione del corpo
+OP_BLOCK = 3     # argomento: indice dell'etichetta
+OP_ENDBLOCK = 4  # argomento: indice dell'etichetta
+
+# Numero massimo di iterazioni di un singolo ciclo
+MAX_LOOP_COUNT = 10_000_000
+
+
+@dataclass
+class Program:
+    code: array = field(default_factory=lambda: array("i"))
+    ops: List[object] = field(default_factory=list)
+    labels: List[str] = field(default_factory=list)
+    # Numero di operazioni eseguite da una esecuzione completa del programma
+    op_count: int = 0
+
+    def __len__(self) -> int:
+        return len(self.code) // 2
+
+
+def compile_program(ops: Iterable[object]) -> Program:
+    """
+    Compila una sequenza di operazioni del piano.
+
+    Gli eventi ControlEvent loop/block/end delimitano i blocchi, wait resta
+    un'operazione normale. Un end senza blocco aperto viene ignorato e i
+    blocchi ancora aperti alla fine vengono chiusi automaticamente.
+    """
+    prog = Program()
+    code = prog.code
+    # (tipo, posizione del corpo o indice etichetta, moltiplicatore esterno)
+    open_blocks: List[tuple] = []
+    multiplier = 1
+
+    def _close(kind: str, arg: int) -> None:
+        code.extend((OP_ENDLOOP if kind == "loop" else OP_ENDBLOCK, arg))
+
+    for op in ops:
+        if isinstance(op, ControlEvent) and op.action != "wait":
+            if op.action == "loop":
+                count = max(0, min(int(op.count), MAX_LOOP_COUNT))
+                code.extend((OP_LOOP, count))
+                open_blocks.append(("loop", len(code) // 2, multiplier))
+                multiplier *= count
+            elif op.action == "block":
+                prog.labels.append(op.label or "")
+                label_idx = len(prog.labels) - 1
+                code.extend((OP_BLOCK, label_idx))
+                open_blocks.append(("block", label_idx, multiplier))
+            elif op.action == "end":
+                if not open_blocks:
+                    logger.warning("Fine blocco senza inizio corrispondente ignorata")
+                    continue
+                kind, arg, multiplier = open_blocks.pop()
+                _close(kind, arg)
+            continue
+
+        prog.ops.append(op)
+        code.extend((OP_EMIT, len(prog.ops) - 1))
+        prog.op_count += multiplier
+
+    while open_blocks:
+        kind, arg, _ = open_blocks.pop()
+        logger.warning("Blocco {} non chiuso: chiusura automatica a fine macro", kind)
+        _close(kind, arg)
+
+    return prog
+
+
+def run_program(prog: Program) -> Iterator[object]:
+    """Esegue il programma restituendo le operazioni nell'ordine di riproduzione"""
+    code = prog.code
+    ops = prog.ops
+    n = len(code)
+    pc = 0
+    # Iterazioni rimanenti per ogni ciclo aperto
+    counters: List[int] = []
+
+    while pc < n:
+        opcode = code[pc]
+        arg = code[pc + 1]
+        pc += 2
+        if opcode == OP_EMIT:
+            yield ops[arg]
+        elif opcode == OP_LOOP:
+            if arg <= 0:
+                pc = _skip_loop(code, pc)
+            else:
+                counters.append(arg)
+        elif opcode == OP_ENDLOOP:
+            counters[-1] -= 1
+            if counters[-1] > 0:
+                pc = arg * 2
+            else:
+                counters.pop()
+        # OP_BLOCK / OP_ENDBLOCK: solo delimitatori di etichette
+
+
+def _skip_loop(code: array, pc: int) -> int:
+    """Posizione successiva all'OP_ENDLOOP corrispondente al ciclo che inizia in pc"""
+    depth = 0
+    n = len(code)
+    while pc < n:
+        opcode = code[pc]
+        pc += 2
+        if opcode == OP_LOOP:
+            depth += 1
+        elif opcode == OP_ENDLOOP:
+            if depth == 0:
+                return pc
+            depth -= 1
+    return pc
+
+
+
+def run_stream(ops: Iterable[object]) -> Iterator[object]:
+    """
+    Esegue una sequenza di operazioni senza compilarla per intero.
+
+    Fuori dai cicli le operazioni vengono restituite man mano, senza essere
+    conservate; il corpo di un ciclo viene raccolto fino alla chiusura del
+    ciclo più esterno e solo allora compilato ed eseguito. Usato per le
+    registrazioni mappate in memoria, che non vanno caricate tutte.
+    """
+    it = iter(ops)
+    for op in it:
+        if not isinstance(op, ControlEvent) or op.action == "wait":
+            yield op
+            continue
+        if op.action != "loop":
+            continue  # block/end fuori dai cicli: solo delimitatori
+        body = [op]
+        depth = 1
+        for nxt in it:
+            body.append(nxt)
+            if isinstance(nxt, ControlEvent):
+                if nxt.action in ("loop", "block"):
+                    depth += 1
+                elif nxt.action == "end":
+                    depth -= 1
+                    if depth == 0:
+                        break
+        yield from run_program(compile_program(body))
@@ -0,0 +1,194 @@
+"""
+Archivio dei segmenti di eventi indirizzati per contenuto.
+
+Le sequenze di eventi vengono divise in segmenti con confini definiti dal
+contenuto: un confine cade dopo ogni evento la cui impronta soddisfa una
+maschera, quindi un'inserzione o una modifica sposta solo i segmenti vicini.
+Ogni segmento è codificato con app/codec.py e salvato una sola volta con il
+suo hash come nome; le macro salvano la lista degli hash.
+
+I segmenti sono contati per riferimento: quando una macro viene eliminata o
+modificata, i segmenti non più usati da nessuna macro vengono cancellati.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from .codec import decode_events, encode_events
+from .models import Event
+from .writer import atomic_write_bytes
+
+CHUNK_SUFFIX = ".mrc"
+
+# Dimensioni dei segmenti in numero di eventi
+MIN_CHUNK_EVENTS = 32
+AVG_CHUNK_EVENTS = 256  # deve essere una potenza di 2
+MAX_CHUNK_EVENTS = 2048
+
+_BOUNDARY_MASK = AVG_CHUNK_EVENTS - 1
+
+# Dimensione massima dei segmenti letti tenuti in memoria (dati codificati)
+READ_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def _fingerprint(ev: Event) -> int:
+    return zlib.crc32(repr(ev).encode("utf-8"))
+
+
+def split_events(events: Iterable[Event]) -> Iterator[List[Event]]:
+    """Divide gli eventi in segmenti con confini definiti dal contenuto"""
+    chunk: List[Event] = []
+    for ev in events:
+        chunk.append(ev)
+        n = len(chunk)
+        if n >= MAX_CHUNK_EVENTS or (n >= MIN_CHUNK_EVENTS and (_fingerprint(ev) & _BOUNDARY_MASK) == 0):
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def chunk_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def encode_chunks(events: Iterable[Event]) -> Iterator[Tuple[str, bytes]]:
+    """Segmenti codificati come (hash, dati)"""
+    for chunk in split_events(events):
+        data = encode_events(chunk)
+        yield chunk_hash(data), data
+
+
+class ChunkStore:
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._lock = threading.Lock()
+        # id macro -> hash dei segmenti referenziati nell'ultimo salvataggio
+        self._macro_refs: Dict[str, Tuple[str, ...]] = {}
+        self._refcounts: Counter = Counter()
+        # Segmenti rimasti senza riferimenti al salvataggio precedente: ancora
+        # usati dal file di backup, vengono eliminati al salvataggio successivo
+        self._released: set = set()
+        # id macro -> (lista eventi, hash): evita di ridividere eventi invariati
+        self._hash_cache: Dict[str, Tuple[Sequence[Event], Tuple[str, ...]]] = {}
+        # hash -> dati verificati dei segmenti letti di recente (LRU). Si tengono
+        # i byte e non gli eventi: gli eventi sono modificabili e ogni macro
+        # deve ricevere i propri
+        self._read_cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._read_cache_bytes = 0
+        self.chunks_written = 0
+
+    def path_for(self, digest: str) -> Path:
+        return self.root / digest[:2] / (digest + CHUNK_SUFFIX)
+
+    def hashes_for(self, events: Sequence[Event]) -> Tuple[str, ...]:
+        """Hash dei segmenti degli eventi, senza scrivere nulla"""
+        return tuple(digest for digest, _ in encode_chunks(events))
+
+    def put(self, macro_id: str, events: Sequence[Event]) -> Tuple[str, ...]:
+        """Salva i segmenti mancanti degli eventi e restituisce la lista degli hash"""
+        with self._lock:
+            cached = self._hash_cache.get(macro_id)
+        if cached is not None and cached[0] is events:
+            return cached[1]
+
+        digests: List[str] = []
+        for digest, data in encode_chunks(events):
+            digests.append(digest)
+            path = self.path_for(digest)
+            if not path.exists():
+                atomic_write_bytes(path, data, keep_backup=False)
+                self.chunks_written += 1
+        result = tuple(digests)
+        with self._lock:
+            self._hash_cache[macro_id] = (events, result)
+        return result
+
+    def load(self, macro_id: str, digests: Sequence[str]) -> Optional[List[Event]]:
+        """Ricostruisce gli eventi di una macro; None se un segmento manca o è corrotto"""
+        events: List[Event] = []
+        for digest in digests:
+            try:
+                data = self._read_chunk(digest)
+                events.extend(decode_events(data))
+            except Exception as exc:
+                logger.error("Segmento {} della macro {} non leggibile: {}", digest, macro_id, exc)
+                return None
+        with self._lock:
+            self._hash_cache[macro_id] = (events, tuple(digests))
+        return events
+
+    def _read_chunk(self, digest: str) -> bytes:
+        with self._lock:
+            data = self._read_cache.get(digest)
+            if data is not None:
+                self._read_cache.move_to_end(digest)
+                return data
+        data = self.path_for(digest).read_bytes()
+        if chunk_hash(data) != digest:
+            raise ValueError("hash non corrispondente")
+        with self._lock:
+            if digest not in self._read_cache:
+                self._read_cache[digest] = data
+                self._read_cache_bytes += len(data)
+                while self._read_cache_bytes > READ_CACHE_BYTES and len(self._read_cache) > 1:
+                    _, old = self._read_cache.popitem(last=False)
+                    self._read_cache_bytes -= len(old)
+        return data
+
+    def set_references(self, refs: Dict[str, Tuple[str, ...]]) -> List[str]:
+        """
+        Registra i segmenti usati da ogni macro nello stato salvato.
+
+        Returns:
+            hash dei segmenti da eliminare con remove: quelli senza riferimenti
+            sia in questo salvataggio sia nel precedente (il backup)
+        """
+        with self._lock:
+            new_counts: Counter = Counter()
+            for digests in refs.values():
+                new_counts.update(set(digests))
+            expired = [d for d in self._released if d not in new_counts]
+            released = {d for d in self._refcounts if d not in new_counts}
+            self._released = released
+            self._refcounts = new_counts
+            self._macro_refs = dict(refs)
+            for mid in set(self._hash_cache) - set(refs):
+                del self._hash_cache[mid]
+            for digest in released:
+                data = self._read_cache.pop(digest, None)
+                if data is not None:
+                    self._read_cache_bytes -= len(data)
+            return expired
+
+    def refcount(self, digest: str) -> int:
+        with self._lock:
+            return self._refcounts.get(digest, 0)
+
+    def find_duplicate(self, digests: Sequence[str]) -> Optional[str]:
+        """Id di una macro salvata con esattamente gli stessi segmenti"""
+        target = tuple(digests)
+        with self._lock:
+            return next((mid for mid, refs in self._macro_refs.items() if refs == target), None)
+
+    def remove(self, digests: Iterable[str]) -> int:
+        removed = 0
+        for digest in digests:
+            path = self.path_for(digest)
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                logger.debug(f"Segmento non eliminato {path}: {exc}")
+        return removed
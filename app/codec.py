@@ -0,0 +1,215 @@
+"""
+Formato binario compatto per le sequenze di eventi.
+
+Struttura:
+    header   -> magic, versione, numero di stringhe, numero di eventi
+    stringhe -> tabella dei nomi di tasti e pulsanti (lunghezza u16 + UTF-8)
+    record   -> un record a dimensione fissa per evento
+
+I record a dimensione fissa permettono di leggere un evento qualsiasi tramite
+offset, senza decodificare quelli precedenti.
+"""
+
+from __future__ import annotations
+
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .models import CallEvent, ControlEvent, Event, KeyEvent, MouseEvent
+
+MAGIC = b"MRE1"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHII")
+# kind, action, indice stringa, time_delta_ms, x, y, dx, dy
+RECORD = struct.Struct("<BBHIiiii")
+_STRLEN = struct.Struct("<H")
+
+KIND_KEY = 0
+KIND_MOUSE = 1
+KIND_CALL = 2
+KIND_CONTROL = 3
+
+NO_STRING = 0xFFFF
+NONE_INT = -(2 ** 31)
+
+KEY_ACTIONS: Tuple[str, ...] = ("press", "release")
+MOUSE_ACTIONS: Tuple[str, ...] = ("move", "click", "press", "release", "scroll")
+CONTROL_ACTIONS: Tuple[str, ...] = ("loop", "block", "end", "wait")
+
+_KEY_ACTION_CODES = {a: i for i, a in enumerate(KEY_ACTIONS)}
+_MOUSE_ACTION_CODES = {a: i for i, a in enumerate(MOUSE_ACTIONS)}
+_CONTROL_ACTION_CODES = {a: i for i, a in enumerate(CONTROL_ACTIONS)}
+
+
+class CodecError(ValueError):
+    """Dati binari non validi"""
+
+
+def _opt(value: Optional[int]) -> int:
+    return NONE_INT if value is None else int(value)
+
+
+def _unopt(value: int) -> Optional[int]:
+    return None if value == NONE_INT else value
+
+
+class StringTable:
+    """Tabella delle stringhe (nomi tasti e pulsanti) indicizzate"""
+
+    def __init__(self, strings: Sequence[str] = ()) -> None:
+        self.strings: List[str] = list(strings)
+        self._index: Dict[str, int] = {s: i for i, s in enumerate(self.strings)}
+
+    def index_of(self, s: Optional[str]) -> int:
+        if s is None:
+            return NO_STRING
+        idx = self._index.get(s)
+        if idx is None:
+            idx = len(self.strings)
+            if idx >= NO_STRING:
+                raise CodecError("Troppi nomi di tasti distinti")
+            self.strings.append(s)
+            self._index[s] = idx
+        return idx
+
+    def get(self, idx: int) -> Optional[str]:
+        return None if idx == NO_STRING else self.strings[idx]
+
+    def encode(self) -> bytes:
+        out = bytearray()
+        for s in self.strings:
+            raw = s.encode("utf-8")
+            out += _STRLEN.pack(len(raw))
+            out += raw
+        return bytes(out)
+
+
+def pack_event(ev: Event, strings: StringTable) -> bytes:
+    """Codifica un evento in un record a dimensione fissa"""
+    if isinstance(ev, KeyEvent):
+        return RECORD.pack(
+            KIND_KEY, _KEY_ACTION_CODES[ev.action], strings.index_of(ev.key),
+            max(0, int(ev.time_delta_ms)), 0, 0, NONE_INT, NONE_INT,
+        )
+    if isinstance(ev, MouseEvent):
+        return RECORD.pack(
+            KIND_MOUSE, _MOUSE_ACTION_CODES[ev.action], strings.index_of(ev.button),
+            max(0, int(ev.time_delta_ms)), int(ev.x), int(ev.y), _opt(ev.dx), _opt(ev.dy),
+        )
+    if isinstance(ev, CallEvent):
+        # Per le chiamate la stringa è l'id della macro e x il numero di ripetizioni
+        return RECORD.pack(
+            KIND_CALL, 0, strings.index_of(ev.macro_id),
+            max(0, int(ev.time_delta_ms)), int(ev.repetitions), 0, NONE_INT, NONE_INT,
+        )
+    if isinstance(ev, ControlEvent):
+        # Per i costrutti di controllo la stringa è l'etichetta, x il conteggio e y l'attesa
+        return RECORD.pack(
+            KIND_CONTROL, _CONTROL_ACTION_CODES[ev.action], strings.index_of(ev.label),
+            max(0, int(ev.time_delta_ms)), int(ev.count), int(ev.wait_ms), NONE_INT, NONE_INT,
+        )
+    raise CodecError(f"Tipo di evento non supportato: {type(ev).__name__}")
+
+
+def unpack_event(fields: Tuple[int, ...], strings: StringTable) -> Event:
+    """Ricostruisce un evento dai campi di un record"""
+    kind, action, sidx, delta, x, y, dx, dy = fields
+    try:
+        if kind == KIND_KEY:
+            return KeyEvent(type="key", time_delta_ms=delta, action=KEY_ACTIONS[action], key=strings.get(sidx) or "")  # type: ignore[arg-type]
+        if kind == KIND_MOUSE:
+            return MouseEvent(
+                type="mouse", time_delta_ms=delta, action=MOUSE_ACTIONS[action],  # type: ignore[arg-type]
+                x=x, y=y, button=strings.get(sidx), dx=_unopt(dx), dy=_unopt(dy),
+            )
+        if kind == KIND_CALL:
+            return CallEvent(type="call", time_delta_ms=delta, macro_id=strings.get(sidx) or "", repetitions=x)
+        if kind == KIND_CONTROL:
+            return ControlEvent(
+                type="control", time_delta_ms=delta, action=CONTROL_ACTIONS[action],  # type: ignore[arg-type]
+                count=x, wait_ms=y, label=strings.get(sidx),
+            )
+    except IndexError as exc:
+        raise CodecError(f"Record non valido: {fields}") from exc
+    raise CodecError(f"Tipo di record sconosciuto: {kind}")
+
+
+def encode_events(events: Iterable[Event]) -> bytes:
+    """Codifica una sequenza di eventi nel formato binario compatto"""
+    strings = StringTable()
+    records = bytearray()
+    count = 0
+    for ev in events:
+        records += pack_event(ev, strings)
+        count += 1
+    table = strings.encode()
+    return HEADER.pack(MAGIC, FORMAT_VERSION, len(strings.strings), len(table), count) + table + bytes(records)
+
+
+def read_header(buf, records: bool = True) -> Tuple[StringTable, int, int]:
+    """
+    Legge header e tabella delle stringhe. Con records=False `buf` può
+    contenere solo header e tabella (lettura parziale, es. BLOB di SQLite).
+
+    Returns:
+        (tabella stringhe, offset del primo record, numero di eventi)
+    """
+    # Vista rilasciata anche in caso di errore: un file mappato deve poter essere chiuso
+    with memoryview(buf) as view:
+        if len(view) < HEADER.size:
+            raise CodecError("Dati troppo corti")
+        magic, version, n_strings, table_size, count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise CodecError("Formato eventi non riconosciuto")
+        if version > FORMAT_VERSION:
+            raise CodecError(f"Versione formato eventi non supportata: {version}")
+
+        strings: List[str] = []
+        offset = HEADER.size
+        for _ in range(n_strings):
+            (length,) = _STRLEN.unpack_from(view, offset)
+            offset += _STRLEN.size
+            strings.append(bytes(view[offset:offset + length]).decode("utf-8"))
+            offset += length
+        if offset != HEADER.size + table_size:
+            raise CodecError("Tabella stringhe corrotta")
+        if records and len(view) < offset + count * RECORD.size:
+            raise CodecError("Dati eventi troncati")
+        return StringTable(strings), offset, count
+
+
+def iter_decode(buf) -> Iterator[Event]:
+    """Decodifica gli eventi uno alla volta senza creare liste intermedie"""
+    strings, offset, count = read_header(buf)
+    view = memoryview(buf)[offset:offset + count * RECORD.size]
+    for fields in RECORD.iter_unpack(view):
+        yield unpack_event(fields, strings)
+
+
+def record_columns(buf, offset: int, count: int) -> Tuple[bytes, array]:
+    """
+    Tipo e pausa di tutti i record senza decodificare gli eventi.
+
+    Returns:
+        (tipi KIND_* come bytes, time_delta_ms come array "I")
+    """
+    size = RECORD.size
+    data = memoryview(buf)[offset:offset + count * size].tobytes()
+    kinds = data[0::size]
+    raw = bytearray(4 * count)
+    # time_delta_ms è il campo u32 little-endian all'offset 4 del record
+    for b in range(4):
+        raw[b::4] = data[4 + b::size]
+    deltas = array("I")
+    deltas.frombytes(bytes(raw))
+    if sys.byteorder != "little":
+        deltas.byteswap()
+    return kinds, deltas
+
+
+def decode_events(buf) -> List[Event]:
+    """Decodifica tutti gli eventi"""
+    return list(iter_decode(buf))
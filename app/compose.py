@@ -0,0 +1,207 @@
+"""
+Composizione di macro: espansione degli eventi CallEvent con una cache
+condivisa delle sequenze espanse e rilevamento dei cicli di chiamata.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import replace
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+from .display import DisplayTopology, current_topology, remap_events
+from .eventfile import MappedEvents
+from .models import CallEvent, ControlEvent, Event, Macro
+from .sqlstore import StoredEvents
+
+
+class MacroCycleError(ValueError):
+    """Le chiamate tra macro formano un ciclo"""
+
+    def __init__(self, cycle: List[str]) -> None:
+        super().__init__("Ciclo di chiamate tra macro: " + " -> ".join(cycle))
+        self.cycle = cycle
+
+
+# id macro -> (lista di eventi, id chiamati): le liste di eventi non vengono
+# modificate sul posto ma sostituite, quindi basta confrontarne l'identità
+_callees: Dict[str, Tuple[Sequence[Event], FrozenSet[str]]] = {}
+_callees_lock = threading.Lock()
+
+
+def called_ids(macro: Macro) -> FrozenSet[str]:
+    """
+    Id delle macro chiamate direttamente da una macro. Calcolati una sola
+    volta per lista di eventi; per i file mappati si decodificano solo i
+    record delle chiamate, per gli eventi nel database si usa la colonna calls.
+    """
+    events = macro.events
+    with _callees_lock:
+        cached = _callees.get(macro.id)
+    if cached is not None and cached[0] is events:
+        return cached[1]
+    if isinstance(events, (MappedEvents, StoredEvents)):
+        ids = frozenset(events.call_ids())
+    else:
+        ids = frozenset(ev.macro_id for ev in events if isinstance(ev, CallEvent))
+    with _callees_lock:
+        _callees[macro.id] = (events, ids)
+    return ids
+
+
+def find_call_cycle(macros: Iterable[Macro]) -> Optional[List[str]]:
+    """Restituisce il primo ciclo di chiamate trovato (lista di id), None se assente"""
+    graph: Dict[str, FrozenSet[str]] = {m.id: called_ids(m) for m in macros}
+    with _callees_lock:
+        # Macro eliminate: non trattengono più la loro lista di eventi
+        for mid in [mid for mid in _callees if mid not in graph]:
+            del _callees[mid]
+    WHITE, GREY, BLACK = 0, 1, 2
+    color: Dict[str, int] = {mid: WHITE for mid in graph}
+
+    for root in graph:
+        if color[root] != WHITE:
+            continue
+        # DFS iterativa: (nodo, iteratore sui figli)
+        path: List[str] = [root]
+        stack = [(root, iter(sorted(graph[root])))]
+        color[root] = GREY
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                color[node] = BLACK
+                stack.pop()
+                path.pop()
+                continue
+            if child not in graph:
+                continue
+            if color[child] == GREY:
+                return path[path.index(child):] + [child]
+            if color[child] == WHITE:
+                color[child] = GREY
+                path.append(child)
+                stack.append((child, iter(sorted(graph[child]))))
+    return None
+
+
+def check_call_cycles(macros: Iterable[Macro]) -> None:
+    """Solleva MacroCycleError se le chiamate tra macro formano un ciclo"""
+    cycle = find_call_cycle(macros)
+    if cycle:
+        raise MacroCycleError(cycle)
+
+
+class PlanCache:
+    """
+    Cache condivisa delle sequenze di eventi con le chiamate espanse.
+
+    La sequenza di una macro contiene gli eventi dei sottoprogrammi già
+    rimappati sul layout dei display corrente (ogni macro con il proprio
+    layout registrato). Gli eventi sono condivisi, non copiati, tra le
+    sequenze che includono lo stesso sottoprogramma; le ripetizioni di una
+    chiamata diventano un ciclo ControlEvent invece di copie del corpo.
+
+    Quando una macro cambia, invalidate() scarta solo la sua sequenza e
+    quelle delle macro che la chiamano, direttamente o indirettamente.
+    """
+
+    def __init__(self, resolver: Callable[[str], Optional[Macro]]) -> None:
+        self._resolver = resolver
+        self._lock = threading.RLock()
+        self._expanded: Dict[str, List[Event]] = {}
+        self._topology: Optional[DisplayTopology] = None
+        # callee id -> id delle macro che lo chiamano
+        self._callers: Dict[str, Set[str]] = {}
+
+    def expanded(self, macro: Macro) -> List[Event]:
+        """Eventi della macro con le chiamate sostituite dagli eventi delle macro chiamate"""
+        with self._lock:
+            topology = current_topology()
+            if topology != self._topology:
+                self._expanded.clear()
+                self._topology = topology
+            return self._expand(macro, [])
+
+    def _expand(self, macro: Macro, stack: List[str]) -> List[Event]:
+        cached = self._expanded.get(macro.id)
+        if cached is not None:
+            return cached
+        if macro.id in stack:
+            raise MacroCycleError(stack[stack.index(macro.id):] + [macro.id])
+
+        stack.append(macro.id)
+        out: List[Event] = []
+        for ev in remap_events(macro.events, macro.display_layout, self._topology):
+            if isinstance(ev, CallEvent):
+                out.extend(self._call_events(ev, macro.id, stack))
+            else:
+                out.append(ev)
+        stack.pop()
+
+        self._expanded[macro.id] = out
+        return out
+
+    def _call_events(self, ev: CallEvent, caller_id: str, stack: List[str]) -> List[Event]:
+        """Eventi che sostituiscono una chiamata"""
+        self._callers.setdefault(ev.macro_id, set()).add(caller_id)
+        callee = self._resolver(ev.macro_id)
+        if callee is None:
+            logger.warning("Macro chiamata non trovata: {}", ev.macro_id)
+            return []
+        body = self._expand(callee, stack)
+        if not body:
+            return []
+        out: List[Event] = []
+        # La pausa che precede la chiamata si somma al primo evento chiamato
+        if ev.time_delta_ms > 0:
+            out.append(replace(body[0], time_delta_ms=body[0].time_delta_ms + ev.time_delta_ms))
+            out.extend(body[1:])
+        else:
+            out.extend(body)
+        # Le ripetizioni successive diventano un ciclo, senza copiare il corpo
+        extra = max(1, int(ev.repetitions)) - 1
+        if extra > 0:
+            out.append(ControlEvent(type="control", time_delta_ms=0, action="loop", count=extra))
+            out.extend(body)
+            out.append(ControlEvent(type="control", time_delta_ms=0, action="end"))
+        return out
+
+    def iter_expanded(self, macro: Macro) -> Iterator[Event]:
+        """
+        Come expanded(), ma senza materializzare né memorizzare la sequenza
+        della macro: usato per le registrazioni mappate in memoria. Le macro
+        chiamate vengono espanse e memorizzate normalmente.
+        """
+        with self._lock:
+            topology = current_topology()
+            if topology != self._topology:
+                self._expanded.clear()
+                self._topology = topology
+        for ev in remap_events(macro.events, macro.display_layout, topology):
+            if not isinstance(ev, CallEvent):
+                yield ev
+                continue
+            with self._lock:
+                events = self._call_events(ev, macro.id, [macro.id])
+            yield from events
+
+    def invalidate(self, macro_id: str) -> None:
+        """Scarta la sequenza della macro e di tutte le macro che la chiamano"""
+        with self._lock:
+            pending = [macro_id]
+            seen: Set[str] = set()
+            while pending:
+                mid = pending.pop()
+                if mid in seen:
+                    continue
+                seen.add(mid)
+                self._expanded.pop(mid, None)
+                pending.extend(self._callers.get(mid, ()))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._expanded.clear()
+            self._callers.clear()
@@ -12,6 +12,16 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 MACROS_FILE: Path = DATA_DIR / "macros.json"
 SETTINGS_FILE: Path = DATA_DIR / "settings.json"
+# Modifiche ai metadati delle macro successive all'ultimo salvataggio di MACROS_FILE
+MACROS_JOURNAL_FILE: Path = DATA_DIR / "macros.journal"
+# File degli eventi delle registrazioni molto grandi (vedi app/eventfile.py)
+EVENTS_DIR: Path = DATA_DIR / "events"
+# Segmenti di eventi indirizzati per contenuto (vedi app/chunks.py)
+CHUNKS_DIR: Path = DATA_DIR / "chunks"
+# Libreria su SQLite (impostazione storage.backend = "sqlite")
+MACROS_DB_FILE: Path = DATA_DIR / "macros.sqlite3"
+# Indice del contenuto degli eventi (vedi app/content.py)
+CONTENT_INDEX_FILE: Path = DATA_DIR / "content_index.json"
 
 DEFAULT_HOTKEYS = {
     "toggle_record": "<ctrl>+<alt>+r",
@@ -22,6 +32,12 @@ DEFAULT_HOTKEYS = {
 DEFAULT_SETTINGS = {
     "hotkeys": DEFAULT_HOTKEYS,
     "ui": {"theme": "light"},
+    # worker_process: riproduzione in un processo separato (vedi app/worker.py)
+    # pipeline: preparazione anticipata degli eventi su un thread dedicato (vedi app/pipeline.py)
+    "playback": {"worker_process": False, "pipeline": False, "pipeline_lookahead_ms": 250},
+    # backend: "json" (macros.json + registro metadati) oppure "sqlite" (vedi app/sqlstore.py);
+    # letto all'avvio, una modifica vale dal riavvio successivo
+    "storage": {"backend": "json"},
 }
 
 @dataclass
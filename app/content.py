@@ -0,0 +1,619 @@
+"""
+Indice del contenuto delle macro: combinazioni di tasti, testo digitato e
+zone dello schermo cliccate, più le statistiche di ogni macro.
+
+Per rispondere a domande come "quali macro premono ctrl+s" o "quali macro
+cliccano in quest'area" senza decodificare gli eventi di tutta la libreria,
+ogni macro viene analizzata una sola volta quando viene salvata. Le
+caratteristiche estratte finiscono in tre indici invertiti:
+
+    combinazioni  "ctrl+s", "alt+tab", "enter" (modificatori premuti + tasto)
+    parole        parole del testo digitato (minuscole, almeno 2 caratteri)
+    celle         celle di CELL_PX pixel con click, pressioni o scroll del mouse
+
+Ogni voce contiene anche le statistiche degli eventi (app/stats.py) e
+l'ora e l'esito dell'ultima esecuzione, mostrati nelle colonne della
+tabella.
+
+L'indice è salvato in content_index.json accanto alla libreria. Ogni voce
+ha una firma degli eventi (numero e campione di eventi): al caricamento le
+voci con firma invariata vengono riusate, le altre ricalcolate. Durante la
+sessione una macro va ricalcolata solo se la sua lista di eventi è stata
+sostituita o ha cambiato lunghezza.
+
+Sono indicizzati solo gli eventi della macro stessa, non quelli delle
+macro richiamate con CallEvent.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import threading
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+from .models import Event, KeyEvent, Macro, MouseEvent
+from .plan import _char_for_key, is_modifier_key, normalize_modifier_name
+from .stats import REPETITION_GAP_MS, MacroStats, compute_stats
+from .writer import atomic_write_bytes, encode_json
+
+CONTENT_INDEX_VERSION = 2
+
+# Lato delle celle della griglia dello schermo
+CELL_PX = 100
+
+# Eventi campionati per la firma di una lista di eventi
+SIGNATURE_SAMPLES = 64
+
+# Lunghezza massima dei testi digitati conservati per la verifica delle frasi
+MAX_TEXT_RUN = 200
+
+_WORD = re.compile(r"\w+")
+
+# Ordine dei modificatori nelle combinazioni
+_MODIFIER_ORDER = ("ctrl", "alt", "alt gr", "shift", "windows")
+
+# Modificatori che impediscono di considerare un tasto come testo digitato
+_NON_TEXT_MODIFIERS = frozenset(("ctrl", "alt", "windows"))
+
+_MOUSE_POSITION_ACTIONS = ("click", "press", "scroll")
+
+# Prefissi dei termini di contenuto nella casella di ricerca
+_TERM_KINDS = {"tasto": "chord", "key": "chord", "testo": "text", "text": "text", "area": "region"}
+_CONTENT_TERM = re.compile(r'(?<!\S)(tasto|key|testo|text|area):("[^"]*"|\S+)', re.IGNORECASE)
+
+# callback(id delle macro con voci cambiate), dal thread che ha aggiornato l'indice
+ContentCallback = Callable[[Set[str]], None]
+
+Cell = Tuple[int, int]
+# (x, y, larghezza, altezza) in pixel
+Region = Tuple[int, int, int, int]
+
+
+def _modifier(key: str) -> str:
+    """Nome del modificatore senza lato (left/right)"""
+    name = normalize_modifier_name(key)
+    for side in ("left ", "right "):
+        if name.startswith(side):
+            return name[len(side):]
+    return name
+
+
+def _chord(modifiers: Iterable[str], key: str) -> str:
+    held = set(modifiers)
+    return "+".join([m for m in _MODIFIER_ORDER if m in held] + [key])
+
+
+def normalize_chord(text: str) -> str:
+    """
+    Forma canonica di una combinazione scritta dall'utente:
+    "Ctrl+Shift+S", "<ctrl>+<shift>+s" e "shift+ctrl+s" diventano "ctrl+shift+s".
+    """
+    parts = [p.strip().strip("<>").strip().lower() for p in text.split("+")]
+    parts = [p for p in parts if p]
+    if not parts:
+        return ""
+    modifiers = {_modifier(p) for p in parts if is_modifier_key(p)}
+    keys = [p for p in parts if not is_modifier_key(p)]
+    if not keys:
+        # Solo modificatori: l'ultimo è il tasto
+        last = _modifier(parts[-1])
+        modifiers.discard(last)
+        return _chord(modifiers, last)
+    return _chord(modifiers, keys[-1])
+
+
+def events_signature(events: Sequence[Event]) -> Tuple[int, int]:
+    """(numero di eventi, crc di un campione distribuito uniformemente)"""
+    n = len(events)
+    if n <= SIGNATURE_SAMPLES:
+        positions: Iterable[int] = range(n)
+    else:
+        step = (n - 1) / (SIGNATURE_SAMPLES - 1)
+        positions = sorted({round(i * step) for i in range(SIGNATURE_SAMPLES)})
+    crc = 0
+    for i in positions:
+        crc = zlib.crc32(repr(events[i]).encode("utf-8"), crc)
+    return n, crc
+
+
+@dataclass
+class ContentEntry:
+    """Caratteristiche del contenuto di una macro"""
+    signature: Tuple[int, int]
+    chords: FrozenSet[str] = frozenset()
+    words: FrozenSet[str] = frozenset()
+    cells: FrozenSet[Cell] = frozenset()
+    # Testi digitati (minuscoli), per verificare le frasi di più parole
+    texts: Tuple[str, ...] = ()
+    stats: MacroStats = field(default_factory=MacroStats)
+    # Ultima esecuzione: ora di avvio e esito (Player.play), None se mai eseguita o in corso
+    last_run_ms: Optional[int] = None
+    last_result: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "signature": list(self.signature),
+            "chords": sorted(self.chords),
+            "words": sorted(self.words),
+            "cells": [list(c) for c in sorted(self.cells)],
+            "texts": list(self.texts),
+            "stats": self.stats.to_dict(),
+            "last_run_ms": self.last_run_ms,
+            "last_result": self.last_result,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "ContentEntry":
+        n, crc = d["signature"]
+        return cls(
+            signature=(int(n), int(crc)),
+            chords=frozenset(str(c) for c in d.get("chords", ())),
+            words=frozenset(str(w) for w in d.get("words", ())),
+            cells=frozenset((int(x), int(y)) for x, y in d.get("cells", ())),
+            texts=tuple(str(t) for t in d.get("texts", ())),
+            stats=MacroStats.from_dict(d["stats"]),
+            last_run_ms=int(d["last_run_ms"]) if d.get("last_run_ms") is not None else None,
+            last_result=d.get("last_result"),
+        )
+
+
+def extract_content(events: Sequence[Event]) -> ContentEntry:
+    """Analizza gli eventi di una macro in un'unica scansione"""
+    chords: Set[str] = set()
+    words: Set[str] = set()
+    cells: Set[Cell] = set()
+    texts: Dict[str, None] = {}
+    held: Dict[str, Set[str]] = defaultdict(set)  # modificatore -> tasti fisici premuti
+    typed: List[str] = []
+
+    def end_text() -> None:
+        if not typed:
+            return
+        text = "".join(typed).lower()
+        typed.clear()
+        found = [w for w in _WORD.findall(text) if len(w) >= 2]
+        if found:
+            words.update(found)
+            texts.setdefault(text.strip()[:MAX_TEXT_RUN])
+
+    for ev in events:
+        if isinstance(ev, KeyEvent):
+            key = ev.key.strip().lower()
+            if is_modifier_key(key):
+                name = _modifier(key)
+                if ev.action == "press":
+                    held[name].add(key)
+                else:
+                    held[name].discard(key)
+                    if not held[name]:
+                        del held[name]
+                continue
+            if ev.action != "press":
+                continue
+            chords.add(_chord(held, key))
+            ch = _char_for_key(key)
+            if ch is not None and not _NON_TEXT_MODIFIERS.intersection(held):
+                typed.append(ch)
+            elif key == "backspace" and typed:
+                typed.pop()
+            else:
+                end_text()
+        elif isinstance(ev, MouseEvent):
+            if ev.action in _MOUSE_POSITION_ACTIONS:
+                cells.add((ev.x // CELL_PX, ev.y // CELL_PX))
+                end_text()
+    end_text()
+    return ContentEntry(
+        signature=events_signature(events),
+        chords=frozenset(chords),
+        words=frozenset(words),
+        cells=frozenset(cells),
+        texts=tuple(texts),
+        stats=compute_stats(events),
+    )
+
+
+def region_cells(region: Region) -> List[Cell]:
+    """Celle della griglia che intersecano l'area"""
+    x, y, w, h = region
+    x0, y0 = x // CELL_PX, y // CELL_PX
+    x1, y1 = (x + max(w, 1) - 1) // CELL_PX, (y + max(h, 1) - 1) // CELL_PX
+    return [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+
+
+@dataclass
+class ContentQuery:
+    """Condizioni sul contenuto, tutte richieste"""
+    chords: List[str] = field(default_factory=list)
+    texts: List[str] = field(default_factory=list)
+    regions: List[Region] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.chords or self.texts or self.regions)
+
+
+def parse_content_terms(text: str) -> Tuple[str, ContentQuery]:
+    """
+    Separa i termini di contenuto dal resto di una ricerca:
+
+        tasto:ctrl+s                combinazione di tasti
+        testo:ciao  testo:"a b"     testo digitato (parole o frase tra virgolette)
+        area:x,y,larghezza,altezza  click nell'area (precisione di una cella)
+
+    Sono accettati anche i prefissi key: e text:. I termini non validi
+    restano nel testo e vengono cercati nei titoli.
+
+    Returns:
+        (testo rimanente, condizioni sul contenuto)
+    """
+    query = ContentQuery()
+
+    def take(match: "re.Match[str]") -> str:
+        kind = _TERM_KINDS[match.group(1).lower()]
+        value = match.group(2).strip('"').strip()
+        if not value:
+            return match.group(0)
+        if kind == "chord":
+            chord = normalize_chord(value)
+            if not chord:
+                return match.group(0)
+            query.chords.append(chord)
+        elif kind == "text":
+            query.texts.append(value)
+        else:
+            try:
+                x, y, w, h = (int(p) for p in value.split(","))
+            except ValueError:
+                return match.group(0)
+            query.regions.append((x, y, w, h))
+        return " "
+
+    rest = _CONTENT_TERM.sub(take, text)
+    return " ".join(rest.split()), query
+
+
+class ContentIndex:
+    """
+    Indice invertito del contenuto della libreria.
+
+    sync() registra le macro da (ri)analizzare senza leggere gli eventi;
+    refresh() le analizza (sul thread di scrittura) e salva il file. Le query
+    non analizzano nulla: considerano solo le macro già analizzate, e
+    pending() dice se il risultato può essere incompleto.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self._entries: Dict[str, ContentEntry] = {}
+        self._by_chord: Dict[str, Set[str]] = defaultdict(set)
+        self._by_word: Dict[str, Set[str]] = defaultdict(set)
+        self._by_cell: Dict[Cell, Set[str]] = defaultdict(set)
+        # id -> lista di eventi analizzata (per riconoscere le liste sostituite)
+        self._events: Dict[str, Sequence[Event]] = {}
+        # id -> eventi da analizzare
+        self._stale: Dict[str, Sequence[Event]] = {}
+        # Voci lette dal file e non ancora confrontate con la libreria
+        self._stored: Optional[Dict[str, ContentEntry]] = None
+        # id -> (ora, esito) dell'ultima esecuzione di macro in attesa di analisi
+        self._pending_runs: Dict[str, Tuple[Optional[int], Optional[str]]] = {}
+        # (id, con pause) -> durata stimata comprese le macro richiamate
+        self._estimates: Dict[Tuple[str, bool], int] = {}
+        self._subscribers: List[ContentCallback] = []
+        self._dirty = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries) + len(self._stale)
+
+    def _load_stored(self) -> Dict[str, ContentEntry]:
+        if self._stored is None:
+            self._stored = {}
+            if self.path is not None and self.path.exists():
+                try:
+                    data = json.loads(self.path.read_text(encoding="utf-8"))
+                    if data.get("version") == CONTENT_INDEX_VERSION and data.get("cell_px") == CELL_PX:
+                        for mid, raw in data.get("macros", {}).items():
+                            try:
+                                self._stored[mid] = ContentEntry.from_dict(raw)
+                            except (KeyError, TypeError, ValueError) as exc:
+                                logger.debug(f"Voce dell'indice del contenuto ignorata ({mid}): {exc}")
+                except Exception as exc:
+                    logger.warning("Indice del contenuto {} non leggibile, verrà ricostruito: {}", self.path, exc)
+        return self._stored
+
+    def sync(self, macros: Iterable[Macro]) -> None:
+        """Allinea l'indice alla libreria: macro nuove o con eventi cambiati vanno rianalizzate"""
+        with self._lock:
+            stored = self._load_stored()
+            seen: Set[str] = set()
+            for m in macros:
+                mid = m.id
+                seen.add(mid)
+                events = m.events
+                known = self._events.get(mid)
+                if known is events and self._entries[mid].signature[0] == len(events):
+                    continue
+                if self._stale.get(mid) is events:
+                    continue
+                entry = stored.pop(mid, None)
+                if entry is not None:
+                    if entry.signature == events_signature(events):
+                        self._install(mid, events, entry)
+                        continue
+                    self._pending_runs[mid] = (entry.last_run_ms, entry.last_result)
+                self._stale[mid] = events
+            for mid in [mid for mid in self._entries if mid not in seen]:
+                self._unindex(mid)
+                self._dirty = True
+            for mid in [mid for mid in self._stale if mid not in seen]:
+                del self._stale[mid]
+                self._pending_runs.pop(mid, None)
+            if stored:
+                # Voci del file per macro non più presenti
+                stored.clear()
+                self._dirty = True
+
+    def invalidate(self, macro: Macro) -> None:
+        """Da chiamare dopo una modifica degli eventi che non sostituisce la lista"""
+        with self._lock:
+            self._stale[macro.id] = macro.events
+
+    def pending(self) -> int:
+        """Macro in attesa di analisi, escluse dai risultati delle query"""
+        with self._lock:
+            return len(self._stale)
+
+    def refresh(self) -> int:
+        """
+        Analizza le macro in sospeso (fuori dal lock) e salva il file se
+        l'indice è cambiato.
+
+        Returns:
+            numero di macro analizzate
+        """
+        changed: Set[str] = set()
+        while True:
+            with self._lock:
+                if not self._stale:
+                    break
+                mid, events = next(iter(self._stale.items()))
+            entry = extract_content(events)
+            with self._lock:
+                # La macro può essere stata modificata o eliminata nel frattempo
+                if self._stale.get(mid) is events:
+                    del self._stale[mid]
+                    self._install(mid, events, entry)
+                    changed.add(mid)
+        self.save()
+        if changed:
+            # Le stime di durata includono le macro richiamate: cambiano anche
+            # quelle di chi richiama le macro analizzate
+            with self._lock:
+                affected = self._with_callers(changed)
+            self._publish(affected)
+        return len(changed)
+
+    def _with_callers(self, ids: Set[str]) -> Set[str]:
+        """`ids` più le macro che le richiamano, anche indirettamente"""
+        callers: Dict[str, Set[str]] = defaultdict(set)
+        for mid, entry in self._entries.items():
+            for callee in entry.stats.calls:
+                callers[callee].add(mid)
+        result = set(ids)
+        pending = list(ids)
+        while pending:
+            for caller in callers.get(pending.pop(), ()):
+                if caller not in result:
+                    result.add(caller)
+                    pending.append(caller)
+        return result
+
+    def record_run(self, macro_id: str, ts_ms: Optional[int] = None, result: Optional[str] = None) -> None:
+        """
+        Registra l'avvio (ts_ms, esito azzerato) o l'esito (result) di
+        un'esecuzione. Il file viene salvato dal prossimo refresh().
+        """
+        with self._lock:
+            entry = self._entries.get(macro_id)
+            last_run, last_result = (
+                (entry.last_run_ms, entry.last_result) if entry is not None
+                else self._pending_runs.get(macro_id, (None, None))
+            )
+            if ts_ms is not None:
+                last_run, last_result = ts_ms, None
+            if result is not None:
+                last_result = result
+            if entry is not None:
+                entry.last_run_ms, entry.last_result = last_run, last_result
+            else:
+                self._pending_runs[macro_id] = (last_run, last_result)
+            self._dirty = True
+        self._publish({macro_id})
+
+    def subscribe(self, callback: ContentCallback) -> Callable[[], None]:
+        """
+        Registra un callback per le voci aggiornate (analisi completata o
+        nuova esecuzione).
+
+        Returns:
+            funzione che annulla la sottoscrizione
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def _publish(self, ids: Set[str]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(set(ids))
+            except Exception as exc:
+                logger.exception("Content index subscriber failed: {}", exc)
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty or self.path is None:
+                return
+            data = {
+                "version": CONTENT_INDEX_VERSION,
+                "cell_px": CELL_PX,
+                "macros": {mid: e.to_dict() for mid, e in self._entries.items()},
+            }
+            self._dirty = False
+        try:
+            atomic_write_bytes(self.path, encode_json(data), keep_backup=False)
+        except Exception as exc:
+            logger.exception("Failed to write content index {}: {}", self.path, exc)
+
+    def _install(self, mid: str, events: Sequence[Event], entry: ContentEntry) -> None:
+        previous = self._entries.get(mid)
+        if mid in self._pending_runs:
+            entry.last_run_ms, entry.last_result = self._pending_runs.pop(mid)
+        elif previous is not None and entry.last_run_ms is None:
+            entry.last_run_ms, entry.last_result = previous.last_run_ms, previous.last_result
+        self._unindex(mid)
+        self._entries[mid] = entry
+        self._events[mid] = events
+        for chord in entry.chords:
+            self._by_chord[chord].add(mid)
+        for word in entry.words:
+            self._by_word[word].add(mid)
+        for cell in entry.cells:
+            self._by_cell[cell].add(mid)
+        self._estimates.clear()
+        self._dirty = True
+
+    def _unindex(self, mid: str) -> None:
+        entry = self._entries.pop(mid, None)
+        self._events.pop(mid, None)
+        if entry is None:
+            return
+        self._estimates.clear()
+        for table, keys in ((self._by_chord, entry.chords), (self._by_word, entry.words), (self._by_cell, entry.cells)):
+            for key in keys:
+                ids = table.get(key)
+                if ids is not None:
+                    ids.discard(mid)
+                    if not ids:
+                        del table[key]
+
+    def entry(self, macro_id: str) -> Optional[ContentEntry]:
+        with self._lock:
+            return self._entries.get(macro_id)
+
+    def estimate_ms(self, macro_id: str, with_pauses: bool, repetitions: int = 1) -> Optional[int]:
+        """
+        Durata stimata della riproduzione con il profilo indicato, comprese
+        le macro richiamate; None se la macro non è ancora stata analizzata.
+        """
+        with self._lock:
+            once = self._estimate_once(macro_id, with_pauses, set())
+        if once is None:
+            return None
+        repetitions = max(1, int(repetitions))
+        return once * repetitions + REPETITION_GAP_MS * (repetitions - 1)
+
+    def _estimate_once(self, macro_id: str, with_pauses: bool, visiting: Set[str]) -> Optional[int]:
+        key = (macro_id, with_pauses)
+        cached = self._estimates.get(key)
+        if cached is not None:
+            return cached
+        entry = self._entries.get(macro_id)
+        if entry is None or macro_id in visiting:
+            return None
+        visiting.add(macro_id)
+        total = entry.stats.own_ms(with_pauses)
+        for callee, count in entry.stats.calls.items():
+            # Macro richiamate mancanti o non ancora analizzate non contano
+            total += (self._estimate_once(callee, with_pauses, visiting) or 0) * count
+        visiting.discard(macro_id)
+        self._estimates[key] = total
+        return total
+
+    def chords(self) -> List[str]:
+        """Combinazioni presenti nelle macro già analizzate"""
+        with self._lock:
+            return sorted(self._by_chord)
+
+    def _match_text(self, text: str) -> Set[str]:
+        terms = [w for w in _WORD.findall(text.lower()) if len(w) >= 2]
+        if not terms:
+            return set()
+        result: Optional[Set[str]] = None
+        for term in terms:
+            ids = self._by_word.get(term)
+            if ids is None:
+                # Parola digitata solo in parte: prefisso di una parola indicizzata
+                ids = set()
+                for word, word_ids in self._by_word.items():
+                    if word.startswith(term):
+                        ids |= word_ids
+            result = set(ids) if result is None else result & ids
+            if not result:
+                return set()
+        phrase = " ".join(text.lower().split())
+        if len(terms) > 1 or phrase != terms[0]:
+            # Frase: verifica sui testi digitati dei candidati
+            result = {mid for mid in result if any(phrase in t for t in self._entries[mid].texts)}
+        return result
+
+    def _match_region(self, region: Region) -> Set[str]:
+        x, y, w, h = region
+        ids: Set[str] = set()
+        if (w // CELL_PX + 2) * (h // CELL_PX + 2) > len(self._by_cell):
+            # Area molto grande: si scorrono le celle usate
+            x0, y0 = x // CELL_PX, y // CELL_PX
+            x1, y1 = (x + max(w, 1) - 1) // CELL_PX, (y + max(h, 1) - 1) // CELL_PX
+            for (cx, cy), cell_ids in self._by_cell.items():
+                if x0 <= cx <= x1 and y0 <= cy <= y1:
+                    ids |= cell_ids
+        else:
+            for cell in region_cells(region):
+                ids |= self._by_cell.get(cell, set())
+        return ids
+
+    def query(
+        self,
+        chord: Optional[str] = None,
+        text: Optional[str] = None,
+        region: Optional[Region] = None,
+    ) -> Set[str]:
+        """Id delle macro che soddisfano tutte le condizioni indicate"""
+        q = ContentQuery()
+        if chord:
+            q.chords.append(normalize_chord(chord))
+        if text:
+            q.texts.append(text)
+        if region:
+            q.regions.append(region)
+        return self.match(q)
+
+    def match(self, q: ContentQuery) -> Set[str]:
+        """Id delle macro già analizzate che soddisfano la query (vedi pending())"""
+        if not q:
+            return set()
+        with self._lock:
+            matches: List[Set[str]] = []
+            for chord in q.chords:
+                matches.append(self._by_chord.get(chord) or set())
+            for text in q.texts:
+                matches.append(self._match_text(text))
+            for region in q.regions:
+                matches.append(self._match_region(region))
+            matches.sort(key=len)
+            return set(matches[0]).intersection(*matches[1:])
@@ -0,0 +1,247 @@
+"""
+Topologia dei display: geometria dello schermo virtuale, rettangoli e DPI dei
+monitor, con cache aggiornata solo sulle notifiche di cambio configurazione.
+
+Fornisce inoltre la rimappatura delle coordinate registrate con un layout
+diverso da quello corrente.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Protocol, Tuple
+
+from loguru import logger
+
+from .models import MouseEvent
+
+DEFAULT_DPI = 96
+
+
+@dataclass(frozen=True)
+class MonitorInfo:
+    left: int
+    top: int
+    right: int
+    bottom: int
+    dpi: int = DEFAULT_DPI
+    primary: bool = False
+
+    @property
+    def width(self) -> int:
+        return max(1, self.right - self.left)
+
+    @property
+    def height(self) -> int:
+        return max(1, self.bottom - self.top)
+
+    def contains(self, x: int, y: int) -> bool:
+        return self.left <= x < self.right and self.top <= y < self.bottom
+
+
+@dataclass(frozen=True)
+class DisplayTopology:
+    # Schermo virtuale come (x, y, larghezza, altezza)
+    virtual: Tuple[int, int, int, int]
+    monitors: Tuple[MonitorInfo, ...] = ()
+
+    def ordered_monitors(self) -> List[MonitorInfo]:
+        """Monitor in ordine stabile: primario prima, poi da sinistra a destra e dall'alto in basso"""
+        return sorted(self.monitors, key=lambda m: (not m.primary, m.left, m.top))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "virtual": list(self.virtual),
+            "monitors": [
+                {"rect": [m.left, m.top, m.right, m.bottom], "dpi": m.dpi, "primary": m.primary}
+                for m in self.monitors
+            ],
+        }
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> "DisplayTopology":
+        monitors = []
+        for m in d.get("monitors", []):
+            left, top, right, bottom = (int(v) for v in m["rect"])
+            monitors.append(MonitorInfo(left, top, right, bottom, int(m.get("dpi", DEFAULT_DPI)), bool(m.get("primary", False))))
+        vx, vy, vw, vh = (int(v) for v in d["virtual"])
+        return DisplayTopology(virtual=(vx, vy, vw, vh), monitors=tuple(monitors))
+
+
+class TopologyProvider(Protocol):
+    def query(self) -> DisplayTopology:
+        ...
+
+
+class StaticTopologyProvider:
+    """Provider con topologia fissa, utilizzabile nei test e fuori da Windows"""
+
+    def __init__(self, topology: DisplayTopology) -> None:
+        self.topology = topology
+        self.query_count = 0
+
+    def query(self) -> DisplayTopology:
+        self.query_count += 1
+        return self.topology
+
+
+class Win32TopologyProvider:
+    """Interroga la configurazione dei monitor tramite le API Win32"""
+
+    SM_XVIRTUALSCREEN = 76
+    SM_YVIRTUALSCREEN = 77
+    SM_CXVIRTUALSCREEN = 78
+    SM_CYVIRTUALSCREEN = 79
+    MONITORINFOF_PRIMARY = 0x00000001
+    MDT_EFFECTIVE_DPI = 0
+
+    def query(self) -> DisplayTopology:
+        import ctypes
+        from ctypes import wintypes
+
+        user32 = ctypes.windll.user32
+
+        class MONITORINFO(ctypes.Structure):
+            _fields_ = [
+                ("cbSize", wintypes.DWORD),
+                ("rcMonitor", wintypes.RECT),
+                ("rcWork", wintypes.RECT),
+                ("dwFlags", wintypes.DWORD),
+            ]
+
+        MONITORENUMPROC = ctypes.WINFUNCTYPE(
+            wintypes.BOOL, wintypes.HMONITOR, wintypes.HDC, ctypes.POINTER(wintypes.RECT), wintypes.LPARAM
+        )
+
+        try:
+            get_dpi = ctypes.windll.shcore.GetDpiForMonitor
+        except Exception:
+            get_dpi = None
+
+        monitors: List[MonitorInfo] = []
+
+        def _callback(hmon, _hdc, _rect, _data):
+            info = MONITORINFO()
+            info.cbSize = ctypes.sizeof(MONITORINFO)
+            if not user32.GetMonitorInfoW(hmon, ctypes.byref(info)):
+                return True
+            dpi = DEFAULT_DPI
+            if get_dpi is not None:
+                dpi_x, dpi_y = wintypes.UINT(), wintypes.UINT()
+                if get_dpi(hmon, self.MDT_EFFECTIVE_DPI, ctypes.byref(dpi_x), ctypes.byref(dpi_y)) == 0:
+                    dpi = int(dpi_x.value)
+            rc = info.rcMonitor
+            monitors.append(MonitorInfo(
+                rc.left, rc.top, rc.right, rc.bottom, dpi, bool(info.dwFlags & self.MONITORINFOF_PRIMARY)
+            ))
+            return True
+
+        user32.EnumDisplayMonitors(None, None, MONITORENUMPROC(_callback), 0)
+
+        virtual = (
+            int(user32.GetSystemMetrics(self.SM_XVIRTUALSCREEN)),
+            int(user32.GetSystemMetrics(self.SM_YVIRTUALSCREEN)),
+            int(user32.GetSystemMetrics(self.SM_CXVIRTUALSCREEN)),
+            int(user32.GetSystemMetrics(self.SM_CYVIRTUALSCREEN)),
+        )
+        return DisplayTopology(virtual=virtual, monitors=tuple(monitors))
+
+
+class DisplayTopologyCache:
+    """
+    Cache della topologia dei display.
+    La topologia viene letta alla prima richiesta e riletta solo dopo invalidate(),
+    chiamato dalle notifiche di cambio configurazione dei display.
+    """
+
+    def __init__(self, provider: Optional[TopologyProvider] = None) -> None:
+        self._provider: TopologyProvider = provider or Win32TopologyProvider()
+        self._lock = threading.Lock()
+        self._topology: Optional[DisplayTopology] = None
+
+    def set_provider(self, provider: TopologyProvider) -> None:
+        with self._lock:
+            self._provider = provider
+            self._topology = None
+
+    def get(self) -> DisplayTopology:
+        topo = self._topology
+        if topo is not None:
+            return topo
+        with self._lock:
+            if self._topology is None:
+                self._topology = self._provider.query()
+                logger.debug("Topologia display aggiornata: {}", self._topology)
+            return self._topology
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._topology = None
+
+
+_display_cache = DisplayTopologyCache()
+
+
+def get_display_cache() -> DisplayTopologyCache:
+    """Restituisce la cache globale della topologia dei display"""
+    return _display_cache
+
+
+def current_topology() -> Optional[DisplayTopology]:
+    """Topologia corrente, None se non è possibile determinarla"""
+    try:
+        return _display_cache.get()
+    except Exception as exc:
+        logger.debug(f"Topologia display non disponibile: {exc}")
+        return None
+
+
+def _build_transforms(recorded: DisplayTopology, current: DisplayTopology) -> List[Tuple[MonitorInfo, float, float, float, float]]:
+    """Trasformazioni affini (monitor registrato, scala x, scala y, offset x, offset y) per ogni monitor"""
+    rec_monitors = recorded.ordered_monitors()
+    cur_monitors = current.ordered_monitors()
+    transforms = []
+    for i, src in enumerate(rec_monitors):
+        dst = cur_monitors[i] if i < len(cur_monitors) else cur_monitors[0]
+        sx = dst.width / src.width
+        sy = dst.height / src.height
+        transforms.append((src, sx, sy, dst.left - src.left * sx, dst.top - src.top * sy))
+    return transforms
+
+
+def remap_events(
+    ops: Iterable[Any],
+    recorded_layout: Optional[Dict[str, Any]],
+    current: Optional[DisplayTopology] = None,
+) -> Iterator[Any]:
+    """
+    Rimappa le coordinate degli eventi mouse dal layout registrato a quello corrente.
+
+    Ogni punto viene associato al monitor registrato che lo contiene e portato
+    nella stessa posizione relativa del monitor corrispondente. Se i layout
+    coincidono (o uno dei due non è noto) gli eventi sono restituiti invariati.
+    """
+    current = current or current_topology()
+    if not recorded_layout or current is None or not current.monitors:
+        yield from ops
+        return
+
+    recorded = DisplayTopology.from_dict(recorded_layout)
+    if recorded == current or not recorded.monitors:
+        yield from ops
+        return
+
+    transforms = _build_transforms(recorded, current)
+    last = transforms[0]
+
+    for op in ops:
+        if not isinstance(op, MouseEvent):
+            yield op
+            continue
+        x, y = op.x, op.y
+        if not last[0].contains(x, y):
+            last = next((t for t in transforms if t[0].contains(x, y)), transforms[0])
+        _, sx, sy, ox, oy = last
+        nx, ny = int(round(x * sx + ox)), int(round(y * sy + oy))
+        yield op if (nx, ny) == (x, y) else replace(op, x=nx, y=ny)
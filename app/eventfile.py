@@ -0,0 +1,193 @@
+"""
+File di eventi mappati in memoria.
+
+Le registrazioni molto grandi vengono salvate in un file separato nel formato
+binario di app/codec.py (record a dimensione fissa). MappedEvents apre il file
+con mmap e decodifica gli eventi solo quando vengono letti: l'apertura legge
+solo header e tabella delle stringhe, e durante la riproduzione restano
+residenti in memoria solo le pagine vicine alla posizione corrente.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import shutil
+import tempfile
+from array import array
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Iterable, Iterator, List, Set, Tuple, Union, overload
+
+from .codec import HEADER, KIND_CALL, MAGIC, FORMAT_VERSION, RECORD, StringTable, pack_event, read_header, record_columns, unpack_event
+from .models import Event
+from .writer import fsync_dir
+
+# Estensione dei file di eventi
+EVENT_FILE_SUFFIX = ".mre"
+
+# Numero di eventi oltre il quale una macro viene salvata in un file mappato
+MAPPED_EVENTS_THRESHOLD = 100_000
+
+# Record decodificati per finestra durante l'iterazione (~1,5 MB)
+WINDOW_RECORDS = 65536
+
+
+def write_event_file(path: Path, events: Iterable[Event]) -> int:
+    """
+    Scrive gli eventi in modo atomico senza tenerli tutti in memoria.
+
+    I record vengono prima scritti in un file temporaneo, poi accodati a
+    header e tabella delle stringhe (che ne precedono la posizione nel file).
+
+    Returns:
+        numero di eventi scritti
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    strings = StringTable()
+    count = 0
+    with tempfile.TemporaryFile(dir=str(path.parent)) as records:
+        buf = bytearray()
+        for ev in events:
+            buf += pack_event(ev, strings)
+            count += 1
+            if len(buf) >= WINDOW_RECORDS * RECORD.size:
+                records.write(buf)
+                buf.clear()
+        records.write(buf)
+        records.seek(0)
+
+        table = strings.encode()
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(strings.strings), len(table), count))
+            f.write(table)
+            shutil.copyfileobj(records, f, 1024 * 1024)
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_dir(path.parent)
+    return count
+
+
+class MappedEvents(Sequence):
+    """
+    Sequenza di eventi in sola lettura su un file mappato in memoria.
+
+    Supporta len(), accesso per indice (tramite offset, senza decodificare i
+    record precedenti) e iterazione a finestre. Le modifiche producono una
+    normale lista (es. `events + [nuovo_evento]`).
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            # File vuoto: mmap solleva ValueError (lunghezza zero non supportata)
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+        try:
+            self._strings, self._offset, self._count = read_header(self._map)
+        except BaseException:
+            # Intestazione non valida: il chiamante non riceve l'oggetto da chiudere
+            self.close()
+            raise
+        try:
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+        except (AttributeError, OSError):
+            pass  # Non disponibile su Windows
+
+    def close(self) -> None:
+        try:
+            self._map.close()
+        finally:
+            self._file.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @overload
+    def __getitem__(self, index: int) -> Event: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Event]: ...
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._count)
+            if step != 1 or stop <= start:
+                return [self[i] for i in range(start, stop, step)]
+            # Intervallo contiguo: decodifica diretta dei record
+            strings = self._strings
+            view = memoryview(self._map)[self._offset + start * RECORD.size:self._offset + stop * RECORD.size]
+            try:
+                return [unpack_event(fields, strings) for fields in RECORD.iter_unpack(view)]
+            finally:
+                view.release()
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("indice evento fuori intervallo")
+        fields = RECORD.unpack_from(self._map, self._offset + index * RECORD.size)
+        return unpack_event(fields, self._strings)
+
+    def record_columns(self) -> Tuple[bytes, array]:
+        """(tipi, pause) di tutti gli eventi senza decodificarli (codec.record_columns)"""
+        return record_columns(self._map, self._offset, self._count)
+
+    def call_ids(self) -> Set[str]:
+        """Id delle macro chiamate: si leggono i tipi dei record e si decodificano solo le chiamate"""
+        size = RECORD.size
+        with memoryview(self._map) as view:
+            kinds = view[self._offset:self._offset + self._count * size:size].tobytes()
+        ids: Set[str] = set()
+        index = kinds.find(KIND_CALL)
+        while index >= 0:
+            ids.add(self[index].macro_id)  # type: ignore[attr-defined]
+            index = kinds.find(KIND_CALL, index + 1)
+        return ids
+
+    def __iter__(self) -> Iterator[Event]:
+        view = memoryview(self._map)
+        strings = self._strings
+        step = WINDOW_RECORDS * RECORD.size
+        start = self._offset
+        end = self._offset + self._count * RECORD.size
+        try:
+            while start < end:
+                stop = min(end, start + step)
+                for fields in RECORD.iter_unpack(view[start:stop]):
+                    yield unpack_event(fields, strings)
+                self._release_pages(start, stop)
+                start = stop
+        finally:
+            view.release()
+
+    def _release_pages(self, start: int, stop: int) -> None:
+        """Segnala al sistema che le pagine già riprodotte non servono più"""
+        first = (start // mmap.PAGESIZE) * mmap.PAGESIZE
+        length = (stop // mmap.PAGESIZE) * mmap.PAGESIZE - first
+        if length <= 0:
+            return
+        try:
+            self._map.madvise(mmap.MADV_DONTNEED, first, length)
+        except (AttributeError, OSError, ValueError):
+            pass
+
+    def __add__(self, other) -> List[Event]:
+        return list(self) + list(other)
+
+    def __radd__(self, other) -> List[Event]:
+        return list(other) + list(self)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, MappedEvents):
+            return self.path == other.path
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"MappedEvents({str(self.path)!r}, {self._count} eventi)"
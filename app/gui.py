@@ -1,16 +1,31 @@
 from __future__ import annotations
 
-from dataclasses import asdict
+import bisect
+from dataclasses import asdict, replace
+from datetime import datetime
 import threading
-from typing import List, Tuple
+from pathlib import Path
+from typing import Dict, List, Tuple
 
 from loguru import logger
 from PySide6 import QtCore, QtGui, QtWidgets
 
-from .models import Macro
-from .player import Player
+from .compose import MacroCycleError, PlanCache, called_ids
+from .content import ContentIndex, parse_content_terms
+from .display import get_display_cache
+from .eventfile import MappedEvents
+from .codec import KIND_CALL, KIND_CONTROL, KIND_KEY, KIND_MOUSE
+from .models import CallEvent, ControlEvent, Event, KeyEvent, Macro, MouseEvent
+from .player import PLAY_COMPLETED, PLAY_FAILED, PLAY_STOPPED, Player
+from .playqueue import PlaybackQueue
+from .search import SearchIndex
+from .stats import format_duration
 from .recorder import Recorder
-from .storage import load_macros, save_macros, next_recording_title, load_settings, save_settings
+from .timeline import KINDS, DeleteRange, EventTimeline, InsertEvents, RetimeRange, TimelineError
+from .worker import PlaybackWorker
+from .bulkimport import collect_sources, import_into_library, parse_sources
+from .transfer import export_macro, import_macro
+from .storage import configure_storage, discard_fresh_events, find_duplicate, flush_storage, load_macros, new_event_file, prepare_events, record_run, save_macros, save_metadata, next_recording_title, get_allocator, get_content_index, get_settings_store, load_settings
 
 
 class RecordingStopButton(QtWidgets.QPushButton):
@@ -56,27 +71,232 @@ class RecordingStopButton(QtWidgets.QPushButton):
         QtCore.QTimer.singleShot(0, _show)
 
 
-class MacroTableModel(QtCore.QAbstractTableModel):
-    HEADERS = ["Titolo", "Con pause", "Ripetizioni", "Preferito"]
+class _Descending:
+    """Valore confrontato in ordine inverso (colonna ordinata in modo decrescente)"""
+    __slots__ = ("value",)
+
+    def __init__(self, value) -> None:
+        self.value = value
+
+    def __eq__(self, other) -> bool:
+        return self.value == other.value
+
+    def __lt__(self, other) -> bool:
+        return other.value < self.value
+
+
+_RUN_RESULTS = {PLAY_COMPLETED: "Completata", PLAY_STOPPED: "Interrotta", PLAY_FAILED: "Errore"}
 
-    def __init__(self, items: List[Macro]) -> None:
+
+class MacroTableModel(QtCore.QAbstractTableModel):
+    """
+    Macro ordinate con i preferiti in cima, poi per la colonna scelta
+    (predefinita: titolo).
+
+    L'ordine è mantenuto in una lista di chiavi parallela a `items`: inserimenti,
+    rimozioni e spostamenti trovano la riga con bisect e notificano alla vista
+    solo la riga interessata (la selezione segue la macro spostata).
+
+    Le colonne delle statistiche leggono la voce della macro nell'indice del
+    contenuto (app/content.py), mai gli eventi.
+    """
+    HEADERS = [
+        "Titolo", "Con pause", "Ripetizioni", "Preferito", "Tag",
+        "Eventi", "Durata registrata", "Stima con pause", "Stima senza pause",
+        "Tasti distinti", "Area mouse", "Ultima esecuzione", "Esito",
+    ]
+    # Prima colonna delle statistiche
+    STATS_COLUMN = 5
+
+    def __init__(self, items: List[Macro], content: ContentIndex | None = None) -> None:
         super().__init__()
         self._original_items = items
-        self.items = self._sort_items(items)
-
-    def _sort_items(self, items: List[Macro]) -> List[Macro]:
-        # Sort with favorites first, then by title
-        favorites = [m for m in items if m.favorite]
-        non_favorites = [m for m in items if not m.favorite]
-        # Sort each group by title
-        favorites.sort(key=lambda m: m.title.lower())
-        non_favorites.sort(key=lambda m: m.title.lower())
-        return favorites + non_favorites
-
-    def refresh_sorting(self):
-        self.beginResetModel()
-        self.items = self._sort_items(self._original_items)
-        self.endResetModel()
+        self._content = content
+        self._dark = False
+        self._sort_column = 0
+        self._descending = False
+        # Indice di ricerca aggiornato insieme alle righe
+        self.search = SearchIndex()
+        # id macro -> chiave con cui la macro è posizionata in items
+        self._row_keys: Dict[str, Tuple] = {}
+        self._keys: List[Tuple] = []
+        self.items: List[Macro] = []
+        self._rebuild(items)
+
+    def _column_value(self, m: Macro, column: int):
+        """Valore ordinabile della colonna, None se non ancora disponibile"""
+        if column == 0:
+            return m.title.lower()
+        if column == 1:
+            return m.with_pauses
+        if column == 2:
+            return m.repetitions
+        if column == 3:
+            return m.favorite
+        if column == 4:
+            return ", ".join(m.tags).lower()
+        entry = self._content.entry(m.id) if self._content is not None else None
+        if entry is None:
+            return None
+        stats = entry.stats
+        if column == 5:
+            return stats.event_count
+        if column == 6:
+            return stats.recorded_ms
+        if column in (7, 8):
+            return self._content.estimate_ms(m.id, column == 7, m.repetitions)
+        if column == 9:
+            return stats.distinct_keys
+        if column == 10:
+            return stats.mouse_area
+        if column == 11:
+            return entry.last_run_ms
+        if column == 12:
+            return entry.last_result
+        return None
+
+    def _sort_key(self, m: Macro) -> Tuple:
+        value = self._column_value(m, self._sort_column)
+        missing = value is None
+        if missing:
+            value = 0
+        elif self._descending:
+            value = _Descending(value)
+        # I valori mancanti restano in fondo in entrambi gli ordini
+        return (not m.favorite, missing, value, m.title.lower(), m.id)
+
+    def _resort(self) -> None:
+        keyed = sorted(((self._sort_key(m), m) for m in self.items), key=lambda km: km[0])
+        self._keys = [k for k, _ in keyed]
+        self.items = [m for _, m in keyed]
+        self._row_keys = {m.id: k for m, k in zip(self.items, self._keys)}
+
+    def _rebuild(self, items: List[Macro]) -> None:
+        self.items = list(items)
+        self._resort()
+        self.search = SearchIndex(self.items)
+
+    def sort(self, column: int, order=QtCore.Qt.AscendingOrder) -> None:
+        """Ordina per colonna con un cambio di layout: selezione e righe persistenti seguono le macro"""
+        descending = order == QtCore.Qt.DescendingOrder
+        if not 0 <= column < len(self.HEADERS) or (column, descending) == (self._sort_column, self._descending):
+            return
+        self._sort_column, self._descending = column, descending
+        self._relayout()
+
+    def _relayout(self) -> None:
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        old = [self.items[i.row()] if i.isValid() else None for i in persistent]
+        self._resort()
+        new = [
+            self.index(self.row_of(m), i.column()) if m is not None else QtCore.QModelIndex()
+            for i, m in zip(persistent, old)
+        ]
+        self.changePersistentIndexList(persistent, new)
+        self.layoutChanged.emit()
+
+    def stats_changed(self, macros: List[Macro]) -> None:
+        """Statistiche o ultima esecuzione aggiornate: ridisegna (e se serve sposta) le righe"""
+        macros = [m for m in macros if self.row_of(m) >= 0]
+        if not macros:
+            return
+        if self._sort_column >= self.STATS_COLUMN:
+            if len(macros) <= 64:
+                for m in macros:
+                    self.update_macro(m)
+                return
+            # Molte macro analizzate insieme (es. importazione): un solo riordinamento
+            self._relayout()
+        rows = [self.row_of(m) for m in macros]
+        self.dataChanged.emit(
+            self.index(min(rows), self.STATS_COLUMN), self.index(max(rows), len(self.HEADERS) - 1),
+            [QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole],
+        )
+
+    def row_of(self, macro: Macro) -> int:
+        """Riga della macro, -1 se non presente"""
+        key = self._row_keys.get(macro.id)
+        if key is None:
+            return -1
+        row = bisect.bisect_left(self._keys, key)
+        return row if row < len(self.items) and self.items[row] is macro else -1
+
+    def rows_of_ids(self, ids) -> List[int]:
+        """Righe ordinate delle macro con gli id indicati (O(k log n))"""
+        keys = self._row_keys
+        return sorted(bisect.bisect_left(self._keys, keys[mid]) for mid in ids if mid in keys)
+
+    def insert_macro(self, macro: Macro) -> int:
+        if macro.id in self._row_keys:
+            return self.update_macro(macro)
+        key = self._sort_key(macro)
+        row = bisect.bisect_left(self._keys, key)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.items.insert(row, macro)
+        self._keys.insert(row, key)
+        self._row_keys[macro.id] = key
+        self.search.add(macro)
+        self.endInsertRows()
+        return row
+
+    def remove_macro(self, macro: Macro) -> None:
+        row = self.row_of(macro)
+        if row < 0:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self.items[row]
+        del self._keys[row]
+        del self._row_keys[macro.id]
+        self.search.remove(macro.id)
+        self.endRemoveRows()
+
+    def update_macro(self, macro: Macro) -> int:
+        """Riposiziona la macro dopo una modifica di titolo o preferito e ridisegna la sua riga"""
+        row = self.row_of(macro)
+        if row < 0:
+            return self.insert_macro(macro)
+        self.search.update(macro)
+        key = self._sort_key(macro)
+        if key != self._keys[row]:
+            dest = bisect.bisect_left(self._keys, key)
+            if dest in (row, row + 1):
+                self._keys[row] = key
+            else:
+                self.beginMoveRows(QtCore.QModelIndex(), row, row, QtCore.QModelIndex(), dest)
+                del self.items[row]
+                del self._keys[row]
+                if dest > row:
+                    dest -= 1
+                self.items.insert(dest, macro)
+                self._keys.insert(dest, key)
+                self.endMoveRows()
+                row = dest
+            self._row_keys[macro.id] = key
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+        return row
+
+    def refresh_sorting(self) -> None:
+        """Allinea il modello alla lista delle macro con aggiornamenti mirati (nessun reset)"""
+        current = {m.id: m for m in self._original_items}
+        for m in [m for m in self.items if current.get(m.id) is not m]:
+            self.remove_macro(m)
+        for m in self._original_items:
+            key = self._row_keys.get(m.id)
+            if key is None:
+                self.insert_macro(m)
+            elif key != self._sort_key(m):
+                self.update_macro(m)
+
+    def set_dark_theme(self, dark: bool) -> None:
+        """Aggiorna solo i colori di sfondo, senza reset del modello"""
+        if dark == self._dark:
+            return
+        self._dark = dark
+        if self.items:
+            self.dataChanged.emit(
+                self.index(0, 0), self.index(len(self.items) - 1, len(self.HEADERS) - 1), [QtCore.Qt.BackgroundRole]
+            )
 
     def rowCount(self, parent=None):
         return len(self.items)
@@ -98,15 +318,57 @@ class MacroTableModel(QtCore.QAbstractTableModel):
                 return macro.repetitions
             if col == 3:
                 return "★" if macro.favorite else "☆"
+            if col == 4:
+                return ", ".join(macro.tags)
+            if col >= self.STATS_COLUMN and role == QtCore.Qt.DisplayRole:
+                return self._stats_text(macro, col)
+        if role == QtCore.Qt.ToolTipRole and col >= self.STATS_COLUMN:
+            return self._stats_tooltip(macro, col)
         if role == QtCore.Qt.TextAlignmentRole:
             if col in (1, 2, 3):
                 return QtCore.Qt.AlignCenter
+            if self.STATS_COLUMN <= col <= 10:
+                return QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter
         if role == QtCore.Qt.BackgroundRole:
             # Highlight favorite rows with a subtle background
             if macro.favorite:
+                if self._dark:
+                    return QtGui.QColor(74, 66, 40)
                 return QtGui.QColor(255, 248, 220)  # Light yellow for light theme
         return None
 
+    def _stats_text(self, macro: Macro, col: int) -> str:
+        value = self._column_value(macro, col)
+        if value is None:
+            return ""
+        if col in (6, 7, 8):
+            return format_duration(value)
+        if col == 10:
+            x0, y0, x1, y1 = self._content.entry(macro.id).stats.mouse_box
+            return f"{x1 - x0 + 1}×{y1 - y0 + 1}"
+        if col == 11:
+            return datetime.fromtimestamp(value / 1000).strftime("%d/%m/%Y %H:%M")
+        if col == 12:
+            return _RUN_RESULTS.get(value, value)
+        return str(value)
+
+    def _stats_tooltip(self, macro: Macro, col: int) -> str | None:
+        entry = self._content.entry(macro.id) if self._content is not None else None
+        if entry is None:
+            return "Statistiche non ancora calcolate"
+        stats = entry.stats
+        if col == 5:
+            return (
+                f"Tastiera: {stats.key_events}\nMouse: {stats.mouse_events}\n"
+                f"Chiamate: {stats.call_events}\nControllo: {stats.control_events}"
+            )
+        if col in (7, 8):
+            return f"{macro.repetitions} ripetizioni, macro richiamate incluse"
+        if col == 10 and stats.mouse_box is not None:
+            x0, y0, x1, y1 = stats.mouse_box
+            return f"Da ({x0}, {y0}) a ({x1}, {y1})"
+        return None
+
     def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
         if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
             return self.HEADERS[section]
@@ -114,7 +376,7 @@ class MacroTableModel(QtCore.QAbstractTableModel):
 
     def flags(self, index):
         base = super().flags(index)
-        if index.column() in (0, 2):
+        if index.column() in (0, 2, 4):
             return base | QtCore.Qt.ItemIsEditable
         return base
 
@@ -123,18 +385,202 @@ class MacroTableModel(QtCore.QAbstractTableModel):
             return False
         m = self.items[index.row()]
         if index.column() == 0:
-            m.title = str(value)
+            changes = {"title": str(value)}
         elif index.column() == 2:
             try:
-                m.repetitions = max(1, int(value))
+                changes = {"repetitions": max(1, int(value))}
             except Exception:
                 return False
+        elif index.column() == 4:
+            changes = {"tags": list(dict.fromkeys(t.strip() for t in str(value).split(",") if t.strip()))}
         else:
             return False
-        self.dataChanged.emit(index, index, [QtCore.Qt.DisplayRole])
+        save_metadata(self._original_items, m, **changes)
+        # Titolo e ripetizioni determinano la posizione (e le durate stimate):
+        # update_macro ridisegna la riga e se serve la sposta
+        self.update_macro(m)
         return True
 
 
+class MacroFilterProxyModel(QtCore.QAbstractProxyModel):
+    """
+    Vista filtrata di MacroTableModel tramite il suo indice di ricerca.
+
+    Senza filtro le righe coincidono con quelle del modello e le notifiche
+    vengono inoltrate una per una. Con un filtro attivo le righe visibili sono
+    ricalcolate da SearchIndex.query e da una sola scansione degli id; la
+    selezione viene conservata con un cambio di layout invece di un reset.
+    I termini sul contenuto (tasto:, testo:, area:) usano l'indice del
+    contenuto degli eventi (app/content.py), che comprende solo le macro già
+    analizzate: al termine di ogni analisi il filtro viene ricalcolato.
+    """
+
+    def __init__(self, parent=None, content: ContentIndex | None = None) -> None:
+        super().__init__(parent)
+        self._content = content
+        self._query = ""
+        # (indici persistenti, macro corrispondenti) durante un cambio di layout
+        self._layout_state: Tuple[list, list] = ([], [])
+        # Macro visibili e loro riga (solo con un filtro attivo)
+        self._visible: List[Macro] | None = None
+        self._pos: Dict[str, int] = {}
+
+    @property
+    def query(self) -> str:
+        return self._query
+
+    def setSourceModel(self, model: MacroTableModel) -> None:
+        super().setSourceModel(model)
+        model.rowsAboutToBeInserted.connect(lambda parent, first, last: self._forward(self.beginInsertRows, QtCore.QModelIndex(), first, last))
+        model.rowsInserted.connect(lambda *_: self._after_change(self.endInsertRows))
+        model.rowsAboutToBeRemoved.connect(lambda parent, first, last: self._forward(self.beginRemoveRows, QtCore.QModelIndex(), first, last))
+        model.rowsRemoved.connect(lambda *_: self._after_change(self.endRemoveRows))
+        model.rowsAboutToBeMoved.connect(
+            lambda sp, start, end, dp, dest: self._forward(self.beginMoveRows, QtCore.QModelIndex(), start, end, QtCore.QModelIndex(), dest)
+        )
+        model.rowsMoved.connect(lambda *_: self._after_change(self.endMoveRows))
+        # Ordinamento per colonna del modello
+        model.layoutAboutToBeChanged.connect(lambda *_: self._begin_layout())
+        model.layoutChanged.connect(lambda *_: self._end_layout())
+        model.dataChanged.connect(self._on_data_changed)
+        model.modelAboutToBeReset.connect(self.beginResetModel)
+        model.modelReset.connect(self._on_model_reset)
+
+    def _forward(self, begin, *args) -> None:
+        if self._visible is None:
+            begin(*args)
+
+    def _after_change(self, end) -> None:
+        if self._visible is None:
+            end()
+        else:
+            self._refilter()
+
+    def _on_data_changed(self, top_left, bottom_right, roles=()) -> None:
+        if self._visible is None:
+            self.dataChanged.emit(self.mapFromSource(top_left), self.mapFromSource(bottom_right), roles)
+        elif top_left.column() >= MacroTableModel.STATS_COLUMN:
+            # Solo statistiche: il filtro non cambia
+            if self._visible:
+                self.dataChanged.emit(
+                    self.index(0, top_left.column()), self.index(len(self._visible) - 1, bottom_right.column()), roles
+                )
+        else:
+            # Titolo o tag modificati: la riga può entrare o uscire dal filtro
+            self._refilter()
+
+    def _on_model_reset(self) -> None:
+        if self._visible is not None:
+            self._visible, self._pos = self._compute()
+        self.endResetModel()
+
+    def set_query(self, text: str) -> None:
+        if text == self._query:
+            return
+        self._query = text
+        self._refilter()
+
+    @property
+    def content_pending(self) -> bool:
+        """Filtro sul contenuto con macro ancora da analizzare (risultato parziale)"""
+        return bool(parse_content_terms(self._query)[1]) and self._content is not None and self._content.pending() > 0
+
+    def content_changed(self) -> bool:
+        """Analisi del contenuto completate: ricalcola un filtro sul contenuto; True se attivo"""
+        if self._visible is None or not parse_content_terms(self._query)[1]:
+            return False
+        self._refilter()
+        return True
+
+    def _compute(self) -> Tuple[List[Macro] | None, Dict[str, int]]:
+        src: MacroTableModel = self.sourceModel()
+        text, content_query = parse_content_terms(self._query)
+        matches = src.search.query(text)
+        if content_query and self._content is not None:
+            content_matches = self._content.match(content_query)
+            matches = content_matches if matches is None else matches & content_matches
+        if matches is None:
+            return None, {}
+        if len(matches) * 8 < len(src.items):
+            # Pochi risultati: posizione di ciascuno per bisezione
+            visible = [src.items[row] for row in src.rows_of_ids(matches)]
+        else:
+            visible = [m for m in src.items if m.id in matches]
+        return visible, {m.id: row for row, m in enumerate(visible)}
+
+    def _refilter(self) -> None:
+        self._begin_layout()
+        self._end_layout()
+
+    def _begin_layout(self) -> None:
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        self._layout_state = (persistent, [self._macro_at(i.row()) if i.isValid() else None for i in persistent])
+
+    def _end_layout(self) -> None:
+        persistent, old = self._layout_state
+        self._layout_state = ([], [])
+        self._visible, self._pos = self._compute()
+        new = []
+        for index, macro in zip(persistent, old):
+            row = self._row_of(macro) if macro is not None else -1
+            new.append(self.index(row, index.column()) if row >= 0 else QtCore.QModelIndex())
+        self.changePersistentIndexList(persistent, new)
+        self.layoutChanged.emit()
+
+    def _macro_at(self, row: int) -> Macro | None:
+        items = self.sourceModel().items if self._visible is None else self._visible
+        return items[row] if 0 <= row < len(items) else None
+
+    def _row_of(self, macro: Macro) -> int:
+        if self._visible is None:
+            return self.sourceModel().row_of(macro)
+        return self._pos.get(macro.id, -1)
+
+    def macro_at(self, row: int) -> Macro | None:
+        return self._macro_at(row)
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid():
+            return QtCore.QModelIndex()
+        src: MacroTableModel = self.sourceModel()
+        if self._visible is None:
+            return src.index(proxy_index.row(), proxy_index.column())
+        macro = self._macro_at(proxy_index.row())
+        row = src.row_of(macro) if macro is not None else -1
+        return src.index(row, proxy_index.column()) if row >= 0 else QtCore.QModelIndex()
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid():
+            return QtCore.QModelIndex()
+        if self._visible is None:
+            return self.index(source_index.row(), source_index.column())
+        macro = self.sourceModel().items[source_index.row()]
+        row = self._pos.get(macro.id, -1)
+        return self.index(row, source_index.column()) if row >= 0 else QtCore.QModelIndex()
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if parent.isValid() or row < 0 or column < 0 or row >= self.rowCount() or column >= self.columnCount():
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        if index is None:
+            # QObject.parent()
+            return QtCore.QObject.parent(self)
+        return QtCore.QModelIndex()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent is not None and parent.isValid():
+            return 0
+        if self._visible is None:
+            return self.sourceModel().rowCount()
+        return len(self._visible)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return self.sourceModel().columnCount()
+
+
 class SaveRecordingDialog(QtWidgets.QDialog):
     def __init__(self, default_title: str, parent=None) -> None:
         super().__init__(parent)
@@ -172,9 +618,444 @@ class SaveRecordingDialog(QtWidgets.QDialog):
         self.accept()
 
 
+def _format_time(ms: int) -> str:
+    """Tempo dall'inizio della macro: "m:ss.mmm" """
+    minutes, rest = divmod(int(ms), 60_000)
+    return f"{minutes}:{rest // 1000:02d}.{rest % 1000:03d}"
+
+
+def _event_details(ev, find_macro) -> str:
+    if isinstance(ev, KeyEvent):
+        return ev.key
+    if isinstance(ev, MouseEvent):
+        text = f"{ev.x}, {ev.y}"
+        if ev.button:
+            text += f" {ev.button}"
+        if ev.action == "scroll":
+            text += f" ({ev.dx or 0}, {ev.dy or 0})"
+        return text
+    if isinstance(ev, CallEvent):
+        callee = find_macro(ev.macro_id)
+        name = callee.title if callee is not None else ev.macro_id
+        return f"{name} ×{ev.repetitions}" if ev.repetitions != 1 else name
+    if isinstance(ev, ControlEvent):
+        if ev.action == "loop":
+            return f"×{ev.count}"
+        if ev.action == "wait":
+            return format_duration(ev.wait_ms)
+        return ev.label or ""
+    return ""
+
+
+# Nome e colore di ogni tipo di evento (nell'ordine di timeline.KINDS)
+_KIND_LABELS = {KIND_KEY: "Tastiera", KIND_MOUSE: "Mouse", KIND_CALL: "Chiamata", KIND_CONTROL: "Controllo"}
+_KIND_COLORS = {KIND_KEY: "#4a6ea8", KIND_MOUSE: "#4caf50", KIND_CALL: "#ff9800", KIND_CONTROL: "#9e9e9e"}
+
+
+class EventTableModel(QtCore.QAbstractTableModel):
+    """
+    Righe di un EventTimeline. La vista chiede solo le righe visibili e
+    ognuna viene decodificata alla richiesta (con una piccola cache), quindi
+    aprire e scorrere una macro non dipende dal numero di eventi.
+    """
+
+    HEADERS = ["#", "Tempo", "Pausa", "Tipo", "Azione", "Dettagli"]
+    # Eventi decodificati tenuti in cache
+    CACHE_SIZE = 4096
+    # data() viene chiamata per ogni cella visibile e ruolo: le enum Qt lette
+    # una volta sola (l'accesso a QtCore.Qt.* costa qualche microsecondo)
+    _DISPLAY_ROLE = QtCore.Qt.DisplayRole
+    _FOREGROUND_ROLE = QtCore.Qt.ForegroundRole
+
+    def __init__(self, timeline: EventTimeline, find_macro, parent=None) -> None:
+        super().__init__(parent)
+        self.timeline = timeline
+        self._find_macro = find_macro
+        self._cache: Dict[int, object] = {}
+
+    def reload(self) -> None:
+        """Dopo un gruppo di modifiche o un annullamento"""
+        self.beginResetModel()
+        self._cache.clear()
+        self.endResetModel()
+
+    def _event(self, row: int):
+        ev = self._cache.get(row)
+        if ev is None:
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache.clear()
+            ev = self._cache[row] = self.timeline.event(row)
+        return ev
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.timeline)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, col = index.row(), index.column()
+        if role != self._DISPLAY_ROLE:
+            if role == self._FOREGROUND_ROLE and col == 3:
+                return QtGui.QColor(_KIND_COLORS.get(self.timeline.kind(row), "#9e9e9e"))
+            return None
+        # Numero, tempi e tipo dalle colonne compatte, senza decodificare l'evento
+        if col == 0:
+            return row + 1
+        if col == 1:
+            return _format_time(self.timeline.time_of(row))
+        if col == 2:
+            return f"{self.timeline.delta_of(row)} ms"
+        if col == 3:
+            return _KIND_LABELS.get(self.timeline.kind(row), "")
+        ev = self._event(row)
+        if col == 4:
+            return getattr(ev, "action", ev.type)
+        return _event_details(ev, self._find_macro)
+
+
+class TimelineOverview(QtWidgets.QWidget):
+    """
+    Panoramica dei tempi della macro: eventi per tipo nel tempo, disegnati
+    dai conteggi aggregati di TimeBuckets (una colonna per pixel). La rotella
+    ingrandisce attorno al cursore, il trascinamento con il tasto destro
+    sposta la finestra, il clic sinistro porta la tabella a quel tempo.
+    """
+
+    timeSelected = QtCore.Signal(float)
+
+    # Finestra minima visibile (ms)
+    MIN_SPAN_MS = 50
+
+    def __init__(self, timeline: EventTimeline, parent=None) -> None:
+        super().__init__(parent)
+        self.timeline = timeline
+        self.setMinimumHeight(80)
+        self.setMouseTracking(False)
+        self._t0 = 0.0
+        self._t1 = float(max(1, timeline.duration_ms))
+        # Tempi delle righe visibili nella tabella (evidenziati)
+        self._visible = (0.0, 0.0)
+        self._pan_from: Tuple[float, float, float] | None = None
+        # Istogramma dell'ultimo disegno: scorrendo la tabella cambia solo l'evidenziazione
+        self._columns_key: Tuple | None = None
+        self._columns: List[Tuple[float, ...]] = []
+
+    def reset_view(self) -> None:
+        self._t0, self._t1 = 0.0, float(max(1, self.timeline.duration_ms))
+        self.update()
+
+    def timeline_changed(self) -> None:
+        """Dopo una modifica: mantiene lo zoom entro la nuova durata"""
+        self._set_window(self._t0, self._t1)
+
+    def set_visible_range(self, t0: float, t1: float) -> None:
+        self._visible = (t0, t1)
+        self.update()
+
+    def _set_window(self, t0: float, t1: float) -> None:
+        duration = float(max(1, self.timeline.duration_ms))
+        span = min(max(t1 - t0, float(self.MIN_SPAN_MS)), duration)
+        t0 = min(max(0.0, t0), duration - span)
+        self._t0, self._t1 = t0, t0 + span
+        self.update()
+
+    def _time_at(self, x: float) -> float:
+        return self._t0 + (self._t1 - self._t0) * x / max(1, self.width())
+
+    def paintEvent(self, event: QtGui.QPaintEvent) -> None:
+        painter = QtGui.QPainter(self)
+        rect = self.rect()
+        painter.fillRect(rect, self.palette().base())
+        width, height = rect.width(), rect.height() - 14
+        span = self._t1 - self._t0
+        if len(self.timeline) and width > 0 and height > 0:
+            key = (self.timeline.revision, self._t0, self._t1, width)
+            if key != self._columns_key:
+                self._columns = self.timeline.buckets().histogram(self._t0, self._t1, width)
+                self._columns_key = key
+            columns = self._columns
+            peak = max((sum(c) for c in columns), default=0.0) or 1.0
+            # Barre impilate per tipo, disegnate con una chiamata per tipo
+            bars: List[List[QtCore.QRect]] = [[] for _ in KINDS]
+            for x, counts in enumerate(columns):
+                y = height
+                for k, count in enumerate(counts):
+                    if count <= 0:
+                        continue
+                    bar = max(1, int(round(height * count / peak)))
+                    bars[k].append(QtCore.QRect(x, y - bar, 1, bar))
+                    y -= bar
+            painter.setPen(QtCore.Qt.NoPen)
+            for kind, rects in zip(KINDS, bars):
+                if rects:
+                    painter.setBrush(QtGui.QColor(_KIND_COLORS[kind]))
+                    painter.drawRects(rects)
+            # Righe visibili nella tabella
+            a, b = self._visible
+            xa = int((a - self._t0) * width / span)
+            xb = max(xa + 2, int((b - self._t0) * width / span))
+            highlight = self.palette().highlight().color()
+            highlight.setAlpha(70)
+            painter.fillRect(QtCore.QRect(xa, 0, xb - xa, height), highlight)
+        painter.setPen(self.palette().text().color())
+        painter.drawText(QtCore.QRect(2, height, width - 4, 14), QtCore.Qt.AlignLeft, _format_time(self._t0))
+        painter.drawText(QtCore.QRect(2, height, width - 4, 14), QtCore.Qt.AlignRight, _format_time(self._t1))
+        painter.end()
+
+    def wheelEvent(self, event: QtGui.QWheelEvent) -> None:
+        steps = event.angleDelta().y() / 120
+        if not steps:
+            return
+        factor = 0.8 ** steps
+        at = self._time_at(event.position().x())
+        self._set_window(at - (at - self._t0) * factor, at + (self._t1 - at) * factor)
+
+    def mousePressEvent(self, event: QtGui.QMouseEvent) -> None:
+        if event.button() == QtCore.Qt.LeftButton:
+            self.timeSelected.emit(self._time_at(event.position().x()))
+        elif event.button() == QtCore.Qt.RightButton:
+            self._pan_from = (event.position().x(), self._t0, self._t1)
+
+    def mouseMoveEvent(self, event: QtGui.QMouseEvent) -> None:
+        if event.buttons() & QtCore.Qt.LeftButton:
+            self.timeSelected.emit(self._time_at(event.position().x()))
+        elif self._pan_from is not None and event.buttons() & QtCore.Qt.RightButton:
+            x, t0, t1 = self._pan_from
+            shift = (x - event.position().x()) * (t1 - t0) / max(1, self.width())
+            self._set_window(t0 + shift, t1 + shift)
+
+    def mouseReleaseEvent(self, event: QtGui.QMouseEvent) -> None:
+        if event.button() == QtCore.Qt.RightButton:
+            self._pan_from = None
+
+    def mouseDoubleClickEvent(self, event: QtGui.QMouseEvent) -> None:
+        self.reset_view()
+
+
+class TimelineDialog(QtWidgets.QDialog):
+    """
+    Visualizza e modifica gli eventi di una macro. Le modifiche restano
+    nell'EventTimeline (annullabili) finché non si preme Salva; il
+    salvataggio vero e proprio lo fa MainWindow.
+    """
+
+    def __init__(self, macro: Macro, find_macro, parent=None) -> None:
+        super().__init__(parent)
+        self.macro = macro
+        self.setWindowTitle(f"Eventi di {macro.title}")
+        self.resize(820, 600)
+        self.timeline = EventTimeline(macro.events)
+        # Eventi copiati (restano validi tra un gruppo di modifiche e l'altro)
+        self._clipboard: Tuple[Event, ...] = ()
+
+        self.model = EventTableModel(self.timeline, find_macro, self)
+        self.overview = TimelineOverview(self.timeline)
+        self.overview.timeSelected.connect(self._scroll_to_time)
+
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QtWidgets.QTableView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QTableView.ExtendedSelection)
+        self.table.setAlternatingRowColors(True)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        # Righe ad altezza fissa: la vista non misura le righe fuori schermo
+        header = self.table.verticalHeader()
+        header.setVisible(False)
+        header.setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        header.setDefaultSectionSize(self.table.fontMetrics().height() + 6)
+        self.table.verticalScrollBar().valueChanged.connect(self._update_visible_range)
+        self.table.selectionModel().selectionChanged.connect(self._update_buttons)
+
+        buttons = QtWidgets.QHBoxLayout()
+        self.btn_delete = QtWidgets.QPushButton("Elimina")
+        self.btn_delete.clicked.connect(self.delete_selection)
+        self.btn_retime = QtWidgets.QPushButton("Modifica pause…")
+        self.btn_retime.clicked.connect(self.retime_selection)
+        self.btn_copy = QtWidgets.QPushButton("Copia")
+        self.btn_copy.clicked.connect(self.copy_selection)
+        self.btn_paste = QtWidgets.QPushButton("Incolla")
+        self.btn_paste.clicked.connect(self.paste)
+        self.btn_wait = QtWidgets.QPushButton("Inserisci attesa…")
+        self.btn_wait.clicked.connect(self.insert_wait)
+        self.btn_undo = QtWidgets.QPushButton("Annulla")
+        self.btn_undo.clicked.connect(self.undo)
+        for btn in (self.btn_delete, self.btn_retime, self.btn_copy, self.btn_paste, self.btn_wait, self.btn_undo):
+            buttons.addWidget(btn)
+        buttons.addStretch(1)
+
+        box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Save | QtWidgets.QDialogButtonBox.Close)
+        box.accepted.connect(self.accept)
+        box.rejected.connect(self.reject)
+        self.btn_save = box.button(QtWidgets.QDialogButtonBox.Save)
+
+        self.summary = QtWidgets.QLabel()
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.overview)
+        layout.addWidget(self.table, 1)
+        layout.addLayout(buttons)
+        bottom = QtWidgets.QHBoxLayout()
+        bottom.addWidget(self.summary, 1)
+        bottom.addWidget(box)
+        layout.addLayout(bottom)
+
+        QtGui.QShortcut(QtGui.QKeySequence.Delete, self.table, self.delete_selection)
+        QtGui.QShortcut(QtGui.QKeySequence.Copy, self.table, self.copy_selection)
+        QtGui.QShortcut(QtGui.QKeySequence.Paste, self.table, self.paste)
+        QtGui.QShortcut(QtGui.QKeySequence.Undo, self, self.undo)
+
+        self._refresh()
+
+    def showEvent(self, event: QtGui.QShowEvent) -> None:
+        super().showEvent(event)
+        self._update_visible_range()
+
+    def resizeEvent(self, event: QtGui.QResizeEvent) -> None:
+        super().resizeEvent(event)
+        self._update_visible_range()
+
+    def _selected_ranges(self) -> List[Tuple[int, int]]:
+        """Righe selezionate come intervalli [start, stop) ordinati e disgiunti"""
+        # Dagli intervalli della selezione: selectedRows() creerebbe un indice per riga
+        spans = sorted((r.top(), r.bottom() + 1) for r in self.table.selectionModel().selection())
+        merged: List[Tuple[int, int]] = []
+        for start, stop in spans:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+            else:
+                merged.append((start, stop))
+        return merged
+
+    def _insert_position(self) -> int:
+        current = self.table.currentIndex()
+        return current.row() if current.isValid() else len(self.timeline)
+
+    def _apply(self, ops, select_row: int) -> None:
+        try:
+            self.timeline.apply(ops)
+        except TimelineError as exc:
+            QtWidgets.QMessageBox.warning(self, "Modifica eventi", str(exc))
+            return
+        self._after_edit(select_row)
+
+    def _after_edit(self, row: int) -> None:
+        self.model.reload()
+        self.overview.timeline_changed()
+        if len(self.timeline):
+            row = max(0, min(row, len(self.timeline) - 1))
+            index = self.model.index(row, 0)
+            self.table.setCurrentIndex(index)
+            self.table.scrollTo(index, QtWidgets.QAbstractItemView.PositionAtCenter)
+        self._refresh()
+
+    def _refresh(self) -> None:
+        self.summary.setText(f"{len(self.timeline)} eventi, {format_duration(self.timeline.duration_ms)}")
+        self.btn_undo.setEnabled(self.timeline.can_undo)
+        self.btn_save.setEnabled(self.timeline.modified)
+        self._update_buttons()
+        self._update_visible_range()
+
+    def _update_buttons(self, *_) -> None:
+        selected = self.table.selectionModel().hasSelection()
+        for btn in (self.btn_delete, self.btn_retime, self.btn_copy):
+            btn.setEnabled(selected)
+        self.btn_paste.setEnabled(bool(self._clipboard))
+
+    def _update_visible_range(self, *_) -> None:
+        if not len(self.timeline):
+            self.overview.set_visible_range(0.0, 0.0)
+            return
+        viewport = self.table.viewport()
+        first = max(0, self.table.rowAt(0))
+        last = self.table.rowAt(viewport.height() - 1)
+        last = len(self.timeline) - 1 if last < 0 else last
+        self.overview.set_visible_range(self.timeline.time_of(first), self.timeline.time_of(last))
+
+    def _scroll_to_time(self, ms: float) -> None:
+        if not len(self.timeline):
+            return
+        index = self.model.index(self.timeline.index_at(ms), 0)
+        self.table.scrollTo(index, QtWidgets.QAbstractItemView.PositionAtCenter)
+        self.table.setCurrentIndex(index)
+
+    def delete_selection(self) -> None:
+        ranges = self._selected_ranges()
+        if ranges:
+            self._apply([DeleteRange(start, stop) for start, stop in ranges], ranges[0][0])
+
+    def retime_selection(self) -> None:
+        ranges = self._selected_ranges()
+        if not ranges:
+            return
+        choices = ["Scala le pause (%)", "Pausa fissa (ms)"]
+        choice, ok = QtWidgets.QInputDialog.getItem(self, "Modifica pause", "Nuove pause per gli eventi selezionati:", choices, 0, False)
+        if not ok:
+            return
+        if choice == choices[0]:
+            percent, ok = QtWidgets.QInputDialog.getDouble(self, "Modifica pause", "Percentuale delle pause attuali:", 100.0, 0.0, 10000.0, 1)
+            if not ok:
+                return
+            ops = [RetimeRange(start, stop, scale=percent / 100.0) for start, stop in ranges]
+        else:
+            delta, ok = QtWidgets.QInputDialog.getInt(self, "Modifica pause", "Pausa prima di ogni evento (ms):", 0, 0, 3_600_000)
+            if not ok:
+                return
+            ops = [RetimeRange(start, stop, delta_ms=delta) for start, stop in ranges]
+        self._apply(ops, ranges[0][0])
+
+    def copy_selection(self) -> None:
+        ranges = self._selected_ranges()
+        if not ranges:
+            return
+        self._clipboard = tuple(ev for start, stop in ranges for ev in self.timeline.events(start, stop))
+        self._update_buttons()
+
+    def paste(self) -> None:
+        if not self._clipboard:
+            return
+        at = self._insert_position()
+        self._apply([InsertEvents(at, self._clipboard)], at)
+
+    def insert_wait(self) -> None:
+        wait_ms, ok = QtWidgets.QInputDialog.getInt(self, "Inserisci attesa", "Durata dell'attesa (ms):", 1000, 0, 3_600_000)
+        if not ok:
+            return
+        at = self._insert_position()
+        wait = ControlEvent(type="control", time_delta_ms=0, action="wait", wait_ms=wait_ms)
+        self._apply([InsertEvents(at, (wait,))], at)
+
+    def undo(self) -> None:
+        if self.timeline.undo():
+            self._after_edit(self.table.currentIndex().row())
+
+    def reject(self) -> None:
+        if self.timeline.modified:
+            answer = QtWidgets.QMessageBox.question(self, "Modifica eventi", "Chiudere senza salvare le modifiche?")
+            if answer != QtWidgets.QMessageBox.Yes:
+                return
+        super().reject()
+
+
 class MainWindow(QtWidgets.QMainWindow):
     recordingStateChanged = QtCore.Signal(bool)
     playbackFinished = QtCore.Signal()
+    playbackProgress = QtCore.Signal(int, int)
+    transferProgress = QtCore.Signal(str, int, int)
+    importFinished = QtCore.Signal(object, object, str)
+    exportFinished = QtCore.Signal(str, str)
+    bulkImportParsed = QtCore.Signal(object, object, str)
+    settingsChanged = QtCore.Signal(str, object)
+    statsChanged = QtCore.Signal(object)
+    eventsMaterialized = QtCore.Signal(object, object, str)
+    eventsVerified = QtCore.Signal(object)
 
     def __init__(self) -> None:
         super().__init__()
@@ -184,21 +1065,53 @@ class MainWindow(QtWidgets.QMainWindow):
         # State
         self.recorder = Recorder()
         self.player = Player()
+        self._playback_worker: PlaybackWorker | None = None
+        # Macro in riproduzione nel processo separato (per registrarne l'esito)
+        self._worker_macro: Macro | None = None
+        self.play_queue = PlaybackQueue(
+            self.player,
+            on_item_finished=lambda item, ok: record_run(item.macro, item.result),
+            on_drained=self.playbackFinished.emit,
+        )
+        self.player.set_progress_callback(self.playbackProgress.emit)
+        self.settings_store = get_settings_store()
+        self.settings = load_settings()
+        configure_storage(self.settings)
         self.macros: List[Macro] = load_macros()
+        self.plan_cache = PlanCache(self._find_macro)
+        self.player.plan_cache = self.plan_cache
         self.stopOverlay = RecordingStopButton(self._stop_by_overlay)
-        self.settings = load_settings()
+        self.player.configure(self.settings.get("playback", {}))
         self.current_theme = self.settings.get("ui", {}).get("theme", "light")
+        self.settingsChanged.connect(self._on_settings_changed)
+        self.settings_store.subscribe(lambda section, value: self.settingsChanged.emit(section, value))
+        # Modifiche manuali a settings.json mentre l'applicazione è aperta
+        self._settings_timer = QtCore.QTimer(self)
+        self._settings_timer.setInterval(2000)
+        self._settings_timer.timeout.connect(self.settings_store.check_for_changes)
+        self._settings_timer.start()
 
         # UI
-        self.table_model = MacroTableModel(self.macros)
+        self.content_index = get_content_index()
+        self.table_model = MacroTableModel(self.macros, self.content_index)
+        self.filter_model = MacroFilterProxyModel(self, self.content_index)
+        self.filter_model.setSourceModel(self.table_model)
+        # Indice di ricerca costruito in background (la prima ricerca attende se non è pronto)
+        threading.Thread(target=self.table_model.search.ensure_built, name="SearchIndex", daemon=True).start()
         self.table = QtWidgets.QTableView()
-        self.table.setModel(self.table_model)
+        self.table.setModel(self.filter_model)
         self.table.setSelectionBehavior(QtWidgets.QTableView.SelectRows)
         self.table.setSelectionMode(QtWidgets.QTableView.SingleSelection)
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.verticalHeader().setVisible(False)
         self.table.setEditTriggers(QtWidgets.QTableView.DoubleClicked | QtWidgets.QTableView.SelectedClicked | QtWidgets.QTableView.EditKeyPressed)
         self.table.setAlternatingRowColors(True)
+        # Clic sull'intestazione: ordinamento del modello (i preferiti restano in cima)
+        self.table.horizontalHeader().setSortIndicator(0, QtCore.Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
+        # Statistiche calcolate dal thread di scrittura ed esiti delle esecuzioni
+        self.statsChanged.connect(self._on_stats_changed)
+        self.content_index.subscribe(self.statsChanged.emit)
 
         toolbar = QtWidgets.QToolBar("Actions")
         self.addToolBar(toolbar)
@@ -211,6 +1124,14 @@ class MainWindow(QtWidgets.QMainWindow):
         act_play.triggered.connect(self.execute_selected)
         toolbar.addAction(act_play)
 
+        act_enqueue = QtGui.QAction("Accoda selezionata", self)
+        act_enqueue.triggered.connect(self.enqueue_selected)
+        toolbar.addAction(act_enqueue)
+
+        act_run_queue = QtGui.QAction("Esegui coda", self)
+        act_run_queue.triggered.connect(self.run_queue)
+        toolbar.addAction(act_run_queue)
+
         act_toggle_pause = QtGui.QAction("Toggle Con/Senza pause", self)
         act_toggle_pause.triggered.connect(self.toggle_with_pauses)
         toolbar.addAction(act_toggle_pause)
@@ -219,6 +1140,14 @@ class MainWindow(QtWidgets.QMainWindow):
         act_fav.triggered.connect(self.toggle_favorite)
         toolbar.addAction(act_fav)
 
+        act_call = QtGui.QAction("Inserisci chiamata macro", self)
+        act_call.triggered.connect(self.insert_macro_call)
+        toolbar.addAction(act_call)
+
+        act_edit_events = QtGui.QAction("Modifica eventi", self)
+        act_edit_events.triggered.connect(self.edit_events)
+        toolbar.addAction(act_edit_events)
+
         act_delete = QtGui.QAction("Elimina", self)
         act_delete.triggered.connect(self.delete_selected)
         toolbar.addAction(act_delete)
@@ -233,6 +1162,10 @@ class MainWindow(QtWidgets.QMainWindow):
         act_import.triggered.connect(lambda: QtCore.QTimer.singleShot(0, self._do_import))
         toolbar.addAction(act_import)
 
+        act_bulk_import = QtGui.QAction("Importa cartella/zip", self)
+        act_bulk_import.triggered.connect(lambda: QtCore.QTimer.singleShot(0, self._do_bulk_import))
+        toolbar.addAction(act_bulk_import)
+
         toolbar.addSeparator()
 
         # Theme toggle action
@@ -246,6 +1179,11 @@ class MainWindow(QtWidgets.QMainWindow):
 
         central = QtWidgets.QWidget()
         layout = QtWidgets.QVBoxLayout(central)
+        self.search_box = QtWidgets.QLineEdit()
+        self.search_box.setPlaceholderText("Cerca per titolo, tag (#tag) o contenuto (tasto:ctrl+s, testo:ciao, area:x,y,l,a)")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self._on_search_changed)
+        layout.addWidget(self.search_box)
         layout.addWidget(self.table)
 
         btn_row = QtWidgets.QHBoxLayout()
@@ -261,10 +1199,44 @@ class MainWindow(QtWidgets.QMainWindow):
         QtGui.QShortcut(QtGui.QKeySequence("Delete"), self, self.delete_selected)
 
         self.playbackFinished.connect(self._restore_window)
+        self.playbackProgress.connect(self._show_playback_progress)
+        self.transferProgress.connect(self._show_transfer_progress)
+        self.importFinished.connect(self._on_import_finished)
+        self.exportFinished.connect(self._on_export_finished)
+        self.bulkImportParsed.connect(self._on_bulk_import_parsed)
+        self.eventsMaterialized.connect(self._on_events_materialized)
+        self.eventsVerified.connect(self._on_events_verified)
+        # Macro salvate prima dell'analisi del bilanciamento
+        self._verifying: set = set()
+        self._verify_in_background()
+
+        self._watch_display_changes()
 
         # Apply initial theme
         self._apply_theme(self.current_theme)
 
+    def _watch_display_changes(self) -> None:
+        """Invalida la cache della topologia display ai cambi di monitor, risoluzione o DPI"""
+        app = QtGui.QGuiApplication.instance()
+        if app is None:
+            return
+        cache = get_display_cache()
+
+        def _connect_screen(screen: QtGui.QScreen) -> None:
+            screen.geometryChanged.connect(lambda *_: cache.invalidate())
+            screen.logicalDotsPerInchChanged.connect(lambda *_: cache.invalidate())
+
+        for screen in QtGui.QGuiApplication.screens():
+            _connect_screen(screen)
+
+        def _on_screen_added(screen: QtGui.QScreen) -> None:
+            _connect_screen(screen)
+            cache.invalidate()
+
+        app.screenAdded.connect(_on_screen_added)
+        app.screenRemoved.connect(lambda *_: cache.invalidate())
+        app.primaryScreenChanged.connect(lambda *_: cache.invalidate())
+
     def _apply_theme(self, theme: str):
         if theme == "dark":
             # Dark theme stylesheet
@@ -332,29 +1304,51 @@ class MainWindow(QtWidgets.QMainWindow):
             self.setStyleSheet(dark_style)
             self.act_theme.setText("Tema: Scuro")
             # Update table model for dark theme favorite highlighting
-            self.table_model.beginResetModel()
-            self.table_model.endResetModel()
+            self.table_model.set_dark_theme(True)
         else:
             # Light theme (default)
             self.setStyleSheet("")
             self.act_theme.setText("Tema: Chiaro")
-            # Reset table model for light theme
-            self.table_model.beginResetModel()
-            self.table_model.endResetModel()
+            # Favorite highlighting for light theme
+            self.table_model.set_dark_theme(False)
 
     def toggle_theme(self):
-        self.current_theme = "dark" if self.current_theme == "light" else "light"
-        self._apply_theme(self.current_theme)
-        # Save theme preference
-        if "ui" not in self.settings:
-            self.settings["ui"] = {}
-        self.settings["ui"]["theme"] = self.current_theme
-        save_settings(self.settings)
-        self.statusBar().showMessage(f"Tema cambiato in {self.current_theme}", 2000)
+        theme = "dark" if self.current_theme == "light" else "light"
+        # Il tema viene applicato dalla notifica di modifica delle impostazioni
+        self.settings_store.update("ui", theme=theme)
+        self.statusBar().showMessage(f"Tema cambiato in {theme}", 2000)
+
+    def _on_settings_changed(self, section: str, value) -> None:
+        """Impostazioni modificate dalla GUI o dall'esterno (file settings.json)"""
+        self.settings[section] = value
+        if section == "ui":
+            theme = (value or {}).get("theme", "light")
+            if theme != self.current_theme:
+                self.current_theme = theme
+                self._apply_theme(theme)
+        elif section == "playback":
+            self.player.configure(value or {})
+        elif section == "storage":
+            # La libreria è già stata caricata dal backend scelto all'avvio
+            self.statusBar().showMessage("Il nuovo archivio della libreria sarà usato dal prossimo avvio", 5000)
 
     def _selected_index(self) -> int:
+        """Riga della macro selezionata in table_model (la vista mostra le righe filtrate)"""
         indexes = self.table.selectionModel().selectedRows()
-        return indexes[0].row() if indexes else -1
+        return self.filter_model.mapToSource(indexes[0]).row() if indexes else -1
+
+    def _on_search_changed(self, text: str) -> None:
+        self.filter_model.set_query(text)
+        self._show_search_status()
+
+    def _show_search_status(self) -> None:
+        if self.filter_model.query.strip():
+            message = f"{self.filter_model.rowCount()} macro trovate su {self.table_model.rowCount()}"
+            if self.filter_model.content_pending:
+                message += " (analisi del contenuto in corso)"
+            self.statusBar().showMessage(message)
+        else:
+            self.statusBar().clearMessage()
 
     def _stop_by_overlay(self) -> None:
         if self.recorder.is_recording:
@@ -376,12 +1370,20 @@ class MainWindow(QtWidgets.QMainWindow):
                 rec_id, default_title = next_recording_title(self.macros)
                 dlg = SaveRecordingDialog(default_title, self)
                 if dlg.exec() == QtWidgets.QDialog.Accepted:
-                    m = Macro(id=rec_id, title=dlg.title, events=events, with_pauses=dlg.with_pauses, repetitions=1)
+                    m = Macro(
+                        id=rec_id,
+                        title=dlg.title,
+                        events=events,
+                        with_pauses=dlg.with_pauses,
+                        repetitions=1,
+                        display_layout=self.recorder.display_layout,
+                    )
                     self.macros.append(m)
                     save_macros(self.macros)
-                    self.table_model._original_items = self.macros
-                    self.table_model.refresh_sorting()
+                    self.table_model.insert_macro(m)
                     self.statusBar().showMessage(f"Salvata {m.title}")
+                    # Registrazioni grandi: il bilanciamento non viene verificato da save_macros
+                    self._verify_in_background()
             else:
                 self.statusBar().showMessage("Nessun evento registrato")
 
@@ -393,22 +1395,125 @@ class MainWindow(QtWidgets.QMainWindow):
         path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Esporta macro", f"{m.title}.json", "JSON (*.json)")
         if not path:
             return
-        import json
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(m.to_dict(), indent=2, ensure_ascii=False))
+
+        def run() -> None:
+            try:
+                count = export_macro(m, Path(path), lambda done, total: self.transferProgress.emit("Esportazione", done, total))
+                self.exportFinished.emit(f"Esportati {count} eventi di {m.title}", "")
+            except Exception as exc:
+                logger.exception("Export failed: {}", exc)
+                self.exportFinished.emit("", str(exc))
+
+        self.statusBar().showMessage(f"Esportazione di {m.title}…")
+        threading.Thread(target=run, name="MacroExport", daemon=True).start()
+
+    def _on_export_finished(self, message: str, error: str) -> None:
+        if error:
+            QtWidgets.QMessageBox.warning(self, "Esporta macro", error)
+            return
+        self.statusBar().showMessage(message, 3000)
 
     def _do_import(self) -> None:
         path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Importa macro", "", "JSON (*.json)")
         if not path:
             return
-        import json
-        with open(path, "r", encoding="utf-8") as f:
-            d = json.load(f)
-        m = Macro.from_dict(d)
+        macros = list(self.macros)
+
+        def run() -> None:
+            try:
+                m = import_macro(
+                    Path(path),
+                    lambda done, total: self.transferProgress.emit("Importazione", done, total),
+                    events_file=new_event_file,
+                )
+                # Il bilanciamento di un file esterno va sempre verificato, qui come nell'importazione in blocco
+                m.events = prepare_events(m.id, m.title, m.events, len(m.events))
+                m.verified = True
+                # Confronto con la libreria (hash dei segmenti) fuori dal thread della GUI
+                self.importFinished.emit(m, find_duplicate(macros, m), "")
+            except Exception as exc:
+                logger.exception("Import failed: {}", exc)
+                self.importFinished.emit(None, None, str(exc))
+
+        self.statusBar().showMessage("Importazione in corso…")
+        threading.Thread(target=run, name="MacroImport", daemon=True).start()
+
+    def _on_import_finished(self, m: Macro | None, dup: Macro | None, error: str) -> None:
+        if m is None:
+            QtWidgets.QMessageBox.warning(self, "Importa macro", error or "Importazione non riuscita")
+            return
+        if dup is not None and dup in self.macros:
+            discard_fresh_events(m.events)
+            self.statusBar().showMessage(f"Macro già presente nella libreria: {dup.title}", 3000)
+            return
+        if self._find_macro(m.id) is not None:
+            # Stesso id ma eventi diversi: la macro importata riceve un id nuovo
+            m.id = get_allocator().new_id("imp")
         self.macros.append(m)
-        save_macros(self.macros)
-        self.table_model._original_items = self.macros
-        self.table_model.refresh_sorting()
+        try:
+            save_macros(self.macros)
+        except MacroCycleError as exc:
+            self.macros.remove(m)
+            discard_fresh_events(m.events)
+            QtWidgets.QMessageBox.warning(self, "Importa macro", str(exc))
+            return
+        self.plan_cache.invalidate(m.id)
+        self.table_model.insert_macro(m)
+        self.statusBar().showMessage(f"Importata {m.title} ({len(m.events)} eventi)", 3000)
+
+    def _do_bulk_import(self) -> None:
+        box = QtWidgets.QMessageBox(self)
+        box.setWindowTitle("Importa macro")
+        box.setText("Importare una cartella o un archivio .zip?")
+        btn_dir = box.addButton("Cartella", QtWidgets.QMessageBox.AcceptRole)
+        btn_zip = box.addButton("Archivio .zip", QtWidgets.QMessageBox.AcceptRole)
+        box.addButton(QtWidgets.QMessageBox.Cancel)
+        box.exec()
+        if box.clickedButton() is btn_dir:
+            path = QtWidgets.QFileDialog.getExistingDirectory(self, "Importa cartella di macro")
+        elif box.clickedButton() is btn_zip:
+            path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Importa archivio di macro", "", "Archivi zip (*.zip)")
+        else:
+            return
+        if not path:
+            return
+
+        def run() -> None:
+            try:
+                sources = collect_sources(Path(path))
+                parsed, errors = parse_sources(
+                    sources, progress=lambda done, total: self.transferProgress.emit("Importazione file", done, total)
+                )
+                self.bulkImportParsed.emit(parsed, errors, "")
+            except Exception as exc:
+                logger.exception("Bulk import failed: {}", exc)
+                self.bulkImportParsed.emit(None, None, str(exc))
+
+        self.statusBar().showMessage("Lettura dei file in corso…")
+        threading.Thread(target=run, name="MacroBulkImport", daemon=True).start()
+
+    def _on_bulk_import_parsed(self, parsed, errors, error: str) -> None:
+        if parsed is None:
+            QtWidgets.QMessageBox.warning(self, "Importa macro", error or "Importazione non riuscita")
+            return
+        try:
+            result = import_into_library(self.macros, parsed, errors)
+        except MacroCycleError as exc:
+            QtWidgets.QMessageBox.warning(self, "Importa macro", str(exc))
+            return
+        for m in result.imported:
+            self.plan_cache.invalidate(m.id)
+            self.table_model.insert_macro(m)
+        self.statusBar().showMessage(f"Importazione completata: {result.summary()}", 5000)
+        if result.errors:
+            details = "\n".join(f"{source}: {msg}" for source, msg in result.errors[:20])
+            if len(result.errors) > 20:
+                details += f"\n… e altri {len(result.errors) - 20}"
+            QtWidgets.QMessageBox.warning(self, "Importa macro", f"{result.summary()}\n\n{details}")
+
+    def _show_transfer_progress(self, label: str, done: int, total: int) -> None:
+        if total > 0:
+            self.statusBar().showMessage(f"{label}: {done * 100 // total}%")
 
     def execute_selected(self) -> None:
         idx = self._selected_index()
@@ -425,15 +1530,75 @@ class MainWindow(QtWidgets.QMainWindow):
         self.hide()
         self._play_macro_with_restore(m)
 
+    def _use_worker_process(self) -> bool:
+        return bool(self.settings.get("playback", {}).get("worker_process", False))
+
+    def _ensure_playback_worker(self) -> PlaybackWorker:
+        if self._playback_worker is None or not self._playback_worker.is_alive:
+            self._playback_worker = PlaybackWorker(
+                on_progress=self.playbackProgress.emit,
+                on_finished=self._on_worker_finished,
+            )
+            self._playback_worker.start()
+        return self._playback_worker
+
+    def _on_worker_finished(self, ok: bool) -> None:
+        """Fine della riproduzione nel processo separato (thread di ascolto del worker)"""
+        macro, self._worker_macro = self._worker_macro, None
+        if macro is not None:
+            record_run(macro, PLAY_COMPLETED if ok else PLAY_FAILED)
+        self.playbackFinished.emit()
+
+    def _on_stats_changed(self, ids) -> None:
+        self.table_model.stats_changed([m for m in self.macros if m.id in ids])
+        if self.filter_model.content_changed():
+            self._show_search_status()
+
+    def _show_playback_progress(self, done: int, total: int) -> None:
+        if total > 0:
+            self.statusBar().showMessage(f"Riproduzione: {done}/{total} eventi")
+
     def _play_macro_with_restore(self, m: Macro) -> None:
-        def run_and_notify():
+        record_run(m)
+        mapped = isinstance(m.events, MappedEvents)
+        if self._use_worker_process() and mapped and called_ids(m):
+            # Il processo apre il file mappato così com'è e non ha accesso alla libreria:
+            # le chiamate vengono espanse solo dalla riproduzione locale
+            self.statusBar().showMessage(f"{m.title} richiama altre macro: riproduzione nel processo principale", 5000)
+        elif self._use_worker_process():
             try:
-                self.player.play(m.events, with_pauses=m.with_pauses, repetitions=m.repetitions, macro=m)
+                worker = self._ensure_playback_worker()
+                # Il processo di riproduzione non ha accesso alla libreria: riceve la sequenza già espansa
+                if mapped:
+                    # Registrazione mappata senza chiamate: il processo apre lo stesso file
+                    expanded = m
+                else:
+                    expanded = replace(m, events=self.plan_cache.expanded(m), display_layout=None)
+                worker.load(expanded, self.settings.get("playback", {}))
+                self._worker_macro = m
+                worker.play()
+                return
             except Exception as exc:
-                logger.exception("Playback failed: {}", exc)
-            finally:
-                self.playbackFinished.emit()
-        threading.Thread(target=run_and_notify, daemon=True).start()
+                logger.exception("Processo di riproduzione non disponibile, uso thread locale: {}", exc)
+
+        # Solo questa macro: quelle accodate restano in attesa di "Esegui coda"
+        self.play_queue.play_now(m)
+
+    def enqueue_selected(self) -> None:
+        idx = self._selected_index()
+        if idx < 0:
+            return
+        m = self.table_model.items[idx]
+        self.play_queue.enqueue(m)
+        self.statusBar().showMessage(f"{self.play_queue.pending} macro in coda")
+
+    def run_queue(self) -> None:
+        if self.play_queue.pending == 0:
+            self.statusBar().showMessage("Coda vuota", 2000)
+            return
+        # La finestra resta nascosta finché la coda non è esaurita
+        self.hide()
+        self.play_queue.start()
 
     def _restore_window(self) -> None:
         self.setWindowState(self.windowState() & ~QtCore.Qt.WindowMinimized)
@@ -443,11 +1608,14 @@ class MainWindow(QtWidgets.QMainWindow):
         self.activateWindow()
 
     def _play_macro(self, m: Macro) -> None:
+        record_run(m)
         def run():
             try:
-                self.player.play(m.events, with_pauses=m.with_pauses, repetitions=m.repetitions, macro=m)
+                result = self.player.play(m.events, with_pauses=m.with_pauses, repetitions=m.repetitions, macro=m)
             except Exception as exc:
+                result = PLAY_FAILED
                 logger.exception("Playback failed: {}", exc)
+            record_run(m, result)
         threading.Thread(target=run, daemon=True).start()
 
     def toggle_with_pauses(self) -> None:
@@ -455,19 +1623,18 @@ class MainWindow(QtWidgets.QMainWindow):
         if idx < 0:
             return
         m = self.table_model.items[idx]
-        m.with_pauses = not m.with_pauses
-        save_macros(self.macros)
-        self.table_model.dataChanged.emit(self.table_model.index(idx, 1), self.table_model.index(idx, 1))
+        save_metadata(self.macros, m, with_pauses=not m.with_pauses)
+        # La riga può spostarsi se la tabella è ordinata per questa colonna
+        self.table_model.update_macro(m)
 
     def toggle_favorite(self) -> None:
         idx = self._selected_index()
         if idx < 0:
             return
         m = self.table_model.items[idx]
-        m.favorite = not m.favorite
-        save_macros(self.macros)
-        # Refresh sorting to move favorites to top
-        self.table_model.refresh_sorting()
+        save_metadata(self.macros, m, favorite=not m.favorite)
+        # Sposta la riga tra i preferiti (o fuori) mantenendo la selezione
+        self.table_model.update_macro(m)
 
     def delete_selected(self) -> None:
         idx = self._selected_index()
@@ -477,8 +1644,134 @@ class MainWindow(QtWidgets.QMainWindow):
         # Remove from original list
         self.macros.remove(macro_to_delete)
         save_macros(self.macros)
-        self.table_model._original_items = self.macros
-        self.table_model.refresh_sorting()
+        self.plan_cache.invalidate(macro_to_delete.id)
+        self.table_model.remove_macro(macro_to_delete)
+
+    def _find_macro(self, macro_id: str) -> Macro | None:
+        return next((m for m in self.macros if m.id == macro_id), None)
+
+    def insert_macro_call(self) -> None:
+        idx = self._selected_index()
+        if idx < 0:
+            return
+        m = self.table_model.items[idx]
+        candidates = [c for c in self.macros if c.id != m.id]
+        if not candidates:
+            self.statusBar().showMessage("Nessuna altra macro da chiamare", 2000)
+            return
+        labels = [f"{c.title} ({c.id})" for c in candidates]
+        label, ok = QtWidgets.QInputDialog.getItem(self, "Inserisci chiamata", "Macro da chiamare:", labels, 0, False)
+        if not ok:
+            return
+        callee = candidates[labels.index(label)]
+        reps, ok = QtWidgets.QInputDialog.getInt(self, "Inserisci chiamata", "Ripetizioni:", 1, 1, 1000000)
+        if not ok:
+            return
+        call = CallEvent(type="call", time_delta_ms=0, macro_id=callee.id, repetitions=reps)
+        m.events = m.events + [call]
+        try:
+            save_macros(self.macros)
+        except MacroCycleError as exc:
+            m.events = m.events[:-1]
+            QtWidgets.QMessageBox.warning(self, "Inserisci chiamata", str(exc))
+            return
+        self.plan_cache.invalidate(m.id)
+        self.statusBar().showMessage(f"Aggiunta chiamata a {callee.title} in {m.title}", 2000)
+
+    def edit_events(self) -> None:
+        idx = self._selected_index()
+        if idx < 0:
+            return
+        m = self.table_model.items[idx]
+        dialog = TimelineDialog(m, self._find_macro, self)
+        if dialog.exec() != QtWidgets.QDialog.Accepted or not dialog.timeline.modified:
+            return
+        timeline = dialog.timeline
+
+        def run() -> None:
+            # Le macro molto grandi vengono riscritte a flusso in un nuovo file mappato
+            try:
+                # Blocchi e cicli modificati: bilanciamento verificato mentre si scrivono gli eventi
+                events = prepare_events(m.id, m.title, timeline, len(timeline))
+                self.eventsMaterialized.emit(m, events, "")
+            except Exception as exc:
+                logger.exception("Saving edited events failed: {}", exc)
+                self.eventsMaterialized.emit(m, None, str(exc))
+
+        self.statusBar().showMessage(f"Salvataggio degli eventi di {m.title}…")
+        threading.Thread(target=run, name="MacroEventsSave", daemon=True).start()
+
+    def _on_events_materialized(self, m: Macro, events, error: str) -> None:
+        if events is None:
+            QtWidgets.QMessageBox.warning(self, "Modifica eventi", error or "Salvataggio non riuscito")
+            return
+        if m not in self.macros:
+            return
+        previous, was_verified = m.events, m.verified
+        m.events = events
+        m.verified = True
+        try:
+            save_macros(self.macros)
+        except MacroCycleError as exc:
+            m.events, m.verified = previous, was_verified
+            QtWidgets.QMessageBox.warning(self, "Modifica eventi", str(exc))
+            return
+        self.plan_cache.invalidate(m.id)
+        self.table_model.update_macro(m)
+        self.statusBar().showMessage(f"Salvati {len(events)} eventi di {m.title}", 3000)
+
+    def _verify_in_background(self) -> None:
+        """Verifica (e se serve corregge) il bilanciamento delle macro non ancora verificate"""
+        pending = [(m, m.events) for m in self.macros if not m.verified and m.id not in self._verifying]
+        if not pending:
+            return
+        self._verifying.update(m.id for m, _ in pending)
+
+        def run() -> None:
+            results = []
+            for m, events in pending:
+                try:
+                    results.append((m, events, prepare_events(m.id, m.title, events, len(events))))
+                except Exception as exc:
+                    logger.exception("Balance verification of {} failed: {}", m.title, exc)
+                    results.append((m, events, None))
+            self.eventsVerified.emit(results)
+
+        threading.Thread(target=run, name="MacroVerify", daemon=True).start()
+
+    def _on_events_verified(self, results) -> None:
+        repaired: List[Macro] = []
+        verified = 0
+        for m, original, events in results:
+            self._verifying.discard(m.id)
+            # Macro eliminata o con eventi sostituiti nel frattempo: resta da verificare
+            if events is None or m.events is not original or not any(x is m for x in self.macros):
+                continue
+            m.events = events
+            m.verified = True
+            verified += 1
+            if events is not original:
+                repaired.append(m)
+        if not verified:
+            return
+        try:
+            save_macros(self.macros)
+        except MacroCycleError as exc:
+            logger.error("Macro verificate non salvate: {}", exc)
+            return
+        for m in repaired:
+            self.plan_cache.invalidate(m.id)
+            self.table_model.update_macro(m)
+
+    def closeEvent(self, event: QtGui.QCloseEvent) -> None:
+        self.play_queue.close()
+        if self._playback_worker is not None:
+            self._playback_worker.close()
+            self._playback_worker = None
+        # Salvataggi ancora in attesa del debounce
+        if not flush_storage(5.0):
+            logger.warning("Salvataggi non completati alla chiusura")
+        super().closeEvent(event)
 
     def show_help(self) -> None:
         text = (
@@ -486,7 +1779,11 @@ class MainWindow(QtWidgets.QMainWindow):
             "<ul>"
             "<li><b>Registra:</b> usa la toolbar; durante la registrazione clic sinistro Stop per fermare, tasto destro per trascinare</li>"
             "<li><b>Esegui:</b> la finestra si nasconde, esegue e si riapre alla fine</li>"
+            "<li><b>Coda:</b> accoda più macro e avviale con Esegui coda; la finestra si riapre quando la coda è terminata</li>"
             "<li><b>Preferiti:</b> marca le macro come preferite per tenerle in cima alla lista</li>"
+            "<li><b>Ricerca:</b> filtra per parti del titolo o dei tag; #nome filtra per tag. I tag si modificano con doppio clic sulla colonna Tag (separati da virgola)</li>"
+            "<li><b>Ricerca nel contenuto:</b> tasto:ctrl+s (combinazione premuta), testo:parola o testo:\"più parole\" (testo digitato), area:x,y,larghezza,altezza (click nell'area, precisione 100 px)</li>"
+            "<li><b>Modifica eventi:</b> elenco degli eventi con panoramica dei tempi (rotella per lo zoom, tasto destro per spostarsi, clic per andare a quel tempo); elimina, copia e incolla, modifica le pause o inserisci attese sulle righe selezionate</li>"
             "<li><b>Tema:</b> passa dal tema chiaro a quello scuro dal pulsante nella toolbar</li>"
             "</ul>"
         )
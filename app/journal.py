@@ -0,0 +1,148 @@
+"""
+Registro append-only delle modifiche ai metadati delle macro.
+
+Ogni modifica (titolo, preferito, ripetizioni, ...) aggiunge una riga JSON
+al registro invece di riscrivere l'intera libreria. All'avvio le righe
+vengono riapplicate sull'ultimo salvataggio completo. I record contengono
+valori assoluti, quindi riapplicarli più volte dà lo stesso risultato.
+
+Compattazione: prima di un salvataggio completo il registro corrente viene
+spostato in un segmento chiuso (<nome>.old), che viene eliminato solo dopo
+che il salvataggio è stato scritto su disco.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+from loguru import logger
+
+from .models import Macro
+
+# Campi di Macro modificabili tramite il registro
+JOURNAL_FIELDS: Tuple[str, ...] = ("title", "favorite", "repetitions", "with_pauses", "preserve_cursor", "tags")
+
+# Soglie oltre le quali il registro va compattato
+MAX_JOURNAL_RECORDS = 1000
+MAX_JOURNAL_BYTES = 256 * 1024
+
+
+class MetadataJournal:
+    def __init__(
+        self,
+        path: Path,
+        max_records: int = MAX_JOURNAL_RECORDS,
+        max_bytes: int = MAX_JOURNAL_BYTES,
+    ) -> None:
+        self.path = path
+        self.sealed_path = path.with_name(path.name + ".old")
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._records = 0
+        self._bytes = 0
+        # Incrementato a ogni chiusura di segmento
+        self._generation = 0
+
+    @property
+    def needs_compaction(self) -> bool:
+        with self._lock:
+            return self._records >= self.max_records or self._bytes >= self.max_bytes
+
+    def append(self, macro_id: str, changes: Dict[str, Any]) -> None:
+        """Aggiunge un record con i nuovi valori dei campi della macro"""
+        values = {k: v for k, v in changes.items() if k in JOURNAL_FIELDS}
+        if not values:
+            return
+        line = json.dumps({"id": macro_id, "set": values, "ts": int(time.time())}, ensure_ascii=False)
+        data = (line + "\n").encode("utf-8")
+        with self._lock:
+            try:
+                with open(self.path, "ab") as f:
+                    f.write(data)
+            except Exception as exc:
+                logger.exception("Failed to append journal {}: {}", self.path, exc)
+                return
+            self._records += 1
+            self._bytes += len(data)
+
+    def _iter_records(self, path: Path) -> Iterator[Dict[str, Any]]:
+        try:
+            with open(path, "rb") as f:
+                for n, raw in enumerate(f, 1):
+                    try:
+                        rec = json.loads(raw)
+                    except ValueError:
+                        # Tipicamente l'ultima riga troncata da un crash
+                        logger.warning("Record {} del registro {} non valido, ignorato", n, path)
+                        continue
+                    if isinstance(rec, dict) and isinstance(rec.get("set"), dict):
+                        yield rec
+        except FileNotFoundError:
+            return
+
+    def replay(self, macros: Iterable[Macro]) -> int:
+        """Applica i record del registro (segmento chiuso, poi corrente) alle macro"""
+        by_id = {m.id: m for m in macros}
+        applied = 0
+        records = 0
+        size = 0
+        for path in (self.sealed_path, self.path):
+            for rec in self._iter_records(path):
+                records += 1
+                m = by_id.get(rec.get("id"))
+                if m is None:
+                    continue
+                for key, value in rec["set"].items():
+                    if key in JOURNAL_FIELDS:
+                        setattr(m, key, value)
+                applied += 1
+            try:
+                size += path.stat().st_size
+            except OSError:
+                pass
+        with self._lock:
+            self._records = records
+            self._bytes = size
+        return applied
+
+    def seal(self) -> int:
+        """
+        Chiude il registro corrente prima di un salvataggio completo.
+
+        Returns:
+            generazione da passare a drop_sealed dopo la scrittura del salvataggio
+        """
+        with self._lock:
+            self._generation += 1
+            try:
+                if self.path.exists():
+                    if self.sealed_path.exists():
+                        # Segmento precedente non ancora eliminato: i record vengono accodati
+                        with open(self.path, "rb") as src, open(self.sealed_path, "ab") as dst:
+                            dst.write(src.read())
+                        os.remove(self.path)
+                    else:
+                        os.replace(self.path, self.sealed_path)
+            except Exception as exc:
+                logger.exception("Failed to seal journal {}: {}", self.path, exc)
+            self._records = 0
+            self._bytes = 0
+            return self._generation
+
+    def drop_sealed(self, generation: int) -> None:
+        """Elimina il segmento chiuso se nessun'altra chiusura è avvenuta dopo `generation`"""
+        with self._lock:
+            if generation != self._generation:
+                return
+            try:
+                os.remove(self.sealed_path)
+            except FileNotFoundError:
+                pass
+            except Exception as exc:
+                logger.debug(f"Errore eliminazione registro chiuso: {exc}")
@@ -3,6 +3,7 @@ from __future__ import annotations
 import sys
 import os
 import ctypes
+import multiprocessing
 
 # Aggiungi il percorso del progetto al path Python per risolvere gli import
 # Questo è necessario per PyInstaller
@@ -289,6 +290,8 @@ def main() -> int:
 
 
 if __name__ == "__main__":
+    # Necessario per il processo di riproduzione separato negli eseguibili PyInstaller
+    multiprocessing.freeze_support()
     # CORREZIONE PROBLEMA 3: Gestione exit code robusta
     try:
         exit_code = main()
@@ -3,7 +3,7 @@ from __future__ import annotations
 from dataclasses import dataclass, field
 from typing import List, Literal, Optional, Union, Dict, Any
 
-EventType = Literal["key", "mouse"]
+EventType = Literal["key", "mouse", "call", "control"]
 
 @dataclass
 class BaseEvent:
@@ -24,7 +24,26 @@ class MouseEvent(BaseEvent):
     dx: Optional[int] = None
     dy: Optional[int] = None
 
-Event = Union[KeyEvent, MouseEvent]
+@dataclass
+class CallEvent(BaseEvent):
+    """Esecuzione di un'altra macro della libreria, identificata tramite id"""
+    macro_id: str
+    repetitions: int = 1
+
+@dataclass
+class ControlEvent(BaseEvent):
+    """
+    Costrutto di controllo:
+    loop (ripete `count` volte gli eventi fino al relativo end), block
+    (blocco etichettato, chiuso da end), end, wait (attesa fissa di `wait_ms`,
+    rispettata anche nella riproduzione senza pause)
+    """
+    action: Literal["loop", "block", "end", "wait"]
+    count: int = 1
+    wait_ms: int = 0
+    label: Optional[str] = None
+
+Event = Union[KeyEvent, MouseEvent, CallEvent, ControlEvent]
 
 @dataclass
 class Macro:
@@ -35,40 +54,46 @@ class Macro:
     repetitions: int = 1
     favorite: bool = False
     preserve_cursor: bool = False
+    # Layout dei display al momento della registrazione (DisplayTopology.to_dict)
+    display_layout: Optional[Dict[str, Any]] = None
+    # Bilanciamento press/release verificato staticamente (balance.verify_macro)
+    verified: bool = False
+    # Etichette libere per la ricerca (app/search.py)
+    tags: List[str] = field(default_factory=list)
 
     def to_dict(self) -> Dict[str, Any]:
-        def encode_event(e: Event) -> Dict[str, Any]:
-            d = e.__dict__.copy()
-            d["__class__"] = e.__class__.__name__
-            return d
+        from .schema import SCHEMA_VERSION
 
         return {
+            "schema": SCHEMA_VERSION,
             "id": self.id,
             "title": self.title,
-            "events": [encode_event(e) for e in self.events],
+            "events": [event_to_dict(e) for e in self.events],
             "with_pauses": self.with_pauses,
             "repetitions": self.repetitions,
             "favorite": self.favorite,
             "preserve_cursor": self.preserve_cursor,
+            "display_layout": self.display_layout,
+            "verified": self.verified,
+            "tags": list(self.tags),
         }
 
     @staticmethod
-    def from_dict(d: Dict[str, Any]) -> "Macro":
-        def decode_event(e: Dict[str, Any]) -> Event:
-            cls = e.pop("__class__", "")
-            if cls == "KeyEvent":
-                return KeyEvent(**e)  # type: ignore[arg-type]
-            if cls == "MouseEvent":
-                return MouseEvent(**e)  # type: ignore[arg-type]
-            raise ValueError(f"Unknown event class: {cls}")
-
-        return Macro(
-            id=d["id"],
-            title=d.get("title", d["id"]),
-            events=[decode_event(e) for e in d.get("events", [])],
-            with_pauses=d.get("with_pauses", True),
-            repetitions=int(d.get("repetitions", 1)),
-            favorite=bool(d.get("favorite", False)),
-            preserve_cursor=bool(d.get("preserve_cursor", False)),
-        )
+    def from_dict(d: Dict[str, Any], version: Optional[int] = None) -> "Macro":
+        """Macro dal dizionario di to_dict (validato da schema.decode_macro, che solleva SchemaError)"""
+        from .schema import decode_macro
+
+        return decode_macro(d, version)
+
+
+def event_to_dict(e: Event) -> Dict[str, Any]:
+    d = e.__dict__.copy()
+    d["__class__"] = e.__class__.__name__
+    return d
+
+
+def event_from_dict(e: Dict[str, Any]) -> Event:
+    """Evento dal dizionario di event_to_dict; il dizionario non viene modificato"""
+    from .schema import decode_event
 
+    return decode_event(e)
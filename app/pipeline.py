@@ -0,0 +1,184 @@
+"""
+Pipeline di riproduzione a due stadi.
+
+Un thread di preparazione riempie una coda limitata con operazioni pronte per
+l'iniezione, con un anticipo configurabile rispetto alle loro scadenze; il
+thread di iniezione si limita ad attendere la scadenza e inviare l'operazione.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from loguru import logger
+
+# Anticipo predefinito con cui le operazioni vengono preparate
+DEFAULT_LOOKAHEAD_S = 0.25
+# Dimensione massima predefinita della coda di operazioni pronte
+DEFAULT_QUEUE_SIZE = 256
+# Sotto questa soglia l'attesa della scadenza avviene con spin invece che con sleep
+_SPIN_THRESHOLD_S = 0.002
+
+_END = object()
+
+
+@dataclass
+class PreparedOp:
+    op: Any
+    # Scadenza relativa all'inizio della riproduzione, in secondi (None = appena possibile)
+    due: Optional[float] = None
+    # Dati precalcolati dallo stadio di preparazione
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class PipelineMetrics:
+    prepared: int = 0
+    injected: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    # Il thread di iniezione ha trovato la coda vuota
+    injector_stalls: int = 0
+    # Il thread di preparazione ha trovato la coda piena
+    producer_stalls: int = 0
+    # Operazioni inviate oltre la loro scadenza
+    late_ops: int = 0
+    max_lateness_ms: float = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class PlaybackPipeline:
+    """
+    Esegue una sequenza di operazioni con preparazione anticipata.
+
+    Args:
+        prepare: Trasforma un'operazione del piano in PreparedOp (thread di preparazione)
+        submit: Invia un'operazione preparata (thread di iniezione)
+        lookahead_s: Anticipo massimo della preparazione rispetto alla scadenza
+        max_queue: Dimensione massima della coda
+        stop_event: Evento che interrompe la riproduzione
+        resume_event: Evento azzerato durante la pausa
+    """
+
+    def __init__(
+        self,
+        prepare: Callable[[Any, Optional[float]], PreparedOp],
+        submit: Callable[[PreparedOp], None],
+        lookahead_s: float = DEFAULT_LOOKAHEAD_S,
+        max_queue: int = DEFAULT_QUEUE_SIZE,
+        stop_event: Optional[threading.Event] = None,
+        resume_event: Optional[threading.Event] = None,
+    ) -> None:
+        self._prepare = prepare
+        self._submit = submit
+        self._lookahead_s = max(0.0, lookahead_s)
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, max_queue))
+        self._stop = stop_event or threading.Event()
+        self._resume = resume_event
+        self.metrics = PipelineMetrics()
+        self._t0 = 0.0
+        self._producer_error: Optional[BaseException] = None
+
+    def _now(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def run(self, ops: Iterable[Any], with_pauses: bool) -> None:
+        """Esegue le operazioni rispettando i tempi registrati se with_pauses è True"""
+        self._t0 = time.perf_counter()
+        producer = threading.Thread(target=self._produce, args=(ops, with_pauses), name="PlaybackPrepare", daemon=True)
+        producer.start()
+        try:
+            self._consume()
+        finally:
+            self._stop_producer(producer)
+        if self._producer_error is not None:
+            raise self._producer_error
+        logger.debug("Metriche pipeline riproduzione: {}", self.metrics.snapshot())
+
+    def _produce(self, ops: Iterable[Any], with_pauses: bool) -> None:
+        due = 0.0
+        try:
+            for op in ops:
+                if self._stop.is_set():
+                    break
+                op_due: Optional[float] = None
+                if with_pauses:
+                    due += max(0, getattr(op, "time_delta_ms", 0) or 0) / 1000.0
+                    op_due = due
+                    # Le attese fisse spostano le scadenze delle operazioni successive
+                    due += max(0, getattr(op, "wait_ms", 0) or 0) / 1000.0
+                    # Non preparare oltre la finestra di anticipo
+                    wait = op_due - self._lookahead_s - self._now()
+                    if wait > 0 and self._stop.wait(wait):
+                        break
+                prepared = self._prepare(op, op_due)
+                self.metrics.prepared += 1
+                self._put(prepared)
+        except BaseException as exc:
+            self._producer_error = exc
+        finally:
+            self._put(_END)
+
+    def _put(self, item: Any) -> None:
+        if self._queue.full():
+            self.metrics.producer_stalls += 1
+        while True:
+            try:
+                self._queue.put(item, timeout=0.05)
+                break
+            except queue.Full:
+                if self._stop.is_set() and item is not _END:
+                    return
+        depth = self._queue.qsize()
+        self.metrics.queue_depth = depth
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, depth)
+
+    def _consume(self) -> None:
+        while not self._stop.is_set():
+            if self._queue.empty():
+                self.metrics.injector_stalls += 1
+            item = self._queue.get()
+            self.metrics.queue_depth = self._queue.qsize()
+            if item is _END:
+                return
+
+            if self._resume is not None and not self._resume.is_set():
+                paused_at = time.perf_counter()
+                self._resume.wait()
+                # Le scadenze successive slittano della durata della pausa
+                self._t0 += time.perf_counter() - paused_at
+            if self._stop.is_set():
+                return
+
+            if item.due is not None:
+                self._wait_until(item.due)
+                lateness_ms = (self._now() - item.due) * 1000.0
+                if lateness_ms > 1.0:
+                    self.metrics.late_ops += 1
+                    self.metrics.max_lateness_ms = max(self.metrics.max_lateness_ms, lateness_ms)
+
+            self._submit(item)
+            self.metrics.injected += 1
+
+    def _wait_until(self, due: float) -> None:
+        while True:
+            remaining = due - self._now()
+            if remaining <= 0 or self._stop.is_set():
+                return
+            if remaining > _SPIN_THRESHOLD_S:
+                time.sleep(remaining - _SPIN_THRESHOLD_S)
+
+    def _stop_producer(self, producer: threading.Thread) -> None:
+        if producer.is_alive():
+            # Svuota la coda per sbloccare il produttore se è in attesa di spazio
+            while producer.is_alive():
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    producer.join(timeout=0.05)
@@ -0,0 +1,307 @@
+"""
+Piano di riproduzione: passaggi di analisi eseguiti sugli eventi di una macro
+prima della riproduzione.
+
+I passaggi lavorano in streaming (iterabile in ingresso, generatore in uscita)
+e non modificano gli eventi originali della macro.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Set, Union
+
+from .display import DisplayTopology, remap_events
+from .models import Event, KeyEvent, MouseEvent
+
+
+@dataclass
+class TextRun:
+    """Sequenza di tasti carattere riprodotta come un'unica iniezione di testo"""
+    text: str
+    time_delta_ms: int
+    source: List[KeyEvent] = field(default_factory=list)
+
+
+PlanOp = Union[Event, TextRun]
+
+_MODIFIER_KEYWORDS = (
+    'shift', 'ctrl', 'control', 'alt', 'win', 'windows',
+    'cmd', 'command', 'maiusc', 'altgr', 'alt gr'
+)
+
+_NAMED_CHARS = {"space": " "}
+
+# Numero minimo di caratteri perché una sequenza diventi un TextRun
+MIN_TEXT_RUN_CHARS = 2
+
+# Frequenza massima (rispetto al tempo registrato) dei movimenti durante un trascinamento
+DRAG_RESAMPLE_HZ = 60
+
+# Azioni mouse che posizionano il cursore da sole prima di essere eseguite
+_SELF_POSITIONING_ACTIONS = ("click", "press", "release")
+
+
+def is_modifier_key(key: str) -> bool:
+    """Controlla se un tasto è un modificatore"""
+    key_lower = key.lower().strip()
+    return any(keyword in key_lower for keyword in _MODIFIER_KEYWORDS)
+
+
+def normalize_modifier_name(key: str) -> str:
+    """Normalizza i nomi dei modificatori per un tracciamento coerente"""
+    key_lower = key.lower().strip()
+    
+    if any(s in key_lower for s in ['shift', 'maiusc']):
+        if 'left' in key_lower:
+            return 'left shift'
+        elif 'right' in key_lower:
+            return 'right shift'
+        return 'shift'
+    
+    if any(c in key_lower for c in ['ctrl', 'control']):
+        if 'left' in key_lower:
+            return 'left ctrl'
+        elif 'right' in key_lower:
+            return 'right ctrl'
+        return 'ctrl'
+    
+    if 'alt' in key_lower:
+        if 'gr' in key_lower:
+            return 'alt gr'
+        elif 'left' in key_lower:
+            return 'left alt'
+        elif 'right' in key_lower:
+            return 'right alt'
+        return 'alt'
+    
+    if any(w in key_lower for w in ['win', 'windows', 'cmd']):
+        if 'left' in key_lower:
+            return 'left windows'
+        elif 'right' in key_lower:
+            return 'right windows'
+        return 'windows'
+    
+    return key
+
+
+def normalize_button_name(btn: Any | None) -> str:
+    """Normalizza il nome del pulsante del mouse"""
+    if btn is None:
+        return "left"
+    try:
+        n = int(str(btn))
+        if n == 1:
+            return "left"
+        if n == 2:
+            return "right"
+        if n == 3:
+            return "middle"
+    except Exception:
+        pass
+    s = str(btn).strip().lower()
+    if "left" in s or s in ("l",):
+        return "left"
+    if "right" in s or s in ("r",):
+        return "right"
+    if "middle" in s or "wheel" in s or s in ("m",):
+        return "middle"
+    return "left"
+
+
+def _is_shift_key(key: str) -> bool:
+    key_lower = key.lower().strip()
+    return "shift" in key_lower or "maiusc" in key_lower
+
+
+def _char_for_key(key: str) -> Optional[str]:
+    """Restituisce il carattere digitato da un tasto, None se non è un tasto carattere"""
+    if key in _NAMED_CHARS:
+        return _NAMED_CHARS[key]
+    if len(key) == 1 and key.isprintable():
+        return key
+    return None
+
+
+class _Lookahead:
+    """Iteratore con buffer di lettura anticipata"""
+
+    def __init__(self, items: Iterable[PlanOp]) -> None:
+        self._it = iter(items)
+        self._buffer: Deque[PlanOp] = deque()
+
+    def peek(self, offset: int = 0) -> Optional[PlanOp]:
+        while len(self._buffer) <= offset:
+            nxt = next(self._it, None)
+            if nxt is None:
+                return None
+            self._buffer.append(nxt)
+        return self._buffer[offset]
+
+    def pop(self) -> Optional[PlanOp]:
+        if self._buffer:
+            return self._buffer.popleft()
+        return next(self._it, None)
+
+
+class _KeyState:
+    """Stato dei modificatori e del Bloc Maiusc durante l'analisi"""
+
+    def __init__(self) -> None:
+        self.held: Set[str] = set()
+        self.caps = False
+
+    def apply(self, op: PlanOp) -> None:
+        if not isinstance(op, KeyEvent):
+            return
+        key = op.key.strip().lower()
+        if is_modifier_key(key):
+            if op.action == "press":
+                self.held.add(key)
+            else:
+                self.held.discard(key)
+        elif key == "caps lock" and op.action == "press":
+            self.caps = not self.caps
+
+    @property
+    def only_shift_held(self) -> bool:
+        return all(_is_shift_key(k) for k in self.held)
+
+
+def _scan_text_run(la: _Lookahead, state: _KeyState) -> tuple[int, str]:
+    """
+    Analizza gli eventi a partire dalla posizione corrente.
+
+    Returns:
+        (numero di eventi consumabili, testo corrispondente). La sequenza termina
+        sempre in un punto in cui lo stato di Shift è uguale a quello iniziale,
+        così la sostituzione con un'iniezione di testo non altera i modificatori.
+    """
+    start_shift = {k for k in state.held if _is_shift_key(k)}
+    shift = set(start_shift)
+    text: List[str] = []
+    i = 0
+    committed_events, committed_chars = 0, 0
+
+    while True:
+        ev = la.peek(i)
+        if not isinstance(ev, KeyEvent):
+            break
+        key = ev.key.strip().lower()
+        if _is_shift_key(key):
+            if ev.action == "press":
+                shift.add(key)
+            else:
+                shift.discard(key)
+            i += 1
+        else:
+            ch = _char_for_key(key)
+            nxt = la.peek(i + 1)
+            if (ch is None or ev.action != "press" or not isinstance(nxt, KeyEvent)
+                    or nxt.action != "release" or nxt.key.strip().lower() != key):
+                break
+            if ch.isalpha() and (bool(shift) != state.caps):
+                ch = ch.upper()
+            text.append(ch)
+            i += 2
+        if shift == start_shift:
+            committed_events, committed_chars = i, len(text)
+
+    return committed_events, "".join(text[:committed_chars])
+
+
+def detect_text_runs(events: Iterable[PlanOp], min_chars: int = MIN_TEXT_RUN_CHARS) -> Iterator[PlanOp]:
+    """
+    Raggruppa le sequenze di tasti carattere (press seguito dal release dello
+    stesso tasto) in operazioni TextRun.
+
+    Una sequenza si interrompe su qualunque evento mouse, su tasti non carattere
+    e quando è premuto un modificatore diverso da Shift: in questi casi gli
+    eventi originali vengono restituiti invariati.
+    """
+    la = _Lookahead(events)
+    state = _KeyState()
+
+    while True:
+        head = la.peek()
+        if head is None:
+            return
+
+        if isinstance(head, KeyEvent) and state.only_shift_held:
+            count, text = _scan_text_run(la, state)
+            if count and len(text) >= min_chars:
+                source = [la.pop() for _ in range(count)]
+                for ev in source:
+                    state.apply(ev)
+                yield TextRun(text=text, time_delta_ms=source[0].time_delta_ms, source=source)  # type: ignore[arg-type]
+                continue
+
+        op = la.pop()
+        state.apply(op)  # type: ignore[arg-type]
+        yield op  # type: ignore[misc]
+
+
+def decimate_moves(ops: Iterable[PlanOp], max_drag_rate_hz: int = DRAG_RESAMPLE_HZ) -> Iterator[PlanOp]:
+    """
+    Riduce i movimenti del mouse intermedi.
+
+    Fuori da un trascinamento ogni sequenza di movimenti viene ridotta al solo
+    punto finale, eliminato anche quello se l'evento successivo è un click,
+    press o release (che posizionano il cursore da soli). Mentre un pulsante è
+    premuto il percorso viene ricampionato a `max_drag_rate_hz` movimenti al
+    secondo di tempo registrato, mantenendo sempre l'ultimo punto.
+    """
+    interval_ms = 1000.0 / max(1, max_drag_rate_hz)
+    held_buttons: Set[str] = set()
+    pending: Optional[MouseEvent] = None
+    elapsed_ms = 0.0
+
+    for op in ops:
+        elapsed_ms += max(0, getattr(op, "time_delta_ms", 0) or 0)
+
+        if isinstance(op, MouseEvent) and op.action == "move":
+            if held_buttons and elapsed_ms >= interval_ms:
+                yield op
+                pending = None
+                elapsed_ms = 0.0
+            else:
+                pending = op
+            continue
+
+        if pending is not None:
+            if not (isinstance(op, MouseEvent) and op.action in _SELF_POSITIONING_ACTIONS):
+                yield pending
+            pending = None
+            elapsed_ms = 0.0
+
+        if isinstance(op, MouseEvent):
+            if op.action == "press":
+                held_buttons.add(str(op.button))
+                elapsed_ms = 0.0
+            elif op.action == "release":
+                held_buttons.discard(str(op.button))
+
+        yield op
+
+    if pending is not None:
+        yield pending
+
+
+def build_plan(
+    events: Iterable[Event],
+    with_pauses: bool,
+    display_layout: Optional[Dict[str, Any]] = None,
+    topology: Optional[DisplayTopology] = None,
+) -> Iterator[PlanOp]:
+    """
+    Costruisce il piano di riproduzione di una sequenza di eventi.
+    Le coordinate vengono rimappate sul layout dei display corrente; le
+    ottimizzazioni che alterano il timing vengono applicate solo quando le
+    pause originali non devono essere rispettate.
+    """
+    ops: Iterable[PlanOp] = remap_events(events, display_layout, topology)
+    if not with_pauses:
+        ops = decimate_moves(ops)
+        ops = detect_text_runs(ops)
+    return iter(ops)
@@ -2,13 +2,22 @@ from __future__ import annotations
 
 import threading
 import time
-from typing import Iterable, Set, Any, Dict
+from typing import Callable, Iterable, Optional, Set, Any, Dict
 
 from loguru import logger
 import keyboard  # type: ignore
 
-from .models import Event, KeyEvent, MouseEvent, Macro
-from .wininput import move_cursor_abs, mouse_down, mouse_up, mouse_click, mouse_wheel, get_cursor_pos
+from .bytecode import compile_program, run_program, run_stream
+from .eventfile import MappedEvents
+from .models import ControlEvent, Event, KeyEvent, MouseEvent, Macro
+from .pipeline import DEFAULT_LOOKAHEAD_S, DEFAULT_QUEUE_SIZE, PlaybackPipeline, PreparedOp
+from .plan import PlanOp, TextRun, build_plan, is_modifier_key, normalize_button_name, normalize_modifier_name
+from .wininput import move_cursor_abs, mouse_down, mouse_up, mouse_click, mouse_wheel, get_cursor_pos, send_unicode_text
+
+# Esito di Player.play
+PLAY_COMPLETED = "ok"
+PLAY_STOPPED = "stopped"
+PLAY_FAILED = "failed"
 
 try:
     import pydirectinput  # type: ignore
@@ -25,36 +34,12 @@ except Exception:
     _HAS_PYAUTOGUI = False
 
 try:
-    from .winmsg import post_click_at_screen  # type: ignore
+    from .winmsg import ClickTargetCache, post_click_at_screen  # type: ignore
     _HAS_WINMSG = True
 except Exception:
     _HAS_WINMSG = False
 
 
-def _normalize_button_name(btn: Any | None) -> str:
-    """Normalizza il nome del pulsante del mouse"""
-    if btn is None:
-        return "left"
-    try:
-        n = int(str(btn))
-        if n == 1:
-            return "left"
-        if n == 2:
-            return "right"
-        if n == 3:
-            return "middle"
-    except Exception:
-        pass
-    s = str(btn).strip().lower()
-    if "left" in s or s in ("l",):
-        return "left"
-    if "right" in s or s in ("r",):
-        return "right"
-    if "middle" in s or "wheel" in s or s in ("m",):
-        return "middle"
-    return "left"
-
-
 class Player:
     def __init__(self) -> None:
         self._stop_flag = threading.Event()
@@ -65,43 +50,158 @@ class Player:
         self._key_sequence_timing: Dict[str, float] = {}  # CORREZIONE PROBLEMA 2: Timing per tasti ripetuti
         self._mouse_button_states: Dict[str, bool] = {}
         self._forced_cleanup_enabled = True  # Controllo per cleanup forzato modificatori
+        # Macro con bilanciamento verificato staticamente: niente doppio rilascio di sicurezza
+        self._verified_balance = False
+        self._resume_flag = threading.Event()
+        self._resume_flag.set()
+        # Callback di avanzamento (eseguiti, totali), chiamato al massimo ogni _progress_interval secondi
+        self._progress_callback: Optional[Callable[[int, int], None]] = None
+        self._progress_interval = 0.1
+        self._last_progress_ts = 0.0
+        # Pipeline a due stadi (preparazione anticipata + iniezione)
+        self.use_pipeline = False
+        self.pipeline_lookahead_s = DEFAULT_LOOKAHEAD_S
+        self.pipeline_queue_size = DEFAULT_QUEUE_SIZE
+        self.pipeline_metrics: Dict[str, Any] = {}
+        # Cache condivisa delle sequenze con le chiamate a sottomacro espanse (compose.PlanCache)
+        self.plan_cache: Any = None
+        # Cache delle finestre destinazione dei click in background, condivisa tra le ripetizioni
+        self._click_targets: Any = None
+
+    def configure(self, playback_settings: Dict[str, Any]) -> None:
+        """Applica le impostazioni della sezione "playback" delle impostazioni"""
+        self.use_pipeline = bool(playback_settings.get("pipeline", self.use_pipeline))
+        lookahead_ms = playback_settings.get("pipeline_lookahead_ms")
+        if lookahead_ms is not None:
+            self.pipeline_lookahead_s = max(0.0, float(lookahead_ms) / 1000.0)
 
     def stop(self) -> None:
         """Ferma la riproduzione in corso"""
         self._stop_flag.set()
+        self._resume_flag.set()
+
+    def pause(self) -> None:
+        """Sospende la riproduzione prima del prossimo evento"""
+        self._resume_flag.clear()
+
+    def resume(self) -> None:
+        """Riprende una riproduzione sospesa"""
+        self._resume_flag.set()
+
+    @property
+    def is_paused(self) -> bool:
+        return not self._resume_flag.is_set()
 
-    def play(self, events: Iterable[Event], with_pauses: bool = True, repetitions: int = 1, macro: Macro | None = None) -> None:
+    def set_progress_callback(self, cb: Optional[Callable[[int, int], None]], interval: float = 0.1) -> None:
+        """Imposta il callback di avanzamento, limitato a una chiamata ogni `interval` secondi"""
+        self._progress_callback = cb
+        self._progress_interval = max(0.0, interval)
+
+    def _report_progress(self, done: int, total: int, force: bool = False) -> None:
+        cb = self._progress_callback
+        if cb is None:
+            return
+        now = time.monotonic()
+        if force or now - self._last_progress_ts >= self._progress_interval:
+            self._last_progress_ts = now
+            try:
+                cb(done, total)
+            except Exception as exc:
+                logger.debug(f"Errore callback avanzamento: {exc}")
+
+    def play(
+        self,
+        events: Iterable[Event],
+        with_pauses: bool = True,
+        repetitions: int = 1,
+        macro: Macro | None = None,
+        cleanup: bool = True,
+    ) -> str:
         """
         Riproduce una sequenza di eventi con correzioni per i problemi identificati
         
         CORREZIONE PROBLEMA 1: Gestione robusta dei modificatori
         CORREZIONE PROBLEMA 2: Timing ottimizzato per tasti ripetuti
+        
+        Con cleanup=False il cleanup completo dei modificatori a inizio e fine
+        viene omesso (lo esegue chi gestisce la sessione, es. la coda di
+        riproduzione con begin_session/end_session); vengono comunque
+        rilasciati i tasti e i pulsanti rimasti premuti dalla macro.
+
+        Returns:
+            PLAY_COMPLETED, PLAY_STOPPED (stop richiesto) o PLAY_FAILED
         """
-        self._stop_flag.clear()
+        if cleanup:
+            self._stop_flag.clear()
+        # Con cleanup=False lo stop resta valido fino al prossimo begin_session:
+        # uno stop arrivato tra due macro della serie non va perso
+        self._resume_flag.set()
         self._reset_all_states()
         
         preserve_cursor = bool(getattr(macro, "preserve_cursor", False))
+        self._verified_balance = bool(getattr(macro, "verified", False)) and events is getattr(macro, "events", None)
         original_pos = get_cursor_pos() if preserve_cursor else None
+        if not (preserve_cursor and _HAS_WINMSG):
+            self._click_targets = None
+        elif cleanup or self._click_targets is None:
+            self._click_targets = ClickTargetCache()
         
         try:
             # FASE PRELIMINARE: Cleanup completo modificatori
-            self._emergency_cleanup_modifiers()
+            if cleanup:
+                self._emergency_cleanup_modifiers()
+            
+            # Piano di riproduzione costruito una sola volta per tutte le ripetizioni
+            display_layout = getattr(macro, "display_layout", None)
+            # Registrazione mappata in memoria: gli eventi vengono letti man mano a ogni ripetizione
+            lazy = isinstance(events, MappedEvents)
+            source: Callable[[], Iterable[Event]] = lambda: events
+            if self.plan_cache is not None and macro is not None and events is macro.events:
+                # Sequenza espansa già rimappata sul layout corrente
+                if lazy:
+                    source = lambda: self.plan_cache.iter_expanded(macro)
+                else:
+                    expanded = self.plan_cache.expanded(macro)
+                    source = lambda: expanded
+                display_layout = None
+            if lazy:
+                program = None
+                total_ops = len(events) * max(1, int(repetitions))
+            else:
+                plan_ops = list(build_plan(source(), with_pauses, display_layout))
+                # Cicli e attese compilati: le iterazioni non vengono materializzate
+                program = compile_program(plan_ops)
+                total_ops = program.op_count * max(1, int(repetitions))
+            done_ops = 0
             
             for rep in range(max(1, int(repetitions))):
                 logger.info("Inizio ripetizione {} di {}", rep + 1, repetitions)
                 
                 # CORREZIONE: Pulizia completa tra ripetizioni
                 if rep > 0:
-                    self._complete_state_reset()
+                    # Senza cleanup il rilascio di emergenza dei modificatori spetta alla sessione
+                    self._complete_state_reset(emergency=cleanup)
                     time.sleep(0.05)  # Pausa più lunga per stabilità
                 
                 # CORREZIONE PROBLEMA 2: Preprocessing per ottimizzare timing tasti ripetuti
-                events_list = list(events)
-                self._optimize_repeated_key_timing(events_list, with_pauses)
+                self._optimize_repeated_key_timing(program.ops if program is not None else [], with_pauses)
                 
-                for ev in events_list:
+                if program is not None:
+                    rep_ops = run_program(program)
+                else:
+                    rep_ops = run_stream(build_plan(source(), with_pauses, display_layout))
+                
+                if self.use_pipeline:
+                    done_ops = self._play_with_pipeline(rep_ops, with_pauses, preserve_cursor, done_ops, total_ops)
                     if self._stop_flag.is_set():
-                        return
+                        return PLAY_STOPPED
+                    continue
+                
+                for ev in rep_ops:
+                    if not self._resume_flag.is_set():
+                        self._resume_flag.wait()
+                    if self._stop_flag.is_set():
+                        return PLAY_STOPPED
                     
                     # CORREZIONE PROBLEMA 2: Gestione intelligente timing
                     if with_pauses and getattr(ev, "time_delta_ms", 0) > 0:
@@ -111,15 +211,57 @@ class Player:
                         self._apply_intelligent_delay(ev)
                     
                     self._play_event(ev, preserve_cursor)
+                    done_ops += 1
+                    self._report_progress(done_ops, total_ops)
+            
+            # Per le registrazioni mappate il totale era una stima
+            self._report_progress(done_ops, total_ops if program is not None else done_ops, force=True)
+            return PLAY_COMPLETED
                     
         except Exception as exc:
             logger.exception("Errore durante la riproduzione della macro: {}", exc)
+            return PLAY_FAILED
         finally:
             # FASE FINALE: Cleanup garantito
-            self._guaranteed_cleanup()
+            if cleanup:
+                self._guaranteed_cleanup()
+            else:
+                self._complete_state_reset(emergency=False)
             if preserve_cursor and original_pos is not None:
                 move_cursor_abs(original_pos[0], original_pos[1])
 
+    def _play_with_pipeline(self, ops: Iterable[PlanOp], with_pauses: bool, preserve_cursor: bool, done_ops: int, total_ops: int) -> int:
+        """Riproduce una ripetizione tramite la pipeline preparazione/iniezione"""
+        counter = {"done": done_ops}
+
+        def prepare(op: PlanOp, due: float | None) -> PreparedOp:
+            # La finestra destinazione dei click in background viene cercata in submit:
+            # un click precedente ancora in coda può aprire o spostare finestre
+            return PreparedOp(op=op, due=due)
+
+        def submit(prepared: PreparedOp) -> None:
+            if isinstance(prepared.op, ControlEvent) and prepared.due is not None:
+                return  # Attesa già inclusa nelle scadenze della pipeline
+            if not with_pauses:
+                self._apply_intelligent_delay(prepared.op)
+            self._play_event(prepared.op, preserve_cursor)
+            counter["done"] += 1
+            self._report_progress(counter["done"], total_ops)
+
+        pipeline = PlaybackPipeline(
+            prepare,
+            submit,
+            lookahead_s=self.pipeline_lookahead_s,
+            max_queue=self.pipeline_queue_size,
+            stop_event=self._stop_flag,
+            resume_event=self._resume_flag,
+        )
+        try:
+            pipeline.run(ops, with_pauses)
+        finally:
+            self.pipeline_metrics = pipeline.metrics.snapshot()
+        return counter["done"]
+
     def _reset_all_states(self) -> None:
         """Reset completo di tutti gli stati interni"""
         self._pressed_keys.clear()
@@ -172,7 +314,7 @@ class Player:
                 if current_key == next_key:
                     self._key_sequence_timing[f"{current_key}_{i}"] = time.time()
 
-    def _apply_intelligent_delay(self, ev: Event) -> None:
+    def _apply_intelligent_delay(self, ev: PlanOp) -> None:
         """
         CORREZIONE PROBLEMA 2: Applica ritardi intelligenti per evitare perdita tasti
         """
@@ -198,62 +340,46 @@ class Player:
             
             # Aggiorna timing
             self._key_sequence_timing[key] = current_time
+        elif isinstance(ev, TextRun):
+            time.sleep(0.003)
         else:
             # Ritardo standard per eventi mouse
             time.sleep(0.005)
 
     def _is_modifier_key(self, key: str) -> bool:
         """Controlla se un tasto è un modificatore"""
-        key_lower = key.lower().strip()
-        modifier_keywords = [
-            'shift', 'ctrl', 'control', 'alt', 'win', 'windows', 
-            'cmd', 'command', 'maiusc', 'altgr', 'alt gr'
-        ]
-        return any(keyword in key_lower for keyword in modifier_keywords)
+        return is_modifier_key(key)
 
     def _normalize_modifier_name(self, key: str) -> str:
         """Normalizza nomi modificatori per tracciamento coerente"""
-        key_lower = key.lower().strip()
-        
-        # Mappatura completa normalizzazione
-        if any(s in key_lower for s in ['shift', 'maiusc']):
-            if 'left' in key_lower:
-                return 'left shift'
-            elif 'right' in key_lower:
-                return 'right shift'
-            return 'shift'
-        
-        if any(c in key_lower for c in ['ctrl', 'control']):
-            if 'left' in key_lower:
-                return 'left ctrl'
-            elif 'right' in key_lower:
-                return 'right ctrl'
-            return 'ctrl'
-        
-        if 'alt' in key_lower:
-            if 'gr' in key_lower:
-                return 'alt gr'
-            elif 'left' in key_lower:
-                return 'left alt'
-            elif 'right' in key_lower:
-                return 'right alt'
-            return 'alt'
-        
-        if any(w in key_lower for w in ['win', 'windows', 'cmd']):
-            if 'left' in key_lower:
-                return 'left windows'
-            elif 'right' in key_lower:
-                return 'right windows'
-            return 'windows'
-        
-        return key
+        return normalize_modifier_name(key)
 
-    def _play_event(self, ev: Event, preserve_cursor: bool) -> None:
+    def _play_event(self, ev: PlanOp, preserve_cursor: bool) -> None:
         """Riproduce un singolo evento"""
         if isinstance(ev, KeyEvent):
             self._play_key_event(ev)
         elif isinstance(ev, MouseEvent):
             self._play_mouse_event(ev, preserve_cursor)
+        elif isinstance(ev, TextRun):
+            self._play_text_run(ev)
+        elif isinstance(ev, ControlEvent) and ev.action == "wait":
+            # Attesa fissa interrompibile
+            self._stop_flag.wait(max(0, ev.wait_ms) / 1000.0)
+
+    def _play_text_run(self, op: TextRun) -> None:
+        """Digita una sequenza di caratteri con una sola iniezione unicode"""
+        sent = 0
+        try:
+            sent = send_unicode_text(op.text)
+        except Exception as exc:
+            logger.debug(f"Errore iniezione testo unicode: {exc}")
+        
+        if sent < len(op.text):
+            # Fallback: digitazione tramite libreria keyboard del testo rimanente
+            try:
+                keyboard.write(op.text[sent:])
+            except Exception as exc:
+                logger.debug(f"Errore digitazione testo: {exc}")
 
     def _play_key_event(self, ev: KeyEvent) -> None:
         """
@@ -287,6 +413,9 @@ class Player:
                         if self._modifier_balance[key] == 0:
                             self._active_modifiers.discard(key)
                     
+                    if self._verified_balance:
+                        return
+                    
                     # CORREZIONE: Rilascio di sicurezza per modificatori
                     time.sleep(0.003)
                     try:
@@ -307,7 +436,7 @@ class Player:
             return
         
         if ev.action == "press":
-            btn = _normalize_button_name(ev.button)
+            btn = normalize_button_name(ev.button)
             if not preserve_cursor:
                 move_cursor_abs(ev.x, ev.y)
                 time.sleep(0.015)
@@ -321,7 +450,7 @@ class Player:
             return
         
         if ev.action == "release":
-            btn = _normalize_button_name(ev.button)
+            btn = normalize_button_name(ev.button)
             if not preserve_cursor:
                 move_cursor_abs(ev.x, ev.y)
                 time.sleep(0.015)
@@ -335,11 +464,12 @@ class Player:
             return
         
         if ev.action == "click":
-            btn = _normalize_button_name(ev.button)
+            btn = normalize_button_name(ev.button)
             
             if preserve_cursor and _HAS_WINMSG:
                 try:
-                    if post_click_at_screen(ev.x, ev.y, btn):
+                    # Destinazione cercata al momento dell'invio (cache con verifica della finestra)
+                    if post_click_at_screen(ev.x, ev.y, btn, self._click_targets):
                         return
                 except Exception:
                     pass
@@ -367,9 +497,10 @@ class Player:
             move_cursor_abs(x, y)
             time.sleep(0.003)
 
-    def _complete_state_reset(self) -> None:
+    def _complete_state_reset(self, emergency: bool = True) -> None:
         """
         CORREZIONE PROBLEMA 1: Reset completo dello stato con cleanup forzato
+        Con emergency=False vengono rilasciati solo i tasti e pulsanti tracciati
         """
         # Rilascio tutti i tasti tracciati
         for key in list(self._pressed_keys):
@@ -400,9 +531,20 @@ class Player:
         self._reset_all_states()
         
         # Cleanup di emergenza finale
-        if self._forced_cleanup_enabled:
+        if emergency and self._forced_cleanup_enabled:
             self._emergency_cleanup_modifiers()
 
+    def begin_session(self) -> None:
+        """Cleanup iniziale per una serie di riproduzioni con cleanup=False"""
+        self._stop_flag.clear()
+        self._reset_all_states()
+        self._click_targets = None
+        self._emergency_cleanup_modifiers()
+
+    def end_session(self) -> None:
+        """Cleanup finale per una serie di riproduzioni con cleanup=False"""
+        self._guaranteed_cleanup()
+
     def _guaranteed_cleanup(self) -> None:
         """Cleanup garantito alla fine della riproduzione"""
         logger.debug("Esecuzione cleanup garantito finale")
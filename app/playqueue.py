@@ -0,0 +1,220 @@
+"""
+Coda di riproduzione: esegue più macro in sequenza su un unico thread di
+lunga durata, con il cleanup completo dei modificatori solo all'inizio e
+alla fine di ogni serie.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Optional
+
+from loguru import logger
+
+from .models import Macro
+from .player import PLAY_FAILED, PLAY_STOPPED, Player
+
+
+@dataclass
+class QueuedPlayback:
+    macro: Macro
+    with_pauses: bool
+    repetitions: int
+    # Esito di Player.play, impostato al termine
+    result: Optional[str] = None
+
+
+class PlaybackQueue:
+    """
+    Coda di macro da riprodurre.
+
+    I callback vengono invocati dal thread della coda:
+        on_item_started(item), on_item_finished(item, ok), on_drained()
+
+    play_now() esegue subito una singola macro (prima degli elementi in coda,
+    che restano in attesa di start()). Dopo stop() nessun elemento viene più
+    avviato fino alla fine della serie in corso.
+    """
+
+    def __init__(
+        self,
+        player: Player,
+        on_item_started: Optional[Callable[[QueuedPlayback], None]] = None,
+        on_item_finished: Optional[Callable[[QueuedPlayback, bool], None]] = None,
+        on_drained: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self._player = player
+        self.on_item_started = on_item_started
+        self.on_item_finished = on_item_finished
+        self.on_drained = on_drained
+        self._items: Deque[QueuedPlayback] = deque()
+        # Macro da eseguire subito, indipendentemente da start()
+        self._immediate: Deque[QueuedPlayback] = deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._busy = False
+        self._closed = False
+        # Stop richiesto durante la serie in corso
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+    @property
+    def is_busy(self) -> bool:
+        """True mentre una serie è in esecuzione"""
+        with self._cond:
+            return self._busy
+
+    def enqueue(
+        self,
+        macro: Macro,
+        with_pauses: Optional[bool] = None,
+        repetitions: Optional[int] = None,
+    ) -> QueuedPlayback:
+        """Accoda una macro; le opzioni non specificate sono prese dalla macro"""
+        item = self._make_item(macro, with_pauses, repetitions)
+        with self._cond:
+            self._items.append(item)
+            self._cond.notify_all()
+        return item
+
+    def play_now(
+        self,
+        macro: Macro,
+        with_pauses: Optional[bool] = None,
+        repetitions: Optional[int] = None,
+    ) -> QueuedPlayback:
+        """Esegue la macro appena possibile, senza avviare gli elementi in coda"""
+        item = self._make_item(macro, with_pauses, repetitions)
+        with self._cond:
+            self._ensure_thread()
+            self._immediate.append(item)
+            self._cond.notify_all()
+        return item
+
+    @staticmethod
+    def _make_item(macro: Macro, with_pauses: Optional[bool], repetitions: Optional[int]) -> QueuedPlayback:
+        return QueuedPlayback(
+            macro=macro,
+            with_pauses=macro.with_pauses if with_pauses is None else bool(with_pauses),
+            repetitions=macro.repetitions if repetitions is None else max(1, int(repetitions)),
+        )
+
+    def start(self) -> None:
+        """Avvia l'esecuzione degli elementi in coda"""
+        with self._cond:
+            self._ensure_thread()
+            self._running = True
+            self._cond.notify_all()
+
+    def clear(self) -> None:
+        """Rimuove gli elementi non ancora avviati"""
+        with self._cond:
+            self._items.clear()
+
+    def stop(self) -> None:
+        """Svuota la coda e interrompe la macro in corso"""
+        with self._cond:
+            self._items.clear()
+            self._immediate.clear()
+            if self._busy:
+                self._stopping = True
+        self._player.stop()
+
+    def close(self) -> None:
+        self.stop()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="PlaybackQueue", daemon=True)
+            self._thread.start()
+
+    def _next_item(self, block: bool) -> Optional[QueuedPlayback]:
+        with self._cond:
+            while block and not self._closed and not (self._immediate or (self._running and self._items)):
+                self._cond.wait()
+            if self._closed or self._stopping:
+                return None
+            if self._immediate:
+                item = self._immediate.popleft()
+            elif self._running and self._items:
+                item = self._items.popleft()
+            else:
+                return None
+            # Impostato con l'elemento estratto: uno stop da qui in poi ferma la serie
+            self._busy = True
+            return item
+
+    def _run(self) -> None:
+        while True:
+            item = self._next_item(block=True)
+            if item is None:
+                if self._closed:
+                    return
+                continue
+
+            try:
+                self._player.begin_session()
+            except Exception as exc:
+                logger.debug(f"Errore cleanup iniziale coda: {exc}")
+
+            while item is not None:
+                self._play_item(item)
+                item = self._next_item(block=False)
+
+            try:
+                self._player.end_session()
+            except Exception as exc:
+                logger.debug(f"Errore cleanup finale coda: {exc}")
+
+            with self._cond:
+                self._busy = False
+                self._running = False
+                self._stopping = False
+            if self.on_drained:
+                try:
+                    self.on_drained()
+                except Exception as exc:
+                    logger.debug(f"Errore callback coda: {exc}")
+
+    def _play_item(self, item: QueuedPlayback) -> None:
+        with self._cond:
+            stopping = self._stopping
+        if stopping:
+            # Stop arrivato prima dell'avvio (begin_session azzera lo stop del player)
+            item.result = PLAY_STOPPED
+            self._item_finished(item)
+            return
+        if self.on_item_started:
+            try:
+                self.on_item_started(item)
+            except Exception as exc:
+                logger.debug(f"Errore callback coda: {exc}")
+        try:
+            item.result = self._player.play(
+                item.macro.events,
+                with_pauses=item.with_pauses,
+                repetitions=item.repetitions,
+                macro=item.macro,
+                cleanup=False,
+            )
+        except Exception as exc:
+            item.result = PLAY_FAILED
+            logger.exception("Playback failed: {}", exc)
+        self._item_finished(item)
+
+    def _item_finished(self, item: QueuedPlayback) -> None:
+        if self.on_item_finished:
+            try:
+                self.on_item_finished(item, item.result != PLAY_FAILED)
+            except Exception as exc:
+                logger.debug(f"Errore callback coda: {exc}")
@@ -8,6 +8,7 @@ from loguru import logger
 import keyboard  # type: ignore
 import mouse  # type: ignore
 
+from .display import current_topology
 from .models import KeyEvent, MouseEvent, Event
 
 
@@ -51,6 +52,8 @@ class Recorder:
         self._click_threshold_ms = 25    # Soglia ridotta per click più responsivi
         self._drag_threshold_pixels = 6   # Soglia ottimizzata per drag detection
         self._drag_threshold_time_ms = 120  # Tempo ottimizzato per drag
+        # Layout dei display al momento della registrazione
+        self.display_layout: Optional[dict] = None
 
     def set_on_stop_requested(self, cb: Optional[Callable[[], None]]) -> None:
         """Imposta il callback per la richiesta di stop"""
@@ -83,6 +86,9 @@ class Recorder:
         # CORREZIONE PROBLEMA 2: Reset storia tasti
         self._key_press_history.clear()
         
+        topology = current_topology()
+        self.display_layout = topology.to_dict() if topology else None
+        
         # Hook tastiera con configurazioni ottimizzate
         self._hk_press = keyboard.on_press(self._on_key_press, suppress=False)
         self._hk_release = keyboard.on_release(self._on_key_release, suppress=False)
@@ -0,0 +1,312 @@
+"""
+Decodifica validata di macro ed eventi dal formato JSON (Macro.to_dict).
+
+Per ogni classe di evento lo schema è precompilato dai campi del dataclass
+(nome, tipo, valori ammessi, default). Il percorso veloce controlla in un
+solo passaggio l'insieme delle chiavi e i tipi dei valori e costruisce
+l'evento con argomenti posizionali; solo se fallisce l'evento passa dal
+percorso lento, che applica le migrazioni dei formati precedenti e
+individua il campo non valido. Il dizionario di ingresso non viene mai
+modificato.
+
+Versioni dello schema (campo "schema" del file o del record):
+    1  formato senza versione: "__class__" o "type" possono mancare,
+       valori numerici anche come float interi o stringhe
+    2  formato corrente
+"""
+
+from __future__ import annotations
+
+import gc
+import typing
+from dataclasses import MISSING, dataclass, fields
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from .models import CallEvent, ControlEvent, Event, KeyEvent, Macro, MouseEvent
+
+SCHEMA_VERSION = 2
+
+# Liste di eventi oltre le quali la decodifica sospende il garbage collector
+GC_PAUSE_EVENTS = 10_000
+
+_EVENT_CLASSES = (KeyEvent, MouseEvent, CallEvent, ControlEvent)
+_TYPE_TO_CLASS = {"key": "KeyEvent", "mouse": "MouseEvent", "call": "CallEvent", "control": "ControlEvent"}
+
+_NO_DEFAULT = object()
+
+
+class SchemaError(ValueError):
+    """Struttura non valida; il messaggio indica macro, evento e campo"""
+
+    def __init__(self, message: str, macro_id: Optional[str] = None, index: Optional[int] = None, field_name: Optional[str] = None) -> None:
+        self.macro_id = macro_id
+        self.index = index
+        self.field_name = field_name
+        where = []
+        if macro_id is not None:
+            where.append(f"macro {macro_id!r}")
+        if index is not None:
+            where.append(f"evento {index}")
+        if field_name is not None:
+            where.append(f"campo {field_name!r}")
+        super().__init__(f"{', '.join(where)}: {message}" if where else message)
+
+
+@dataclass(frozen=True)
+class _FieldSpec:
+    name: str
+    kind: type  # int, str
+    optional: bool
+    choices: Optional[FrozenSet[str]]
+    default: Any
+
+
+@dataclass(frozen=True)
+class _ClassSpec:
+    cls: type
+    type_name: str
+    fields: Tuple[_FieldSpec, ...]
+    names: Tuple[str, ...]
+    # Chiavi attese nel dizionario (campi più "__class__")
+    keys: FrozenSet[str]
+    required: FrozenSet[str]
+    fast: Callable[[Dict[str, Any]], Optional[Event]]
+
+
+def _field_spec(f, hints: Dict[str, Any]) -> _FieldSpec:
+    hint = hints[f.name]
+    optional = False
+    choices = None
+    args = typing.get_args(hint)
+    if typing.get_origin(hint) is typing.Union and type(None) in args:
+        optional = True
+        hint = next(a for a in args if a is not type(None))
+    if typing.get_origin(hint) is typing.Literal:
+        choices = frozenset(typing.get_args(hint))
+        kind = str
+    else:
+        kind = hint
+    default = f.default if f.default is not MISSING else _NO_DEFAULT
+    return _FieldSpec(f.name, kind, optional, choices, default)
+
+
+def _compile_fast(spec_fields: Tuple[_FieldSpec, ...], cls: type, keys: FrozenSet[str], type_name: str) -> Callable[[Dict[str, Any]], Optional[Event]]:
+    """
+    Genera la funzione del percorso veloce: restituisce None se il dizionario
+    non ha esattamente le chiavi attese o un valore non ha il tipo atteso.
+    """
+    checks = []
+    args = []
+    env: Dict[str, Any] = {"cls": cls, "keys": keys, "int": int, "str": str}
+    for i, f in enumerate(spec_fields):
+        var = f"v{i}"
+        args.append(var)
+        cond = f"{var}.__class__ is {f.kind.__name__}"
+        if f.name == "type":
+            cond = f"{var} == {type_name!r}"
+        elif f.choices is not None:
+            env[f"c{i}"] = f.choices
+            cond = f"{cond} and {var} in c{i}"
+        if f.optional:
+            cond = f"({var} is None or {cond})"
+        checks.append(f"    {var} = e[{f.name!r}]\n    if not ({cond}): return None\n")
+    src = (
+        "def fast(e):\n"
+        "    if e.keys() != keys: return None\n"
+        + "".join(checks)
+        + f"    return cls({', '.join(args)})\n"
+    )
+    exec(src, env)
+    return env["fast"]
+
+
+def _compile_specs() -> Dict[str, _ClassSpec]:
+    specs: Dict[str, _ClassSpec] = {}
+    for cls in _EVENT_CLASSES:
+        hints = typing.get_type_hints(cls)
+        spec_fields = tuple(_field_spec(f, hints) for f in fields(cls))
+        type_name = next(t for t, name in _TYPE_TO_CLASS.items() if name == cls.__name__)
+        keys = frozenset(f.name for f in spec_fields) | {"__class__"}
+        specs[cls.__name__] = _ClassSpec(
+            cls=cls,
+            type_name=type_name,
+            fields=spec_fields,
+            names=tuple(f.name for f in spec_fields),
+            keys=keys,
+            required=frozenset(f.name for f in spec_fields if f.default is _NO_DEFAULT and f.name != "type"),
+            fast=_compile_fast(spec_fields, cls, keys, type_name),
+        )
+    return specs
+
+
+_SPECS = _compile_specs()
+# Percorsi veloci per nome di classe
+_FAST = {name: spec.fast for name, spec in _SPECS.items()}
+
+
+# --- migrazioni --------------------------------------------------------------
+
+def _migrate_event_v1(e: Dict[str, Any]) -> Dict[str, Any]:
+    """Formato senza versione: classe o tipo impliciti"""
+    if "__class__" in e and "type" in e:
+        return e
+    e = dict(e)
+    if "__class__" not in e and e.get("type") in _TYPE_TO_CLASS:
+        e["__class__"] = _TYPE_TO_CLASS[e["type"]]
+    spec = _SPECS.get(e.get("__class__"))
+    if spec is not None and "type" not in e:
+        e["type"] = spec.type_name
+    return e
+
+
+# versione di origine -> migrazione verso la versione successiva
+_EVENT_MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    1: _migrate_event_v1,
+}
+
+
+def _coerce(spec: _FieldSpec, value: Any, lenient: bool) -> Any:
+    """Valore convertito al tipo del campo; solleva ValueError con il motivo"""
+    if value is None:
+        if spec.optional:
+            return None
+        raise ValueError("valore mancante (null)")
+    if spec.kind is int:
+        if value.__class__ is int:
+            return value
+        if lenient:
+            if isinstance(value, float) and value.is_integer():
+                return int(value)
+            if isinstance(value, str):
+                try:
+                    return int(value)
+                except ValueError:
+                    pass
+        raise ValueError(f"atteso intero, trovato {type(value).__name__} {value!r}")
+    if value.__class__ is not str:
+        raise ValueError(f"attesa stringa, trovato {type(value).__name__} {value!r}")
+    if spec.choices is not None and value not in spec.choices:
+        raise ValueError(f"valore {value!r} non ammesso (ammessi: {', '.join(sorted(spec.choices))})")
+    return value
+
+
+def _decode_event_slow(e: Any, version: int, macro_id: Optional[str], index: Optional[int]) -> Event:
+    if not isinstance(e, dict):
+        raise SchemaError(f"atteso oggetto, trovato {type(e).__name__}", macro_id, index)
+    for v in range(version, SCHEMA_VERSION):
+        migrate = _EVENT_MIGRATIONS.get(v)
+        if migrate is not None:
+            e = migrate(e)
+    cls_name = e.get("__class__")
+    spec = _SPECS.get(cls_name)  # type: ignore[arg-type]
+    if spec is None:
+        raise SchemaError(f"classe di evento sconosciuta {cls_name!r}", macro_id, index, "__class__")
+    unknown = e.keys() - spec.keys
+    if unknown:
+        raise SchemaError(f"chiavi non previste: {', '.join(sorted(map(str, unknown)))}", macro_id, index)
+    missing = spec.required - e.keys()
+    if missing:
+        raise SchemaError(f"campi obbligatori mancanti: {', '.join(sorted(missing))}", macro_id, index)
+    if e.get("type", spec.type_name) != spec.type_name:
+        raise SchemaError(f"tipo {e['type']!r} non coerente con {cls_name}", macro_id, index, "type")
+    lenient = version < SCHEMA_VERSION
+    values = []
+    for f in spec.fields:
+        if f.name == "type":
+            values.append(spec.type_name)
+            continue
+        value = e.get(f.name, f.default)
+        try:
+            values.append(_coerce(f, value, lenient))
+        except ValueError as exc:
+            raise SchemaError(str(exc), macro_id, index, f.name) from None
+    return spec.cls(*values)
+
+
+def decode_event(e: Any, version: int = SCHEMA_VERSION, macro_id: Optional[str] = None, index: Optional[int] = None) -> Event:
+    """Evento dal dizionario di Macro.to_dict, senza modificarlo; solleva SchemaError"""
+    try:
+        ev = _FAST[e["__class__"]](e)
+    except (KeyError, TypeError):
+        ev = None
+    if ev is not None:
+        return ev
+    return _decode_event_slow(e, version, macro_id, index)
+
+
+def decode_events(raw: Any, version: int = SCHEMA_VERSION, macro_id: Optional[str] = None) -> List[Event]:
+    if not isinstance(raw, list):
+        raise SchemaError(f"attesa lista di eventi, trovato {type(raw).__name__}", macro_id, field_name="events")
+    fast = _FAST
+    out: List[Event] = []
+    append = out.append
+    # Il garbage collector scansionerebbe più volte tutti gli eventi appena creati
+    paused = len(raw) >= GC_PAUSE_EVENTS and gc.isenabled()
+    if paused:
+        gc.disable()
+    try:
+        for i, e in enumerate(raw):
+            try:
+                ev = fast[e["__class__"]](e)
+            except (KeyError, TypeError):
+                ev = None
+            append(ev if ev is not None else _decode_event_slow(e, version, macro_id, i))
+    finally:
+        if paused:
+            gc.enable()
+    return out
+
+
+# Campi di Macro (esclusi id ed eventi): (nome, tipo, default)
+_MACRO_FIELDS: Tuple[Tuple[str, type, Any], ...] = (
+    ("with_pauses", bool, True),
+    ("repetitions", int, 1),
+    ("favorite", bool, False),
+    ("preserve_cursor", bool, False),
+    ("verified", bool, False),
+)
+
+
+def schema_version(d: Dict[str, Any], default: int = 1) -> int:
+    """Versione dello schema di un file o record; i file senza versione sono v1"""
+    version = d.get("schema", default)
+    if version.__class__ is not int or version < 1:
+        raise SchemaError(f"versione dello schema non valida: {version!r}", field_name="schema")
+    if version > SCHEMA_VERSION:
+        raise SchemaError(f"schema {version} più recente di quello supportato ({SCHEMA_VERSION})", field_name="schema")
+    return version
+
+
+def decode_macro(d: Any, version: Optional[int] = None, with_events: bool = True) -> Macro:
+    """
+    Macro dal dizionario di Macro.to_dict, senza modificarlo; solleva SchemaError.
+    `version` è la versione del file contenitore se il record non ne indica una.
+    Le chiavi non riconosciute del record (es. riferimenti dello storage) sono ignorate.
+    """
+    if not isinstance(d, dict):
+        raise SchemaError(f"atteso oggetto, trovato {type(d).__name__}")
+    version = schema_version(d, version or 1)
+    macro_id = d.get("id")
+    if not isinstance(macro_id, str) or not macro_id:
+        raise SchemaError("id mancante o non valido", field_name="id")
+    title = d.get("title", macro_id)
+    if not isinstance(title, str):
+        raise SchemaError(f"attesa stringa, trovato {type(title).__name__}", macro_id, field_name="title")
+    values: Dict[str, Any] = {}
+    for name, kind, default in _MACRO_FIELDS:
+        value = d.get(name, default)
+        if value is None:
+            value = default
+        try:
+            values[name] = int(value) if kind is int else bool(value)
+        except (TypeError, ValueError):
+            raise SchemaError(f"valore non valido {value!r}", macro_id, field_name=name) from None
+    layout = d.get("display_layout")
+    if layout is not None and not isinstance(layout, dict):
+        raise SchemaError("atteso oggetto o null", macro_id, field_name="display_layout")
+    tags = d.get("tags") or []
+    if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+        raise SchemaError("attesa lista di stringhe", macro_id, field_name="tags")
+    events = decode_events(d.get("events", []), version, macro_id) if with_events else []
+    return Macro(id=macro_id, title=title, events=events, display_layout=layout, tags=list(tags), **values)
+
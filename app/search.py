@@ -0,0 +1,187 @@
+"""
+Indice di ricerca in memoria su titoli e tag delle macro.
+
+Ogni macro è indicizzata per trigrammi del testo normalizzato (titolo e tag
+in minuscolo) e per prefissi di una o due lettere delle parole. Una query
+viene divisa in termini, tutti richiesti:
+
+    termine di 3+ caratteri  intersezione dei trigrammi, poi verifica della
+                             sottostringa solo sui candidati
+    termine di 1-2 caratteri parole che iniziano con il termine
+    #tag                     macro con il tag (anche solo iniziale del tag)
+
+L'indice viene aggiornato per singola macro (aggiunta, rinomina, modifica
+dei tag, eliminazione) senza riesaminare la libreria. I risultati dei
+termini restano in cache finché l'indice non cambia, così mentre si digita
+ogni tasto filtra solo i risultati del tasto precedente.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from .models import Macro
+
+_WORD = re.compile(r"\w+")
+
+# Lunghezza massima dei prefissi indicizzati per i termini corti
+_PREFIX_LEN = 2
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _prefixes(text: str) -> Set[str]:
+    out: Set[str] = set()
+    for word in _WORD.findall(text):
+        for n in range(1, min(_PREFIX_LEN, len(word)) + 1):
+            out.add(word[:n])
+    return out
+
+
+def _tag_keys(tags: Iterable[str]) -> Set[str]:
+    return {normalize(t) for t in tags if t and t.strip()}
+
+
+class SearchIndex:
+    """
+    La costruzione iniziale è rinviata a ensure_built (chiamata dalla prima
+    query o da un thread in background); fino ad allora aggiunte e rimozioni
+    aggiornano solo l'elenco delle macro da indicizzare.
+    """
+
+    def __init__(self, macros: Iterable[Macro] = ()) -> None:
+        self._lock = threading.RLock()
+        # id -> (testo normalizzato, trigrammi, prefissi, tag)
+        self._docs: Dict[str, Tuple[str, FrozenSet[str], FrozenSet[str], FrozenSet[str]]] = {}
+        # id -> testo normalizzato (verifica delle sottostringhe)
+        self._texts: Dict[str, str] = {}
+        self._trigrams: Dict[str, Set[str]] = defaultdict(set)
+        self._prefixes: Dict[str, Set[str]] = defaultdict(set)
+        self._tags: Dict[str, Set[str]] = defaultdict(set)
+        # Macro non ancora indicizzate (id -> macro), None dopo la costruzione
+        self._pending: Optional[Dict[str, Macro]] = {m.id: m for m in macros}
+        # Risultati dei singoli termini per la versione corrente dell'indice:
+        # mentre si digita, "fatt" filtra i risultati di "fat"
+        self._term_cache: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._docs) + len(self._pending or ())
+
+    def ensure_built(self) -> None:
+        with self._lock:
+            if self._pending is None:
+                return
+            pending, self._pending = self._pending, None
+            for m in pending.values():
+                self._index(m)
+
+    def add(self, macro: Macro) -> None:
+        """Indicizza la macro (o la reindicizza se già presente)"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending[macro.id] = macro
+                return
+            self._index(macro)
+
+    update = add
+
+    def remove(self, macro_id: str) -> None:
+        with self._lock:
+            if self._pending is not None:
+                self._pending.pop(macro_id, None)
+                return
+            self._unindex(macro_id)
+
+    def _index(self, macro: Macro) -> None:
+        tags = frozenset(_tag_keys(macro.tags))
+        text = normalize(" ".join([macro.title, *sorted(tags)]))
+        doc = self._docs.get(macro.id)
+        if doc is not None:
+            if doc[0] == text and doc[3] == tags:
+                return
+            self._unindex(macro.id)
+        self._term_cache.clear()
+        mid = macro.id
+        grams = frozenset(_trigrams(text))
+        prefixes = frozenset(_prefixes(text))
+        self._docs[mid] = (text, grams, prefixes, tags)
+        self._texts[mid] = text
+        trigram_table = self._trigrams
+        for g in grams:
+            trigram_table[g].add(mid)
+        prefix_table = self._prefixes
+        for p in prefixes:
+            prefix_table[p].add(mid)
+        for t in tags:
+            self._tags[t].add(mid)
+
+    def _unindex(self, macro_id: str) -> None:
+        doc = self._docs.pop(macro_id, None)
+        if doc is None:
+            return
+        del self._texts[macro_id]
+        self._term_cache.clear()
+        _, grams, prefixes, tags = doc
+        for table, keys in ((self._trigrams, grams), (self._prefixes, prefixes), (self._tags, tags)):
+            for key in keys:
+                ids = table.get(key)
+                if ids is not None:
+                    ids.discard(macro_id)
+                    if not ids:
+                        del table[key]
+
+    def all_tags(self) -> List[str]:
+        self.ensure_built()
+        with self._lock:
+            return sorted(self._tags)
+
+    def _match_term(self, term: str) -> Set[str]:
+        """Id che soddisfano il termine (il risultato non va modificato)"""
+        cached = self._term_cache.get(term)
+        if cached is not None:
+            return cached
+        if term.startswith("#"):
+            # Tag uguale o che inizia con il termine ("#c" trova anche "cab")
+            tag = term[1:]
+            result = set()
+            for name, ids in self._tags.items():
+                if name.startswith(tag):
+                    result |= ids
+        elif len(term) < 3:
+            result = self._prefixes.get(term) or set()
+        else:
+            texts = self._texts
+            previous = self._term_cache.get(term[:-1]) if len(term) > 3 else None
+            if previous is not None:
+                # Raffinamento del termine precedente: basta verificare i suoi risultati
+                result = {mid for mid in previous if term in texts[mid]}
+            else:
+                postings = sorted((self._trigrams.get(g) or set() for g in _trigrams(term)), key=len)
+                candidates = postings[0].intersection(*postings[1:])
+                result = candidates if len(term) == 3 else {mid for mid in candidates if term in texts[mid]}
+        if len(self._term_cache) > 256:
+            self._term_cache.clear()
+        self._term_cache[term] = result
+        return result
+
+    def query(self, text: str) -> Optional[Set[str]]:
+        """Id delle macro che soddisfano tutti i termini; None se la query è vuota"""
+        terms = normalize(text).split()
+        if not terms:
+            return None
+        self.ensure_built()
+        with self._lock:
+            matches = [self._match_term(t) for t in dict.fromkeys(terms)]
+            # Intersezione a partire dall'insieme più piccolo
+            matches.sort(key=len)
+            return set(matches[0]).intersection(*matches[1:])
@@ -0,0 +1,200 @@
+"""
+Impostazioni dell'applicazione in memoria, con notifica delle modifiche.
+
+Il file settings.json viene letto una sola volta e unito in profondità ai
+valori predefiniti (che non vengono mai modificati). Le letture successive
+usano la copia in memoria; il file viene riletto solo se la sua data di
+modifica cambia (es. modifica manuale mentre l'applicazione è aperta).
+
+Le modifiche vengono pubblicate per sezione (es. "ui", "hotkeys",
+"playback") ai sottoscrittori e salvate con il thread di scrittura atomica
+di app/writer.py, come la libreria delle macro. La finestra principale
+applica subito "ui" e "playback"; la sezione "storage" sceglie il backend
+all'avvio e vale dal riavvio successivo.
+"""
+
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from .writer import get_writer
+
+# callback(sezione, nuovo valore della sezione)
+SettingsCallback = Callable[[str, Any], None]
+
+# Intervallo minimo tra due controlli della data di modifica del file
+CHECK_INTERVAL_S = 1.0
+
+
+def deep_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    """Nuovo dizionario con i valori di `override` sopra quelli di `base` (nessuno dei due viene modificato)"""
+    result = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = deep_merge(result[key], value)
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+class SettingsStore:
+    def __init__(self, path: Path, defaults: Dict[str, Any], read: Callable[[Path], Dict[str, Any]]) -> None:
+        self.path = path
+        self._defaults = copy.deepcopy(defaults)
+        self._read = read
+        self._lock = threading.RLock()
+        self._data: Optional[Dict[str, Any]] = None
+        # (mtime_ns, dimensione) del file letto o scritto per ultimo
+        self._file_state: Optional[Tuple[int, int]] = None
+        self._last_check = 0.0
+        self._pending_writes = 0
+        self._subscribers: List[Tuple[Optional[str], SettingsCallback]] = []
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.path.stat()
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self) -> Dict[str, Any]:
+        data = self._read(self.path)
+        if not isinstance(data, dict):
+            data = {}
+        self._file_state = self._stat()
+        self._last_check = time.monotonic()
+        merged = deep_merge(self._defaults, data)
+        if not data:
+            # File mancante: viene creato con i valori predefiniti
+            self._persist(merged)
+        return merged
+
+    def _current(self) -> Dict[str, Any]:
+        """Dati in memoria, ricaricati se il file è cambiato (con il lock acquisito)"""
+        if self._data is None:
+            self._data = self._load()
+        elif time.monotonic() - self._last_check >= CHECK_INTERVAL_S:
+            self.check_for_changes()
+        return self._data
+
+    def check_for_changes(self) -> bool:
+        """
+        Rilegge il file se è stato modificato dall'esterno e notifica le
+        sezioni cambiate. I callback vengono eseguiti nel thread chiamante.
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            if self._data is None or self._pending_writes:
+                # Salvataggio in corso: la copia in memoria è la più recente
+                return False
+            state = self._stat()
+            if state is None or state == self._file_state:
+                return False
+            logger.info("Impostazioni modificate su disco, ricaricamento di {}", self.path)
+            old = self._data
+            self._data = self._load()
+            new = self._data
+        self._publish(old, new)
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copia completa delle impostazioni"""
+        with self._lock:
+            return copy.deepcopy(self._current())
+
+    def get(self, section: str, key: Optional[str] = None, default: Any = None) -> Any:
+        """Copia di una sezione o di un suo valore"""
+        with self._lock:
+            value = self._current().get(section, default)
+            if key is not None:
+                value = value.get(key, default) if isinstance(value, dict) else default
+            return copy.deepcopy(value)
+
+    def update(self, section: str, **values: Any) -> None:
+        """Modifica alcuni valori di una sezione, la salva e notifica i sottoscrittori"""
+        with self._lock:
+            current = self._current()
+            new = copy.deepcopy(current)
+            target = new.get(section)
+            if not isinstance(target, dict):
+                target = new[section] = {}
+            target.update(copy.deepcopy(values))
+            changed = self._commit(current, new)
+        if changed:
+            self._publish(current, new)
+
+    def replace(self, settings: Dict[str, Any]) -> None:
+        """Sostituisce tutte le impostazioni (unite ai valori predefiniti)"""
+        with self._lock:
+            current = self._current()
+            new = deep_merge(self._defaults, settings)
+            changed = self._commit(current, new)
+        if changed:
+            self._publish(current, new)
+
+    def _commit(self, old: Dict[str, Any], new: Dict[str, Any]) -> bool:
+        if new == old:
+            return False
+        self._data = new
+        self._persist(new)
+        return True
+
+    def _persist(self, data: Dict[str, Any]) -> None:
+        def written() -> None:
+            with self._lock:
+                self._pending_writes -= 1
+                self._file_state = self._stat()
+
+        def failed(exc: Exception) -> None:
+            # Scrittura scartata: il file su disco resta quello precedente
+            with self._lock:
+                self._pending_writes -= 1
+            logger.error("Impostazioni non salvate in {}: {}", self.path, exc)
+
+        with self._lock:
+            self._pending_writes += 1
+        try:
+            get_writer().submit(self.path, copy.deepcopy(data), on_written=written, on_failed=failed)
+        except Exception as exc:
+            with self._lock:
+                self._pending_writes -= 1
+            logger.exception("Failed to write settings {}: {}", self.path, exc)
+
+    def subscribe(self, callback: SettingsCallback, section: Optional[str] = None) -> Callable[[], None]:
+        """
+        Registra un callback per le modifiche di una sezione (tutte se None).
+
+        Returns:
+            funzione che annulla la sottoscrizione
+        """
+        entry = (section, callback)
+        with self._lock:
+            self._subscribers.append(entry)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+
+        return unsubscribe
+
+    def _publish(self, old: Dict[str, Any], new: Dict[str, Any]) -> None:
+        changed = [k for k in new.keys() | old.keys() if new.get(k) != old.get(k)]
+        if not changed:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for section in sorted(changed):
+            for wanted, callback in subscribers:
+                if wanted is not None and wanted != section:
+                    continue
+                try:
+                    callback(section, copy.deepcopy(new.get(section)))
+                except Exception as exc:
+                    logger.exception("Settings subscriber failed for {}: {}", section, exc)
@@ -0,0 +1,431 @@
+"""
+Libreria delle macro su database SQLite (backend opzionale di storage).
+
+I metadati sono colonne indicizzate, gli eventi un BLOB nel formato binario
+di app/codec.py. Il database è in modalità WAL: la lettura (es. il player
+che carica gli eventi) non viene bloccata dalle scritture della GUI.
+
+All'avvio load_all legge solo i metadati: gli eventi di ogni macro sono uno
+StoredEvents che li legge dal BLOB solo quando servono. query/count
+restituiscono pagine della libreria filtrate e ordinate tramite gli indici.
+
+Le scritture vengono raccolte in attesa (set_snapshot, set_metadata,
+record_run) e applicate da flush_pending in un'unica transazione, nello
+stesso ordine in cui sono state richieste.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections.abc import Sequence as SequenceABC
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from loguru import logger
+
+from .codec import HEADER, RECORD, StringTable, decode_events, encode_events, iter_decode, read_header, unpack_event
+from .models import CallEvent, ControlEvent, Event, Macro
+
+SCHEMA_VERSION = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS macros (
+    id              TEXT PRIMARY KEY,
+    title           TEXT NOT NULL COLLATE NOCASE,
+    favorite        INTEGER NOT NULL DEFAULT 0,
+    with_pauses     INTEGER NOT NULL DEFAULT 1,
+    repetitions     INTEGER NOT NULL DEFAULT 1,
+    preserve_cursor INTEGER NOT NULL DEFAULT 0,
+    verified        INTEGER NOT NULL DEFAULT 0,
+    display_layout  TEXT,
+    tags            TEXT,
+    created_ms      INTEGER NOT NULL,
+    last_run_ms     INTEGER,
+    event_count     INTEGER NOT NULL DEFAULT 0,
+    duration_ms     INTEGER NOT NULL DEFAULT 0,
+    calls           TEXT,
+    events          BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_macros_favorite_title ON macros(favorite DESC, title);
+CREATE INDEX IF NOT EXISTS idx_macros_title ON macros(title);
+CREATE INDEX IF NOT EXISTS idx_macros_created ON macros(created_ms);
+CREATE INDEX IF NOT EXISTS idx_macros_last_run ON macros(last_run_ms);
+CREATE INDEX IF NOT EXISTS idx_macros_event_count ON macros(event_count);
+CREATE INDEX IF NOT EXISTS idx_macros_duration ON macros(duration_ms);
+"""
+
+_INDEXES: Tuple[str, ...] = tuple(
+    line for line in _SCHEMA.splitlines() if line.startswith("CREATE INDEX")
+)
+
+# Migrazioni dalla versione indicata alla successiva
+_MIGRATIONS: Dict[int, Tuple[str, ...]] = {
+    1: ("ALTER TABLE macros ADD COLUMN tags TEXT",),
+    # Indici delle query di ordinamento, sostituite dagli indici in memoria
+    2: tuple(
+        f"DROP INDEX IF EXISTS {name}"
+        for name in ("idx_macros_favorite_title", "idx_macros_title", "idx_macros_last_run",
+                     "idx_macros_event_count", "idx_macros_duration")
+    ),
+    # Indici delle query di nuovo disponibili, id delle macro chiamate (NULL: da calcolare dagli eventi)
+    3: ("ALTER TABLE macros ADD COLUMN calls TEXT", *_INDEXES),
+}
+
+# Colonne dei metadati modificabili con set_metadata
+_META_COLUMNS: Tuple[str, ...] = ("title", "favorite", "with_pauses", "repetitions", "preserve_cursor", "verified", "tags")
+
+# Colonne utilizzabili per l'ordinamento nelle query
+SORT_COLUMNS: Tuple[str, ...] = ("title", "created_ms", "last_run_ms", "event_count", "duration_ms")
+
+_META_FIELDS = tuple(f for f in fields(Macro) if f.name != "events")
+
+_REC_ID = re.compile(r"^rec-(\d+)$")
+
+
+@dataclass
+class MacroSummary:
+    """Riga della libreria senza eventi"""
+    id: str
+    title: str
+    favorite: bool
+    with_pauses: bool
+    repetitions: int
+    created_ms: int
+    last_run_ms: Optional[int]
+    event_count: int
+    duration_ms: int
+
+
+def events_duration_ms(events: Sequence[Event]) -> int:
+    """Durata registrata: somma delle pause più le attese fisse"""
+    total = 0
+    for ev in events:
+        total += max(0, int(getattr(ev, "time_delta_ms", 0) or 0))
+        if isinstance(ev, ControlEvent) and ev.action == "wait":
+            total += max(0, int(ev.wait_ms))
+    return total
+
+
+def _created_ms(macro_id: str) -> int:
+    m = _REC_ID.match(macro_id)
+    return int(m.group(1)) if m else int(time.time() * 1000)
+
+
+class StoredEvents(SequenceABC):
+    """
+    Eventi di una macro letti dal database solo quando servono.
+
+    len() usa la colonna event_count; l'accesso per indice legge il solo
+    record richiesto dal BLOB (Connection.blobopen, Python 3.11+; altrimenti
+    gli eventi vengono caricati una volta) e l'iterazione decodifica il BLOB
+    a flusso. Prima che la riga venga sostituita o eliminata lo store chiama
+    detach(), che copia gli eventi in memoria. Le modifiche producono una
+    normale lista (es. `events + [nuovo_evento]`).
+    """
+
+    def __init__(self, store: "SqliteMacroStore", macro_id: str, rowid: int, count: int, calls: Optional[FrozenSet[str]]) -> None:
+        self._store = store
+        self.macro_id = macro_id
+        self._rowid = rowid
+        self._count = count
+        self._calls = calls
+        self._events: Optional[List[Event]] = None
+        # (tabella stringhe, offset del primo record) per le letture parziali
+        self._layout: Optional[Tuple[StringTable, int]] = None
+        self._lock = threading.Lock()
+
+    def _blob(self) -> bytes:
+        row = self._store._conn().execute("SELECT events FROM macros WHERE rowid = ?", (self._rowid,)).fetchone()
+        if row is None:
+            raise LookupError(f"Eventi della macro {self.macro_id} non presenti nel database")
+        return row[0]
+
+    def detach(self) -> None:
+        """Copia gli eventi in memoria: la riga del database può cambiare"""
+        with self._lock:
+            if self._events is None:
+                self._events = decode_events(self._blob())
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: Union[int, slice]):
+        events = self._events
+        if events is not None:
+            return events[index]
+        if isinstance(index, slice):
+            return decode_events(self._blob())[index]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("indice evento fuori intervallo")
+        conn = self._store._conn()
+        if not hasattr(conn, "blobopen"):
+            self.detach()
+            return self._events[index]  # type: ignore[index]
+        with conn.blobopen("macros", "events", self._rowid, readonly=True) as blob:
+            layout = self._layout
+            if layout is None:
+                head = blob.read(HEADER.size)
+                head += blob.read(HEADER.unpack(head)[3])
+                strings, offset, _ = read_header(head, records=False)
+                layout = self._layout = (strings, offset)
+            blob.seek(layout[1] + index * RECORD.size)
+            return unpack_event(RECORD.unpack(blob.read(RECORD.size)), layout[0])
+
+    def __iter__(self) -> Iterator[Event]:
+        events = self._events
+        if events is not None:
+            return iter(events)
+        return iter_decode(self._blob())
+
+    def call_ids(self) -> Set[str]:
+        """Id delle macro chiamate, dalla colonna calls se disponibile"""
+        if self._calls is None:
+            self._calls = frozenset(ev.macro_id for ev in self if isinstance(ev, CallEvent))
+        return set(self._calls)
+
+    def __add__(self, other) -> List[Event]:
+        return list(self) + list(other)
+
+    def __radd__(self, other) -> List[Event]:
+        return list(other) + list(self)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, SequenceABC) or isinstance(other, (str, bytes)):
+            return NotImplemented
+        return len(other) == self._count and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"StoredEvents({self.macro_id!r}, {self._count} eventi)"
+
+
+class SqliteMacroStore:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Scritture in attesa di flush_pending
+        self._snapshot: Optional[List[Tuple[Dict[str, Any], Sequence[Event]]]] = None
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        self._runs: Dict[str, int] = {}
+        # id -> eventi già scritti nel BLOB (evita di ricodificare eventi invariati)
+        self._written_events: Dict[str, Sequence[Event]] = {}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        version = int(conn.execute("PRAGMA user_version").fetchone()[0])
+        if version == 0 or conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'macros'").fetchone() is None:
+            # Database nuovo: lo schema è già quello corrente
+            conn.executescript(_SCHEMA)
+        else:
+            with conn:
+                for v in range(version, SCHEMA_VERSION):
+                    for statement in _MIGRATIONS[v]:
+                        conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _conn(self) -> sqlite3.Connection:
+        """Una connessione per thread (GUI, thread di scrittura, player)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- lettura -----------------------------------------------------------
+
+    def is_empty(self) -> bool:
+        return self._conn().execute("SELECT 1 FROM macros LIMIT 1").fetchone() is None
+
+    def load_all(self) -> List[Macro]:
+        """Libreria con i soli metadati: gli eventi vengono letti quando servono (StoredEvents)"""
+        rows = self._conn().execute(
+            "SELECT rowid, id, title, favorite, with_pauses, repetitions, preserve_cursor, verified, display_layout, tags, "
+            "event_count, calls FROM macros ORDER BY created_ms"
+        ).fetchall()
+        macros: List[Macro] = []
+        for rowid, mid, title, fav, pauses, reps, preserve, verified, layout, tags, count, calls in rows:
+            events = StoredEvents(self, mid, rowid, int(count), frozenset(json.loads(calls)) if calls is not None else None)
+            macro = Macro(
+                id=mid, title=title, events=events, with_pauses=bool(pauses), repetitions=int(reps),
+                favorite=bool(fav), preserve_cursor=bool(preserve),
+                display_layout=json.loads(layout) if layout else None, verified=bool(verified),
+                tags=json.loads(tags) if tags else [],
+            )
+            self._written_events[mid] = events
+            macros.append(macro)
+        return macros
+
+    def load_events(self, macro_id: str) -> Optional[List[Event]]:
+        row = self._conn().execute("SELECT events FROM macros WHERE id = ?", (macro_id,)).fetchone()
+        return decode_events(row[0]) if row else None
+
+    def _where(self, title_prefix: Optional[str], favorites_only: bool) -> Tuple[str, List[Any]]:
+        clauses: List[str] = []
+        params: List[Any] = []
+        if title_prefix:
+            # LIKE con prefisso su colonna NOCASE: usa l'indice sul titolo
+            escaped = title_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append("title LIKE ? ESCAPE '\\'")
+            params.append(escaped + "%")
+        if favorites_only:
+            clauses.append("favorite = 1")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(
+        self,
+        title_prefix: Optional[str] = None,
+        favorites_only: bool = False,
+        order_by: str = "title",
+        descending: bool = False,
+        favorites_first: bool = True,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> List[MacroSummary]:
+        """Pagina della libreria filtrata e ordinata tramite gli indici"""
+        if order_by not in SORT_COLUMNS:
+            raise ValueError(f"Colonna di ordinamento non valida: {order_by}")
+        where, params = self._where(title_prefix, favorites_only)
+        order = f"{order_by} {'DESC' if descending else 'ASC'}"
+        if favorites_first:
+            order = "favorite DESC, " + order
+        sql = (
+            "SELECT id, title, favorite, with_pauses, repetitions, created_ms, last_run_ms, event_count, duration_ms "
+            f"FROM macros{where} ORDER BY {order} LIMIT ? OFFSET ?"
+        )
+        params += [-1 if limit is None else int(limit), max(0, int(offset))]
+        return [
+            MacroSummary(mid, title, bool(fav), bool(pauses), int(reps), created, last_run, count, duration)
+            for mid, title, fav, pauses, reps, created, last_run, count, duration
+            in self._conn().execute(sql, params)
+        ]
+
+    def count(self, title_prefix: Optional[str] = None, favorites_only: bool = False) -> int:
+        where, params = self._where(title_prefix, favorites_only)
+        return int(self._conn().execute(f"SELECT COUNT(*) FROM macros{where}", params).fetchone()[0])
+
+    # --- scrittura ---------------------------------------------------------
+
+    def set_snapshot(self, macros: Sequence[Macro]) -> None:
+        """Registra lo stato completo della libreria; sostituisce le modifiche in attesa"""
+        rows = [({f.name: getattr(m, f.name) for f in _META_FIELDS}, m.events) for m in macros]
+        with self._lock:
+            self._snapshot = rows
+            # Il nuovo stato completo include già i metadati modificati
+            self._meta.clear()
+
+    def set_metadata(self, macro_id: str, changes: Dict[str, Any]) -> None:
+        values = {k: v for k, v in changes.items() if k in _META_COLUMNS}
+        if not values:
+            return
+        with self._lock:
+            self._meta.setdefault(macro_id, {}).update(values)
+
+    def record_run(self, macro_id: str, ts_ms: Optional[int] = None) -> None:
+        with self._lock:
+            self._runs[macro_id] = int(time.time() * 1000) if ts_ms is None else int(ts_ms)
+
+    def flush_pending(self) -> None:
+        """Applica le scritture in attesa in un'unica transazione"""
+        with self._lock:
+            snapshot, self._snapshot = self._snapshot, None
+            meta, self._meta = self._meta, {}
+            runs, self._runs = self._runs, {}
+        if snapshot is None and not meta and not runs:
+            return
+        conn = self._conn()
+        written: Dict[str, Sequence[Event]] = {}
+        try:
+            with conn:
+                if snapshot is not None:
+                    self._write_snapshot(conn, snapshot, written)
+                for mid, values in meta.items():
+                    cols = ", ".join(f"{k} = ?" for k in values)
+                    conn.execute(f"UPDATE macros SET {cols} WHERE id = ?", [*(_sql_value(v) for v in values.values()), mid])
+                for mid, ts in runs.items():
+                    conn.execute("UPDATE macros SET last_run_ms = ? WHERE id = ?", (ts, mid))
+        except Exception:
+            # Transazione annullata: le scritture tornano in attesa (le richieste più recenti prevalgono)
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = snapshot
+                for mid, values in meta.items():
+                    self._meta[mid] = {**values, **self._meta.get(mid, {})}
+                for mid, ts in runs.items():
+                    self._runs.setdefault(mid, ts)
+            raise
+        # Solo dopo il commit: gli eventi di queste macro sono nel database
+        if snapshot is not None:
+            self._written_events = written
+
+    def _write_snapshot(
+        self,
+        conn: sqlite3.Connection,
+        rows: List[Tuple[Dict[str, Any], Sequence[Event]]],
+        written: Dict[str, Sequence[Event]],
+    ) -> None:
+        """Scrive le righe; `written` riceve gli eventi di ogni macro presente nel database"""
+        kept = {meta["id"]: events for meta, events in rows}
+        for mid, events in self._written_events.items():
+            if isinstance(events, StoredEvents) and kept.get(mid) is not events:
+                # Riga sostituita o eliminata: chi usa ancora questi eventi li trova in memoria
+                events.detach()
+        ids = []
+        for meta, events in rows:
+            mid = meta["id"]
+            ids.append(mid)
+            values = (
+                meta["title"], int(bool(meta["favorite"])), int(bool(meta["with_pauses"])), int(meta["repetitions"]),
+                int(bool(meta["preserve_cursor"])), int(bool(meta.get("verified", False))),
+                json.dumps(meta["display_layout"]) if meta.get("display_layout") else None,
+                json.dumps(meta["tags"], ensure_ascii=False) if meta.get("tags") else None,
+            )
+            if self._written_events.get(mid) is events:
+                # Eventi invariati: solo i metadati
+                conn.execute(
+                    "UPDATE macros SET title = ?, favorite = ?, with_pauses = ?, repetitions = ?, "
+                    "preserve_cursor = ?, verified = ?, display_layout = ?, tags = ? WHERE id = ?",
+                    (*values, mid),
+                )
+                written[mid] = events
+                continue
+            calls = sorted({ev.macro_id for ev in events if isinstance(ev, CallEvent)})
+            conn.execute(
+                "INSERT INTO macros (id, title, favorite, with_pauses, repetitions, preserve_cursor, verified, "
+                "display_layout, tags, created_ms, event_count, duration_ms, calls, events) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET title = excluded.title, favorite = excluded.favorite, "
+                "with_pauses = excluded.with_pauses, repetitions = excluded.repetitions, "
+                "preserve_cursor = excluded.preserve_cursor, verified = excluded.verified, "
+                "display_layout = excluded.display_layout, tags = excluded.tags, event_count = excluded.event_count, "
+                "duration_ms = excluded.duration_ms, calls = excluded.calls, events = excluded.events",
+                (mid, *values, _created_ms(mid), len(events), events_duration_ms(events), json.dumps(calls), encode_events(events)),
+            )
+            written[mid] = events
+
+        # Macro eliminate
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_ids (id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM keep_ids")
+        conn.executemany("INSERT OR IGNORE INTO keep_ids (id) VALUES (?)", [(i,) for i in ids])
+        conn.execute("DELETE FROM macros WHERE id NOT IN (SELECT id FROM keep_ids)")
+
+
+def _sql_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return json.dumps(value, ensure_ascii=False) if value else None
+    return int(value) if isinstance(value, bool) else value
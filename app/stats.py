@@ -0,0 +1,178 @@
+"""
+Statistiche di una macro calcolate dagli eventi in un'unica scansione.
+
+Sono salvate nella voce della macro nell'indice del contenuto
+(app/content.py) e ricalcolate solo quando gli eventi cambiano, così la
+tabella le mostra e le ordina senza leggere gli eventi.
+
+Le durate stimate seguono i due profili di riproduzione del player:
+
+    con pause    pause registrate tra gli eventi
+    senza pause  ritardi fissi per tipo di evento (Player._apply_intelligent_delay)
+
+In entrambi i casi contano le attese (ControlEvent "wait") e i cicli
+vengono moltiplicati per il numero di iterazioni. Le macro richiamate con
+CallEvent sono elencate in `calls` e sommate da ContentIndex.estimate_ms.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Sequence, Set, Tuple
+
+from .bytecode import MAX_LOOP_COUNT
+from .models import CallEvent, ControlEvent, Event, KeyEvent, MouseEvent
+
+# Ritardi del player senza pause, in millisecondi
+FAST_KEY_MS = 3
+FAST_REPEAT_PRESS_MS = 20
+FAST_REPEAT_RELEASE_MS = 10
+FAST_MOUSE_MS = 5
+
+# Pausa del player tra due ripetizioni
+REPETITION_GAP_MS = 50
+
+# (x minima, y minima, x massima, y massima)
+BoundingBox = Tuple[int, int, int, int]
+
+
+@dataclass
+class MacroStats:
+    key_events: int = 0
+    mouse_events: int = 0
+    call_events: int = 0
+    control_events: int = 0
+    # Somma delle pause registrate e delle attese, senza ripetere i cicli
+    recorded_ms: int = 0
+    # Una esecuzione della macro, escluse le macro richiamate
+    with_pauses_ms: int = 0
+    without_pauses_ms: int = 0
+    distinct_keys: int = 0
+    # Area dell'attività del mouse, None se la macro non usa il mouse
+    mouse_box: Optional[BoundingBox] = None
+    # id macro richiamata -> numero di chiamate per esecuzione
+    calls: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def event_count(self) -> int:
+        return self.key_events + self.mouse_events + self.call_events + self.control_events
+
+    @property
+    def mouse_area(self) -> int:
+        if self.mouse_box is None:
+            return 0
+        x0, y0, x1, y1 = self.mouse_box
+        return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+    def own_ms(self, with_pauses: bool) -> int:
+        return self.with_pauses_ms if with_pauses else self.without_pauses_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "key_events": self.key_events,
+            "mouse_events": self.mouse_events,
+            "call_events": self.call_events,
+            "control_events": self.control_events,
+            "recorded_ms": self.recorded_ms,
+            "with_pauses_ms": self.with_pauses_ms,
+            "without_pauses_ms": self.without_pauses_ms,
+            "distinct_keys": self.distinct_keys,
+            "mouse_box": list(self.mouse_box) if self.mouse_box is not None else None,
+            "calls": dict(self.calls),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "MacroStats":
+        box = d.get("mouse_box")
+        return cls(
+            key_events=int(d.get("key_events", 0)),
+            mouse_events=int(d.get("mouse_events", 0)),
+            call_events=int(d.get("call_events", 0)),
+            control_events=int(d.get("control_events", 0)),
+            recorded_ms=int(d.get("recorded_ms", 0)),
+            with_pauses_ms=int(d.get("with_pauses_ms", 0)),
+            without_pauses_ms=int(d.get("without_pauses_ms", 0)),
+            distinct_keys=int(d.get("distinct_keys", 0)),
+            mouse_box=tuple(int(v) for v in box) if box else None,  # type: ignore[arg-type]
+            calls={str(k): int(v) for k, v in (d.get("calls") or {}).items()},
+        )
+
+
+def compute_stats(events: Sequence[Event]) -> MacroStats:
+    stats = MacroStats()
+    keys: Set[str] = set()
+    calls: Dict[str, int] = {}
+    min_x = min_y = max_x = max_y = None
+    # Moltiplicatore dei cicli aperti (come bytecode.compile_program)
+    multiplier = 1
+    open_blocks = []
+    last_key = None
+    recorded = paused = fast = 0
+
+    for ev in events:
+        delta = max(0, int(ev.time_delta_ms or 0))
+        recorded += delta
+        if isinstance(ev, ControlEvent):
+            stats.control_events += 1
+            if ev.action == "loop":
+                open_blocks.append(multiplier)
+                multiplier *= max(0, min(int(ev.count), MAX_LOOP_COUNT))
+            elif ev.action == "block":
+                open_blocks.append(multiplier)
+            elif ev.action == "end":
+                if open_blocks:
+                    multiplier = open_blocks.pop()
+            elif ev.action == "wait":
+                wait = max(0, int(ev.wait_ms))
+                recorded += wait
+                paused += wait * multiplier
+                fast += wait * multiplier
+            continue
+
+        paused += delta * multiplier
+        if isinstance(ev, KeyEvent):
+            stats.key_events += 1
+            key = ev.key.strip().lower()
+            keys.add(key)
+            if key == last_key:
+                fast += (FAST_REPEAT_PRESS_MS if ev.action == "press" else FAST_REPEAT_RELEASE_MS) * multiplier
+            else:
+                fast += FAST_KEY_MS * multiplier
+            last_key = key
+        elif isinstance(ev, MouseEvent):
+            stats.mouse_events += 1
+            fast += FAST_MOUSE_MS * multiplier
+            if min_x is None:
+                min_x = max_x = ev.x
+                min_y = max_y = ev.y
+            else:
+                min_x, max_x = min(min_x, ev.x), max(max_x, ev.x)
+                min_y, max_y = min(min_y, ev.y), max(max_y, ev.y)
+        elif isinstance(ev, CallEvent):
+            stats.call_events += 1
+            calls[ev.macro_id] = calls.get(ev.macro_id, 0) + max(1, int(ev.repetitions)) * multiplier
+
+    stats.recorded_ms = recorded
+    stats.with_pauses_ms = paused
+    stats.without_pauses_ms = fast
+    stats.distinct_keys = len(keys)
+    if min_x is not None:
+        stats.mouse_box = (min_x, min_y, max_x, max_y)
+    stats.calls = calls
+    return stats
+
+
+def format_duration(ms: Optional[int]) -> str:
+    """Durata leggibile: "850 ms", "12.4 s", "3:05", "1:02:03" """
+    if ms is None:
+        return ""
+    if ms < 1000:
+        return f"{ms} ms"
+    if ms < 60_000:
+        return f"{ms / 1000:.1f} s"
+    seconds = ms // 1000
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
@@ -1,80 +1,476 @@
 from __future__ import annotations
 
 import json
+import os
+import re
 import time
+from dataclasses import fields
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
 
 from loguru import logger
 
-from .constants import MACROS_FILE, SETTINGS_FILE, DEFAULT_SETTINGS
-from .models import Macro
+from .allocator import RecordingAllocator
+from .balance import check_balance, iter_balanced, log_repair, verify_macro
+from .compose import check_call_cycles
+from .constants import CHUNKS_DIR, CONTENT_INDEX_FILE, EVENTS_DIR, MACROS_DB_FILE, MACROS_FILE, MACROS_JOURNAL_FILE, SETTINGS_FILE, DEFAULT_SETTINGS
+from .chunks import ChunkStore
+from .content import ContentIndex, events_signature
+from .eventfile import EVENT_FILE_SUFFIX, MAPPED_EVENTS_THRESHOLD, MappedEvents, write_event_file
+from .journal import MetadataJournal
+from .models import Event, Macro
+from .settings import SettingsStore
+from .schema import SCHEMA_VERSION, SchemaError, decode_macro, schema_version
+from .sqlstore import SqliteMacroStore, StoredEvents
+from .writer import atomic_write_bytes, backup_path, encode_json, get_writer
+
+
+_journal: MetadataJournal | None = None
+_chunk_store: ChunkStore | None = None
+_allocator: RecordingAllocator | None = None
+_content_index: ContentIndex | None = None
+
+
+_sqlite_store: SqliteMacroStore | None = None
+
+
+def configure_storage(settings: Dict) -> None:
+    """Sceglie il backend della libreria dalla sezione "storage" delle impostazioni"""
+    global _sqlite_store
+    backend = settings.get("storage", {}).get("backend", "json")
+    if backend == "sqlite":
+        if _sqlite_store is None:
+            _sqlite_store = SqliteMacroStore(MACROS_DB_FILE)
+    else:
+        if backend != "json":
+            logger.warning("Backend di archiviazione sconosciuto: {}", backend)
+        _sqlite_store = None
+
+
+def get_sqlite_store() -> SqliteMacroStore | None:
+    """Store SQLite attivo (query per pagine della libreria), None con il backend JSON"""
+    return _sqlite_store
+
+
+def get_journal() -> MetadataJournal:
+    global _journal
+    if _journal is None:
+        _journal = MetadataJournal(MACROS_JOURNAL_FILE)
+    return _journal
+
+
+def get_allocator() -> RecordingAllocator:
+    global _allocator
+    if _allocator is None:
+        _allocator = RecordingAllocator()
+    return _allocator
+
+
+def get_content_index() -> ContentIndex:
+    global _content_index
+    if _content_index is None:
+        _content_index = ContentIndex(CONTENT_INDEX_FILE)
+    return _content_index
+
+
+def _sync_content_index(macros: List[Macro]) -> None:
+    """Allinea l'indice del contenuto; l'analisi degli eventi avviene sul thread di scrittura"""
+    index = get_content_index()
+    index.sync(macros)
+    try:
+        get_writer().submit_task("content_index", index.refresh)
+    except Exception as exc:
+        logger.exception("Failed to update content index: {}", exc)
+
+
+def get_chunk_store() -> ChunkStore:
+    global _chunk_store
+    if _chunk_store is None:
+        _chunk_store = ChunkStore(CHUNKS_DIR)
+    return _chunk_store
+
+
+def find_duplicate(macros: List[Macro], macro: Macro, digests: Tuple[str, ...] | None = None) -> Macro | None:
+    """
+    Macro della libreria con gli stessi eventi di `macro`, None se assente.
+    `digests` sono gli hash dei segmenti se già calcolati (chunks.ChunkStore.hashes_for).
+    """
+    n = len(macro.events)
+    candidates = [m for m in macros if len(m.events) == n]
+    if not candidates:
+        return None
+    if _sqlite_store is None:
+        # Confronto tramite gli hash dei segmenti dell'ultimo salvataggio
+        if digests is None:
+            digests = get_chunk_store().hashes_for(macro.events)
+        dup_id = get_chunk_store().find_duplicate(digests)
+        if dup_id is not None:
+            dup = next((m for m in candidates if m.id == dup_id), None)
+            if dup is not None:
+                return dup
+    # Macro non salvate nei segmenti (file mappati, SQLite, modifiche in attesa):
+    # impronta campionata, poi confronto a flusso senza copiare gli eventi
+    signature = events_signature(macro.events)
+    for m in candidates:
+        if events_signature(m.events) == signature and all(a == b for a, b in zip(m.events, macro.events)):
+            return m
+    return None
+
+
+def _parse_json(path: Path) -> Dict:
+    return json.loads(path.read_text(encoding="utf-8"))
 
 
 def _read_json(path: Path) -> Dict:
+    """
+    Legge un file JSON; se è illeggibile o corrotto usa la copia di backup.
+    Il file corrotto viene conservato a parte invece di essere sovrascritto
+    dal salvataggio successivo.
+    """
+    backup = backup_path(path)
     try:
         if not path.exists():
+            if backup.exists():
+                # Crash tra la rotazione del backup e la sostituzione del file
+                logger.warning("File {} mancante, uso del backup", path)
+                return _parse_json(backup)
             return {}
-        return json.loads(path.read_text(encoding="utf-8"))
+        return _parse_json(path)
     except Exception as exc:
         logger.exception("Failed to read JSON {}: {}", path, exc)
-        return {}
+
+    try:
+        corrupt = path.with_name(f"{path.name}.corrupt-{int(time.time())}")
+        os.replace(path, corrupt)
+        logger.warning("File corrotto conservato come {}", corrupt)
+    except OSError:
+        pass
+    try:
+        if backup.exists():
+            logger.warning("Ripristino di {} dal backup", path)
+            return _parse_json(backup)
+    except Exception as exc:
+        logger.exception("Failed to read JSON backup {}: {}", backup, exc)
+    return {}
 
 
 def _write_json(path: Path, data: Dict) -> None:
+    """Accoda la scrittura atomica sul thread di scrittura; non esegue I/O"""
     try:
-        path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+        get_writer().submit(path, data)
     except Exception as exc:
         logger.exception("Failed to write JSON {}: {}", path, exc)
 
 
+def flush_storage(timeout: float | None = None) -> bool:
+    """Attende che tutti i salvataggi in coda siano stati scritti"""
+    return get_writer().flush(timeout)
+
+
+_settings_store: SettingsStore | None = None
+
+
+def get_settings_store() -> SettingsStore:
+    global _settings_store
+    if _settings_store is None:
+        _settings_store = SettingsStore(SETTINGS_FILE, DEFAULT_SETTINGS, _read_json)
+    return _settings_store
+
+
 def load_settings() -> Dict:
-    data = _read_json(SETTINGS_FILE)
-    if not data:
-        data = DEFAULT_SETTINGS.copy()
-        save_settings(data)
-    # ensure defaults
-    for k, v in DEFAULT_SETTINGS.items():
-        data.setdefault(k, v)
-    return data
+    """Copia delle impostazioni correnti (lette da disco solo la prima volta o se il file cambia)"""
+    return get_settings_store().snapshot()
 
 
 def save_settings(settings: Dict) -> None:
-    _write_json(SETTINGS_FILE, settings)
+    get_settings_store().replace(settings)
 
 
-def load_macros() -> List[Macro]:
+def _load_json_macros() -> List[Macro]:
     data = _read_json(MACROS_FILE)
     macros_raw = data.get("macros", [])
-    macros = [Macro.from_dict(m) for m in macros_raw]
+    chunks = get_chunk_store()
+    refs: Dict[str, Tuple[str, ...]] = {}
+    _unreadable_records.clear()
+    macros: List[Macro] = []
+    try:
+        version: int | None = schema_version(data)
+    except SchemaError as exc:
+        logger.error("Libreria {} non caricabile: {}", MACROS_FILE, exc)
+        version = None
+    for raw in macros_raw:
+        try:
+            if version is None:
+                raise SchemaError("versione dello schema non supportata")
+            m: Macro | None = decode_macro(raw, version)
+        except SchemaError as exc:
+            logger.error("Macro non caricabile: {}", exc)
+            if isinstance(raw, dict) and isinstance(raw.get("id"), str):
+                _unreadable_records[raw["id"]] = raw if "schema" in raw or version is None else {**raw, "schema": version}
+            continue
+        name = raw.get("events_file")
+        digests = raw.get("chunks")
+        if name:
+            try:
+                m.events = MappedEvents(EVENTS_DIR / name)
+            except Exception as exc:
+                logger.exception("Failed to open events file {}: {}", name, exc)
+                m = None
+        elif digests is not None:
+            events = chunks.load(m.id, digests)
+            refs[m.id] = tuple(digests)
+            if events is None:
+                m = None
+            else:
+                m.events = events
+        if m is None:
+            # Record conservato invariato nei salvataggi successivi, per non perdere i dati
+            _unreadable_records[raw["id"]] = raw if "schema" in raw else {**raw, "schema": version}
+            continue
+        macros.append(m)
+    chunks.set_references(refs)
+    # Modifiche ai metadati successive all'ultimo salvataggio completo
+    get_journal().replay(macros)
+    return macros
+
+
+def load_macros() -> List[Macro]:
+    store = _sqlite_store
+    if store is None:
+        macros = _load_json_macros()
+    elif store.is_empty() and (MACROS_FILE.exists() or backup_path(MACROS_FILE).exists()):
+        # Primo avvio con SQLite: migrazione della libreria JSON
+        macros = _load_json_macros()
+        logger.info("Migrazione di {} macro nel database {}", len(macros), store.path)
+        store.set_snapshot(macros)
+        store.flush_pending()
+    else:
+        macros = store.load_all()
+    # Le macro salvate prima dell'analisi del bilanciamento (verified False)
+    # vengono verificate in background con prepare_events
+    get_allocator().sync(macros)
+    _sync_content_index(macros)
     return macros
 
 
 def save_macros(macros: List[Macro]) -> None:
-    data = {"macros": [m.to_dict() for m in macros], "saved_at": int(time.time())}
-    _write_json(MACROS_FILE, data)
+    """
+    Salva la libreria; solleva MacroCycleError se le chiamate tra macro formano un ciclo.
+    Le piccole macro in memoria non ancora verificate vengono analizzate e
+    corrette qui (balance.verify_macro); quelle grandi o mappate restano da
+    verificare in background con prepare_events.
+    """
+    check_call_cycles(macros)
+    for m in macros:
+        if not m.verified and isinstance(m.events, list) and len(m.events) < MAPPED_EVENTS_THRESHOLD:
+            verify_macro(m)
+    get_allocator().sync(macros)
+    _sync_content_index(macros)
+    store = _sqlite_store
+    if store is not None:
+        store.set_snapshot(macros)
+        get_writer().submit_task("sqlite", store.flush_pending)
+        return
+    rows = [({f.name: getattr(m, f.name) for f in _META_FIELDS}, m.events) for m in macros]
+    # Il salvataggio completo include tutti i record del registro corrente
+    journal = get_journal()
+    generation = journal.seal()
+
+    def write_snapshot() -> None:
+        _write_macros_snapshot(rows)
+        journal.drop_sealed(generation)
+
+    try:
+        get_writer().submit_task("macros", write_snapshot)
+    except Exception as exc:
+        logger.exception("Failed to write JSON {}: {}", MACROS_FILE, exc)
+
+
+_META_FIELDS = tuple(f for f in fields(Macro) if f.name != "events")
+
+# id macro -> record non caricabile (segmenti o file eventi mancanti), salvato invariato
+_unreadable_records: Dict[str, Dict] = {}
+
+# id macro -> (lista eventi, nome file) degli eventi già scritti in un file mappabile
+_event_files: Dict[str, Tuple[Any, str]] = {}
+
+# File scritti da materialize_events non ancora presenti in un salvataggio:
+# la pulizia non li elimina finché la macro non li referenzia
+_fresh_event_files: Set[str] = set()
+
+
+def _write_macros_snapshot(rows: List[Tuple[Dict[str, Any], Any]]) -> None:
+    """
+    Scrive macros.json (thread di scrittura). Gli eventi vanno nell'archivio
+    dei segmenti oppure, per le registrazioni molto grandi, in un file
+    mappabile; il record della macro contiene solo i riferimenti.
+    """
+    chunks = get_chunk_store()
+    records: List[Dict[str, Any]] = []
+    refs: Dict[str, Tuple[str, ...]] = {}
+    files: Set[str] = set()
+    for meta, events in rows:
+        rec = dict(meta)
+        rec["events"] = []
+        mid = meta["id"]
+        if isinstance(events, MappedEvents):
+            rec["events_file"] = events.path.name
+        elif len(events) >= MAPPED_EVENTS_THRESHOLD:
+            known = _event_files.get(mid)
+            if known is not None and known[0] is events:
+                name = known[1]
+            else:
+                # Nome nuovo a ogni modifica: il file precedente può essere ancora mappato
+                name = _new_event_file_name(mid)
+                write_event_file(EVENTS_DIR / name, events)
+                _event_files[mid] = (events, name)
+            rec["events_file"] = name
+        else:
+            digests = chunks.put(mid, events)
+            rec["chunks"] = list(digests)
+            refs[mid] = digests
+        if "events_file" in rec:
+            files.add(rec["events_file"])
+        records.append(rec)
+
+    saved_ids = {r["id"] for r in records}
+    for mid, raw in _unreadable_records.items():
+        if mid in saved_ids:
+            continue
+        records.append(raw)
+        if raw.get("chunks") is not None:
+            refs[mid] = tuple(raw["chunks"])
+        if raw.get("events_file"):
+            files.add(raw["events_file"])
+
+    atomic_write_bytes(MACROS_FILE, encode_json({"schema": SCHEMA_VERSION, "macros": records, "saved_at": int(time.time())}))
+    # Solo dopo la scrittura: segmenti e file non più referenziati
+    _fresh_event_files.difference_update(files)
+    _remove_unreferenced_event_files(files | _fresh_event_files)
+    removed = chunks.remove(chunks.set_references(refs))
+    if removed:
+        logger.debug("Eliminati {} segmenti di eventi non più usati", removed)
+
+
+def _new_event_file_name(macro_id: str) -> str:
+    safe_id = re.sub(r"[^\w.-]", "_", macro_id)
+    return f"{safe_id}-{int(time.time() * 1000)}{EVENT_FILE_SUFFIX}"
+
+
+def new_event_file(macro_id: str) -> Path:
+    """Percorso per un nuovo file di eventi, escluso dalla pulizia finché la macro non viene salvata"""
+    path = EVENTS_DIR / _new_event_file_name(macro_id)
+    _fresh_event_files.add(path.name)
+    return path
+
+
+def discard_fresh_events(events: Sequence[Event]) -> None:
+    """Elimina il file di eventi appena scritto e mai salvato (es. importazione scartata)"""
+    if not isinstance(events, MappedEvents) or events.path.name not in _fresh_event_files:
+        return
+    _fresh_event_files.discard(events.path.name)
+    events.close()
+    try:
+        events.path.unlink()
+    except OSError as exc:
+        logger.debug(f"File eventi non eliminato {events.path}: {exc}")
+
+
+def materialize_events(macro_id: str, events: Iterable[Event], count: int) -> Sequence[Event]:
+    """
+    Eventi modificati (es. da app/timeline.py) pronti per Macro.events: una
+    lista, oppure per le registrazioni molto grandi un nuovo file mappato
+    scritto a flusso, senza creare tutti gli eventi in memoria.
+    """
+    if count < MAPPED_EVENTS_THRESHOLD:
+        return list(events)
+    path = new_event_file(macro_id)
+    write_event_file(path, events)
+    return MappedEvents(path)
+
+
+def prepare_events(macro_id: str, title: str, events: Iterable[Event], count: int) -> Sequence[Event]:
+    """
+    Eventi pronti per Macro.events con il bilanciamento verificato
+    (app/balance.py), da chiamare fuori dal thread della GUI. `events` deve
+    poter essere percorso due volte (lista, EventTimeline, MappedEvents, StoredEvents):
+    prima si verifica, poi, solo se serve, gli eventi corretti vengono scritti
+    a flusso come in materialize_events. Liste e file mappati già bilanciati
+    vengono restituiti invariati.
+    """
+    report = check_balance(events)
+    if report.balanced:
+        if isinstance(events, (list, MappedEvents, StoredEvents)):
+            return events
+        return materialize_events(macro_id, iter(events), count)
+    log_repair(title, report)
+    prepared = materialize_events(macro_id, iter_balanced(events), count + report.inserted - report.removed)
+    # File appena scritto (es. importazione) sostituito dalla versione corretta
+    discard_fresh_events(events)
+    return prepared
+
+
+def _remove_unreferenced_event_files(referenced: Set[str]) -> None:
+    """Elimina i file di eventi non più usati dalla libreria salvata"""
+    try:
+        paths = list(EVENTS_DIR.glob("*" + EVENT_FILE_SUFFIX))
+    except OSError:
+        return
+    for path in paths:
+        if path.name in referenced:
+            continue
+        try:
+            path.unlink()
+        except OSError as exc:
+            # Su Windows un file ancora mappato non può essere eliminato: riprova al prossimo salvataggio
+            logger.debug(f"File eventi non eliminato {path}: {exc}")
+
+
+def save_metadata(macros: List[Macro], macro: Macro, **changes) -> None:
+    """
+    Applica e registra una modifica ai metadati di una macro (titolo,
+    preferito, ripetizioni, ...) con un solo record nel registro. Oltre le
+    soglie del registro viene accodato un salvataggio completo di compattazione.
+    """
+    for key, value in changes.items():
+        setattr(macro, key, value)
+    if "title" in changes:
+        get_allocator().rename(macro.id, macro.title)
+    store = _sqlite_store
+    if store is not None:
+        # Con SQLite la modifica è un UPDATE della sola riga
+        store.set_metadata(macro.id, changes)
+        get_writer().submit_task("sqlite", store.flush_pending)
+        return
+    journal = get_journal()
+    journal.append(macro.id, changes)
+    if journal.needs_compaction:
+        logger.debug("Compattazione registro metadati")
+        save_macros(macros)
+
+
+def record_run(macro: Macro, result: str | None = None) -> None:
+    """
+    Registra l'avvio di un'esecuzione (result None) oppure il suo esito
+    (Player.play) nell'indice del contenuto e, con SQLite, nel database.
+    """
+    index = get_content_index()
+    if result is None:
+        ts_ms = int(time.time() * 1000)
+        store = _sqlite_store
+        if store is not None:
+            store.record_run(macro.id, ts_ms)
+            get_writer().submit_task("sqlite", store.flush_pending)
+        index.record_run(macro.id, ts_ms=ts_ms)
+    else:
+        index.record_run(macro.id, result=result)
+    get_writer().submit_task("content_index", index.refresh)
 
 
 def next_recording_title(existing: List[Macro]) -> Tuple[str, str]:
-    # Extract all numbers from existing "Registrazione n.X" titles
-    used_numbers = set()
-    for m in existing:
-        if m.title.startswith("Registrazione n."):
-            try:
-                # Extract the number after "n."
-                parts = m.title.split("n.")
-                if len(parts) > 1:
-                    num_str = parts[1].strip().split()[0]  # Get first word after "n."
-                    if num_str.isdigit():
-                        used_numbers.add(int(num_str))
-            except Exception:
-                continue
-    
-    # Find the smallest available number starting from 1
-    n = 1
-    while n in used_numbers:
-        n += 1
-    
-    rec_id = f"rec-{int(time.time()*1000)}"
-    return rec_id, f"Registrazione n.{n}"
\ No newline at end of file
+    """(id, titolo "Registrazione n.X" con X libero più piccolo) per una nuova registrazione"""
+    allocator = get_allocator()
+    if len(allocator) != len(existing):
+        # Libreria modificata senza passare da save_macros
+        allocator.sync(existing)
+    return allocator.allocate()
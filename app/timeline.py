@@ -0,0 +1,345 @@
+"""
+Modifica degli eventi di una macro senza decodificarli tutti.
+
+EventTimeline tiene la sequenza come tabella di pezzi: intervalli della
+sequenza originale (lista o MappedEvents, mai copiata) e liste di eventi
+inseriti. Accanto ai pezzi mantiene due colonne compatte per evento, il
+tipo (bytearray) e la pausa (array "I"): da queste si ottengono i tempi
+assoluti e l'istogramma della panoramica, mentre gli eventi veri e propri
+vengono decodificati solo quando servono (le righe visibili della vista).
+
+Le modifiche (eliminazione, nuovi tempi, inserimento) vengono applicate a
+gruppi con apply(): gli indici di tutte le operazioni di un gruppo si
+riferiscono alla sequenza prima del gruppo, tempi e istogramma vengono
+ricalcolati una volta sola e il gruppo si annulla con undo().
+"""
+
+from __future__ import annotations
+
+import bisect
+from array import array
+from dataclasses import dataclass, replace
+from itertools import accumulate
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from .codec import KIND_CALL, KIND_CONTROL, KIND_KEY, KIND_MOUSE
+from .eventfile import MappedEvents
+from .models import CallEvent, ControlEvent, Event, KeyEvent, MouseEvent
+
+KINDS: Tuple[int, ...] = (KIND_KEY, KIND_MOUSE, KIND_CALL, KIND_CONTROL)
+
+_KIND_OF = {KeyEvent: KIND_KEY, MouseEvent: KIND_MOUSE, CallEvent: KIND_CALL, ControlEvent: KIND_CONTROL}
+
+# Numero massimo di intervalli del livello più fine della panoramica
+MAX_BUCKETS = 65536
+# Durata minima di un intervallo della panoramica
+MIN_BUCKET_MS = 10
+
+# Gruppi di modifiche annullabili
+UNDO_DEPTH = 10
+
+# Eventi decodificati per volta durante la lettura completa
+_READ_WINDOW = 65536
+
+# Pausa massima rappresentabile nella colonna delle pause
+_MAX_DELTA_MS = 0xFFFFFFFF
+
+
+class TimelineError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class DeleteRange:
+    start: int
+    stop: int
+
+
+@dataclass(frozen=True)
+class RetimeRange:
+    """Nuove pause per gli eventi [start, stop): fisse (delta_ms) oppure scalate"""
+    start: int
+    stop: int
+    scale: float = 1.0
+    delta_ms: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class InsertEvents:
+    """Inserisce gli eventi prima della posizione `index`"""
+    index: int
+    events: Tuple[Event, ...]
+
+
+EditOp = Union[DeleteRange, RetimeRange, InsertEvents]
+
+
+class _Piece(NamedTuple):
+    seq: Sequence[Event]
+    start: int
+    stop: int
+
+
+def _columns(events: Sequence[Event]) -> Tuple[bytearray, array]:
+    if isinstance(events, MappedEvents):
+        kinds, deltas = events.record_columns()
+        return bytearray(kinds), deltas
+    kind_of = _KIND_OF
+    kinds = bytearray(kind_of[type(ev)] for ev in events)
+    deltas = array("I", (max(0, int(ev.time_delta_ms or 0)) for ev in events))
+    return kinds, deltas
+
+
+class TimeBuckets:
+    """
+    Conteggi degli eventi per tipo su intervalli di tempo di uguale durata,
+    con livelli via via più grossolani (ogni livello unisce due intervalli
+    del precedente). La panoramica legge il livello adatto allo zoom, quindi
+    il disegno non dipende dal numero di eventi.
+    """
+
+    def __init__(self, times: Sequence[int], kinds: bytes, duration_ms: int) -> None:
+        n_buckets = max(1, min(MAX_BUCKETS, duration_ms // MIN_BUCKET_MS + 1))
+        self.bucket_ms = max(MIN_BUCKET_MS, -(-(duration_ms + 1) // n_buckets))
+        n_buckets = max(1, -(-(duration_ms + 1) // self.bucket_ms))
+        # Primo evento di ogni intervallo (i tempi sono crescenti)
+        bounds = [bisect.bisect_left(times, b * self.bucket_ms) for b in range(n_buckets)] + [len(times)]
+        pairs = list(zip(bounds, bounds[1:]))
+        level = [array("I", (kinds.count(kind, lo, hi) for lo, hi in pairs)) for kind in KINDS]
+        # levels[l][k][i]: eventi di tipo KINDS[k] nell'intervallo i del livello l
+        self.levels: List[List[array]] = [level]
+        while len(level[0]) > 1:
+            level = [array("I", (a + b for a, b in zip(col[0::2], col[1::2]))) + col[len(col) - len(col) % 2:] for col in level]
+            self.levels.append(level)
+
+    def histogram(self, t0: float, t1: float, columns: int) -> List[Tuple[float, ...]]:
+        """Conteggi per tipo (nell'ordine di KINDS) per ciascuna colonna di [t0, t1)"""
+        columns = max(1, int(columns))
+        span = max(t1 - t0, 1e-9) / columns
+        # Livello più grossolano con intervalli non più larghi di una colonna
+        level_idx = 0
+        while level_idx + 1 < len(self.levels) and self.bucket_ms * (2 ** (level_idx + 1)) <= span:
+            level_idx += 1
+        width = self.bucket_ms * (2 ** level_idx)
+        level = self.levels[level_idx]
+        n = len(level[0])
+        result: List[Tuple[float, ...]] = []
+        for c in range(columns):
+            a, b = t0 + c * span, t0 + (c + 1) * span
+            if width > span:
+                # Zoom oltre la risoluzione: quota dell'intervallo che contiene la colonna
+                i = int(((a + b) / 2) // width)
+                share = span / width
+                result.append(tuple(col[i] * share for col in level) if 0 <= i < n else (0.0,) * len(KINDS))
+            else:
+                # Intervalli che iniziano nella colonna (ognuno contato una volta)
+                lo, hi = max(0, int(-(-a // width))), min(n, int(-(-b // width)))
+                result.append(tuple(float(sum(col[lo:hi])) for col in level) if lo < hi else (0.0,) * len(KINDS))
+        return result
+
+
+class EventTimeline:
+    def __init__(self, events: Sequence[Event]) -> None:
+        self._pieces: List[_Piece] = [_Piece(events, 0, len(events))] if len(events) else []
+        self._kinds, self._deltas = _columns(events)
+        self._starts: Optional[List[int]] = None
+        self._times: Optional[array] = None
+        self._buckets: Optional[TimeBuckets] = None
+        self._undo: List[Tuple[List[_Piece], bytearray, array]] = []
+        # Incrementata a ogni gruppo di modifiche (e annullamento)
+        self.revision = 0
+        # Gruppi applicati e non annullati rispetto agli eventi iniziali
+        self._edits = 0
+
+    def __len__(self) -> int:
+        return len(self._deltas)
+
+    @property
+    def modified(self) -> bool:
+        """
+        False se gli eventi sono quelli iniziali (anche dopo aver annullato
+        tutte le modifiche); oltre UNDO_DEPTH gruppi resta True.
+        """
+        return self._edits > 0
+
+    @property
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    # --- Lettura ---------------------------------------------------------
+
+    def _piece_starts(self) -> List[int]:
+        if self._starts is None:
+            self._starts = list(accumulate((p.stop - p.start for p in self._pieces), initial=0))
+        return self._starts
+
+    def event(self, index: int) -> Event:
+        """Evento in posizione `index` (decodificato solo lui)"""
+        if not 0 <= index < len(self):
+            raise IndexError("indice evento fuori intervallo")
+        starts = self._piece_starts()
+        p = bisect.bisect_right(starts, index) - 1
+        piece = self._pieces[p]
+        return self._with_delta(piece.seq, piece.seq[piece.start + index - starts[p]], self._deltas[index])
+
+    @staticmethod
+    def _with_delta(seq: Sequence[Event], ev: Event, delta: int) -> Event:
+        if ev.time_delta_ms == delta:
+            return ev
+        if isinstance(seq, MappedEvents):
+            # Evento appena decodificato, non condiviso: si modifica direttamente
+            ev.time_delta_ms = delta
+            return ev
+        return replace(ev, time_delta_ms=delta)
+
+    def kind(self, index: int) -> int:
+        return self._kinds[index]
+
+    def delta_of(self, index: int) -> int:
+        return self._deltas[index]
+
+    def events(self, start: int, stop: int) -> List[Event]:
+        return [self.event(i) for i in range(max(0, start), min(stop, len(self)))]
+
+    def __iter__(self) -> Iterator[Event]:
+        """Tutti gli eventi, decodificati a finestre (per il salvataggio)"""
+        deltas = self._deltas
+        with_delta = self._with_delta
+        i = 0
+        for piece in self._pieces:
+            seq = piece.seq
+            for a in range(piece.start, piece.stop, _READ_WINDOW):
+                for ev in seq[a:min(piece.stop, a + _READ_WINDOW)]:
+                    yield with_delta(seq, ev, deltas[i])
+                    i += 1
+
+    def times(self) -> array:
+        """Tempo di ogni evento dall'inizio della macro (somma delle pause), in ms"""
+        if self._times is None:
+            self._times = array("q", accumulate(self._deltas))
+        return self._times
+
+    @property
+    def duration_ms(self) -> int:
+        times = self.times()
+        return times[-1] if times else 0
+
+    def time_of(self, index: int) -> int:
+        return self.times()[index]
+
+    def index_at(self, ms: float) -> int:
+        """Primo evento con tempo >= ms"""
+        return min(bisect.bisect_left(self.times(), ms), max(0, len(self) - 1))
+
+    def buckets(self) -> TimeBuckets:
+        if self._buckets is None:
+            self._buckets = TimeBuckets(self.times(), bytes(self._kinds), self.duration_ms)
+        return self._buckets
+
+    # --- Modifiche -------------------------------------------------------
+
+    def apply(self, ops: Sequence[EditOp]) -> None:
+        """
+        Applica un gruppo di modifiche. Gli indici si riferiscono alla
+        sequenza prima del gruppo; gli intervalli non possono sovrapporsi e
+        un inserimento non può cadere all'interno di un intervallo (solo ai
+        suoi estremi). Un inserimento nella posizione iniziale di un
+        intervallo eliminato lo sostituisce; gli eventi inseriti non vengono
+        toccati dalle altre operazioni del gruppo. Più inserimenti nella
+        stessa posizione mantengono l'ordine del gruppo.
+        """
+        if not ops:
+            return
+        n = len(self)
+        ranges = sorted((op.start, op.stop) for op in ops if not isinstance(op, InsertEvents))
+        for start, stop in ranges:
+            if not 0 <= start <= stop <= n:
+                raise TimelineError(f"Intervallo non valido: {start}-{stop}")
+        for (_, stop), (start, _) in zip(ranges, ranges[1:]):
+            if start < stop:
+                raise TimelineError("Gli intervalli di un gruppo di modifiche non possono sovrapporsi")
+        starts = [start for start, _ in ranges]
+        for op in ops:
+            if not isinstance(op, InsertEvents):
+                continue
+            if not 0 <= op.index <= n:
+                raise TimelineError(f"Posizione non valida: {op.index}")
+            # Intervallo che inizia prima della posizione: l'inserimento non può caderci dentro
+            r = bisect.bisect_left(starts, op.index) - 1
+            if r >= 0 and op.index < ranges[r][1]:
+                raise TimelineError(f"Posizione {op.index} all'interno dell'intervallo {ranges[r][0]}-{ranges[r][1]}")
+
+        self._undo.append((list(self._pieces), bytearray(self._kinds), array("I", self._deltas)))
+        del self._undo[:-UNDO_DEPTH]
+        # Dalla fine all'inizio: le posizioni precedenti restano valide. Nella stessa
+        # posizione l'intervallo va prima dell'inserimento e gli inserimenti in ordine inverso
+        keyed = [
+            ((op.index, 0, i) if isinstance(op, InsertEvents) else (op.start, 1, i), op)
+            for i, op in enumerate(ops)
+        ]
+        keyed.sort(key=lambda item: item[0], reverse=True)
+        for _, op in keyed:
+            if isinstance(op, DeleteRange):
+                self._delete(op.start, op.stop)
+            elif isinstance(op, RetimeRange):
+                self._retime(op)
+            else:
+                self._insert(op.index, op.events)
+        self._edits += 1
+        self._changed()
+
+    def undo(self) -> bool:
+        if not self._undo:
+            return False
+        self._pieces, self._kinds, self._deltas = self._undo.pop()
+        self._edits -= 1
+        self._changed()
+        return True
+
+    def _changed(self) -> None:
+        self._starts = None
+        self._times = None
+        self._buckets = None
+        self.revision += 1
+
+    def _split(self, at: int) -> int:
+        """Indice del pezzo che inizia in posizione `at` (dividendo un pezzo se serve)"""
+        starts = self._piece_starts()
+        p = bisect.bisect_left(starts, at)
+        if p < len(starts) and starts[p] == at:
+            return p
+        p -= 1
+        piece = self._pieces[p]
+        cut = piece.start + at - starts[p]
+        self._pieces[p:p + 1] = [piece._replace(stop=cut), piece._replace(start=cut)]
+        self._starts = None
+        return p + 1
+
+    def _delete(self, start: int, stop: int) -> None:
+        if start >= stop:
+            return
+        first = self._split(start)
+        last = self._split(stop)
+        del self._pieces[first:last]
+        self._starts = None
+        del self._kinds[start:stop]
+        del self._deltas[start:stop]
+
+    def _retime(self, op: RetimeRange) -> None:
+        if op.delta_ms is not None:
+            fixed = max(0, min(int(op.delta_ms), _MAX_DELTA_MS))
+            self._deltas[op.start:op.stop] = array("I", [fixed]) * (op.stop - op.start)
+        else:
+            scale = max(0.0, float(op.scale))
+            self._deltas[op.start:op.stop] = array("I", (min(int(round(d * scale)), _MAX_DELTA_MS) for d in self._deltas[op.start:op.stop]))
+
+    def _insert(self, index: int, events: Sequence[Event]) -> None:
+        if not events:
+            return
+        events = list(events)
+        p = self._split(index) if index < len(self) else len(self._pieces)
+        self._pieces.insert(p, _Piece(events, 0, len(events)))
+        self._starts = None
+        kinds, deltas = _columns(events)
+        self._kinds[index:index] = kinds
+        self._deltas[index:index] = deltas
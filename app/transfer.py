@@ -0,0 +1,258 @@
+"""
+Importazione ed esportazione di macro in JSON a flusso.
+
+L'esportazione scrive gli eventi uno alla volta, senza costruire né il
+dizionario completo della macro né la stringa JSON intera. L'importazione
+legge il file a blocchi e decodifica un evento alla volta. In entrambi i
+casi la memoria usata oltre agli eventi della macro resta costante; le
+registrazioni molto grandi possono essere importate direttamente in un file
+di eventi mappato (app/eventfile.py).
+
+Il formato è lo stesso di Macro.to_dict / Macro.from_dict.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import fields
+from itertools import chain
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+from .eventfile import MAPPED_EVENTS_THRESHOLD, MappedEvents, write_event_file
+from .models import Event, Macro, event_to_dict
+from .schema import SCHEMA_VERSION, SchemaError, decode_event, decode_macro, schema_version
+
+ProgressCallback = Callable[[int, int], None]
+
+# Dimensione dei blocchi letti dal file
+READ_CHUNK = 64 * 1024
+# Eventi tra due chiamate del callback di avanzamento
+PROGRESS_EVERY = 4096
+
+_META_FIELDS = tuple(f.name for f in fields(Macro) if f.name != "events")
+
+
+class StreamFormatError(ValueError):
+    """File JSON non valido o struttura inattesa"""
+
+
+def export_macro(macro: Macro, path: Path, progress: Optional[ProgressCallback] = None) -> int:
+    """
+    Esporta la macro in JSON scrivendo un evento alla volta.
+    Il file viene sostituito solo a esportazione completata.
+
+    Returns:
+        numero di eventi esportati
+    """
+    path = Path(path)
+    total = len(macro.events)
+    tmp = path.with_name(path.name + ".tmp")
+    count = 0
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(f'{{\n  "schema": {SCHEMA_VERSION},\n')
+            for name in _META_FIELDS:
+                value = json.dumps(getattr(macro, name), ensure_ascii=False)
+                f.write(f'  {json.dumps(name)}: {value},\n')
+            f.write('  "events": [')
+            for ev in macro.events:
+                f.write(",\n    " if count else "\n    ")
+                f.write(json.dumps(event_to_dict(ev), ensure_ascii=False))
+                count += 1
+                if progress is not None and count % PROGRESS_EVERY == 0:
+                    progress(count, total)
+            f.write("\n  ]\n}\n" if count else "]\n}\n")
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    if progress is not None:
+        progress(count, total)
+    return count
+
+
+class _JsonStream:
+    """Lettura a blocchi di un documento JSON con decodifica dei singoli valori"""
+
+    def __init__(self, f: TextIO) -> None:
+        self._f = f
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+        # Caratteri già scartati dal buffer (per la posizione negli errori)
+        self._consumed = 0
+
+    @property
+    def offset(self) -> int:
+        return self._consumed + self._pos
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        data = self._f.read(READ_CHUNK)
+        if not data:
+            self._eof = True
+            return False
+        # Scarta la parte già letta per mantenere il buffer piccolo
+        self._consumed += self._pos
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Prossimo carattere non di spaziatura ("" a fine file)"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        found = self.peek()
+        if found != ch:
+            raise StreamFormatError(f"Atteso {ch!r} alla posizione {self.offset}, trovato {found or 'fine file'!r}")
+        self._pos += 1
+
+    def value(self) -> Any:
+        """Decodifica il valore JSON successivo"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError as exc:
+                if self._fill():
+                    continue
+                raise StreamFormatError(f"JSON non valido alla posizione {self._consumed + exc.pos}: {exc.msg}") from exc
+            # Un numero alla fine del buffer potrebbe continuare nel blocco successivo
+            if end >= len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def iter_macro_json(f: TextIO) -> Iterator[Tuple[str, Any]]:
+    """
+    Legge un file di macro a flusso.
+
+    Yields:
+        ("meta", (chiave, valore)) per i campi della macro e
+        ("event", (posizione nel file, valore)) per ogni evento, nell'ordine del file
+    """
+    stream = _JsonStream(f)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        if not isinstance(key, str):
+            raise StreamFormatError(f"Chiave non valida alla posizione {stream.offset}")
+        stream.expect(":")
+        if key == "events":
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.expect("]")
+            else:
+                while True:
+                    stream.peek()
+                    offset = stream.offset
+                    yield "event", (offset, stream.value())
+                    if stream.peek() == ",":
+                        stream.expect(",")
+                        continue
+                    stream.expect("]")
+                    break
+        else:
+            yield "meta", (key, stream.value())
+        if stream.peek() == ",":
+            stream.expect(",")
+            continue
+        stream.expect("}")
+        return
+
+
+def _iter_events(f: TextIO, meta: Dict[str, Any], total: int, progress: Optional[ProgressCallback]) -> Iterator[Event]:
+    """Eventi decodificati uno alla volta; i campi della macro vengono raccolti in `meta`"""
+    count = 0
+    version: Optional[int] = None
+    for kind, item in iter_macro_json(f):
+        if kind == "meta":
+            meta[item[0]] = item[1]
+            continue
+        offset, raw = item
+        try:
+            if version is None:
+                # I campi della macro precedono gli eventi nei file esportati
+                version = schema_version(meta)
+            ev = decode_event(raw, version, meta.get("id"), count)
+        except SchemaError as exc:
+            raise StreamFormatError(f"{exc} (posizione {offset})") from exc
+        count += 1
+        if progress is not None and count % PROGRESS_EVERY == 0:
+            progress(f.buffer.tell() if hasattr(f, "buffer") else 0, total)
+        yield ev
+
+
+def read_macro(
+    f: TextIO,
+    total: int = 0,
+    progress: Optional[ProgressCallback] = None,
+    events_file: Optional[Callable[[str], Path]] = None,
+) -> Macro:
+    """
+    Legge una macro esportata da un file di testo aperto, a flusso.
+    L'avanzamento è riportato in byte letti su `total`.
+
+    Con `events_file` (id della macro -> percorso), oltre MAPPED_EVENTS_THRESHOLD
+    eventi il resto del file viene scritto a flusso in un file di eventi e la
+    macro riceve un MappedEvents invece della lista.
+    """
+    meta: Dict[str, Any] = {}
+    decoded = _iter_events(f, meta, total, progress)
+    events: Sequence[Event] = []
+    buffered: List[Event] = []
+    for ev in decoded:
+        buffered.append(ev)
+        if events_file is not None and len(buffered) >= MAPPED_EVENTS_THRESHOLD:
+            path = events_file(str(meta.get("id") or "import"))
+            write_event_file(path, chain(buffered, decoded))
+            buffered = []
+            events = MappedEvents(path)
+            break
+    else:
+        events = buffered
+    try:
+        macro = decode_macro(meta, with_events=False)
+    except SchemaError as exc:
+        if isinstance(events, MappedEvents):
+            events.close()
+            events.path.unlink(missing_ok=True)
+        raise StreamFormatError(str(exc)) from exc
+    macro.events = events
+    return macro
+
+
+def import_macro(
+    path: Path,
+    progress: Optional[ProgressCallback] = None,
+    events_file: Optional[Callable[[str], Path]] = None,
+) -> Macro:
+    """
+    Importa una macro esportata leggendo il file a flusso.
+    L'avanzamento è riportato in byte letti sul totale del file; per
+    `events_file` vedi read_macro.
+    """
+    path = Path(path)
+    total = max(1, path.stat().st_size)
+    with open(path, "r", encoding="utf-8") as f:
+        macro = read_macro(f, total, progress, events_file)
+    if progress is not None:
+        progress(total, total)
+    return macro
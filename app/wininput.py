@@ -7,6 +7,8 @@ import time
 import ctypes
 from ctypes import wintypes
 
+from .display import get_display_cache
+
 user32 = ctypes.windll.user32
 
 # Compatibilità ULONG_PTR
@@ -29,6 +31,10 @@ MOUSEEVENTF_ABSOLUTE = 0x8000
 
 WHEEL_DELTA = 120
 
+# Keyboard event flags
+KEYEVENTF_KEYUP = 0x0002
+KEYEVENTF_UNICODE = 0x0004
+
 # Virtual screen metrics indices
 SM_XVIRTUALSCREEN = 76
 SM_YVIRTUALSCREEN = 77
@@ -45,14 +51,24 @@ class MOUSEINPUT(ctypes.Structure):
         ("dwExtraInfo", ULONG_PTR),
     ]
 
+class KEYBDINPUT(ctypes.Structure):
+    _fields_ = [
+        ("wVk", wintypes.WORD),
+        ("wScan", wintypes.WORD),
+        ("dwFlags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", ULONG_PTR),
+    ]
+
 class _INPUTUNION(ctypes.Union):
-    _fields_ = [("mi", MOUSEINPUT)]
+    _fields_ = [("mi", MOUSEINPUT), ("ki", KEYBDINPUT)]
 
 class INPUT(ctypes.Structure):
     _anonymous_ = ("u",)
     _fields_ = [("type", wintypes.DWORD), ("u", _INPUTUNION)]
 
 INPUT_MOUSE = 0
+INPUT_KEYBOARD = 1
 
 # Configure SendInput signature
 user32.SendInput.argtypes = (wintypes.UINT, ctypes.POINTER(INPUT), ctypes.c_int)
@@ -108,12 +124,18 @@ def _send_mouse_input(flags: int, data: int = 0, dx: int = 0, dy: int = 0, retry
 
 
 def _virtual_screen_metrics():
-    """Ottiene le metriche dello schermo virtuale per coordinate assolute"""
-    vx = user32.GetSystemMetrics(SM_XVIRTUALSCREEN)
-    vy = user32.GetSystemMetrics(SM_YVIRTUALSCREEN)
-    vw = user32.GetSystemMetrics(SM_CXVIRTUALSCREEN)
-    vh = user32.GetSystemMetrics(SM_CYVIRTUALSCREEN)
-    return vx, vy, vw, vh
+    """
+    Ottiene le metriche dello schermo virtuale per coordinate assolute
+    Usa la topologia in cache, aggiornata solo ai cambi di configurazione dei display
+    """
+    try:
+        return get_display_cache().get().virtual
+    except Exception:
+        vx = user32.GetSystemMetrics(SM_XVIRTUALSCREEN)
+        vy = user32.GetSystemMetrics(SM_YVIRTUALSCREEN)
+        vw = user32.GetSystemMetrics(SM_CXVIRTUALSCREEN)
+        vh = user32.GetSystemMetrics(SM_CYVIRTUALSCREEN)
+        return vx, vy, vw, vh
 
 
 def _normalize_abs_coordinates(x: int, y: int) -> tuple[int, int]:
@@ -344,4 +366,58 @@ def mouse_double_click(button: str, click_interval: float = 0.05) -> None:
     """
     mouse_click(button)
     time.sleep(max(0.01, click_interval))
-    mouse_click(button)
\ No newline at end of file
+    mouse_click(button)
+
+
+def send_unicode_text(text: str, batch_chars: int = 32) -> int:
+    """
+    Digita una stringa tramite SendInput con KEYEVENTF_UNICODE
+    Ogni lotto di caratteri viene inviato con una sola chiamata SendInput,
+    indipendentemente dal layout di tastiera e dallo stato dei modificatori.
+    
+    Args:
+        text: Testo da digitare
+        batch_chars: Numero massimo di caratteri per chiamata SendInput
+        
+    Returns:
+        Numero di caratteri iniziali di `text` inviati completamente
+    """
+    chars = list(text)
+    sent_chars = 0
+    
+    for start in range(0, len(chars), max(1, batch_chars)):
+        batch = chars[start:start + max(1, batch_chars)]
+        
+        # Ogni carattere diventa una o due unità UTF-16 (coppie surrogate)
+        units_per_char = []
+        units = []
+        for ch in batch:
+            data = ch.encode("utf-16-le")
+            char_units = [int.from_bytes(data[i:i + 2], "little") for i in range(0, len(data), 2)]
+            units_per_char.append(len(char_units))
+            units.extend(char_units)
+        
+        inputs = (INPUT * (len(units) * 2))()
+        for i, unit in enumerate(units):
+            for j, flags in enumerate((KEYEVENTF_UNICODE, KEYEVENTF_UNICODE | KEYEVENTF_KEYUP)):
+                inp = inputs[2 * i + j]
+                inp.type = INPUT_KEYBOARD
+                inp.ki = KEYBDINPUT(0, unit, flags, 0, 0)
+        
+        sent = user32.SendInput(len(inputs), inputs, ctypes.sizeof(INPUT))
+        
+        if sent != len(inputs):
+            # Conta solo i caratteri i cui eventi sono stati inviati tutti
+            remaining = max(0, int(sent))
+            for n_units in units_per_char:
+                if remaining < n_units * 2:
+                    break
+                remaining -= n_units * 2
+                sent_chars += 1
+            return sent_chars
+        
+        sent_chars += len(batch)
+        # Breve pausa per non saturare la coda di input dell'applicazione
+        time.sleep(0.002)
+    
+    return sent_chars
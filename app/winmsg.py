@@ -1,7 +1,13 @@
 import ctypes
+import threading
 from ctypes import wintypes
+from typing import Dict, List, Optional, Protocol, Tuple
 
-user32 = ctypes.windll.user32
+try:
+    user32 = ctypes.windll.user32
+except AttributeError:
+    # Fuori da Windows è utilizzabile solo con un WindowTreeProvider sostitutivo
+    user32 = None
 
 # Structures
 class POINT(ctypes.Structure):
@@ -21,14 +27,31 @@ MK_RBUTTON = 0x0002
 MK_MBUTTON = 0x0010
 
 # Prototypes
-user32.WindowFromPoint.argtypes = (POINT,)
-user32.WindowFromPoint.restype = wintypes.HWND
+if user32 is not None:
+    user32.WindowFromPoint.argtypes = (POINT,)
+    user32.WindowFromPoint.restype = wintypes.HWND
 
-user32.ScreenToClient.argtypes = (wintypes.HWND, ctypes.POINTER(POINT))
-user32.ScreenToClient.restype = wintypes.BOOL
+    user32.ScreenToClient.argtypes = (wintypes.HWND, ctypes.POINTER(POINT))
+    user32.ScreenToClient.restype = wintypes.BOOL
 
-user32.PostMessageW.argtypes = (wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM)
-user32.PostMessageW.restype = wintypes.BOOL
+    user32.ClientToScreen.argtypes = (wintypes.HWND, ctypes.POINTER(POINT))
+    user32.ClientToScreen.restype = wintypes.BOOL
+
+    user32.GetWindowRect.argtypes = (wintypes.HWND, ctypes.POINTER(wintypes.RECT))
+    user32.GetWindowRect.restype = wintypes.BOOL
+
+    user32.IsWindow.argtypes = (wintypes.HWND,)
+    user32.IsWindow.restype = wintypes.BOOL
+
+    user32.PostMessageW.argtypes = (wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM)
+    user32.PostMessageW.restype = wintypes.BOOL
+
+# (hwnd, x client, y client)
+ClickTarget = Tuple[int, int, int]
+Rect = Tuple[int, int, int, int]
+
+# Lato in pixel delle celle dello schermo usate come chiave della cache
+DEFAULT_CELL_SIZE = 16
 
 
 def _make_lparam(x: int, y: int) -> int:
@@ -44,20 +67,181 @@ def _btn_msgs(button: str):
     return WM_MBUTTONDOWN, WM_MBUTTONUP, MK_MBUTTON
 
 
-def post_click_at_screen(x: int, y: int, button: str = "left") -> bool:
-    pt = POINT(int(x), int(y))
-    hwnd = user32.WindowFromPoint(pt)
-    if not hwnd:
-        return False
-    # convert to client coords
-    client = POINT(pt.x, pt.y)
-    if not user32.ScreenToClient(hwnd, ctypes.byref(client)):
+class WindowTreeProvider(Protocol):
+    """Accesso all'albero delle finestre usato dalla risoluzione dei click"""
+
+    def window_from_point(self, x: int, y: int) -> int:
+        ...
+
+    def client_origin(self, hwnd: int) -> Optional[Tuple[int, int]]:
+        ...
+
+    def window_rect(self, hwnd: int) -> Optional[Rect]:
+        ...
+
+    def is_window(self, hwnd: int) -> bool:
+        ...
+
+    def post_message(self, hwnd: int, msg: int, wparam: int, lparam: int) -> bool:
+        ...
+
+
+class Win32WindowTree:
+    """Albero delle finestre reale tramite user32"""
+
+    def window_from_point(self, x: int, y: int) -> int:
+        return user32.WindowFromPoint(POINT(int(x), int(y))) or 0
+
+    def client_origin(self, hwnd: int) -> Optional[Tuple[int, int]]:
+        pt = POINT(0, 0)
+        if not user32.ClientToScreen(hwnd, ctypes.byref(pt)):
+            return None
+        return pt.x, pt.y
+
+    def window_rect(self, hwnd: int) -> Optional[Rect]:
+        rc = wintypes.RECT()
+        if not user32.GetWindowRect(hwnd, ctypes.byref(rc)):
+            return None
+        return rc.left, rc.top, rc.right, rc.bottom
+
+    def is_window(self, hwnd: int) -> bool:
+        return bool(user32.IsWindow(hwnd))
+
+    def post_message(self, hwnd: int, msg: int, wparam: int, lparam: int) -> bool:
+        return bool(user32.PostMessageW(hwnd, msg, wparam, lparam))
+
+
+class StaticWindowTree:
+    """
+    Albero delle finestre simulato, utilizzabile nei test e fuori da Windows.
+    Le finestre sono elencate in ordine Z, dalla più in alto.
+    """
+
+    def __init__(self, windows: Optional[List[Tuple[int, Rect, Tuple[int, int]]]] = None) -> None:
+        # (hwnd, rettangolo finestra, origine area client)
+        self.windows: List[Tuple[int, Rect, Tuple[int, int]]] = list(windows or [])
+        self.posted: List[Tuple[int, int, int, int]] = []
+        self.hit_tests = 0
+
+    def _find(self, hwnd: int):
+        return next((w for w in self.windows if w[0] == hwnd), None)
+
+    def window_from_point(self, x: int, y: int) -> int:
+        self.hit_tests += 1
+        for hwnd, (left, top, right, bottom), _ in self.windows:
+            if left <= x < right and top <= y < bottom:
+                return hwnd
+        return 0
+
+    def client_origin(self, hwnd: int) -> Optional[Tuple[int, int]]:
+        w = self._find(hwnd)
+        return w[2] if w else None
+
+    def window_rect(self, hwnd: int) -> Optional[Rect]:
+        w = self._find(hwnd)
+        return w[1] if w else None
+
+    def is_window(self, hwnd: int) -> bool:
+        return self._find(hwnd) is not None
+
+    def post_message(self, hwnd: int, msg: int, wparam: int, lparam: int) -> bool:
+        self.posted.append((hwnd, msg, wparam, lparam))
+        return True
+
+
+class ClickTargetCache:
+    """
+    Cache della finestra destinazione dei click in background.
+
+    Le voci sono indicizzate per cella dello schermo e contengono handle,
+    origine dell'area client e rettangolo della finestra. Un click nella
+    stessa cella riusa la voce dopo una sola verifica sulla finestra in cache
+    (GetWindowRect, che fallisce anche per le finestre distrutte): l'hit test
+    (WindowFromPoint) e la lettura dell'origine client vengono ripetuti solo
+    se la finestra è stata chiusa, spostata o ridimensionata o se il punto
+    esce dal suo rettangolo. Finestre aperte sopra la voce o figlie nella
+    stessa cella vengono viste solo dopo clear() (il player usa una cache
+    nuova per ogni riproduzione o serie di macro in coda).
+    """
+
+    def __init__(self, provider: Optional[WindowTreeProvider] = None, cell_size: int = DEFAULT_CELL_SIZE) -> None:
+        self._provider: WindowTreeProvider = provider or Win32WindowTree()
+        self._cell = max(1, int(cell_size))
+        self._entries: Dict[Tuple[int, int], Tuple[int, Tuple[int, int], Rect]] = {}
+        self._lock = threading.Lock()
+        self._last_move: Optional[Tuple[int, int]] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def provider(self) -> WindowTreeProvider:
+        return self._provider
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._last_move = None
+
+    def resolve(self, x: int, y: int) -> Optional[ClickTarget]:
+        x, y = int(x), int(y)
+        key = (x // self._cell, y // self._cell)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                hwnd, (ox, oy), rect = entry
+                left, top, right, bottom = rect
+                if left <= x < right and top <= y < bottom and self._provider.window_rect(hwnd) == rect:
+                    self.hits += 1
+                    return hwnd, x - ox, y - oy
+                del self._entries[key]
+
+            self.misses += 1
+            hwnd = self._provider.window_from_point(x, y)
+            if not hwnd:
+                return None
+            rect = self._provider.window_rect(hwnd)
+            origin = self._provider.client_origin(hwnd)
+            if origin is None or rect is None:
+                return None
+            self._entries[key] = (hwnd, origin, rect)
+            return hwnd, x - origin[0], y - origin[1]
+
+    def post_click(self, target: ClickTarget, button: str = "left") -> bool:
+        hwnd, cx, cy = target
+        down_msg, up_msg, wbtn = _btn_msgs(button)
+        lparam = _make_lparam(cx, cy)
+        # WM_MOUSEMOVE solo se finestra o posizione sono cambiate dal click precedente
+        if self._last_move != (hwnd, lparam):
+            self._provider.post_message(hwnd, WM_MOUSEMOVE, 0, lparam)
+            self._last_move = (hwnd, lparam)
+        # Down/Up
+        self._provider.post_message(hwnd, down_msg, wbtn, lparam)
+        self._provider.post_message(hwnd, up_msg, 0, lparam)
+        return True
+
+
+_default_cache: Optional[ClickTargetCache] = None
+
+
+def _get_default_cache() -> ClickTargetCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ClickTargetCache()
+    return _default_cache
+
+
+def resolve_click_target(x: int, y: int, cache: Optional[ClickTargetCache] = None) -> Optional[ClickTarget]:
+    """Restituisce (hwnd, x client, y client) della finestra sotto il punto, None se assente"""
+    return (cache or _get_default_cache()).resolve(x, y)
+
+
+def post_click_to_target(target: ClickTarget, button: str = "left", cache: Optional[ClickTargetCache] = None) -> bool:
+    return (cache or _get_default_cache()).post_click(target, button)
+
+
+def post_click_at_screen(x: int, y: int, button: str = "left", cache: Optional[ClickTargetCache] = None) -> bool:
+    cache = cache or _get_default_cache()
+    target = cache.resolve(x, y)
+    if target is None:
         return False
-    down_msg, up_msg, wbtn = _btn_msgs(button)
-    lparam = _make_lparam(client.x, client.y)
-    # Optional move
-    user32.PostMessageW(hwnd, WM_MOUSEMOVE, 0, lparam)
-    # Down/Up
-    user32.PostMessageW(hwnd, down_msg, wbtn, lparam)
-    user32.PostMessageW(hwnd, up_msg, 0, lparam)
-    return True
+    return cache.post_click(target, button)
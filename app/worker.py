@@ -0,0 +1,233 @@
+"""
+Riproduzione in un processo separato controllato tramite pipe.
+
+Evita che il ciclo di riproduzione competa per il GIL con il ciclo eventi Qt
+e con i sink di logging del processo GUI.
+
+Protocollo: ogni messaggio è una tupla (comando, payload).
+
+    GUI -> worker:  ("load", dict) ("play", None) ("stop", None) ("pause", None)
+                    ("resume", None) ("status", None) ("quit", None)
+    worker -> GUI:  ("loaded", n_eventi) ("progress", (eseguiti, totali))
+                    ("finished", ok) ("status", dict) ("error", messaggio)
+
+Gli eventi viaggiano nel formato binario compatto di `codec`.
+"""
+
+from __future__ import annotations
+
+import multiprocessing as mp
+import threading
+from dataclasses import fields
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+from .codec import decode_events, encode_events
+from .eventfile import MappedEvents
+from .models import Macro
+
+# Intervallo minimo tra due aggiornamenti di avanzamento inviati alla GUI
+PROGRESS_INTERVAL_S = 0.1
+
+
+def _macro_payload(macro: Macro, playback_settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    meta = {f.name: getattr(macro, f.name) for f in fields(Macro) if f.name != "events"}
+    payload: Dict[str, Any] = {"meta": meta, "playback": dict(playback_settings or {})}
+    if isinstance(macro.events, MappedEvents):
+        if macro.events.call_ids():
+            # Il processo non ha accesso alla libreria: le chiamate andrebbero perse
+            raise ValueError(f"La macro {macro.id} richiama altre macro: va espansa prima dell'invio")
+        # Il processo apre lo stesso file mappato invece di ricevere gli eventi
+        payload["events_file"] = str(macro.events.path)
+    else:
+        payload["events"] = encode_events(macro.events)
+    return payload
+
+
+def _worker_main(conn) -> None:
+    """Ciclo principale del processo di riproduzione"""
+    from .player import PLAY_FAILED, Player
+
+    player = Player()
+    send_lock = threading.Lock()
+    state: Dict[str, Any] = {"macro": None, "thread": None, "progress": (0, 0)}
+
+    def send(cmd: str, payload: Any = None) -> None:
+        with send_lock:
+            try:
+                conn.send((cmd, payload))
+            except (OSError, EOFError):
+                pass
+
+    def on_progress(done: int, total: int) -> None:
+        state["progress"] = (done, total)
+        send("progress", (done, total))
+
+    player.set_progress_callback(on_progress, PROGRESS_INTERVAL_S)
+
+    def run(macro: Macro) -> None:
+        try:
+            ok = player.play(macro.events, with_pauses=macro.with_pauses, repetitions=macro.repetitions, macro=macro) != PLAY_FAILED
+        except Exception as exc:
+            ok = False
+            logger.exception("Playback failed: {}", exc)
+        send("finished", ok)
+
+    def is_playing() -> bool:
+        thread = state["thread"]
+        return thread is not None and thread.is_alive()
+
+    while True:
+        try:
+            cmd, payload = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        try:
+            if cmd == "load":
+                player.configure(payload.get("playback", {}))
+                meta = dict(payload["meta"])
+                if payload.get("events_file"):
+                    events = MappedEvents(payload["events_file"])
+                else:
+                    events = decode_events(payload["events"])
+                state["macro"] = Macro(events=events, **meta)
+                send("loaded", len(state["macro"].events))
+            elif cmd == "play":
+                if state["macro"] is None:
+                    send("error", "Nessuna macro caricata")
+                    send("finished", False)
+                elif not is_playing():
+                    state["progress"] = (0, 0)
+                    state["thread"] = threading.Thread(target=run, args=(state["macro"],), daemon=True)
+                    state["thread"].start()
+            elif cmd == "stop":
+                player.stop()
+            elif cmd == "pause":
+                player.pause()
+            elif cmd == "resume":
+                player.resume()
+            elif cmd == "status":
+                macro = state["macro"]
+                send("status", {
+                    "loaded": macro.id if macro is not None else None,
+                    "playing": is_playing(),
+                    "paused": player.is_paused,
+                    "progress": state["progress"],
+                })
+            elif cmd == "quit":
+                player.stop()
+                break
+            else:
+                send("error", f"Comando sconosciuto: {cmd}")
+        except Exception as exc:
+            logger.exception("Errore comando worker {}: {}", cmd, exc)
+            send("error", str(exc))
+
+    if is_playing():
+        state["thread"].join(timeout=2.0)
+
+
+class PlaybackWorker:
+    """
+    Lato GUI del processo di riproduzione.
+    I callback vengono invocati dal thread di ascolto della pipe.
+    """
+
+    def __init__(
+        self,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        on_finished: Optional[Callable[[bool], None]] = None,
+        on_status: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> None:
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.on_status = on_status
+        self._conn = None
+        self._proc: Optional[mp.process.BaseProcess] = None
+        self._listener: Optional[threading.Thread] = None
+        self._send_lock = threading.Lock()
+        self._playing = False
+
+    @property
+    def is_alive(self) -> bool:
+        return self._proc is not None and self._proc.is_alive()
+
+    def start(self) -> None:
+        if self.is_alive:
+            return
+        ctx = mp.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        self._proc = ctx.Process(target=_worker_main, args=(child_conn,), name="MacroPlaybackWorker", daemon=True)
+        self._proc.start()
+        child_conn.close()
+        self._conn = parent_conn
+        self._listener = threading.Thread(target=self._listen, name="MacroPlaybackWorkerListener", daemon=True)
+        self._listener.start()
+        logger.info("Processo di riproduzione avviato (pid {})", self._proc.pid)
+
+    def load(self, macro: Macro, playback_settings: Optional[Dict[str, Any]] = None) -> None:
+        self._send("load", _macro_payload(macro, playback_settings))
+
+    def play(self) -> None:
+        self._playing = True
+        self._send("play")
+
+    def stop(self) -> None:
+        self._send("stop")
+
+    def pause(self) -> None:
+        self._send("pause")
+
+    def resume(self) -> None:
+        self._send("resume")
+
+    def request_status(self) -> None:
+        self._send("status")
+
+    def close(self, timeout: float = 2.0) -> None:
+        if self._proc is None:
+            return
+        self._send("quit")
+        self._proc.join(timeout)
+        if self._proc.is_alive():
+            self._proc.terminate()
+        if self._conn is not None:
+            self._conn.close()
+        self._proc = None
+        self._conn = None
+
+    def _send(self, cmd: str, payload: Any = None) -> None:
+        if self._conn is None:
+            raise RuntimeError("Processo di riproduzione non avviato")
+        with self._send_lock:
+            self._conn.send((cmd, payload))
+
+    def _listen(self) -> None:
+        conn = self._conn
+        while conn is not None:
+            try:
+                msg: Tuple[str, Any] = conn.recv()
+            except (EOFError, OSError):
+                break
+            cmd, payload = msg
+            try:
+                if cmd == "progress" and self.on_progress:
+                    self.on_progress(*payload)
+                elif cmd == "finished":
+                    self._playing = False
+                    if self.on_finished:
+                        self.on_finished(bool(payload))
+                elif cmd == "status" and self.on_status:
+                    self.on_status(payload)
+                elif cmd == "error":
+                    logger.warning("Errore processo di riproduzione: {}", payload)
+            except Exception as exc:
+                logger.debug(f"Errore callback worker: {exc}")
+
+        # Processo terminato durante una riproduzione: notifica comunque la fine
+        if self._playing:
+            self._playing = False
+            if self.on_finished:
+                self.on_finished(False)
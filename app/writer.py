@@ -0,0 +1,286 @@
+"""
+Scrittura dei file di archivio.
+
+Le scritture sono atomiche (file temporaneo + fsync + os.replace) e
+mantengono una copia di backup della versione precedente. StorageWriter le
+esegue su un thread dedicato, raggruppando le richieste ravvicinate: di una
+raffica di salvataggi dello stesso file viene scritto solo l'ultimo.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from loguru import logger
+
+# Attesa senza nuove richieste prima di scrivere
+DEFAULT_DEBOUNCE_S = 0.3
+# Ritardo massimo di una richiesta anche durante una raffica continua
+DEFAULT_MAX_DELAY_S = 2.0
+# Tentativi per ogni richiesta e attesa prima di ripetere una scrittura fallita
+MAX_WRITE_ATTEMPTS = 3
+RETRY_DELAY_S = 1.0
+
+BACKUP_SUFFIX = ".bak"
+TEMP_SUFFIX = ".tmp"
+
+
+# Chiave delle richieste: file da scrivere oppure nome di un'operazione (submit_task)
+WriteKey = Union[Path, str]
+
+
+class _Task:
+    """Operazione generica eseguita sul thread di scrittura"""
+
+    def __init__(self, fn: Callable[[], None]) -> None:
+        self.fn = fn
+
+
+def backup_path(path: Path) -> Path:
+    return path.with_name(path.name + BACKUP_SUFFIX)
+
+
+def fsync_dir(directory: Path) -> None:
+    """Rende persistente la rinomina (non supportato su Windows)"""
+    if os.name == "nt":
+        return
+    try:
+        fd = os.open(str(directory), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path: Path, data: bytes, keep_backup: bool = True) -> None:
+    """
+    Scrive il file in modo che dopo un crash esista sempre una versione
+    completa: quella nuova, oppure quella precedente nel file di backup.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + TEMP_SUFFIX)
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if keep_backup and path.exists():
+        os.replace(path, backup_path(path))
+    os.replace(tmp, path)
+    fsync_dir(path.parent)
+
+
+def encode_json(data: Any) -> bytes:
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+class StorageWriter:
+    """
+    Thread di scrittura con debounce.
+
+    submit() non esegue I/O: registra il contenuto da scrivere e ritorna
+    subito. Il contenuto deve essere una copia indipendente dagli oggetti che
+    il chiamante continua a modificare (es. il risultato di Macro.to_dict).
+
+    Una scrittura fallita resta in attesa e viene ripetuta dopo
+    RETRY_DELAY_S (se nel frattempo non è arrivato un contenuto più recente
+    per lo stesso file); dopo MAX_WRITE_ATTEMPTS tentativi viene scartata e
+    vengono chiamati i callback on_failed.
+    """
+
+    def __init__(
+        self,
+        debounce_s: float = DEFAULT_DEBOUNCE_S,
+        max_delay_s: float = DEFAULT_MAX_DELAY_S,
+        encoder: Callable[[Any], bytes] = encode_json,
+    ) -> None:
+        self._debounce_s = max(0.0, debounce_s)
+        self._max_delay_s = max(self._debounce_s, max_delay_s)
+        self._encoder = encoder
+        self._cond = threading.Condition()
+        # path -> contenuto più recente non ancora scritto
+        self._pending: Dict[WriteKey, Any] = {}
+        # path -> callback da eseguire dopo la scrittura riuscita
+        self._callbacks: Dict[WriteKey, List[Callable[[], None]]] = {}
+        # path -> callback da eseguire se la richiesta viene scartata
+        self._failure_callbacks: Dict[WriteKey, List[Callable[[Exception], None]]] = {}
+        # path -> tentativi falliti del contenuto in attesa
+        self._attempts: Dict[WriteKey, int] = {}
+        self._first_ts = 0.0
+        self._last_ts = 0.0
+        # Nessuna scrittura prima di questo istante (dopo un errore)
+        self._retry_ts = 0.0
+        self._writing = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.writes = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def submit(
+        self,
+        path: WriteKey,
+        data: Any,
+        on_written: Optional[Callable[[], None]] = None,
+        on_failed: Optional[Callable[[Exception], None]] = None,
+    ) -> None:
+        """
+        Accoda la scrittura di `data` in `path`, sostituendo quella ancora in attesa.
+        on_written viene chiamato dal thread di scrittura dopo che il file è stato
+        scritto (anche se nel frattempo il contenuto è stato sostituito);
+        on_failed se la scrittura viene scartata dopo gli errori. Per ogni
+        richiesta viene chiamato esattamente uno dei due.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("StorageWriter chiuso")
+            now = time.monotonic()
+            if not self._pending:
+                self._first_ts = now
+            if path in self._pending:
+                self.coalesced += 1
+            self._pending[path] = data
+            self._attempts.pop(path, None)
+            self._callbacks.setdefault(path, []).append(on_written or _noop)
+            self._failure_callbacks.setdefault(path, []).append(on_failed or _noop)
+            self._last_ts = now
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def submit_task(
+        self,
+        key: str,
+        fn: Callable[[], None],
+        on_written: Optional[Callable[[], None]] = None,
+        on_failed: Optional[Callable[[Exception], None]] = None,
+    ) -> None:
+        """
+        Accoda un'operazione da eseguire sul thread di scrittura (es. una
+        transazione su database). Come per i file, di più operazioni con la
+        stessa chiave ancora in attesa viene eseguita solo l'ultima.
+        """
+        self.submit(key, _Task(fn), on_written, on_failed)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Scrive subito le richieste in attesa e attende il completamento"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._first_ts = self._last_ts = self._retry_ts = 0.0  # Nessun debounce per le richieste correnti
+            self._cond.notify_all()
+            while self._pending or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="StorageWriter", daemon=True)
+            self._thread.start()
+
+    def _take_batch(self) -> Optional[Dict[WriteKey, tuple]]:
+        with self._cond:
+            while True:
+                if not self._pending:
+                    if self._closed:
+                        return None
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                due = min(self._last_ts + self._debounce_s, self._first_ts + self._max_delay_s)
+                due = max(due, self._retry_ts)
+                if now >= due:
+                    batch = {
+                        p: (d, self._callbacks.pop(p, []), self._failure_callbacks.pop(p, []), self._attempts.pop(p, 0))
+                        for p, d in self._pending.items()
+                    }
+                    self._pending = {}
+                    self._writing = True
+                    return batch
+                self._cond.wait(due - now)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            for path, (data, callbacks, failure_callbacks, attempts) in batch.items():
+                try:
+                    if isinstance(data, _Task):
+                        data.fn()
+                    else:
+                        atomic_write_bytes(path, self._encoder(data))
+                    self.writes += 1
+                except Exception as exc:
+                    logger.exception("Failed to write {}: {}", path, exc)
+                    self.failures += 1
+                    if self._requeue(path, data, callbacks, failure_callbacks, attempts + 1):
+                        continue
+                    # Richiesta scartata: chi attende la scrittura deve saperlo
+                    self._call(failure_callbacks, exc)
+                    continue
+                self._call(callbacks)
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+    def _requeue(self, path: WriteKey, data: Any, callbacks: list, failure_callbacks: list, attempts: int) -> bool:
+        """Rimette in attesa una richiesta fallita; False se va scartata"""
+        with self._cond:
+            if path in self._pending:
+                # Contenuto più recente già in attesa: sostituisce quello fallito
+                self._callbacks[path] = callbacks + self._callbacks.get(path, [])
+                self._failure_callbacks[path] = failure_callbacks + self._failure_callbacks.get(path, [])
+                return True
+            if attempts >= MAX_WRITE_ATTEMPTS or self._closed:
+                return False
+            if not self._pending:
+                self._first_ts = self._last_ts = time.monotonic()
+            self._pending[path] = data
+            self._callbacks[path] = callbacks
+            self._failure_callbacks[path] = failure_callbacks
+            self._attempts[path] = attempts
+            self._retry_ts = time.monotonic() + RETRY_DELAY_S
+            return True
+
+    @staticmethod
+    def _call(callbacks: list, *args: Any) -> None:
+        for cb in callbacks:
+            try:
+                cb(*args)
+            except Exception as exc:
+                logger.debug(f"Errore callback scrittura: {exc}")
+
+
+def _noop(*_args: Any) -> None:
+    pass
+
+
+_default_writer: Optional[StorageWriter] = None
+_default_lock = threading.Lock()
+
+
+def get_writer() -> StorageWriter:
+    """Writer condiviso dall'applicazione, svuotato automaticamente all'uscita"""
+    global _default_writer
+    with _default_lock:
+        if _default_writer is None:
+            _default_writer = StorageWriter()
+            atexit.register(_default_writer.flush, 10.0)
+        return _default_writer
@@ -0,0 +1,69 @@
+import random
+
+from app import allocator as allocator_module
+from app.allocator import RecordingAllocator, title_number
+from app.models import Macro
+
+
+def macro(mid, title):
+    return Macro(id=mid, title=title)
+
+
+def smallest_free(macros):
+    used = {title_number(m.title) for m in macros}
+    n = 1
+    while n in used:
+        n += 1
+    return n
+
+
+def test_title_number():
+    assert title_number("Registrazione n.7") == 7
+    assert title_number("Registrazione n. 12 prova") == 12
+    assert title_number("Registrazione n.3x") is None
+    assert title_number("Altra macro") is None
+
+
+def test_smallest_free_number_is_reused():
+    alloc = RecordingAllocator()
+    library = [macro(f"m{i}", f"Registrazione n.{i}") for i in range(1, 6)]
+    alloc.sync(library)
+    assert alloc.next_number() == 6
+    del library[1]
+    alloc.sync(library)
+    assert alloc.next_title() == "Registrazione n.2"
+    library[2].title = "Spesa"
+    alloc.rename("m4", "Spesa")
+    assert alloc.next_number() == 2
+    library.append(macro("m9", "Registrazione n.2"))
+    alloc.sync(library)
+    assert alloc.next_number() == 4
+
+
+def test_matches_brute_force_after_random_changes():
+    rng = random.Random(3)
+    alloc = RecordingAllocator()
+    library = []
+    for step in range(400):
+        choice = rng.random()
+        if choice < 0.5 or not library:
+            library.append(macro(f"m{step}", alloc.next_title() if rng.random() < 0.8 else f"Altro {step}"))
+        elif choice < 0.8:
+            library.pop(rng.randrange(len(library)))
+        else:
+            m = library[rng.randrange(len(library))]
+            m.title = f"Registrazione n.{rng.randint(1, 30)}"
+        alloc.sync(library)
+        assert alloc.next_number() == smallest_free(library)
+
+
+def test_new_ids_are_unique_and_increasing(monkeypatch):
+    monkeypatch.setattr(allocator_module.time, "time", lambda: 1.0)
+    alloc = RecordingAllocator()
+    # Id di una macro creata "nel futuro" (es. orologio spostato indietro)
+    alloc.sync([macro("rec-5000", "Registrazione n.1")])
+    ids = [alloc.new_id() for _ in range(3)]
+    assert ids == ["rec-5001", "rec-5002", "rec-5003"]
+    assert alloc.new_id("imp", taken={"imp-5004"}) == "imp-5005"
+    rec_id, title = alloc.allocate()
+    assert rec_id == "rec-5006" and title == "Registrazione n.2"
@@ -0,0 +1,132 @@
+import random
+
+from app.balance import BalanceReport, balance_events, check_balance, iter_balanced, verify_macro
+from app.models import ControlEvent, KeyEvent, Macro, MouseEvent
+
+
+def key(action, name, delta=0):
+    return KeyEvent(type="key", time_delta_ms=delta, action=action, key=name)
+
+
+def released(events):
+    return [ev.key for ev in events if isinstance(ev, KeyEvent) and ev.action == "release"]
+
+
+def test_balanced_sequence_is_unchanged():
+    events = [key("press", "a"), key("release", "a"), key("press", "shift"), key("release", "shift")]
+    out, report = balance_events(events)
+    assert out == events
+    assert report.balanced
+
+
+def test_left_and_right_modifiers_are_tracked_separately():
+    events = [
+        key("press", "left shift"),
+        key("press", "right shift"),
+        key("release", "left shift"),
+        key("release", "right shift"),
+    ]
+    out, report = balance_events(events)
+    assert out == events
+    assert report.removed == 0
+    assert report.balanced
+
+
+def test_generic_release_matches_sided_press():
+    events = [key("press", "left ctrl"), key("press", "c"), key("release", "c"), key("release", "ctrl")]
+    out, report = balance_events(events)
+    assert out == events
+    assert report.balanced
+
+
+def test_sided_release_matches_generic_press():
+    events = [key("press", "shift"), key("release", "right shift")]
+    out, report = balance_events(events)
+    assert out == events
+    assert report.balanced
+
+
+def test_release_without_press_is_removed():
+    out, report = balance_events([key("release", "right shift"), key("press", "a"), key("release", "a")])
+    assert released(out) == ["a"]
+    assert report.removed == 1
+
+
+def test_release_of_other_side_is_not_matched():
+    events = [key("press", "left shift"), key("release", "right shift")]
+    out, report = balance_events(events)
+    assert report.removed == 1
+    # Il tasto rimasto premuto viene rilasciato a fine macro
+    assert released(out) == ["left shift"]
+
+
+def test_held_key_is_released_at_end():
+    out, report = balance_events([key("press", "alt"), key("press", "tab")])
+    assert released(out) == ["tab", "alt"]
+    assert report.inserted == 2
+
+
+def test_key_pressed_in_loop_is_released_before_end():
+    events = [
+        ControlEvent(type="control", time_delta_ms=0, action="loop", count=3),
+        key("press", "a"),
+        ControlEvent(type="control", time_delta_ms=0, action="end"),
+    ]
+    out, report = balance_events(events)
+    assert [getattr(ev, "action", None) for ev in out] == ["loop", "press", "release", "end"]
+    assert report.inserted == 1
+
+
+def test_release_in_loop_of_key_held_before_is_moved_after_end():
+    events = [
+        key("press", "shift"),
+        ControlEvent(type="control", time_delta_ms=0, action="loop", count=2),
+        key("release", "shift"),
+        ControlEvent(type="control", time_delta_ms=0, action="end"),
+    ]
+    out, _ = balance_events(events)
+    assert [getattr(ev, "action", None) for ev in out] == ["press", "loop", "end", "release"]
+
+
+def test_unclosed_block_gets_an_end():
+    out, report = balance_events([ControlEvent(type="control", time_delta_ms=0, action="block", label="x")])
+    assert [ev.action for ev in out] == ["block", "end"]
+    assert report.inserted == 1
+
+
+def test_mouse_buttons_are_balanced():
+    events = [
+        MouseEvent(type="mouse", time_delta_ms=0, action="release", x=1, y=1, button="left"),
+        MouseEvent(type="mouse", time_delta_ms=0, action="press", x=5, y=6, button="right"),
+    ]
+    out, report = balance_events(events)
+    assert [(ev.action, ev.button, ev.x, ev.y) for ev in out] == [("press", "right", 5, 6), ("release", "right", 5, 6)]
+    assert report.removed == 1 and report.inserted == 1
+
+
+def test_verify_macro_marks_verified_and_fixes_events():
+    macro = Macro(id="m", title="M", events=[key("press", "a")])
+    report = verify_macro(macro)
+    assert macro.verified
+    assert not report.balanced
+    assert released(macro.events) == ["a"]
+
+
+def test_iter_balanced_matches_balance_events():
+    rng = random.Random(3)
+    names = ["a", "shift", "left shift", "ctrl"]
+    for _ in range(200):
+        events = []
+        for _ in range(rng.randint(0, 30)):
+            r = rng.random()
+            if r < 0.7:
+                events.append(KeyEvent(type="key", time_delta_ms=1, action=rng.choice(["press", "release"]), key=rng.choice(names)))
+            elif r < 0.85:
+                events.append(ControlEvent(type="control", time_delta_ms=0, action=rng.choice(["loop", "block"]), count=2))
+            else:
+                events.append(ControlEvent(type="control", time_delta_ms=0, action="end"))
+        expected, report = balance_events(list(events))
+        streamed = BalanceReport()
+        assert list(iter_balanced(events, streamed)) == expected
+        assert streamed == report
+        assert check_balance(events) == report
@@ -0,0 +1,68 @@
+from app.bulkimport import ParsedMacro, merge_parsed
+from app.models import CallEvent, KeyEvent, Macro
+
+
+def key(name):
+    return KeyEvent(type="key", time_delta_ms=10, action="press", key=name)
+
+
+def call(macro_id):
+    return CallEvent(type="call", time_delta_ms=0, macro_id=macro_id)
+
+
+def parsed(mid, events, digests):
+    return ParsedMacro(source=f"{mid}.json", macro=Macro(id=mid, title=mid.upper(), events=events), digests=digests)
+
+
+def no_duplicates(macros, macro, digests):
+    return None
+
+
+def numbered_ids():
+    counter = iter(range(1, 100))
+    return lambda taken: f"imp-{next(counter)}"
+
+
+def test_conflicting_ids_are_renamed_on_copies():
+    library = [Macro(id="a", title="Esistente")]
+    items = [parsed("a", [key("x")], ("d1",)), parsed("b", [call("a")], ("d2",))]
+    originals = [(p.macro.id, p.macro.events) for p in items]
+
+    result = merge_parsed(library, items, no_duplicates, numbered_ids())
+
+    assert [m.id for m in result.imported] == ["imp-1", "b"]
+    assert result.renamed == {"a": "imp-1"}
+    # La chiamata tra macro del blocco segue il nuovo id
+    assert result.imported[1].events == [call("imp-1")]
+    # Le macro lette non vengono modificate (es. --dry-run ripetuto)
+    assert [(p.macro.id, p.macro.events) for p in items] == originals
+    assert items[1].macro.events == [call("a")]
+    assert all(m is not p.macro for m, p in zip(result.imported, items))
+    assert [m.id for m in library] == ["a"]
+
+
+def test_dry_run_is_repeatable():
+    library = [Macro(id="a", title="Esistente")]
+    items = [parsed("a", [key("x")], ("d1",))]
+    first = merge_parsed(library, items, no_duplicates, numbered_ids())
+    second = merge_parsed(library, items, no_duplicates, numbered_ids())
+    assert first.renamed == second.renamed == {"a": "imp-1"}
+
+
+def test_duplicates_in_batch_and_library():
+    existing = Macro(id="lib", title="Libreria", events=[key("y")])
+
+    def find_duplicate(macros, macro, digests):
+        return existing if digests == ("dy",) else None
+
+    items = [
+        parsed("a", [key("x")], ("dx",)),
+        parsed("b", [key("x")], ("dx",)),
+        parsed("c", [key("y")], ("dy",)),
+        parsed("d", [call("b"), call("c")], ("dz",)),
+    ]
+    result = merge_parsed([existing], items, find_duplicate, numbered_ids())
+    assert [m.id for m in result.imported] == ["a", "d"]
+    assert result.duplicates == [("b.json", "A"), ("c.json", "Libreria")]
+    # Le chiamate ai duplicati puntano alla macro tenuta
+    assert result.imported[1].events == [call("a"), call("lib")]
@@ -0,0 +1,76 @@
+from app.bytecode import MAX_LOOP_COUNT, compile_program, run_program, run_stream
+from app.models import ControlEvent, KeyEvent
+
+
+def key(name):
+    return KeyEvent(type="key", time_delta_ms=0, action="press", key=name)
+
+
+def loop(count):
+    return ControlEvent(type="control", time_delta_ms=0, action="loop", count=count)
+
+
+def block(label):
+    return ControlEvent(type="control", time_delta_ms=0, action="block", label=label)
+
+
+def end():
+    return ControlEvent(type="control", time_delta_ms=0, action="end")
+
+
+def wait(ms):
+    return ControlEvent(type="control", time_delta_ms=0, action="wait", wait_ms=ms)
+
+
+def names(ops):
+    return [op.key if isinstance(op, KeyEvent) else op.action for op in ops]
+
+
+def test_nested_loops():
+    ops = [key("a"), loop(2), key("b"), loop(3), key("c"), end(), end(), key("d")]
+    program = compile_program(ops)
+    expected = ["a"] + (["b"] + ["c"] * 3) * 2 + ["d"]
+    assert names(run_program(program)) == expected
+    assert program.op_count == len(expected)
+    # Il corpo dei cicli non viene copiato nel programma
+    assert len(program.ops) == 4
+
+
+def test_zero_and_huge_loop_counts():
+    program = compile_program([loop(0), key("a"), loop(5), key("b"), end(), end(), key("c")])
+    assert names(run_program(program)) == ["c"]
+    assert program.op_count == 1
+    assert compile_program([loop(MAX_LOOP_COUNT * 10), key("a"), end()]).op_count == MAX_LOOP_COUNT
+
+
+def test_wait_is_an_operation_and_blocks_are_delimiters():
+    ops = [block("login"), key("a"), wait(500), end(), loop(2), wait(10), end()]
+    program = compile_program(ops)
+    assert names(run_program(program)) == ["a", "wait", "wait", "wait"]
+    assert program.labels == ["login"]
+
+
+def test_unbalanced_blocks():
+    # end senza inizio ignorato, ciclo non chiuso chiuso a fine macro
+    program = compile_program([end(), key("a"), loop(3), key("b")])
+    assert names(run_program(program)) == ["a", "b", "b", "b"]
+    assert program.op_count == 4
+
+
+def test_run_stream_matches_compiled_program():
+    ops = [key("a"), block("x"), key("b"), end(), loop(2), key("c"), loop(2), key("d"), end(), end(), wait(5), key("e")]
+    assert names(run_stream(iter(ops))) == names(run_program(compile_program(ops)))
+
+
+def test_run_stream_yields_before_reading_further():
+    consumed = []
+
+    def source():
+        for op in [key("a"), key("b"), loop(2), key("c"), end(), key("d")]:
+            consumed.append(op)
+            yield op
+
+    it = run_stream(source())
+    assert next(it).key == "a"
+    assert len(consumed) == 1
+    assert names(it) == ["b", "c", "c", "d"]
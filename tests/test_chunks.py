@@ -0,0 +1,88 @@
+import pytest
+
+from app import chunks as chunks_module
+from app import storage
+from app.chunks import ChunkStore
+from app.eventfile import MappedEvents, write_event_file
+from app.models import KeyEvent, Macro
+
+
+def key(i, delta=10):
+    return KeyEvent(type="key", time_delta_ms=delta, action="press", key=f"k{i}")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkStore(tmp_path / "chunks")
+
+
+def test_loads_do_not_share_event_instances(store):
+    events = [key(i) for i in range(300)]
+    digests = store.put("a", events)
+    store.put("b", events)
+
+    first = store.load("a", digests)
+    second = store.load("b", digests)
+    assert first == events and second == events
+    first[0].time_delta_ms = 999
+    # La modifica di una macro non deve comparire nell'altra che condivide i segmenti
+    assert second[0].time_delta_ms == 10
+    assert store.load("a", digests)[0].time_delta_ms == 10
+
+
+def test_read_cache_is_bounded(store, monkeypatch):
+    monkeypatch.setattr(chunks_module, "READ_CACHE_BYTES", 1)
+    digests = []
+    for n in range(5):
+        digests += store.put(f"m{n}", [key(n * 1000 + i) for i in range(50)])
+    for n, digest in enumerate(digests):
+        assert store.load(f"m{n}", (digest,)) is not None
+    assert len(store._read_cache) == 1
+    assert store._read_cache_bytes == len(next(iter(store._read_cache.values())))
+
+
+def test_released_chunks_leave_read_cache(store):
+    digests = store.put("a", [key(i) for i in range(20)])
+    store.set_references({"a": digests})
+    store.load("a", digests)
+    assert store._read_cache
+    store.set_references({})
+    assert not store._read_cache
+    assert store._read_cache_bytes == 0
+
+
+def test_corrupted_chunk_is_not_cached(store):
+    digests = store.put("a", [key(i) for i in range(20)])
+    store.path_for(digests[0]).write_bytes(b"rovinato")
+    assert store.load("a", digests) is None
+    assert not store._read_cache
+
+
+@pytest.fixture
+def chunk_store(store, monkeypatch):
+    monkeypatch.setattr(storage, "_chunk_store", store)
+    monkeypatch.setattr(storage, "_sqlite_store", None)
+    return store
+
+
+def test_find_duplicate_by_saved_chunks(chunk_store):
+    saved = Macro(id="a", title="A", events=[key(i) for i in range(40)])
+    chunk_store.set_references({"a": chunk_store.put("a", saved.events)})
+    other = Macro(id="b", title="B", events=[key(i) for i in range(40)])
+    assert storage.find_duplicate([saved], other) is saved
+
+
+def test_find_duplicate_compares_mapped_events_without_chunks(chunk_store, tmp_path):
+    events = [key(i) for i in range(40)]
+    path = tmp_path / "a.events"
+    write_event_file(path, events)
+    mapped = MappedEvents(path)
+    try:
+        library = [Macro(id="a", title="A", events=mapped)]
+        assert storage.find_duplicate(library, Macro(id="b", title="B", events=list(events))) is library[0]
+        changed = list(events)
+        changed[17] = key(17, delta=11)
+        assert storage.find_duplicate(library, Macro(id="c", title="C", events=changed)) is None
+        assert storage.find_duplicate(library, Macro(id="d", title="D", events=events[:-1])) is None
+    finally:
+        mapped.close()
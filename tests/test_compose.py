@@ -0,0 +1,110 @@
+import pytest
+
+from app import compose
+from app.bytecode import compile_program, run_program
+from app.compose import MacroCycleError, PlanCache, check_call_cycles, called_ids, find_call_cycle
+from app.eventfile import MappedEvents, write_event_file
+from app.models import CallEvent, ControlEvent, KeyEvent, Macro
+
+
+def key(name, delta=10, action="press"):
+    return KeyEvent(type="key", time_delta_ms=delta, action=action, key=name)
+
+
+def call(macro_id, repetitions=1, delta=0):
+    return CallEvent(type="call", time_delta_ms=delta, macro_id=macro_id, repetitions=repetitions)
+
+
+def test_cycle_is_reported():
+    macros = [Macro(id="a", title="A", events=[call("b")]), Macro(id="b", title="B", events=[key("x"), call("a")]), Macro(id="c", title="C", events=[call("a")])]
+    assert find_call_cycle(macros) == ["a", "b", "a"]
+    with pytest.raises(MacroCycleError):
+        check_call_cycles(macros)
+    assert find_call_cycle([Macro(id="a", title="A", events=[call("b"), call("missing")]), Macro(id="b", title="B", events=[key("x")])]) is None
+
+
+class CountingList(list):
+    iterations = 0
+
+    def __iter__(self):
+        CountingList.iterations += 1
+        return super().__iter__()
+
+
+def test_callees_are_computed_once_per_events_list():
+    m = Macro(id="cached", title="M", events=CountingList([call("x"), key("k")]))
+    CountingList.iterations = 0
+    assert called_ids(m) == {"x"}
+    # Stessa lista: nessuna nuova scansione degli eventi
+    assert called_ids(m) == {"x"}
+    assert CountingList.iterations == 1
+    m.events = [call("y")]
+    assert called_ids(m) == {"y"}
+
+
+def test_mapped_events_decode_only_calls(tmp_path, monkeypatch):
+    events = [key(f"k{i}") for i in range(500)]
+    events[17] = call("a")
+    events[400] = call("b", repetitions=3)
+    path = tmp_path / "m.events"
+    write_event_file(path, events)
+    mapped = MappedEvents(path)
+    try:
+        monkeypatch.setattr(MappedEvents, "__iter__", lambda self: pytest.fail("decodifica completa"))
+        assert called_ids(Macro(id="mapped", title="M", events=mapped)) == {"a", "b"}
+    finally:
+        mapped.close()
+
+
+def test_deleted_macros_leave_the_cache():
+    find_call_cycle([Macro(id="gone", title="G", events=[call("x")])])
+    find_call_cycle([Macro(id="kept", title="K", events=[])])
+    assert "gone" not in compose._callees
+
+
+@pytest.fixture
+def library():
+    return {
+        "leaf": Macro(id="leaf", title="Leaf", events=[key("a"), key("b")]),
+        "middle": Macro(id="middle", title="Middle", events=[call("leaf", repetitions=3, delta=100), key("m")]),
+        "top": Macro(id="top", title="Top", events=[key("t"), call("middle")]),
+        "other": Macro(id="other", title="Other", events=[key("o")]),
+    }
+
+
+@pytest.fixture
+def plans(library):
+    return PlanCache(library.get)
+
+
+def test_call_repetitions_become_a_loop(plans, library):
+    expanded = plans.expanded(library["middle"])
+    # La pausa della chiamata si somma al primo evento, le altre ripetizioni sono un ciclo
+    assert expanded[0] == key("a", delta=110)
+    assert [ev.action if isinstance(ev, ControlEvent) else ev.key for ev in expanded] == ["a", "b", "loop", "a", "b", "end", "m"]
+    assert expanded[2].count == 2
+    played = [ev.key for ev in run_program(compile_program(expanded))]
+    assert played == ["a", "b"] * 3 + ["m"]
+    # Il corpo è condiviso con la sequenza della macro chiamata, non copiato
+    assert expanded[3] is plans.expanded(library["leaf"])[0]
+
+
+def test_iter_expanded_matches_expanded(plans, library):
+    assert list(plans.iter_expanded(library["top"])) == plans.expanded(library["top"])
+
+
+def test_invalidate_discards_callers_only(plans, library):
+    for m in library.values():
+        plans.expanded(m)
+    kept = plans.expanded(library["other"])
+    library["leaf"].events = [key("z")]
+    plans.invalidate("leaf")
+    assert [ev.key for ev in plans.expanded(library["top"]) if isinstance(ev, KeyEvent)] == ["t", "z", "z", "m"]
+    assert plans.expanded(library["other"]) is kept
+
+
+def test_expansion_cycle_is_reported(plans, library):
+    library["leaf"].events = [call("top")]
+    plans.invalidate("leaf")
+    with pytest.raises(MacroCycleError):
+        plans.expanded(library["top"])
@@ -0,0 +1,148 @@
+import pytest
+
+from app import content as content_module
+from app.content import ContentIndex
+from app.models import CallEvent, KeyEvent, Macro, MouseEvent
+
+
+def key(name, delta=10, action="press"):
+    return KeyEvent(type="key", time_delta_ms=delta, action=action, key=name)
+
+
+def call(macro_id):
+    return CallEvent(type="call", time_delta_ms=0, macro_id=macro_id)
+
+
+@pytest.fixture
+def index():
+    return ContentIndex()
+
+
+@pytest.fixture
+def published(index):
+    calls = []
+    index.subscribe(calls.append)
+    return calls
+
+
+def test_callee_change_publishes_callers(index, published):
+    leaf = Macro(id="leaf", title="Leaf", events=[key("a", 100)])
+    middle = Macro(id="middle", title="Middle", events=[call("leaf")])
+    top = Macro(id="top", title="Top", events=[call("middle"), key("b")])
+    other = Macro(id="other", title="Other", events=[key("c")])
+    index.sync([leaf, middle, top, other])
+    index.refresh()
+    before = index.estimate_ms("top", True)
+    published.clear()
+
+    leaf.events = [key("a", 500)]
+    index.sync([leaf, middle, top, other])
+    index.refresh()
+    # Le stime di chi richiama la macro (anche indirettamente) sono cambiate
+    assert published == [{"leaf", "middle", "top"}]
+    assert index.estimate_ms("top", True) == before + 400
+
+
+def test_call_cycle_does_not_loop(index, published):
+    a = Macro(id="a", title="A", events=[call("b")])
+    b = Macro(id="b", title="B", events=[call("a")])
+    index.sync([a, b])
+    index.refresh()
+    b.events = [call("a"), key("x")]
+    index.sync([a, b])
+    index.refresh()
+    assert published[-1] == {"a", "b"}
+
+
+def typed(text):
+    events = []
+    for ch in text:
+        name = "space" if ch == " " else ch
+        events += [key(name), key(name, action="release")]
+    return events
+
+
+def click(x, y):
+    return MouseEvent(type="mouse", time_delta_ms=10, action="click", x=x, y=y, button="left")
+
+
+@pytest.fixture
+def library():
+    save = Macro(id="save", title="Save", events=[key("ctrl"), key("s"), key("s", action="release"), key("ctrl", action="release")])
+    greet = Macro(id="greet", title="Greet", events=typed("ciao mondo") + [click(100, 100)])
+    other = Macro(id="other", title="Other", events=typed("altro testo") + [click(900, 700)])
+    return [save, greet, other]
+
+
+def test_match_by_chord_text_and_region(index, library):
+    index.sync(library)
+    index.refresh()
+    assert index.query(chord="Ctrl+S") == {"save"}
+    assert index.query(text="mondo") == {"greet"}
+    assert index.query(text="mon") == {"greet"}
+    assert index.query(text="ciao mondo") == {"greet"}
+    assert index.query(text="mondo ciao") == set()
+    assert index.query(region=(90, 90, 20, 20)) == {"greet"}
+    assert index.query(region=(0, 0, 5000, 5000)) == {"greet", "other"}
+    assert index.query(text="ciao", region=(800, 600, 200, 200)) == set()
+
+
+def test_match_does_not_analyse_pending_macros(index, library, monkeypatch):
+    index.sync(library)
+    analysed = []
+    monkeypatch.setattr(content_module, "extract_content", lambda events: analysed.append(events))
+    # La query (thread della GUI) considera solo le macro già analizzate
+    assert index.query(text="mondo") == set()
+    assert index.chords() == []
+    assert index.pending() == 3
+    assert analysed == []
+
+
+def test_refresh_completes_results_and_publishes(index, library, published):
+    index.sync(library)
+    assert index.query(chord="ctrl+s") == set()
+    index.refresh()
+    assert index.pending() == 0
+    assert published == [{"save", "greet", "other"}]
+    assert index.query(chord="ctrl+s") == {"save"}
+
+
+def test_replaced_events_are_reanalysed(index, library):
+    index.sync(library)
+    index.refresh()
+    library[1].events = typed("buongiorno")
+    index.sync(library)
+    assert index.pending() == 1
+    # Fino alla nuova analisi restano i risultati della versione precedente
+    assert index.query(text="mondo") == {"greet"}
+    index.refresh()
+    assert index.query(text="mondo") == set()
+    assert index.query(text="buongiorno") == {"greet"}
+
+
+def test_removed_macros_leave_the_index(index, library):
+    index.sync(library)
+    index.refresh()
+    index.sync(library[:1])
+    assert index.query(text="mondo") == set()
+    assert index.entry("greet") is None
+    assert len(index) == 1
+
+
+def test_index_file_is_reused(tmp_path, library, monkeypatch):
+    path = tmp_path / "content_index.json"
+    first = ContentIndex(path)
+    first.sync(library)
+    first.refresh()
+    first.record_run("save", ts_ms=1234, result="ok")
+    first.save()
+
+    second = ContentIndex(path)
+    analysed = []
+    real = content_module.extract_content
+    monkeypatch.setattr(content_module, "extract_content", lambda events: analysed.append(events) or real(events))
+    second.sync(library)
+    # Firme invariate: nessuna nuova analisi
+    assert second.pending() == 0 and analysed == []
+    assert second.query(chord="ctrl+s") == {"save"}
+    assert second.entry("save").last_run_ms == 1234
@@ -0,0 +1,54 @@
+from app.display import DisplayTopology, DisplayTopologyCache, MonitorInfo, StaticTopologyProvider, remap_events
+from app.models import KeyEvent, MouseEvent
+
+SINGLE = DisplayTopology(virtual=(0, 0, 1920, 1080), monitors=(MonitorInfo(0, 0, 1920, 1080, primary=True),))
+DUAL = DisplayTopology(
+    virtual=(0, 0, 3840, 1080),
+    monitors=(MonitorInfo(0, 0, 1920, 1080, primary=True), MonitorInfo(1920, 0, 3840, 1080)),
+)
+
+
+def click(x, y):
+    return MouseEvent(type="mouse", time_delta_ms=0, action="click", x=x, y=y, button="left")
+
+
+def test_cache_queries_provider_once_until_invalidated():
+    provider = StaticTopologyProvider(SINGLE)
+    cache = DisplayTopologyCache(provider)
+    assert cache.get() is SINGLE
+    assert cache.get() is SINGLE
+    assert provider.query_count == 1
+    cache.invalidate()
+    cache.get()
+    assert provider.query_count == 2
+
+
+def test_set_provider_drops_cached_topology():
+    cache = DisplayTopologyCache(StaticTopologyProvider(SINGLE))
+    cache.get()
+    cache.set_provider(StaticTopologyProvider(DUAL))
+    assert cache.get() is DUAL
+
+
+def test_topology_round_trips_through_dict():
+    assert DisplayTopology.from_dict(DUAL.to_dict()) == DUAL
+
+
+def test_same_layout_is_not_remapped():
+    events = [click(10, 20), KeyEvent(type="key", time_delta_ms=0, action="press", key="a")]
+    out = list(remap_events(events, SINGLE.to_dict(), SINGLE))
+    assert all(a is b for a, b in zip(out, events))
+
+
+def test_points_keep_relative_position_on_their_monitor():
+    current = DisplayTopology(
+        virtual=(0, 0, 3840, 1440),
+        monitors=(MonitorInfo(0, 0, 2560, 1440, primary=True), MonitorInfo(2560, 0, 3840, 720)),
+    )
+    out = list(remap_events([click(960, 540), click(1920 + 960, 540)], DUAL.to_dict(), current))
+    assert [(ev.x, ev.y) for ev in out] == [(1280, 720), (3200, 360)]
+
+
+def test_missing_monitor_maps_to_primary():
+    out = list(remap_events([click(1920 + 100, 100)], DUAL.to_dict(), SINGLE))
+    assert (out[0].x, out[0].y) == (100, 100)
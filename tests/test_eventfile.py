@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from app.codec import CodecError
+from app.eventfile import MappedEvents, write_event_file
+from app.models import KeyEvent
+
+
+pytestmark = pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="descrittori aperti non ispezionabili")
+
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_invalid_header_closes_file_and_map(tmp_path):
+    path = tmp_path / "rotto.events"
+    path.write_bytes(b"x" * 64)
+    before = open_fds()
+    for _ in range(5):
+        with pytest.raises(CodecError):
+            MappedEvents(path)
+    assert open_fds() == before
+
+
+def test_truncated_file_closes_file_and_map(tmp_path):
+    path = tmp_path / "troncato.events"
+    write_event_file(path, [KeyEvent(type="key", time_delta_ms=1, action="press", key=f"k{i}") for i in range(10)])
+    path.write_bytes(path.read_bytes()[:-5])
+    before = open_fds()
+    with pytest.raises(CodecError):
+        MappedEvents(path)
+    assert open_fds() == before
+
+
+def test_empty_file_closes_file(tmp_path):
+    path = tmp_path / "vuoto.events"
+    path.write_bytes(b"")
+    before = open_fds()
+    with pytest.raises(ValueError):
+        MappedEvents(path)
+    assert open_fds() == before
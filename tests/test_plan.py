@@ -0,0 +1,99 @@
+from app.models import KeyEvent, MouseEvent
+from app.plan import TextRun, build_plan, decimate_moves, detect_text_runs
+
+
+def press(name, delta=10):
+    return KeyEvent(type="key", time_delta_ms=delta, action="press", key=name)
+
+
+def release(name, delta=10):
+    return KeyEvent(type="key", time_delta_ms=delta, action="release", key=name)
+
+
+def tap(name):
+    return [press(name), release(name)]
+
+
+def typed(text):
+    return [ev for ch in text for ev in tap("space" if ch == " " else ch)]
+
+
+def click(x=5, y=5):
+    return MouseEvent(type="mouse", time_delta_ms=10, action="click", x=x, y=y, button="left")
+
+
+def test_typed_text_becomes_one_run():
+    events = typed("ciao mondo")
+    ops = list(detect_text_runs(events))
+    assert len(ops) == 1 and isinstance(ops[0], TextRun)
+    assert ops[0].text == "ciao mondo"
+    assert ops[0].source == events
+    assert ops[0].time_delta_ms == events[0].time_delta_ms
+
+
+def test_shifted_characters_keep_shift_balanced():
+    events = [press("shift"), *tap("c"), release("shift"), *typed("iao")]
+    ops = list(detect_text_runs(events))
+    assert [op.text for op in ops] == ["Ciao"]
+    # Shift ancora premuto alla fine: la sequenza si ferma dove Shift torna allo stato iniziale
+    events = [*typed("ab"), press("shift"), *tap("c")]
+    ops = list(detect_text_runs(events))
+    assert ops[0].text == "ab"
+    assert ops[1:] == [press("shift"), *tap("c")]
+
+
+def test_caps_lock_inverts_case():
+    events = [*tap("caps lock"), *typed("ab"), press("shift"), *tap("c"), release("shift")]
+    ops = list(detect_text_runs(events))
+    assert ops[:2] == tap("caps lock")
+    assert ops[2].text == "ABc"
+
+
+def test_runs_break_on_other_modifiers_mouse_and_short_text():
+    ctrl_s = [press("ctrl"), *tap("s"), *tap("x"), release("ctrl")]
+    assert list(detect_text_runs(ctrl_s)) == ctrl_s
+    ops = list(detect_text_runs([*typed("ab"), click(), *typed("cd")]))
+    assert [op.text if isinstance(op, TextRun) else op.action for op in ops] == ["ab", "click", "cd"]
+    single = typed("a") + [press("enter")]
+    assert list(detect_text_runs(single)) == single
+    # Tasto premuto senza rilascio immediato: eventi originali
+    held = [press("a"), press("b"), release("a"), release("b")]
+    assert list(detect_text_runs(held)) == held
+
+
+def test_text_runs_only_without_pauses():
+    events = typed("ciao")
+    assert list(build_plan(events, with_pauses=True)) == events
+    assert [op.text for op in build_plan(events, with_pauses=False)] == ["ciao"]
+
+
+def move(x, delta=5):
+    return MouseEvent(type="mouse", time_delta_ms=delta, action="move", x=x, y=0)
+
+
+def mouse(action, x=0):
+    return MouseEvent(type="mouse", time_delta_ms=5, action=action, x=x, y=0, button="left")
+
+
+def test_moves_reduced_to_final_point():
+    ops = list(decimate_moves([move(1), move(2), move(3), press("a")]))
+    assert ops == [move(3), press("a")]
+    assert list(decimate_moves([move(1), move(2)])) == [move(2)]
+
+
+def test_moves_before_self_positioning_actions_are_dropped():
+    for action in ("click", "press", "release"):
+        assert list(decimate_moves([move(1), move(2), mouse(action, 2)])) == [mouse(action, 2)]
+    assert list(decimate_moves([move(1), mouse("scroll")])) == [move(1), mouse("scroll")]
+
+
+def test_drag_is_resampled_and_keeps_last_point():
+    # 100 movimenti ogni 5 ms (200 Hz) con il pulsante premuto, ricampionati a 50 Hz
+    drag = [mouse("press")] + [move(x) for x in range(1, 101)] + [move(101), mouse("release", 101)]
+    ops = list(decimate_moves(drag, max_drag_rate_hz=50))
+    moves = [op for op in ops if op.action == "move"]
+    assert ops[0] == drag[0] and ops[-1] == drag[-1]
+    assert [op.x for op in moves] == list(range(4, 101, 4))
+    # Dopo il rilascio si torna a ridurre i movimenti al punto finale
+    after = list(decimate_moves(drag + [move(200), move(201)], max_drag_rate_hz=50))
+    assert after[-1] == move(201) and after[-2] == drag[-1]
@@ -0,0 +1,148 @@
+import threading
+
+import pytest
+
+from app.models import Macro
+
+try:
+    from app.player import PLAY_COMPLETED, PLAY_STOPPED
+    from app.playqueue import PlaybackQueue
+except (ImportError, AttributeError, OSError):
+    # Il player richiede keyboard e le API Win32
+    pytest.skip("player non disponibile su questa piattaforma", allow_module_level=True)
+
+TIMEOUT = 5
+
+
+class FakePlayer:
+    """Player che resta in riproduzione finché il test non lo rilascia"""
+
+    def __init__(self):
+        self.played = []
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+        self.stop_flag = threading.Event()
+        self.sessions = 0
+
+    def begin_session(self):
+        self.sessions += 1
+        self.stop_flag.clear()
+
+    def end_session(self):
+        pass
+
+    def stop(self):
+        self.stop_flag.set()
+
+    def play(self, events, with_pauses=True, repetitions=1, macro=None, cleanup=True):
+        self.played.append(macro.id)
+        self.started.release()
+        while not self.stop_flag.is_set():
+            if self.release.wait(0.01):
+                break
+        return PLAY_STOPPED if self.stop_flag.is_set() else PLAY_COMPLETED
+
+
+@pytest.fixture
+def queue_setup():
+    player = FakePlayer()
+    finished = []
+    drained = threading.Event()
+    queue = PlaybackQueue(
+        player,
+        on_item_finished=lambda item, ok: finished.append((item.macro.id, item.result)),
+        on_drained=drained.set,
+    )
+    yield queue, player, finished, drained
+    player.release.set()
+    queue.close()
+
+
+def macro(mid):
+    return Macro(id=mid, title=mid)
+
+
+def test_start_plays_queued_items_in_order(queue_setup):
+    queue, player, finished, drained = queue_setup
+    player.release.set()
+    for mid in ("a", "b", "c"):
+        queue.enqueue(macro(mid))
+    queue.start()
+    assert drained.wait(TIMEOUT)
+    assert player.played == ["a", "b", "c"]
+    assert finished == [("a", PLAY_COMPLETED), ("b", PLAY_COMPLETED), ("c", PLAY_COMPLETED)]
+    assert player.sessions == 1
+
+
+def test_play_now_does_not_run_queued_items(queue_setup):
+    queue, player, finished, drained = queue_setup
+    player.release.set()
+    queue.enqueue(macro("queued"))
+    queue.play_now(macro("single"))
+    assert drained.wait(TIMEOUT)
+    assert player.played == ["single"]
+    assert queue.pending == 1
+
+
+def test_play_now_runs_before_queued_items_of_running_series(queue_setup):
+    queue, player, finished, drained = queue_setup
+    queue.enqueue(macro("a"))
+    queue.enqueue(macro("b"))
+    queue.start()
+    assert player.started.acquire(timeout=TIMEOUT)
+    queue.play_now(macro("single"))
+    player.release.set()
+    assert drained.wait(TIMEOUT)
+    assert player.played == ["a", "single", "b"]
+
+
+def test_stop_discards_pending_items(queue_setup):
+    queue, player, finished, drained = queue_setup
+    for mid in ("a", "b", "c"):
+        queue.enqueue(macro(mid))
+    queue.start()
+    assert player.started.acquire(timeout=TIMEOUT)
+    queue.stop()
+    assert drained.wait(TIMEOUT)
+    assert player.played == ["a"]
+    assert finished == [("a", PLAY_STOPPED)]
+    assert queue.pending == 0
+
+
+def test_stop_before_next_item_is_not_lost(queue_setup):
+    queue, player, finished, drained = queue_setup
+    player.release.set()
+    queue.enqueue(macro("a"))
+    queue.enqueue(macro("b"))
+    # Stop richiesto mentre termina "a": "b" non deve partire
+    queue.on_item_finished = lambda item, ok: (finished.append((item.macro.id, item.result)), queue.stop())
+    queue.start()
+    assert drained.wait(TIMEOUT)
+    assert player.played == ["a"]
+
+
+def test_item_requested_after_stop_runs_in_new_session(queue_setup):
+    queue, player, finished, drained = queue_setup
+    queue.play_now(macro("a"))
+    assert player.started.acquire(timeout=TIMEOUT)
+    queue.stop()
+    queue.play_now(macro("late"))
+    player.release.set()
+    assert player.started.acquire(timeout=TIMEOUT)
+    assert player.played == ["a", "late"]
+    assert finished[0] == ("a", PLAY_STOPPED)
+    assert player.sessions == 2
+
+
+def test_queue_runs_again_after_stop(queue_setup):
+    queue, player, finished, drained = queue_setup
+    queue.play_now(macro("a"))
+    assert player.started.acquire(timeout=TIMEOUT)
+    queue.stop()
+    assert drained.wait(TIMEOUT)
+    drained.clear()
+    player.release.set()
+    queue.play_now(macro("b"))
+    assert drained.wait(TIMEOUT)
+    assert player.played == ["a", "b"]
+    assert finished[-1] == ("b", PLAY_COMPLETED)
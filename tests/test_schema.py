@@ -0,0 +1,89 @@
+import copy
+import gc
+
+import pytest
+
+from app import schema
+from app.models import KeyEvent, Macro, MouseEvent
+from app.schema import SCHEMA_VERSION, SchemaError, decode_event, decode_events, decode_macro, schema_version
+
+
+def key_dict(**changes):
+    d = {"__class__": "KeyEvent", "type": "key", "time_delta_ms": 10, "action": "press", "key": "a"}
+    d.update(changes)
+    return d
+
+
+def test_current_format_round_trip():
+    macro = Macro(id="m", title="M", events=[KeyEvent("key", 5, "press", "a"), MouseEvent("mouse", 0, "click", 1, 2, "left")], tags=["x"])
+    data = macro.to_dict()
+    original = copy.deepcopy(data)
+    assert decode_macro(data) == macro
+    # Il dizionario di ingresso non viene modificato
+    assert data == original
+
+
+def test_v1_events_are_migrated():
+    # Formato senza versione: classe o tipo impliciti, numeri come float o stringhe
+    raw = [
+        {"type": "key", "time_delta_ms": 10.0, "action": "press", "key": "a"},
+        {"__class__": "MouseEvent", "time_delta_ms": "3", "action": "move", "x": 1, "y": 2},
+    ]
+    events = decode_events(raw, version=1)
+    assert events == [KeyEvent("key", 10, "press", "a"), MouseEvent("mouse", 3, "move", 1, 2)]
+    assert "__class__" not in raw[0] and "type" not in raw[1]
+    macro = decode_macro({"id": "old", "events": raw})
+    assert macro.title == "old" and macro.events == events
+
+
+def test_current_version_is_strict():
+    with pytest.raises(SchemaError) as exc:
+        decode_event(key_dict(time_delta_ms="10"), macro_id="m", index=3)
+    assert (exc.value.macro_id, exc.value.index, exc.value.field_name) == ("m", 3, "time_delta_ms")
+
+
+@pytest.mark.parametrize("event, field", [
+    (key_dict(action="hold"), "action"),
+    (key_dict(key=None), "key"),
+    (key_dict(__class__="Nope"), "__class__"),
+    (key_dict(type="mouse"), "type"),
+])
+def test_rejected_event_fields(event, field):
+    with pytest.raises(SchemaError) as exc:
+        decode_event(event)
+    assert exc.value.field_name == field
+
+
+def test_rejected_events():
+    with pytest.raises(SchemaError, match="chiavi non previste"):
+        decode_event(key_dict(extra=1))
+    with pytest.raises(SchemaError, match="mancanti"):
+        decode_event({"__class__": "KeyEvent", "type": "key", "action": "press"})
+    with pytest.raises(SchemaError) as exc:
+        decode_events([key_dict(), "non un evento"], macro_id="m")
+    assert exc.value.index == 1
+    with pytest.raises(SchemaError):
+        decode_events({"non": "una lista"})
+
+
+def test_rejected_macros_and_versions():
+    with pytest.raises(SchemaError):
+        decode_macro({"title": "senza id"})
+    with pytest.raises(SchemaError):
+        decode_macro({"id": "m", "repetitions": "molte"})
+    with pytest.raises(SchemaError):
+        decode_macro({"id": "m", "tags": "x"})
+    assert schema_version({}) == 1
+    for version in (0, "2", SCHEMA_VERSION + 1):
+        with pytest.raises(SchemaError):
+            schema_version({"schema": version})
+
+
+def test_collector_restored_after_error(monkeypatch):
+    monkeypatch.setattr(schema, "GC_PAUSE_EVENTS", 2)
+    assert gc.isenabled()
+    with pytest.raises(SchemaError):
+        decode_events([key_dict(), key_dict(), key_dict(action="hold")])
+    assert gc.isenabled()
+    assert len(decode_events([key_dict()] * 3)) == 3
+    assert gc.isenabled()
@@ -0,0 +1,92 @@
+import pytest
+
+from app.models import Macro
+from app.search import SearchIndex
+
+
+def macro(mid, title, tags=()):
+    return Macro(id=mid, title=title, tags=list(tags))
+
+
+@pytest.fixture
+def index():
+    return SearchIndex([
+        macro("a", "Apri fattura", ["contabilità", "mensile"]),
+        macro("b", "Fatturato annuo", ["report"]),
+        macro("c", "Chiudi finestra"),
+    ])
+
+
+def test_empty_query_is_none(index):
+    assert index.query("") is None
+    assert index.query("   ") is None
+
+
+def test_substring_terms(index):
+    assert index.query("fatt") == {"a", "b"}
+    assert index.query("fatturato") == {"b"}
+    assert index.query("FATTURATO") == {"b"}
+    assert index.query("attur") == {"a", "b"}
+    assert index.query("apri fatt") == {"a"}
+    assert index.query("zzz") == set()
+
+
+def test_refined_term_uses_previous_results(index):
+    # Mentre si digita i risultati del termine precedente restano in cache
+    assert index.query("fin") == {"c"}
+    assert index.query("fine") == {"c"}
+    assert index.query("finx") == set()
+
+
+def test_short_terms_match_word_prefixes(index):
+    assert index.query("f") == {"a", "b", "c"}
+    assert index.query("ch") == {"c"}
+    assert index.query("ur") == set()
+
+
+def test_tags(index):
+    assert index.query("#report") == {"b"}
+    assert index.query("#con") == {"a"}
+    assert index.query("#mensile fattura") == {"a"}
+    assert index.all_tags() == ["contabilità", "mensile", "report"]
+
+
+def test_updates_and_removal(index):
+    index.query("fatt")
+    index.update(macro("c", "Fattura di prova"))
+    assert index.query("fatt") == {"a", "b", "c"}
+    assert index.query("finestra") == set()
+    index.remove("a")
+    assert index.query("fatt") == {"b", "c"}
+    assert index.query("#mensile") == set()
+    assert len(index) == 2
+
+
+def test_changes_before_build_are_kept():
+    index = SearchIndex([macro("a", "Uno")])
+    index.add(macro("b", "Due"))
+    index.remove("a")
+    assert len(index) == 1
+    assert index.query("due") == {"b"}
+    assert index.query("uno") == set()
+
+
+def test_exact_tag_also_matches_longer_tags():
+    index = SearchIndex([macro("a", "Uno", ["c"]), macro("b", "Due", ["cab"]), macro("c", "Tre", ["xc"])])
+    assert index.query("#c") == {"a", "b"}
+    assert index.query("#ca") == {"b"}
+    assert index.query("#cab") == {"b"}
+
+
+def test_tag_terms_match_brute_force():
+    import random
+
+    rng = random.Random(7)
+    letters = "abc"
+    macros = [macro(f"m{i}", f"M{i}", ["".join(rng.choice(letters) for _ in range(rng.randint(1, 3))) for _ in range(2)]) for i in range(80)]
+    index = SearchIndex(macros)
+    for n in range(1, 4):
+        for _ in range(10):
+            tag = "".join(rng.choice(letters) for _ in range(n))
+            expected = {m.id for m in macros if any(t.startswith(tag) for t in m.tags)}
+            assert index.query("#" + tag) == expected
@@ -0,0 +1,50 @@
+import json
+import os
+
+import pytest
+
+from app import settings as settings_module
+from app.settings import SettingsStore
+from app.writer import get_writer
+
+DEFAULTS = {"hotkeys": {"toggle_record": "<ctrl>+<alt>+r"}, "ui": {"theme": "light"}, "storage": {"backend": "json"}}
+
+
+def read_json(path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings_module, "CHECK_INTERVAL_S", 0.0)
+    s = SettingsStore(tmp_path / "settings.json", DEFAULTS, read_json)
+    s.snapshot()
+    assert get_writer().flush(5)
+    return s
+
+
+def test_hotkeys_changes_reach_section_subscribers(store):
+    received = []
+    store.subscribe(lambda section, value: received.append((section, value)), section="hotkeys")
+    store.update("ui", theme="dark")
+    store.update("hotkeys", toggle_record="<ctrl>+<shift>+r")
+    store.update("hotkeys", toggle_record="<ctrl>+<shift>+r")
+    assert received == [("hotkeys", {"toggle_record": "<ctrl>+<shift>+r"})]
+
+
+def test_external_edit_is_published(store):
+    received = []
+    store.subscribe(lambda section, value: received.append(section))
+    assert get_writer().flush(5)
+    data = read_json(store.path)
+    data["hotkeys"]["toggle_record"] = "<f9>"
+    data["storage"]["backend"] = "sqlite"
+    store.path.write_text(json.dumps(data), encoding="utf-8")
+    st = store.path.stat()
+    os.utime(store.path, ns=(st.st_atime_ns, st.st_mtime_ns + 10_000_000))
+    assert store.check_for_changes()
+    assert sorted(received) == ["hotkeys", "storage"]
+    assert store.get("hotkeys", "toggle_record") == "<f9>"
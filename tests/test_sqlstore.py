@@ -0,0 +1,171 @@
+import sqlite3
+
+import pytest
+
+from app.compose import called_ids
+from app.models import CallEvent, KeyEvent, Macro
+from app.sqlstore import SCHEMA_VERSION, SqliteMacroStore, StoredEvents
+
+
+def macro(mid, title="T", n=3):
+    events = [KeyEvent(type="key", time_delta_ms=i, action="press", key=f"k{i}") for i in range(n)]
+    return Macro(id=mid, title=title, events=events)
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = SqliteMacroStore(tmp_path / "macros.db")
+    yield s
+    s.close()
+
+
+def test_snapshot_round_trip(store):
+    macros = [macro("a", "Alpha"), macro("b", "Beta", n=0)]
+    macros[0].tags = ["x"]
+    store.set_snapshot(macros)
+    store.flush_pending()
+    loaded = {m.id: m for m in store.load_all()}
+    assert loaded["a"].title == "Alpha" and loaded["a"].tags == ["x"]
+    assert loaded["a"].events == macros[0].events
+    assert loaded["b"].events == []
+
+
+def test_metadata_and_deletions(store):
+    a, b = macro("a"), macro("b")
+    store.set_snapshot([a, b])
+    store.flush_pending()
+    store.set_metadata("a", {"title": "Nuovo", "favorite": True, "events": "ignorato"})
+    store.flush_pending()
+    store.set_snapshot([store.load_all()[0]])
+    store.flush_pending()
+    loaded = store.load_all()
+    assert [(m.id, m.title, m.favorite) for m in loaded] == [("a", "Nuovo", True)]
+
+
+def test_failed_transaction_keeps_pending_writes_and_reencodes_events(store):
+    a = macro("a")
+    conn = store._conn()
+    conn.execute(
+        "CREATE TRIGGER fail_boom BEFORE INSERT ON macros WHEN NEW.title = 'boom' "
+        "BEGIN SELECT RAISE(ABORT, 'boom'); END"
+    )
+    store.set_snapshot([a, macro("b", "boom")])
+    with pytest.raises(sqlite3.DatabaseError):
+        store.flush_pending()
+    assert store.load_all() == []
+    # Le scritture annullate restano in attesa
+    conn.execute("DROP TRIGGER fail_boom")
+    store.flush_pending()
+    assert {m.id for m in store.load_all()} == {"a", "b"}
+
+
+def test_events_written_in_rolled_back_transaction_are_written_again(store):
+    a = macro("a")
+    store._conn().execute(
+        "CREATE TRIGGER fail_boom BEFORE INSERT ON macros WHEN NEW.title = 'boom' "
+        "BEGIN SELECT RAISE(ABORT, 'boom'); END"
+    )
+    store.set_snapshot([a, macro("b", "boom")])
+    with pytest.raises(sqlite3.DatabaseError):
+        store.flush_pending()
+    store.set_snapshot([a])
+    store.flush_pending()
+    assert [m.events for m in store.load_all()] == [a.events]
+
+
+def test_old_schema_is_migrated(tmp_path):
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE macros (id TEXT PRIMARY KEY, title TEXT NOT NULL, favorite INTEGER NOT NULL DEFAULT 0, "
+        "with_pauses INTEGER NOT NULL DEFAULT 1, repetitions INTEGER NOT NULL DEFAULT 1, "
+        "preserve_cursor INTEGER NOT NULL DEFAULT 0, verified INTEGER NOT NULL DEFAULT 0, display_layout TEXT, "
+        "created_ms INTEGER NOT NULL, last_run_ms INTEGER, event_count INTEGER NOT NULL DEFAULT 0, "
+        "duration_ms INTEGER NOT NULL DEFAULT 0, events BLOB NOT NULL);"
+        "CREATE INDEX idx_macros_title ON macros(title);"
+        "PRAGMA user_version = 1;"
+    )
+    conn.close()
+    store = SqliteMacroStore(path)
+    conn = store._conn()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_macros_title", "idx_macros_favorite_title", "idx_macros_duration"} <= indexes
+    store.set_snapshot([macro("a")])
+    store.flush_pending()
+    assert store.load_all()[0].tags == []
+    store.close()
+
+
+def test_load_all_reads_only_metadata(store):
+    a = macro("a", n=5)
+    store.set_snapshot([a])
+    store.flush_pending()
+    statements = []
+    store._conn().set_trace_callback(statements.append)
+    events = store.load_all()[0].events
+    assert isinstance(events, StoredEvents)
+    assert len(events) == 5
+    assert not any("events" in sql.split("FROM")[0] for sql in statements)
+    # Accesso per indice senza decodificare gli altri eventi
+    assert events[3] == a.events[3] and events[-1] == a.events[-1]
+    assert events[1:3] == a.events[1:3]
+    assert list(events) == a.events and events == a.events
+    store._conn().set_trace_callback(None)
+
+
+def test_unchanged_stored_events_are_not_rewritten(store):
+    store.set_snapshot([macro("a")])
+    store.flush_pending()
+    loaded = store.load_all()
+    statements = []
+    store._conn().set_trace_callback(statements.append)
+    loaded[0].title = "Nuovo"
+    store.set_snapshot(loaded)
+    store.flush_pending()
+    store._conn().set_trace_callback(None)
+    assert not any(sql.startswith("INSERT INTO macros") for sql in statements)
+    assert store.load_all()[0].title == "Nuovo"
+
+
+def test_replaced_or_deleted_rows_detach_events(store):
+    a, b = macro("a", n=4), macro("b", n=2)
+    store.set_snapshot([a, b])
+    store.flush_pending()
+    old_a, old_b = (m.events for m in store.load_all())
+    store.set_snapshot([Macro(id="a", title="T", events=a.events[:1])])
+    store.flush_pending()
+    # Chi usava ancora gli eventi precedenti (es. il player) li trova in memoria
+    assert list(old_a) == a.events and old_a[2] == a.events[2]
+    assert list(old_b) == b.events
+
+
+def test_call_ids_from_column(store):
+    caller = Macro(id="c", title="C", events=[CallEvent(type="call", time_delta_ms=0, macro_id="a"), *macro("x").events])
+    store.set_snapshot([macro("a"), caller])
+    store.flush_pending()
+    loaded = {m.id: m for m in store.load_all()}
+    statements = []
+    store._conn().set_trace_callback(statements.append)
+    assert called_ids(loaded["c"]) == {"a"}
+    assert called_ids(loaded["a"]) == frozenset()
+    store._conn().set_trace_callback(None)
+    assert statements == []
+
+
+def test_query_uses_indexed_columns(store):
+    a, b, c = macro("a", "Beta", n=1), macro("b", "alfa", n=3), macro("c", "Gamma", n=2)
+    c.favorite = True
+    store.set_snapshot([a, b, c])
+    store.record_run("a", ts_ms=10)
+    store.flush_pending()
+    assert [s.id for s in store.query()] == ["c", "b", "a"]
+    assert [s.id for s in store.query(order_by="event_count", favorites_first=False)] == ["a", "c", "b"]
+    assert [s.id for s in store.query(title_prefix="AL")] == ["b"]
+    assert [s.id for s in store.query(offset=1, limit=1)] == ["b"]
+    assert store.count() == 3 and store.count(favorites_only=True) == 1
+    assert store.query(title_prefix="Beta")[0].last_run_ms == 10
+    plan = " ".join(row[3] for row in store._conn().execute("EXPLAIN QUERY PLAN SELECT id FROM macros ORDER BY favorite DESC, title"))
+    assert "idx_macros_favorite_title" in plan
+    with pytest.raises(ValueError):
+        store.query(order_by="events")
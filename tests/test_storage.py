@@ -0,0 +1,61 @@
+import pytest
+
+from app import storage
+from app.balance import balance_events
+from app.eventfile import MappedEvents, write_event_file
+from app.models import KeyEvent
+
+
+def key(name, action="press"):
+    return KeyEvent(type="key", time_delta_ms=1, action=action, key=name)
+
+
+@pytest.fixture
+def events_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "EVENTS_DIR", tmp_path)
+    monkeypatch.setattr(storage, "MAPPED_EVENTS_THRESHOLD", 50)
+    return tmp_path
+
+
+def unbalanced(n):
+    # Rilascio senza pressione all'inizio e tasto lasciato premuto alla fine
+    return [key("x", "release")] + [key(f"k{i % 7}", "press" if i % 2 == 0 else "release") for i in range(n)] + [key("shift")]
+
+
+def test_balanced_events_are_returned_unchanged(events_dir):
+    events = [key("a"), key("a", "release")]
+    assert storage.prepare_events("m", "M", events, len(events)) is events
+
+
+def test_large_repair_is_streamed_to_an_event_file(events_dir):
+    source = events_dir / "src.events"
+    events = unbalanced(200)
+    write_event_file(source, events)
+    mapped = MappedEvents(source)
+    prepared = storage.prepare_events("m", "M", mapped, len(mapped))
+    try:
+        assert isinstance(prepared, MappedEvents)
+        assert prepared.path != source
+        assert list(prepared) == balance_events(events)[0]
+    finally:
+        prepared.close()
+        mapped.close()
+
+
+def test_small_repair_is_a_list(events_dir):
+    events = unbalanced(10)
+    prepared = storage.prepare_events("m", "M", events, len(events))
+    assert isinstance(prepared, list)
+    assert prepared == balance_events(events)[0]
+    assert list(events_dir.iterdir()) == []
+
+
+def test_fresh_file_replaced_by_repair_is_removed(events_dir):
+    fresh = storage.materialize_events("m", iter(unbalanced(200)), 202)
+    assert isinstance(fresh, MappedEvents)
+    prepared = storage.prepare_events("m", "M", fresh, len(fresh))
+    try:
+        assert not fresh.path.exists()
+        assert [p.name for p in events_dir.iterdir()] == [prepared.path.name]
+    finally:
+        prepared.close()
@@ -0,0 +1,157 @@
+import random
+from dataclasses import replace
+
+import pytest
+
+from app.eventfile import MappedEvents, write_event_file
+from app.models import ControlEvent, KeyEvent, MouseEvent
+from app.timeline import DeleteRange, EventTimeline, InsertEvents, RetimeRange, TimelineError
+
+
+def key(i, delta=10):
+    return KeyEvent(type="key", time_delta_ms=delta, action="press", key=f"k{i}")
+
+
+def wait(ms=500):
+    return ControlEvent(type="control", time_delta_ms=0, action="wait", wait_ms=ms)
+
+
+def names(timeline):
+    return [getattr(ev, "key", ev.action) for ev in timeline]
+
+
+@pytest.fixture
+def events():
+    return [key(i) for i in range(8)]
+
+
+def test_insert_inside_retime_range_is_rejected(events):
+    timeline = EventTimeline(events)
+    with pytest.raises(TimelineError):
+        timeline.apply([RetimeRange(0, 6, delta_ms=0), InsertEvents(3, (wait(),))])
+    assert not timeline.modified
+    assert list(timeline) == events
+
+
+def test_insert_inside_delete_range_is_rejected(events):
+    timeline = EventTimeline(events)
+    with pytest.raises(TimelineError):
+        timeline.apply([DeleteRange(2, 6), InsertEvents(4, (wait(),))])
+    assert len(timeline) == 8
+
+
+def test_insert_at_range_bounds_is_not_touched_by_range(events):
+    timeline = EventTimeline(events)
+    timeline.apply([
+        RetimeRange(0, 6, delta_ms=0),
+        InsertEvents(0, (key("a", 99),)),
+        InsertEvents(6, (key("b", 99),)),
+    ])
+    assert names(timeline) == ["ka", "k0", "k1", "k2", "k3", "k4", "k5", "kb", "k6", "k7"]
+    assert [ev.time_delta_ms for ev in timeline] == [99] + [0] * 6 + [99, 10, 10]
+
+
+def test_insert_at_start_of_deleted_range_replaces_it(events):
+    timeline = EventTimeline(events)
+    timeline.apply([DeleteRange(2, 6), InsertEvents(2, (wait(),))])
+    assert names(timeline) == ["k0", "k1", "wait", "k6", "k7"]
+
+
+def test_inserts_at_same_position_keep_group_order(events):
+    timeline = EventTimeline(events)
+    timeline.apply([InsertEvents(1, (key("a"),)), InsertEvents(1, (key("b"),))])
+    assert names(timeline)[:4] == ["k0", "ka", "kb", "k1"]
+
+
+def test_overlapping_ranges_are_rejected(events):
+    timeline = EventTimeline(events)
+    with pytest.raises(TimelineError):
+        timeline.apply([DeleteRange(0, 5), RetimeRange(3, 8, scale=2.0)])
+
+
+def test_undo_back_to_original_clears_modified(events):
+    timeline = EventTimeline(events)
+    timeline.apply([DeleteRange(0, 2)])
+    timeline.apply([RetimeRange(0, 3, scale=2.0)])
+    assert timeline.modified
+    assert timeline.undo() and timeline.undo()
+    assert not timeline.modified
+    assert not timeline.undo()
+    assert list(timeline) == events
+
+
+def test_retime_updates_times_and_duration(events):
+    timeline = EventTimeline(events)
+    assert timeline.duration_ms == 80
+    timeline.apply([RetimeRange(0, 4, scale=0.5)])
+    assert list(timeline.times()) == [5, 10, 15, 20, 30, 40, 50, 60]
+    assert timeline.index_at(25) == 4
+    # Gli eventi originali non vengono modificati
+    assert events[0].time_delta_ms == 10
+
+
+def test_histogram_counts_every_event_once():
+    events = [key(i, delta=i % 7) for i in range(500)] + [MouseEvent(type="mouse", time_delta_ms=3, action="move", x=1, y=2)]
+    timeline = EventTimeline(events)
+    buckets = timeline.buckets()
+    for columns in (1, 7, 64):
+        histogram = buckets.histogram(0, timeline.duration_ms + 1, columns)
+        assert len(histogram) == columns
+        assert sum(sum(c) for c in histogram) == pytest.approx(len(events))
+
+
+def _reference_apply(ref, ops):
+    out = list(ref)
+    keyed = [((op.index, 0, i) if isinstance(op, InsertEvents) else (op.start, 1, i), op) for i, op in enumerate(ops)]
+    for _, op in sorted(keyed, key=lambda item: item[0], reverse=True):
+        if isinstance(op, DeleteRange):
+            del out[op.start:op.stop]
+        elif isinstance(op, RetimeRange):
+            out[op.start:op.stop] = [
+                replace(ev, time_delta_ms=op.delta_ms if op.delta_ms is not None else int(round(ev.time_delta_ms * op.scale)))
+                for ev in out[op.start:op.stop]
+            ]
+        else:
+            out[op.index:op.index] = list(op.events)
+    return out
+
+
+@pytest.mark.parametrize("mapped", [False, True])
+def test_random_groups_match_reference(tmp_path, mapped):
+    rng = random.Random(3)
+    base = [
+        key(i, rng.randint(0, 40)) if rng.random() < 0.6
+        else MouseEvent(type="mouse", time_delta_ms=rng.randint(0, 40), action="move", x=i, y=i)
+        for i in range(300)
+    ]
+    source = base
+    if mapped:
+        path = tmp_path / "events.mre"
+        write_event_file(path, base)
+        source = MappedEvents(path)
+    timeline = EventTimeline(source)
+    ref, history = list(base), []
+    for step in range(150):
+        cuts = sorted(rng.sample(range(len(ref) + 1), min(len(ref) + 1, 6)))
+        ops = []
+        for a, b in zip(cuts[0::2], cuts[1::2]):
+            kind = rng.choice("dri")
+            if kind == "d":
+                ops.append(DeleteRange(a, b))
+            elif kind == "r":
+                ops.append(RetimeRange(a, b, delta_ms=7) if rng.random() < 0.5 else RetimeRange(a, b, scale=2.0))
+            else:
+                ops.append(InsertEvents(a, (wait(step),)))
+            # Inserimenti agli estremi degli intervalli
+            ops.append(InsertEvents(rng.choice((a, b)), (key(f"x{step}", 1),)))
+        timeline.apply(ops)
+        history.append(ref)
+        ref = _reference_apply(ref, ops)
+        if step % 5 == 0:
+            timeline.undo()
+            ref = history.pop()
+        assert len(timeline) == len(ref)
+        if step % 10 == 0:
+            assert list(timeline) == ref
+            assert [timeline.event(i) for i in range(len(ref))] == ref
+    assert timeline.modified
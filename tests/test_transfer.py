@@ -0,0 +1,85 @@
+import io
+
+import pytest
+
+from app import transfer
+from app.eventfile import MappedEvents
+from app.models import KeyEvent, Macro, MouseEvent
+from app.transfer import StreamFormatError, export_macro, import_macro, read_macro
+
+
+def key(i, action="press"):
+    return KeyEvent(type="key", time_delta_ms=i % 50, action=action, key=f"k{i % 7}")
+
+
+def mouse(i):
+    return MouseEvent(type="mouse", time_delta_ms=5, action="move", x=i, y=-i)
+
+
+@pytest.fixture
+def exported(tmp_path):
+    events = []
+    for i in range(60):
+        events += [key(i), key(i, action="release"), mouse(i)]
+    macro = Macro(id="m1", title="Prova «à»", events=events, repetitions=3, tags=["uno"])
+    path = tmp_path / "m1.json"
+    assert export_macro(macro, path) == len(events)
+    return macro, path
+
+
+def test_round_trip_as_list(exported):
+    macro, path = exported
+    progress = []
+    imported = import_macro(path, lambda done, total: progress.append((done, total)))
+    assert isinstance(imported.events, list)
+    assert imported.events == macro.events
+    assert (imported.title, imported.repetitions, imported.tags) == (macro.title, 3, ["uno"])
+    assert progress[-1][0] == progress[-1][1]
+
+
+def test_large_import_streams_to_event_file(exported, tmp_path, monkeypatch):
+    macro, path = exported
+    monkeypatch.setattr(transfer, "MAPPED_EVENTS_THRESHOLD", 50)
+    requested = []
+
+    def events_file(macro_id):
+        requested.append(macro_id)
+        return tmp_path / "events" / "m1.mre"
+
+    imported = import_macro(path, events_file=events_file)
+    try:
+        # Oltre la soglia gli eventi vanno nel file, senza una lista completa in memoria
+        assert isinstance(imported.events, MappedEvents)
+        assert requested == ["m1"]
+        assert list(imported.events) == macro.events
+        assert imported.title == macro.title
+    finally:
+        imported.events.close()
+
+
+def test_small_import_ignores_event_file(exported, tmp_path):
+    _, path = exported
+    imported = import_macro(path, events_file=lambda macro_id: pytest.fail("file non richiesto"))
+    assert isinstance(imported.events, list)
+
+
+def test_malformed_stream(tmp_path):
+    with pytest.raises(StreamFormatError):
+        read_macro(io.StringIO('{"id": "a", "title": "A", "events": [{"type": "key"'))
+    with pytest.raises(StreamFormatError):
+        read_macro(io.StringIO('{"id": "a", "title": "A", "events": [{"type": "boh", "time_delta_ms": 0}]}'))
+    with pytest.raises(StreamFormatError):
+        read_macro(io.StringIO('["non", "una", "macro"]'))
+
+
+def test_invalid_macro_removes_streamed_file(exported, tmp_path, monkeypatch):
+    macro, _ = exported
+    monkeypatch.setattr(transfer, "MAPPED_EVENTS_THRESHOLD", 50)
+    path = tmp_path / "etichette.json"
+    # I campi della macro vengono validati solo dopo aver letto tutti gli eventi
+    export_macro(macro, path)
+    text = path.read_text(encoding="utf-8").replace('"tags": ["uno"]', '"tags": 5')
+    target = tmp_path / "events" / "a.mre"
+    with pytest.raises(StreamFormatError):
+        read_macro(io.StringIO(text), events_file=lambda macro_id: target)
+    assert not target.exists()
@@ -0,0 +1,69 @@
+from app.winmsg import WM_LBUTTONDOWN, WM_LBUTTONUP, WM_MOUSEMOVE, ClickTargetCache, StaticWindowTree
+
+PARENT = (1, (0, 0, 400, 300), (8, 30))
+CHILD = (2, (100, 100, 116, 116), (100, 100))
+
+
+def test_resolve_returns_client_coordinates():
+    tree = StaticWindowTree([PARENT])
+    cache = ClickTargetCache(tree)
+    assert cache.resolve(50, 60) == (1, 42, 30)
+    assert cache.resolve(52, 61) == (1, 44, 31)
+    assert (cache.hits, cache.misses) == (1, 1)
+    # La voce valida viene riusata senza un nuovo hit test
+    assert tree.hit_tests == 1
+
+
+def test_child_window_in_other_cell_is_resolved():
+    tree = StaticWindowTree([CHILD, PARENT])
+    cache = ClickTargetCache(tree, cell_size=16)
+    assert cache.resolve(90, 90) == (1, 82, 60)
+    assert cache.resolve(105, 105) == (2, 5, 5)
+    assert cache.resolve(91, 91) == (1, 83, 61)
+    assert tree.hit_tests == 2
+
+
+def test_window_raised_over_cached_entry_is_hit_after_clear():
+    tree = StaticWindowTree([PARENT])
+    cache = ClickTargetCache(tree)
+    assert cache.resolve(50, 50)[0] == 1
+    tree.windows.insert(0, (3, (40, 40, 80, 80), (40, 40)))
+    cache.clear()
+    assert cache.resolve(50, 50) == (3, 10, 10)
+
+
+def test_point_outside_cached_rect_is_hit_tested():
+    tree = StaticWindowTree([(4, (0, 0, 20, 20), (0, 0)), PARENT])
+    cache = ClickTargetCache(tree, cell_size=32)
+    assert cache.resolve(10, 10)[0] == 4
+    # Stessa cella ma fuori dalla finestra in cache
+    assert cache.resolve(25, 25) == (1, 17, -5)
+    assert tree.hit_tests == 2
+
+
+def test_moved_window_refreshes_origin():
+    tree = StaticWindowTree([PARENT])
+    cache = ClickTargetCache(tree)
+    cache.resolve(50, 50)
+    tree.windows[0] = (1, (10, 0, 410, 300), (18, 30))
+    assert cache.resolve(50, 50) == (1, 32, 20)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_destroyed_window_is_not_resolved():
+    tree = StaticWindowTree([PARENT])
+    cache = ClickTargetCache(tree)
+    cache.resolve(50, 50)
+    tree.windows.clear()
+    assert cache.resolve(50, 50) is None
+
+
+def test_post_click_sends_mouse_move_only_when_position_changes():
+    tree = StaticWindowTree([PARENT])
+    cache = ClickTargetCache(tree)
+    target = cache.resolve(50, 60)
+    cache.post_click(target)
+    cache.post_click(target)
+    assert [msg for _, msg, _, _ in tree.posted] == [
+        WM_MOUSEMOVE, WM_LBUTTONDOWN, WM_LBUTTONUP, WM_LBUTTONDOWN, WM_LBUTTONUP,
+    ]
@@ -0,0 +1,30 @@
+import pytest
+
+from app.eventfile import MappedEvents, write_event_file
+from app.models import CallEvent, KeyEvent, Macro
+from app.worker import _macro_payload
+
+
+def mapped(tmp_path, events):
+    path = tmp_path / "m.mre"
+    write_event_file(path, events)
+    return MappedEvents(path)
+
+
+def test_mapped_macro_is_sent_as_file(tmp_path):
+    events = mapped(tmp_path, [KeyEvent(type="key", time_delta_ms=0, action="press", key="a")])
+    try:
+        payload = _macro_payload(Macro(id="m", title="M", events=events))
+        assert payload["events_file"] == str(events.path) and "events" not in payload
+    finally:
+        events.close()
+
+
+def test_mapped_macro_with_calls_is_refused(tmp_path):
+    # Il processo di riproduzione ignorerebbe le chiamate: meglio un errore che perderle
+    events = mapped(tmp_path, [CallEvent(type="call", time_delta_ms=0, macro_id="altra")])
+    try:
+        with pytest.raises(ValueError):
+            _macro_payload(Macro(id="m", title="M", events=events))
+    finally:
+        events.close()
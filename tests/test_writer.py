@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app import writer as writer_module
+from app.writer import StorageWriter
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(writer_module, "RETRY_DELAY_S", 0.01)
+
+
+@pytest.fixture
+def writer():
+    w = StorageWriter(debounce_s=0.0, max_delay_s=0.0)
+    yield w
+    w.close()
+
+
+def test_writes_file_and_calls_callback(tmp_path, writer):
+    done = threading.Event()
+    path = tmp_path / "a.json"
+    writer.submit(path, {"v": 1}, on_written=done.set)
+    assert writer.flush(5)
+    assert done.is_set()
+    assert json.loads(path.read_text(encoding="utf-8")) == {"v": 1}
+
+
+def test_failed_task_is_retried(writer):
+    calls = []
+    written = threading.Event()
+
+    def task():
+        calls.append(1)
+        if len(calls) < 2:
+            raise OSError("disco occupato")
+
+    writer.submit_task("db", task, on_written=written.set)
+    assert writer.flush(5)
+    assert len(calls) == 2
+    assert written.is_set()
+    assert writer.failures == 1
+
+
+def test_request_failing_every_attempt_calls_on_failed_once(writer):
+    failed, written = [], []
+
+    def task():
+        raise OSError("sola lettura")
+
+    writer.submit_task("db", task, on_written=lambda: written.append(1), on_failed=failed.append)
+    assert writer.flush(5)
+    assert written == []
+    assert len(failed) == 1 and isinstance(failed[0], OSError)
+    assert writer.failures == writer_module.MAX_WRITE_ATTEMPTS
+
+
+def test_newer_request_replaces_failed_one(writer):
+    gate = threading.Event()
+    results = []
+
+    def failing():
+        gate.wait(5)
+        raise OSError("errore")
+
+    first = []
+    writer.submit_task("db", failing, on_written=lambda: first.append("written"), on_failed=lambda exc: first.append("failed"))
+    # Nuovo contenuto mentre il primo è in scrittura
+    while not writer._writing:
+        time.sleep(0.001)
+    writer.submit_task("db", lambda: results.append("new"))
+    gate.set()
+    assert writer.flush(5)
+    assert results == ["new"]
+    # Il chiamante della richiesta sostituita viene avvisato come per i file
+    assert first == ["written"]
+
+
+def test_settings_store_recovers_after_failed_write(tmp_path, monkeypatch):
+    from app import settings as settings_module
+    from app.settings import SettingsStore
+
+    w = StorageWriter(debounce_s=0.0, max_delay_s=0.0)
+    monkeypatch.setattr(settings_module, "get_writer", lambda: w)
+
+    def broken_write(path, data, keep_backup=True):
+        raise OSError("disco pieno")
+
+    monkeypatch.setattr(writer_module, "atomic_write_bytes", broken_write)
+    path = tmp_path / "settings.json"
+    store = SettingsStore(path, {"ui": {"theme": "light"}}, lambda p: json.loads(p.read_text()) if p.exists() else {})
+    store.update("ui", theme="dark")
+    assert w.flush(5)
+    assert store._pending_writes == 0
+    w.close()